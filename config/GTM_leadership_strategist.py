@@ -150,6 +150,27 @@ You have direct access to the company's Snowflake data warehouse through the sno
 
 Remember: Always ground recommendations in data, explain the business logic, and consider cross-functional impacts. When in doubt, ask for clarification rather than assume."""
 
+GTM_LEADERSHIP_STRATEGIST_RESPONSE_GUIDELINES = """Respond in a data-driven, strategic manner. Use the snowflake_query tool to fetch data directly when needed. Always provide structured insights with clear reasoning (the WHY), quantified evidence, and specific recommendations with success metrics. If you need more context to provide accurate guidance, ask clarifying questions. Reference any relevant context from previous conversations when applicable.
+
+**CRITICAL**: If you cannot substantiate claims through actual data from the snowflake_query tool or existing knowledge in this prompt, you must either:
+1. Ask specific clarifying questions to gather the needed information
+2. Clearly state "I don't have sufficient data to answer that" and explain what information would be needed
+Never make up data, metrics, or insights. It's always better to acknowledge limitations than to provide unsubstantiated guidance."""
+
+def get_persona_prompt():
+    """
+    Generate the static system prompt: the persona and its response guidelines.
+    
+    It contains no per-turn context, so it is byte-identical on every turn and
+    can be served from the provider's prompt cache.
+    
+    Returns:
+        System prompt without memories or conversation
+    """
+    return f"""{GTM_LEADERSHIP_STRATEGIST_PERSONA}
+
+{GTM_LEADERSHIP_STRATEGIST_RESPONSE_GUIDELINES}"""
+
 def get_system_prompt(user_memories, companion_memories, recent_conversation):
     """
     Generate the complete system prompt with all context.
@@ -173,9 +194,4 @@ Your own relevant memories:
 Recent conversation:
 {recent_conversation}
 
-Respond in a data-driven, strategic manner. Use the snowflake_query tool to fetch data directly when needed. Always provide structured insights with clear reasoning (the WHY), quantified evidence, and specific recommendations with success metrics. If you need more context to provide accurate guidance, ask clarifying questions. Reference any relevant context from previous conversations when applicable.
-
-**CRITICAL**: If you cannot substantiate claims through actual data from the snowflake_query tool or existing knowledge in this prompt, you must either:
-1. Ask specific clarifying questions to gather the needed information
-2. Clearly state "I don't have sufficient data to answer that" and explain what information would be needed
-Never make up data, metrics, or insights. It's always better to acknowledge limitations than to provide unsubstantiated guidance."""
\ No newline at end of file
+{GTM_LEADERSHIP_STRATEGIST_RESPONSE_GUIDELINES}"""
@@ -28,4 +28,27 @@ CHROMA_COLLECTION_NAME = os.environ.get("CHROMA_COLLECTION_NAME", "vanna_snowfla
 
 # Vanna.AI Configuration
 VANNA_MODEL_NAME = os.environ.get("VANNA_MODEL_NAME", "gpt-4o")  # Default to GPT-4 for Vanna
-VANNA_DIALECT = os.environ.get("VANNA_DIALECT", "snowflake") 
\ No newline at end of file
+VANNA_DIALECT = os.environ.get("VANNA_DIALECT", "snowflake") 
+
+# Logging Configuration
+# SQL statements and connection details are logged at DEBUG; set LOG_LEVEL=DEBUG to see them
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+
+# Data-intent Router Configuration
+# Messages are scored by similarity to the Vanna question/SQL training set minus similarity
+# to a labelled set of non-data messages; scores at or above the threshold trigger a query
+DATA_INTENT_INDEX_COLLECTION = os.environ.get("DATA_INTENT_INDEX_COLLECTION", "data_intent_router")
+DATA_INTENT_NEGATIVE_EXAMPLES_PATH = os.environ.get("DATA_INTENT_NEGATIVE_EXAMPLES_PATH", "data/training_sources/data_intent/negative_examples.json")
+DATA_INTENT_CALIBRATION_SET_PATH = os.environ.get("DATA_INTENT_CALIBRATION_SET_PATH", "data/training_sources/data_intent/calibration_set.json")
+DATA_INTENT_CALIBRATION_PATH = os.environ.get("DATA_INTENT_CALIBRATION_PATH", "data/training_sources/data_intent/calibration.json")
+DATA_INTENT_THRESHOLD = float(os.environ.get("DATA_INTENT_THRESHOLD", "0.05"))  # Used until calibrate() has been run
+DATA_INTENT_CACHE_SIZE = int(os.environ.get("DATA_INTENT_CACHE_SIZE", "2048"))
+
+# Local Replica Configuration
+# Base tables of SNOWFLAKE_SCHEMA are snapshotted to Parquet and generated SQL that DuckDB can run
+# against the snapshot is answered locally; everything else (and any local failure) goes to Snowflake
+REPLICA_ENABLED = os.environ.get("REPLICA_ENABLED", "true").lower() in ("1", "true", "yes")
+REPLICA_DIRECTORY = os.environ.get("REPLICA_DIRECTORY", "data/replica")
+REPLICA_REFRESH_INTERVAL = float(os.environ.get("REPLICA_REFRESH_INTERVAL", "300"))  # Seconds between table-version checks
+REPLICA_MAX_STALENESS = float(os.environ.get("REPLICA_MAX_STALENESS", "900"))  # Unverified for longer than this: use Snowflake
+REPLICA_MAX_TABLE_ROWS = int(os.environ.get("REPLICA_MAX_TABLE_ROWS", "1000000"))  # Larger tables are not replicated
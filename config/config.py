@@ -32,11 +32,38 @@ SNOWFLAKE_PRIVATE_KEY_BASE64 = os.getenv("SNOWFLAKE_PRIVATE_KEY_BASE64")
 SNOWFLAKE_DATABASE = os.getenv("SNOWFLAKE_DATABASE", "DEMO_V4")
 SNOWFLAKE_MEMORY_SCHEMA = os.getenv("SNOWFLAKE_MEMORY_SCHEMA", "CORRELATED_SCHEMA")
 
+# Short-Term Memory Storage Settings
+# "messages": one USER_MESSAGES row per message; a flush inserts only the new messages.
+# "conversation": the legacy USER_CONVERSATIONS layout, whose flush rewrites the whole history
+# in one VARIANT cell. Users with no USER_MESSAGES rows are migrated from USER_CONVERSATIONS on load
+SHORT_TERM_MEMORY_STORAGE = os.getenv("SHORT_TERM_MEMORY_STORAGE", "messages")
+SHORT_TERM_MEMORY_INSERT_BATCH_ROWS = 200  # Rows per multi-row INSERT (flushes and migrations)
+# A session starts with only the most recent messages loaded; older ones are read in pages of this size
+SHORT_TERM_MEMORY_HISTORY_PAGE_SIZE = 50
+
 # API Settings
 OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
 OPENROUTER_MODEL = "openai/o3"
 API_TIMEOUT = 45.0  # seconds
 
+# OpenRouter Connection Pool Settings
+# LlmApi sends every call through shared keep-alive clients instead of a new connection per call.
+# HTTP/2 (used when the h2 package is installed) multiplexes concurrent calls over one connection
+LLM_HTTP2_ENABLED = True
+LLM_HTTP_MAX_CONNECTIONS = 32  # Above SCHEDULER_BACKEND_LIMITS["llm"] so admitted calls never wait for a connection
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = 16
+LLM_HTTP_KEEPALIVE_EXPIRY = 120.0  # seconds an idle connection is kept open between turns
+LLM_HTTP_CONNECT_TIMEOUT = 10.0  # seconds
+
+# LLM Hedging Settings
+# If a streamed answer has no first token within the budget (or the model fails before it),
+# the secondary model is asked as well and whichever answers first is streamed; the other is cancelled.
+# Only async-streamed plain answers are hedged (see src/hedging.py); non-streaming, tool-calling and
+# synchronous streaming calls go to one model
+LLM_HEDGE_ENABLED = True
+LLM_HEDGE_MODEL = "openai/gpt-4o-2024-11-20"  # Also offered in the UI model selector
+LLM_HEDGE_TTFT_BUDGET = 10.0  # seconds; above o3's usual time to first token, well under API_TIMEOUT
+
 # Token and Context Management Settings
 # Default max completion tokens for API calls - used in llm_api.py as the default parameter
 DEFAULT_MAX_COMPLETION_TOKENS = 3000  # Increased from 1500 to allow longer responses
@@ -44,12 +71,138 @@ DEFAULT_MAX_COMPLETION_TOKENS = 3000  # Increased from 1500 to allow longer resp
 # Actual completion tokens limit used in Companion - this overrides the default when called from companion.py
 COMPANION_MAX_COMPLETION_TOKENS = 2500  # Increased from 1000 to prevent truncation
 
+# LLM Rate Limit Settings
+# Every OpenRouter call in the process draws from shared request and token buckets and waits for
+# headroom instead of failing; a 429 pauses new calls for its Retry-After and the call is retried
+LLM_RATE_LIMIT_ENABLED = True
+LLM_RATE_LIMIT_RPM = int(os.getenv("LLM_RATE_LIMIT_RPM", "500"))  # Requests per minute
+LLM_RATE_LIMIT_TPM = int(os.getenv("LLM_RATE_LIMIT_TPM", "2000000"))  # Prompt + completion tokens per minute
+LLM_RATE_LIMIT_MAX_WAIT = 30.0  # seconds a call may wait for headroom before failing
+LLM_RATE_LIMIT_MAX_RETRIES = 3  # 429 responses retried per call
+LLM_RATE_LIMIT_DEFAULT_RETRY_AFTER = 2.0  # seconds to pause after a 429 without a Retry-After header
+
+# Model Routing Settings
+# Each turn is routed by a cheap intent signal: "chit_chat" (greetings, thanks, short clarifications),
+# "strategy" (narrative advice) or "data" (interpreting query results). A route's model of None
+# means the model selected in the UI (OPENROUTER_MODEL); its max_tokens is the completion limit
+MODEL_ROUTING_ENABLED = True
+MODEL_ROUTES = {
+    "chit_chat": {"model": "openai/gpt-4o-mini", "max_tokens": 400},
+    "strategy": {"model": None, "max_tokens": COMPANION_MAX_COMPLETION_TOKENS},
+    "data": {"model": None, "max_tokens": COMPANION_MAX_COMPLETION_TOKENS}
+}
+# Per-analyst overrides merged over MODEL_ROUTES, e.g. {"Arabella (Business Architect)": {"strategy": {"max_tokens": 1800}}}
+MODEL_ROUTES_BY_ANALYST = {}
+MODEL_ROUTING_CHIT_CHAT_MAX_WORDS = 10  # Longer messages are never treated as chit-chat
+MODEL_ROUTING_METRICS_WINDOW = 1000  # Recent latency samples kept per route
+
+# Two-phase streaming: completion limit for the opening segment streamed while SQL runs,
+# and how long to wait for the query before giving up on the data-grounded segment
+TWO_PHASE_OPENING_MAX_TOKENS = 600
+TWO_PHASE_DATA_TIMEOUT = 120.0  # seconds
+
+# Tool-calling mode: the model decides whether to query data by calling snowflake_query;
+# the calls of one round run concurrently and the answer continues in the same stream
+TOOL_CALL_MAX_ROUNDS = 3  # Tool-calling rounds before the model must answer
+TOOL_CALL_TIMEOUT = 120.0  # seconds to wait for one round of tool calls
+TOOL_CALL_MAX_RESULTS = 100  # Row limit for snowflake_query calls that do not set max_results
+
 # Number of recent conversation messages to include in the prompt to reduce token usage
 # This determines how many short-term memory messages are passed to the API from companion.py
 API_CONVERSATION_HISTORY_LIMIT = 15  # Limiting history to save tokens in prompts
 
+# Prompt Budget Settings
+# Input-token budget for the assembled prompt (persona, data, memories, history, summary and message).
+# Sections are admitted in that priority order; API_CONVERSATION_HISTORY_LIMIT still caps history
+PROMPT_TOKEN_BUDGETS = {
+    "openai/o3": 12000,
+    "openai/gpt-4o-2024-11-20": 12000,
+    "openai/gpt-4o-mini": 12000
+}
+DEFAULT_PROMPT_TOKEN_BUDGET = 10000
+PROMPT_TOKENIZER_ENCODING = "o200k_base"  # tiktoken encoding used by the o-series and GPT-4o models
+
+# Conversation Summary Settings
+# Messages older than the API_CONVERSATION_HISTORY_LIMIT window are folded into a rolling
+# summary in the background after each exchange, and the summary is sent in their place
+CONVERSATION_SUMMARY_MODEL = "openai/gpt-4o-mini"  # Small, fast model - the summary is not user facing
+CONVERSATION_SUMMARY_MAX_TOKENS = 400  # Completion limit, which also bounds the summary's prompt size
+CONVERSATION_SUMMARY_MIN_NEW_MESSAGES = 2  # Fold at least one full exchange per refresh
+CONVERSATION_SUMMARY_MAX_MESSAGES_PER_REFRESH = 20  # Larger backlogs (e.g. old histories) are folded in chunks
+CONVERSATION_SUMMARY_MESSAGE_CHARS = 2000  # Each message is truncated to this many characters for the summarizer
+
+# Question Decomposition Settings
+# Compound data questions are split into independent sub-questions whose SQL is generated
+# and executed concurrently, then merged into one labelled result
+QUESTION_DECOMPOSITION_ENABLED = True
+QUESTION_DECOMPOSITION_MODEL = "openai/gpt-4o-mini"  # Small, fast model - only splits the question
+QUESTION_DECOMPOSITION_MAX_TOKENS = 300
+QUESTION_DECOMPOSITION_MAX_PARTS = 4
+QUESTION_DECOMPOSITION_MIN_WORDS = 8  # Shorter questions are never decomposed
+QUESTION_DECOMPOSITION_WORKERS = 8  # Threads running sub-queries, separate from the pipeline executor
+QUESTION_DECOMPOSITION_CACHE_SIZE = 256  # Decompositions remembered per process
+
+# Result Encoding Settings
+# SQL results are sent to the LLM as summaries plus a CSV table; larger results are summarized only
+RESULT_SUMMARY_ONLY_ROWS = 40
+RESULT_TOP_K_ROWS = 5
+RESULT_TREND_FLAT_TOLERANCE = 0.01  # Fitted slope per period, relative to the mean, below which a trend is "flat"
+
+# Answer Cache Settings
+# Query results and data-grounded answers are cached until a referenced table changes
+ANSWER_CACHE_PATH = os.path.join(DATA_DIRECTORY, "answer_cache.json")
+ANSWER_CACHE_MAX_ENTRIES = 500
+ANSWER_CACHE_MAX_AGE = 24 * 60 * 60  # seconds; older entries are recomputed even if tables are unchanged
+ANSWER_CACHE_FRESHNESS_CHECK_INTERVAL = 60.0  # seconds between table-version checks for one entry
+ANSWER_CACHE_PREWARM_INTERVAL = 60 * 60  # seconds between Warm Start prewarm runs
+ANSWER_CACHE_SAVE_DELAY = 5.0  # seconds; changes within this window are written to disk together
+
+# Warm Start briefing, prewarmed in the answer cache for every analyst
+WARM_START_PROMPT = "Give me a status of the most recent financial milestones and business risks, and show me the revenue for the last quarter, be succinct"
+ANALYST_TYPES = ["GTM Leadership Strategist", "Arabella (Business Architect)", "Sales Motion Strategy Agent"]
+
 # Memory Settings
-OUTPUT_FORMAT = "v1.1"  # Mem0 output format 
+OUTPUT_FORMAT = "v1.1"  # Mem0 output format
+
+# Long-term Memory Write-behind Settings
+MEM0_WRITE_WORKERS = 4  # Maximum concurrent Mem0 add calls per process
+MEM0_WRITE_MAX_BATCH_TURNS = 5  # Queued turns for one entity coalesced into a single add
+MEM0_WRITE_MAX_RETRIES = 3  # Retries per batch before it is dropped
+MEM0_WRITE_RETRY_BASE_DELAY = 1.0  # seconds, doubled on each retry
+MEM0_WRITE_JOURNAL_PATH = os.path.join(DATA_DIRECTORY, "mem0_write_journal.jsonl")  # Replayed on restart
+# The journal is compacted to the outstanding turns whenever the queue empties, or beyond this size if it never does
+MEM0_WRITE_JOURNAL_COMPACT_BYTES = 5 * 1024 * 1024
+
+# Request Pipeline Settings
+# Threads available to the shared background event loop for blocking Mem0, Snowflake and LLM calls
+PIPELINE_EXECUTOR_WORKERS = 16
+# Seconds Companion.close() waits for background memory writes before giving up
+PENDING_WRITE_FLUSH_TIMEOUT = 30.0
+# LLM streams are read with httpx.AsyncClient on the background event loop and handed to the
+# session's thread through a queue; the loop reads at most this many chunks ahead of the reader
+LLM_ASYNC_STREAMING = True
+STREAM_BRIDGE_MAX_BUFFERED_CHUNKS = 64
+# The UI repaints a streaming answer at most once per this many seconds, coalescing the deltas in between
+STREAM_RENDER_FRAME_INTERVAL = 0.04
+
+# Shared Resource Settings
+# Vanna, Chroma, Snowflake and Mem0 clients are built once per process and health-checked
+# at most this often when a session borrows them
+RESOURCE_HEALTH_CHECK_INTERVAL = 60.0  # seconds
+
+# Admission Control Settings
+# Concurrent OpenRouter calls, Vanna/Snowflake queries and Mem0 operations allowed per process.
+# Queued calls are admitted interactive first, then by fewest slots held per user
+SCHEDULER_BACKEND_LIMITS = {"llm": 8, "sql": 4, "memory": 8}
+SCHEDULER_BACKGROUND_SHARE = 0.5  # Fraction of a backend's slots background work may hold
+SCHEDULER_METRICS_WINDOW = 1000  # Recent queue-time samples kept per backend and class
+
+# Tracing Settings
+# Per-request spans (detect, memory search, SQL, LLM, persist) are appended to a JSONL file
+TRACE_FILE_PATH = os.getenv("TRACE_FILE_PATH", os.path.join(DATA_DIRECTORY, "traces.jsonl"))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))  # Fraction of requests traced; failed spans are always written
+TRACE_FILE_MAX_BYTES = 50 * 1024 * 1024  # Rotated to <path>.1 beyond this size
+TRACE_MAX_ATTRIBUTE_CHARS = 500  # Longer attribute values (questions, SQL, errors) are truncated
 
 # Function to update the model at runtime
 def update_model(new_model):
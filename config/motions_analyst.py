@@ -72,6 +72,22 @@ You have direct access to the company's Snowflake data warehouse through special
 
 You always provide actionable insights backed by quantified evidence and recommend specific experiments with clear success metrics. You focus on identifying immature sales motions and prescribing revenue-impacting improvements through data-driven analysis."""
 
+SALES_MOTION_ANALYST_RESPONSE_GUIDELINES = """Respond in a data-driven, analytical manner. Use the available snowflake_query tool to fetch data directly when needed for your analysis. Always provide structured insights with headline insights, evidence bullets, and specific recommendations with success KPIs. If you recall something about the user's previous analysis requests or business context from previous conversations, reference it in your response."""
+
+def get_persona_prompt():
+    """
+    Generate the static system prompt: the persona and its response guidelines.
+    
+    It contains no per-turn context, so it is byte-identical on every turn and
+    can be served from the provider's prompt cache.
+    
+    Returns:
+        System prompt without memories or conversation
+    """
+    return f"""{SALES_MOTION_ANALYST_PERSONA}
+
+{SALES_MOTION_ANALYST_RESPONSE_GUIDELINES}"""
+
 def get_system_prompt(user_memories, companion_memories, recent_conversation):
     """
     Generate the complete system prompt with all context.
@@ -95,4 +111,4 @@ Your own relevant memories:
 Recent conversation:
 {recent_conversation}
 
-Respond in a data-driven, analytical manner. Use the available snowflake_query tool to fetch data directly when needed for your analysis. Always provide structured insights with headline insights, evidence bullets, and specific recommendations with success KPIs. If you recall something about the user's previous analysis requests or business context from previous conversations, reference it in your response.""" 
\ No newline at end of file
+{SALES_MOTION_ANALYST_RESPONSE_GUIDELINES}"""
@@ -33,6 +33,22 @@ You have deep expertise in key metrics that matter at the "Growth" Stage for com
 
 You understand that shifting from 'grow at all costs' to engineered growth is crucial in the post-2022 economic landscape where investors demand profitability alongside expansion. And you know that many of today's executives built successful careers on the growth at all costs model, and/or by using outdated methodologies & frameworks, so it's important to use data and hard facts to show why a new approach is needed to create viable, healthy companies."""
 
+ARABELLA_RESPONSE_GUIDELINES = """Respond in a conversational, business-like manner. If you recall something about the user's preferences or shared information from previous conversations, reference it in your response."""
+
+def get_persona_prompt():
+    """
+    Generate the static system prompt: the persona and its response guidelines.
+    
+    It contains no per-turn context, so it is byte-identical on every turn and
+    can be served from the provider's prompt cache.
+    
+    Returns:
+        System prompt without memories or conversation
+    """
+    return f"""{ARABELLA_PERSONA}
+
+{ARABELLA_RESPONSE_GUIDELINES}"""
+
 def get_system_prompt(user_memories, companion_memories, recent_conversation):
     """
     Generate the complete system prompt with all context.
@@ -56,4 +72,4 @@ Your own relevant memories:
 Recent conversation:
 {recent_conversation}
 
-Respond in a conversational, business-like manner. If you recall something about the user's preferences or shared information from previous conversations, reference it in your response.""" 
\ No newline at end of file
+{ARABELLA_RESPONSE_GUIDELINES}"""
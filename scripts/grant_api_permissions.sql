@@ -20,6 +20,12 @@ GRANT SELECT ON FUTURE TABLES IN SCHEMA DEMO_V4.CORRELATED_SCHEMA TO ROLE API_AC
 -- (needed for the memory system to read and write conversation history)
 GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE DEMO_V4.CORRELATED_SCHEMA.USER_CONVERSATIONS TO ROLE API_ACCESS_ROLE;
 
+-- And for the per-message log that replaces it (SHORT_TERM_MEMORY_STORAGE = "messages")
+GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE DEMO_V4.CORRELATED_SCHEMA.USER_MESSAGES TO ROLE API_ACCESS_ROLE;
+
+-- Same for the rolling conversation summaries stored alongside it
+GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE DEMO_V4.CORRELATED_SCHEMA.USER_CONVERSATION_SUMMARIES TO ROLE API_ACCESS_ROLE;
+
 -- Grant USAGE on the warehouse (if not already granted)
 GRANT USAGE ON WAREHOUSE COMPUTE_WH TO ROLE API_ACCESS_ROLE;
 
@@ -0,0 +1,1039 @@
+#!/usr/bin/env python3
+"""
+Concurrent-user load generator for the Companion request pipeline.
+
+Drives N simulated users through Companion.process_message and
+Companion.process_message_stream against local stand-ins for the external
+services, so deployments can be sized and regressions caught without spending
+tokens or warehouse credits:
+
+- OpenRouter: LlmApi's pooled httpx client is served by an httpx.MockTransport
+  that waits a configurable time to first token and per token, and streams
+  server-sent events like the real API.
+- Mem0: mem0.Memory is replaced by an in-process store with configurable
+  search and add latency.
+- Snowflake: snowflake.connector.connect returns connections to a local SQLite
+  database holding a small demo schema and the conversation history tables;
+  Vanna's SQL generation is replaced by a keyword lookup with configurable latency.
+
+Every fake can also fail a configurable fraction of calls. All requests are
+traced, and the report gives p50/p95/p99 per pipeline stage (the tracing span
+names), end-to-end latency and time to first token, throughput and error rates
+as JSON.
+
+Usage:
+    python scripts/load_test.py --users 20 --messages 5 --mode mixed --output load_report.json
+"""
+import os
+import sys
+import re
+import json
+import time
+import random
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+import threading
+import logging
+import contextlib
+import functools
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Every request is traced so each stage is measured; spans are collected in memory
+os.environ["TRACE_SAMPLE_RATE"] = "1.0"
+os.environ["TRACE_FILE_PATH"] = ""
+# The fakes accept any credentials, but the connectors need one to be configured
+for _name in ("SNOWFLAKE_ACCOUNT", "SNOWFLAKE_USER", "SNOWFLAKE_WAREHOUSE", "SNOWFLAKE_PASSWORD"):
+    os.environ.setdefault(_name, "loadtest")
+os.environ.setdefault("SNOWFLAKE_SCHEMA", "DEMO")  # The schema of the fake warehouse's tables
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import httpx
+import snowflake.connector
+
+from config.config import CONVERSATION_SUMMARY_MODEL, LLM_HEDGE_MODEL, OPENROUTER_MODEL
+from src import tracing
+from src import http_pool
+from src import hedging
+from src import llm_api
+from src import model_router
+from src import rate_limiter
+from src import answer_cache
+from src import companion as companion_module
+from src.memory import long_term
+from src.memory import snowflake_memory
+from src.memory import write_behind
+from src.resource_registry import get_resource_registry, VANNA, REPLICA
+from src.scheduler import get_scheduler
+from src.vanna_scripts import local_replica
+from src.vanna_scripts.vanna_snowflake import VannaSnowflake
+from src.vanna_scripts.vanna_tool_wrapper import VannaToolWrapper
+
+# Questions sent by the simulated users: data questions exercise the SQL path, the rest memory and LLM only
+DATA_QUESTIONS = [
+    "Show me the revenue for the last quarter by region",
+    "What is the total pipeline value by stage?",
+    "How many customers do we have in each segment?",
+    "Show me the revenue trend over the last four quarters",
+    "Give me a status of the most recent financial milestones and business risks, and show me the revenue for the last quarter",
+    "What are the top business risks by severity, and how many customers are in the enterprise segment?"
+]
+STRATEGY_QUESTIONS = [
+    "How should we think about expanding into a new market next year?",
+    "What makes a good sales compensation plan for a growing team?",
+    "Help me structure my quarterly business review presentation",
+    "What are the best practices for aligning marketing and sales?"
+]
+CHIT_CHAT_MESSAGES = [
+    "Thanks, that's helpful!",
+    "Great, got it",
+    "What do you mean by that?",
+    "Hi there"
+]
+# Short messages that open with an acknowledgement but ask for real work; they must not reach the chit-chat model
+NOT_CHIT_CHAT_MESSAGES = [
+    "Thanks. Now draft a 90 day GTM plan for EMEA",
+    "Perfect, now compare our win rates across segments",
+    "ok, tell me how to restructure our sales team"
+]
+
+# Demo warehouse served by the Snowflake stand-in: table -> (DDL, rows)
+DEMO_TABLES = {
+    "REVENUE": (
+        "CREATE TABLE REVENUE (QUARTER TEXT, REGION TEXT, AMOUNT REAL)",
+        [(f"2025-Q{q}", region, round(1_000_000 * (1 + q / 10) * factor, 2))
+         for q in range(1, 5) for region, factor in (("AMER", 1.0), ("EMEA", 0.6), ("APAC", 0.4))]
+    ),
+    "PIPELINE": (
+        "CREATE TABLE PIPELINE (STAGE TEXT, DEALS INTEGER, VALUE REAL)",
+        [("Prospecting", 120, 4_200_000.0), ("Qualification", 80, 3_100_000.0),
+         ("Proposal", 45, 2_400_000.0), ("Negotiation", 20, 1_500_000.0)]
+    ),
+    "CUSTOMERS": (
+        "CREATE TABLE CUSTOMERS (CUSTOMER_ID INTEGER, SEGMENT TEXT, ARR REAL)",
+        [(i, ("Enterprise", "Mid-Market", "SMB")[i % 3], 10_000.0 * (1 + i % 7)) for i in range(300)]
+    ),
+    "MILESTONES": (
+        "CREATE TABLE MILESTONES (MILESTONE_DATE TEXT, NAME TEXT, STATUS TEXT)",
+        [("2025-10-01", "Series C closed", "Done"), ("2025-11-15", "EMEA launch", "In progress"),
+         ("2026-01-10", "SOC 2 Type II", "Planned")]
+    ),
+    "RISKS": (
+        "CREATE TABLE RISKS (NAME TEXT, SEVERITY TEXT, OWNER TEXT)",
+        [("Churn in SMB segment", "High", "CS"), ("Long enterprise sales cycles", "Medium", "Sales"),
+         ("FX exposure", "Low", "Finance")]
+    )
+}
+
+# Keyword -> SQL used by the Vanna stand-in, checked in order; the first entry is the fallback
+DEMO_SQL = [
+    ("revenue", "SELECT QUARTER, REGION, AMOUNT FROM REVENUE ORDER BY QUARTER DESC, REGION LIMIT 12"),
+    ("pipeline", "SELECT STAGE, DEALS, VALUE FROM PIPELINE ORDER BY VALUE DESC"),
+    ("customer", "SELECT SEGMENT, COUNT(*) AS CUSTOMERS, SUM(ARR) AS ARR FROM CUSTOMERS GROUP BY SEGMENT"),
+    ("milestone", "SELECT MILESTONE_DATE, NAME, STATUS FROM MILESTONES ORDER BY MILESTONE_DATE DESC"),
+    ("risk", "SELECT NAME, SEVERITY, OWNER FROM RISKS ORDER BY SEVERITY")
+]
+
+HISTORY_TABLES = [
+    "CREATE TABLE USER_CONVERSATIONS (USER_ID TEXT PRIMARY KEY, LAST_UPDATED TEXT, CONVERSATION_HISTORY TEXT)",
+    "CREATE TABLE USER_MESSAGES (SEQ INTEGER PRIMARY KEY AUTOINCREMENT, USER_ID TEXT, ROLE TEXT, CONTENT TEXT, TS TEXT)",
+    "CREATE TABLE USER_CONVERSATION_SUMMARIES (USER_ID TEXT PRIMARY KEY, SUMMARY TEXT, SUMMARIZED_COUNT INTEGER, LAST_UPDATED TEXT)"
+]
+
+FILLER_WORDS = ("revenue growth pipeline coverage improved across regions while enterprise deals "
+                "lengthened and the team should focus on expansion retention and forecast accuracy").split()
+
+_rng = random.Random()
+_rng_lock = threading.Lock()
+
+
+class FakeServiceError(Exception):
+    """Failure injected by a stand-in service."""
+
+
+class Latency:
+    """A configurable service latency with uniform jitter and an error rate."""
+
+    def __init__(self, mean_ms, jitter=0.3, error_rate=0.0):
+        """
+        Initialize the latency model.
+
+        Args:
+            mean_ms: Mean latency in milliseconds
+            jitter: Relative spread, e.g. 0.3 for +/-30%
+            error_rate: Fraction of calls that fail
+        """
+        self.mean_ms = mean_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def seconds(self):
+        """Draw one latency in seconds."""
+        with _rng_lock:
+            factor = _rng.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(0.0, self.mean_ms * factor) / 1000
+
+    def wait(self):
+        """Sleep for one latency draw."""
+        time.sleep(self.seconds())
+
+    async def wait_async(self):
+        """Sleep for one latency draw without blocking the event loop."""
+        await asyncio.sleep(self.seconds())
+
+    def fails(self):
+        """Return True if this call should fail."""
+        with _rng_lock:
+            return _rng.random() < self.error_rate
+
+
+class ServiceStats:
+    """Thread-safe call and error counters for one stand-in service."""
+
+    def __init__(self):
+        """Initialize empty counters."""
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def add(self, key, amount=1):
+        """Increment a counter."""
+        with self._lock:
+            self.counts[key] += amount
+
+    def snapshot(self):
+        """Return a copy of the counters."""
+        with self._lock:
+            return dict(self.counts)
+
+
+class FakeOpenRouter:
+    """Serves OpenRouter chat completions through httpx.MockTransports for the sync and async clients."""
+
+    def __init__(self, ttft, token, tokens=120, stall=None, light_ttft=None, rate_limit=None, rate_window=10.0):
+        """
+        Initialize the stand-in.
+
+        Args:
+            ttft: Latency until the first token (its error rate applies per request)
+            token: Latency between tokens
+            tokens: Completion tokens per response (capped by the request's max_tokens)
+            stall: Time to first token of streams of the primary model that stall (its
+                error rate is the fraction that stall); the hedge model never stalls
+            light_ttft: Time to first token of every model except OPENROUTER_MODEL (default: ttft)
+            rate_limit: Requests accepted per rate_window seconds; beyond it requests get a 429
+                with Retry-After (default: unlimited)
+            rate_window: Length in seconds of the fixed rate-limit window
+        """
+        self.ttft = ttft
+        self.light_ttft = light_ttft or ttft
+        self.token = token
+        self.tokens = tokens
+        self.stall = stall or Latency(0)
+        self.stats = ServiceStats()
+        self._prefixes = set()  # (model, message prefix) pairs served before, for the prompt cache
+        self._prefixes_lock = threading.Lock()
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self._window = [0.0, 0]  # start, requests accepted
+        self._window_lock = threading.Lock()
+        self.transport = httpx.MockTransport(self.handle)
+        self.async_transport = httpx.MockTransport(self.handle_async)
+
+    def _completion_words(self, payload):
+        """Words of one response, sized by the configured and requested token counts."""
+        count = max(1, min(self.tokens, payload.get("max_tokens") or self.tokens))
+        with _rng_lock:
+            return [_rng.choice(FILLER_WORDS) for _ in range(count)]
+
+    def _admit(self):
+        """
+        Apply the rate limit to one request.
+
+        Returns:
+            Tuple of (accepted, X-RateLimit-* headers to send with the response)
+        """
+        if not self.rate_limit:
+            return True, {}
+        with self._window_lock:
+            now = time.time()
+            if now - self._window[0] >= self.rate_window:
+                self._window = [now, 0]
+            accepted = self._window[1] < self.rate_limit
+            if accepted:
+                self._window[1] += 1
+            reset = self._window[0] + self.rate_window
+            headers = {
+                "x-ratelimit-limit": str(self.rate_limit),
+                "x-ratelimit-remaining": str(self.rate_limit - self._window[1]),
+                "x-ratelimit-reset": str(int(reset * 1000))
+            }
+        if not accepted:
+            headers["retry-after"] = f"{reset - now:.2f}"
+        return accepted, headers
+
+    def _ttft_for(self, model):
+        """Time to first token of a model: the configured reasoning model is slower than the rest."""
+        return self.ttft if model == OPENROUTER_MODEL else self.light_ttft
+
+    def _cached_tokens(self, model, messages):
+        """
+        Stand-in prompt cache: tokens of the longest run of leading messages already sent to this model.
+
+        Like the provider's cache it only covers prompts of at least 1024 tokens.
+        """
+        prefix, tokens, cached = [], 0, 0
+        with self._prefixes_lock:
+            for message in messages:
+                prefix.append(json.dumps(message, sort_keys=True))
+                tokens += len(str(message.get("content", ""))) // 4
+                key = hash((model, "\n".join(prefix)))
+                if key in self._prefixes:
+                    cached = tokens
+                else:
+                    self._prefixes.add(key)
+        return cached if cached >= 1024 else 0
+
+    @staticmethod
+    def _split_question(question):
+        """Stand-in decomposition: split on list separators and conjunctions."""
+        parts = [p.strip(" ,;?") for p in re.split(r",\s*(?:and\s+)?|;\s*|\s+and\s+(?=show|what|how|give)", question)]
+        parts = [p for p in parts if len(p.split()) >= 3]
+        return parts or [question]
+
+    def handle(self, request):
+        """
+        Handle one chat completion request from the sync client.
+
+        Args:
+            request: httpx.Request sent by LlmApi
+
+        Returns:
+            httpx.Response, streamed as server-sent events if the request asked for a stream
+        """
+        delay, response = self._respond(request, _EventStream)
+        time.sleep(delay)
+        return response
+
+    async def handle_async(self, request):
+        """
+        Handle one chat completion request from the async client.
+
+        Args:
+            request: httpx.Request sent by LlmApi
+
+        Returns:
+            httpx.Response, streamed as server-sent events if the request asked for a stream
+        """
+        delay, response = self._respond(request, _AsyncEventStream)
+        await asyncio.sleep(delay)
+        return response
+
+    def _respond(self, request, stream_class):
+        """
+        Build the response to a chat completion request.
+
+        Args:
+            request: httpx.Request sent by LlmApi
+            stream_class: Byte stream class for streamed completions (paced by itself)
+
+        Returns:
+            Tuple of (seconds to wait before responding, httpx.Response)
+        """
+        payload = json.loads(request.content or b"{}")
+        self.stats.add("requests")
+        accepted, rate_headers = self._admit()
+        if not accepted:
+            self.stats.add("rate_limited")
+            return 0.0, httpx.Response(429, headers=rate_headers, json={"error": {"message": "Rate limit exceeded"}})
+        if self.ttft.fails():
+            self.stats.add("errors")
+            return self.ttft.seconds(), httpx.Response(502, json={"error": {"message": "injected upstream error"}})
+
+        messages = payload.get("messages", [])
+        usage = {
+            "prompt_tokens": sum(len(str(m.get("content", ""))) // 4 for m in messages),
+            "prompt_tokens_details": {"cached_tokens": self._cached_tokens(payload.get("model"), messages)}
+        }
+        if payload.get("stream"):
+            self.stats.add("streams")
+            words = self._completion_words(payload)
+            usage["completion_tokens"] = len(words)
+            ttft = self._ttft_for(payload.get("model"))
+            if payload.get("model") != LLM_HEDGE_MODEL and self.stall.fails():
+                self.stats.add("stalls")
+                ttft = self.stall
+            return 0.0, httpx.Response(200, headers={"content-type": "text/event-stream", **rate_headers},
+                                       stream=stream_class(words, ttft, self.token, usage))
+
+        if payload.get("response_format", {}).get("type") == "json_object":
+            question = payload["messages"][-1]["content"]
+            content = json.dumps({"sub_questions": self._split_question(question)})
+        elif payload.get("model") == CONVERSATION_SUMMARY_MODEL:
+            content = "The user asked about revenue, pipeline and go-to-market planning."
+        else:
+            content = " ".join(self._completion_words(payload))
+        words = len(content.split())
+        usage["completion_tokens"] = words
+        return self._ttft_for(payload.get("model")).seconds() + sum(self.token.seconds() for _ in range(words)), httpx.Response(200, headers=rate_headers, json={
+            "choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage
+        })
+
+
+class _EventStream(httpx.SyncByteStream):
+    """Server-sent events for one streamed completion, paced like a real model."""
+
+    def __init__(self, words, ttft, token, usage):
+        self.words = words
+        self.ttft = ttft
+        self.token = token
+        self.usage = usage
+
+    def _events(self):
+        """(latency to wait first, event bytes) pairs of the stream."""
+        for index, word in enumerate(self.words):
+            chunk = {"choices": [{"delta": {"content": word + " "}}]}
+            yield self.token if index else self.ttft, f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+        yield None, f"data: {json.dumps({'choices': [], 'usage': self.usage})}\n\n".encode("utf-8")
+        yield None, b"data: [DONE]\n\n"
+
+    def __iter__(self):
+        for latency, event in self._events():
+            if latency:
+                latency.wait()
+            yield event
+
+
+class _AsyncEventStream(_EventStream, httpx.AsyncByteStream):
+    """Server-sent events for one completion streamed to the async client."""
+
+    async def __aiter__(self):
+        for latency, event in self._events():
+            if latency:
+                await latency.wait_async()
+            yield event
+
+
+class FakeMem0Memory:
+    """In-process stand-in for mem0.Memory with configurable latency."""
+
+    search_latency = Latency(0)
+    add_latency = Latency(0)
+    stats = ServiceStats()
+    _store = defaultdict(list)
+    _lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Build the stand-in (the Mem0 configuration is ignored)."""
+        return cls()
+
+    def add(self, content, agent_id=None, user_id=None, output_format=None):
+        """Store memories for an entity."""
+        self.stats.add("adds")
+        self.add_latency.wait()
+        if self.add_latency.fails():
+            self.stats.add("errors")
+            raise FakeServiceError("injected Mem0 add error")
+        messages = content if isinstance(content, list) else [{"content": str(content)}]
+        with self._lock:
+            self._store[agent_id or user_id].extend(m.get("content", "") for m in messages if m.get("content"))
+        return {"results": [{"event": "ADD"}]}
+
+    def search(self, query, agent_id=None, user_id=None, output_format=None):
+        """Return an entity's memories ranked by word overlap with the query."""
+        self.stats.add("searches")
+        self.search_latency.wait()
+        if self.search_latency.fails():
+            self.stats.add("errors")
+            raise FakeServiceError("injected Mem0 search error")
+        words = set(query.lower().split())
+        with self._lock:
+            memories = list(self._store.get(agent_id or user_id, []))
+        scored = [(len(words & set(m.lower().split())) / (len(words) or 1), m) for m in memories[-200:]]
+        scored.sort(reverse=True)
+        return {"results": [{"memory": m[:300], "score": s} for s, m in scored[:5] if s > 0]}
+
+
+class FakeSnowflake:
+    """Snowflake stand-in: connections to a shared local SQLite database."""
+
+    def __init__(self, directory, execute, roundtrip):
+        """
+        Create the demo warehouse and conversation tables.
+
+        Args:
+            directory: Directory for the SQLite files
+            execute: Latency (and error rate) of queries on the demo tables
+            roundtrip: Latency of every other statement (history, table versions, health checks)
+        """
+        self.path = os.path.join(directory, "warehouse.db")
+        self.information_schema_path = os.path.join(directory, "information_schema.db")
+        self.execute = execute
+        self.roundtrip = roundtrip
+        self.stats = ServiceStats()
+        self._query_ids = 0
+        self._lock = threading.Lock()
+        self._pending = {}
+
+        with sqlite3.connect(self.path) as conn:
+            for ddl in HISTORY_TABLES:
+                conn.execute(ddl)
+            for table, (ddl, rows) in DEMO_TABLES.items():
+                conn.execute(ddl)
+                conn.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+        with sqlite3.connect(self.information_schema_path) as conn:
+            conn.execute("CREATE TABLE TABLES (TABLE_SCHEMA TEXT, TABLE_NAME TEXT, TABLE_TYPE TEXT, LAST_ALTERED TEXT, ROW_COUNT INTEGER)")
+            conn.executemany("INSERT INTO TABLES VALUES ('DEMO', ?, 'BASE TABLE', '2025-12-31 00:00:00', ?)",
+                             [(table, len(rows)) for table, (_, rows) in DEMO_TABLES.items()])
+
+    def seed_history(self, user_ids, count, storage):
+        """
+        Give each user a prior conversation.
+
+        Args:
+            user_ids: Users to seed
+            count: Messages in each user's history
+            storage: "conversation" seeds USER_CONVERSATIONS (which "messages" sessions migrate
+                on load), "messages" seeds USER_MESSAGES as if already migrated
+        """
+        history = [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": " ".join(FILLER_WORDS[:20 + i % 10])}
+            for i in range(count)
+        ]
+        with sqlite3.connect(self.path) as conn:
+            if storage == snowflake_memory.MESSAGES_STORAGE:
+                conn.executemany("INSERT INTO USER_MESSAGES (USER_ID, ROLE, CONTENT, TS) "
+                                 "VALUES (?, ?, ?, '2025-12-31T00:00:00')",
+                                 [(user_id, msg["role"], msg["content"])
+                                  for user_id in user_ids for msg in history])
+            else:
+                conn.executemany("INSERT INTO USER_CONVERSATIONS VALUES (?, '2025-12-31T00:00:00', ?)",
+                                 [(user_id, json.dumps(history)) for user_id in user_ids])
+
+    def connect(self, **kwargs):
+        """Stand-in for snowflake.connector.connect (credentials are ignored)."""
+        self.stats.add("connections")
+        return _FakeConnection(self)
+
+    def next_query_id(self):
+        """Allocate a query id."""
+        with self._lock:
+            self._query_ids += 1
+            return f"loadtest-{self._query_ids}"
+
+    def latency(self, sql):
+        """The latency model for a statement: queries on the demo tables are the expensive ones."""
+        return self.execute if _DEMO_TABLE.search(sql) else self.roundtrip
+
+
+# Statements answered without touching SQLite
+_NO_OP_STATEMENT = re.compile(r"^\s*(USE\s|ALTER\s+SESSION)", re.IGNORECASE)
+_CANCEL_STATEMENT = re.compile(r"SYSTEM\$CANCEL_QUERY", re.IGNORECASE)
+_DEMO_TABLE = re.compile(r"\b(?:FROM|JOIN)\s+(?:%s)\b" % "|".join(DEMO_TABLES), re.IGNORECASE)
+_HISTORY_WRITE = re.compile(r"^\s*(?:INSERT|MERGE)\s+INTO\s+(?:USER_MESSAGES|USER_CONVERSATIONS)\b", re.IGNORECASE)
+_MERGE_STATEMENT = re.compile(r"MERGE\s+INTO\s+(\w+).*?USING\s*\(\s*SELECT\s+(.*?)\)\s*AS\s+source", re.IGNORECASE | re.DOTALL)
+
+
+def _translate(sql, params):
+    """
+    Translate the Snowflake dialect used by the app into SQLite.
+
+    Args:
+        sql: Snowflake SQL statement
+        params: Statement parameters (dict for %(name)s, sequence for %s)
+
+    Returns:
+        Tuple of (SQLite statement, parameters)
+    """
+    merge = _MERGE_STATEMENT.search(sql)
+    if merge:
+        columns, values = [], []
+        for item in re.split(r",\s*(?![^()]*\))", merge.group(2)):
+            value, column = re.split(r"\s+AS\s+", item.strip(), flags=re.IGNORECASE)
+            columns.append(column.strip())
+            values.append(value.strip())
+        sql = f"INSERT OR REPLACE INTO {merge.group(1)} ({', '.join(columns)}) VALUES ({', '.join(values)})"
+    sql = re.sub(r"%\((\w+)\)s", r":\1", sql).replace("%s", "?")
+    sql = re.sub(r"PARSE_JSON\((.*?)\)", r"\1", sql, flags=re.IGNORECASE)
+    # Fully qualified "DATABASE"."SCHEMA"."TABLE" names (replica snapshots) name the attached tables
+    sql = re.sub(r'"\w+"\."\w+"\.(?=")', "", sql)
+    return sql, params if params is not None else ()
+
+
+class _FakeConnection:
+    """One connection to the SQLite-backed warehouse."""
+
+    def __init__(self, warehouse):
+        self.warehouse = warehouse
+        self.conn = sqlite3.connect(warehouse.path, check_same_thread=False, timeout=30)
+        self.conn.execute(f"ATTACH DATABASE '{warehouse.information_schema_path}' AS INFORMATION_SCHEMA")
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def cursor(self, *args, **kwargs):
+        return _FakeCursor(self)
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+        self.conn.close()
+
+
+class _FakeCursor:
+    """Cursor supporting the synchronous and execute_async/get_results_from_sfqid paths."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rowcount = -1
+        self.sfqid = None
+        self._rows = []
+        self._submitted = None
+
+    def _run(self, sql, params):
+        warehouse = self.connection.warehouse
+        if _NO_OP_STATEMENT.match(sql):
+            self.description, self._rows = None, []
+            return
+        if _CANCEL_STATEMENT.search(sql):
+            event = warehouse._pending.get(params[0])
+            if event is not None:
+                event.set()
+            self.description, self._rows = [("RESULT",)], [("cancelled",)]
+            return
+        if "CURRENT_USER()" in sql.upper():
+            self.description, self._rows = [(c,) for c in ("USER", "ROLE", "WAREHOUSE", "DATABASE", "SCHEMA")], \
+                [("LOADTEST", "LOADTEST", "LOADTEST", "DEMO", "DEMO")]
+            return
+
+        warehouse.stats.add("statements")
+        if warehouse.latency(sql) is warehouse.execute and warehouse.execute.fails():
+            warehouse.stats.add("errors")
+            raise snowflake.connector.errors.ProgrammingError("injected warehouse error")
+        if _HISTORY_WRITE.match(sql):
+            # Bytes sent to store conversation history, to compare the storage layouts
+            warehouse.stats.add("history_writes")
+            values = params.values() if isinstance(params, dict) else params or ()
+            warehouse.stats.add("history_write_bytes", sum(len(str(value)) for value in values))
+        translated, params = _translate(sql, params)
+        with self.connection.lock:
+            cursor = self.connection.conn.execute(translated, params)
+            self.description = cursor.description
+            self._rows = cursor.fetchall() if cursor.description else []
+            self.rowcount = cursor.rowcount
+
+    def execute(self, sql, params=None):
+        if not (_NO_OP_STATEMENT.match(sql) or _CANCEL_STATEMENT.search(sql)):
+            self.connection.warehouse.latency(sql).wait()
+        self._run(sql, params)
+        return self
+
+    def execute_async(self, sql, params=None):
+        self.sfqid = self.connection.warehouse.next_query_id()
+        self._submitted = (sql, params)
+        self.connection.warehouse._pending[self.sfqid] = threading.Event()
+        return {"queryId": self.sfqid}
+
+    def get_results_from_sfqid(self, query_id):
+        warehouse = self.connection.warehouse
+        event = warehouse._pending[query_id]
+        try:
+            if event.wait(warehouse.latency(self._submitted[0]).seconds()):
+                warehouse.stats.add("cancelled")
+                raise snowflake.connector.errors.ProgrammingError(f"SQL execution canceled: {query_id}")
+            self._run(*self._submitted)
+        finally:
+            warehouse._pending.pop(query_id, None)
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self._rows = []
+
+
+class FakeVannaAI:
+    """Stand-in for Vanna's text-to-SQL model."""
+
+    def __init__(self, latency):
+        """
+        Args:
+            latency: Latency of each SQL generation call (with its error rate)
+        """
+        self.latency = latency
+        self.stats = ServiceStats()
+
+    def generate_sql(self, question, **kwargs):
+        """Pick a demo query by keyword."""
+        self.stats.add("generations")
+        self.latency.wait()
+        if self.latency.fails():
+            self.stats.add("errors")
+            raise FakeServiceError("injected SQL generation error")
+        lowered = question.lower()
+        return next((sql for keyword, sql in DEMO_SQL if keyword in lowered), DEMO_SQL[0][1])
+
+
+class SpanCollector(tracing.SpanExporter):
+    """Keeps finished spans in memory instead of writing them to a file."""
+
+    def __init__(self):
+        super().__init__(path=None)
+        self.spans = []
+
+    def export(self, span):
+        with self._lock:
+            self.spans.append(span)
+            self.exported += 1
+
+
+class _UnavailableRouter:
+    """Makes Companion fall back to the regex detector, which needs no embedding model."""
+
+    def is_available(self):
+        return False
+
+
+def install_fakes(args, directory):
+    """
+    Swap the external services for the local stand-ins.
+
+    Args:
+        args: Parsed command-line arguments
+        directory: Scratch directory for the SQLite files
+
+    Returns:
+        Dictionary of the installed stand-ins and the span collector
+    """
+    _rng.seed(args.seed)
+
+    openrouter = FakeOpenRouter(
+        Latency(args.llm_ttft_ms, args.jitter, args.llm_error_rate),
+        Latency(args.llm_token_ms, args.jitter),
+        tokens=args.llm_tokens,
+        stall=Latency(args.llm_stall_ms, args.jitter, args.llm_stall_rate),
+        light_ttft=Latency(args.llm_light_ttft_ms, args.jitter) if args.llm_light_ttft_ms is not None else None,
+        rate_limit=args.llm_rate_limit
+    )
+    http_pool._http_pool = http_pool.LlmHttpPool(transport=openrouter.transport, async_transport=openrouter.async_transport)
+    if args.no_rate_limit:
+        rate_limiter._rate_limiter = rate_limiter.LlmRateLimiter(enabled=False)
+    if args.hedge_budget is not None:
+        hedging._hedge_policy = hedging.HedgePolicy(ttft_budget=args.hedge_budget)
+
+    FakeMem0Memory.search_latency = Latency(args.mem0_search_ms, args.jitter, args.mem0_error_rate)
+    FakeMem0Memory.add_latency = Latency(args.mem0_add_ms, args.jitter, args.mem0_error_rate)
+    long_term.Memory = FakeMem0Memory
+
+    warehouse = FakeSnowflake(
+        directory,
+        Latency(args.sql_execute_ms, args.jitter, args.sql_error_rate),
+        Latency(args.sql_roundtrip_ms, args.jitter)
+    )
+    snowflake.connector.connect = warehouse.connect
+    if args.history_messages:
+        warehouse.seed_history([f"loadtest_user_{i}" for i in range(args.users)], args.history_messages,
+                               args.seed_storage or args.history_storage)
+    snowflake_memory.SHORT_TERM_MEMORY_STORAGE = args.history_storage
+
+    vanna_ai = FakeVannaAI(Latency(args.sql_generate_ms, args.jitter, args.sql_error_rate))
+
+    def init_vanna(self):
+        self.vanna_ai = vanna_ai
+    VannaSnowflake._init_vanna = init_vanna
+    # The local replica answers data queries without the Snowflake latency, so it is opt-in here
+    local_replica.LocalReplica = functools.partial(local_replica.LocalReplica, directory=os.path.join(directory, "replica"))
+    registry = get_resource_registry()
+
+    def create_vanna():
+        return VannaToolWrapper(replica=registry.acquire(REPLICA) if args.replica else None)
+
+    def close_vanna(wrapper):
+        wrapper.close()
+        if wrapper.replica is not None:
+            registry.release(REPLICA, wrapper.replica)
+
+    # Shared clients and caches are rebuilt over the stand-ins, and nothing is written under data/
+    registry.register(VANNA, create_vanna, close=close_vanna)
+    companion_module.get_data_intent_router = _UnavailableRouter
+    answer_cache._answer_cache = answer_cache.AnswerCache(path=None, max_entries=500 if args.answer_cache else 0)
+    write_behind._write_queue = write_behind.MemoryWriteQueue(journal_path=None)
+
+    collector = SpanCollector()
+    tracing._exporter = collector
+    return {"openrouter": openrouter, "mem0": FakeMem0Memory.stats, "snowflake": warehouse,
+            "vanna": vanna_ai, "spans": collector}
+
+
+def _percentiles(samples):
+    """Summarize latency samples in milliseconds."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def rank(fraction):
+        return round(ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))], 2)
+    return {
+        "count": len(ordered),
+        "p50": rank(0.50),
+        "p95": rank(0.95),
+        "p99": rank(0.99),
+        "max": round(ordered[-1], 2),
+        "mean": round(sum(ordered) / len(ordered), 2)
+    }
+
+
+def _is_error_response(text):
+    """Return True if a response reports a failure instead of answering."""
+    return not text or text.startswith(companion_module.UNCACHEABLE_RESPONSE_PREFIXES)
+
+
+def run_user(index, args, results, session_starts, results_lock):
+    """
+    Simulate one user: open a session, send messages, close the session.
+
+    Args:
+        index: User number
+        args: Parsed command-line arguments
+        results: List receiving one record per request
+        session_starts: List receiving the session's start-up time in milliseconds
+        results_lock: Lock guarding results and session_starts
+    """
+    with _rng_lock:
+        rng = random.Random(_rng.random())
+    time.sleep(rng.uniform(0, args.ramp_up))
+    user_id = f"loadtest_user_{index}"
+    start = time.time()
+    session = companion_module.Companion(user_id, analyst_type=rng.choice(companion_module.ANALYST_TYPES))
+    with results_lock:
+        session_starts.append((time.time() - start) * 1000)
+    try:
+        for _ in range(args.messages):
+            if args.chat_ratio and rng.random() < args.chat_ratio:
+                pool = CHIT_CHAT_MESSAGES
+            else:
+                pool = DATA_QUESTIONS if rng.random() < args.data_ratio else STRATEGY_QUESTIONS
+            question = rng.choice(pool)
+            mode = args.mode if args.mode != "mixed" else rng.choice(["process", "stream"])
+            record = {"user": user_id, "mode": mode, "data_question": pool is DATA_QUESTIONS}
+            start = time.time()
+            try:
+                if mode == "stream":
+                    chunks, first_chunk_at = [], None
+                    generator, result = session.process_message_stream(question)
+                    for chunk in generator:
+                        if first_chunk_at is None and chunk:
+                            first_chunk_at = time.time()
+                        chunks.append(chunk)
+                    response = "".join(chunks)
+                    if first_chunk_at is not None:
+                        record["ttft_ms"] = (first_chunk_at - start) * 1000
+                else:
+                    result = session.process_message(question)
+                    response = result["response"]
+                record["error"] = "error response" if _is_error_response(response) else None
+                record["has_data"] = bool(result.get("data_analysis"))
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+            record["latency_ms"] = (time.time() - start) * 1000
+            with results_lock:
+                results.append(record)
+            time.sleep(rng.uniform(0, 2 * args.think_time))
+    finally:
+        session.close()
+
+
+def build_report(args, results, session_starts, fakes, duration):
+    """
+    Summarize a run.
+
+    Args:
+        args: Parsed command-line arguments
+        results: Per-request records from run_user
+        session_starts: Session start-up times from run_user
+        fakes: Stand-ins returned by install_fakes
+        duration: Wall time of the run in seconds
+
+    Returns:
+        JSON-serializable report dictionary
+    """
+    stage_samples, stage_errors = defaultdict(list), Counter()
+    for span in fakes["spans"].spans:
+        stage_samples[span["name"]].append(span["duration_ms"])
+        if span["status"]["code"] == "ERROR":
+            stage_errors[span["name"]] += 1
+
+    failed = [r for r in results if r["error"]]
+    by_mode = {}
+    for mode in sorted({r["mode"] for r in results}):
+        mode_results = [r for r in results if r["mode"] == mode]
+        mode_failed = sum(1 for r in mode_results if r["error"])
+        by_mode[mode] = {
+            "requests": len(mode_results),
+            "errors": mode_failed,
+            "error_rate": round(mode_failed / len(mode_results), 4),
+            "latency_ms": _percentiles([r["latency_ms"] for r in mode_results])
+        }
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "verbose")},
+        "duration_s": round(duration, 2),
+        "throughput_rps": round(len(results) / duration, 3) if duration else 0.0,
+        "requests": {
+            "total": len(results),
+            "succeeded": len(results) - len(failed),
+            "failed": len(failed),
+            "error_rate": round(len(failed) / len(results), 4) if results else 0.0,
+            "data_questions": sum(1 for r in results if r["data_question"]),
+            # Data questions answered without query results (SQL failed or was not detected)
+            "data_questions_without_data": sum(
+                1 for r in results if r["data_question"] and not r["error"] and not r.get("has_data")
+            )
+        },
+        "latency_ms": _percentiles([r["latency_ms"] for r in results]),
+        "ttft_ms": _percentiles([r["ttft_ms"] for r in results if "ttft_ms" in r]),
+        "session_start_ms": _percentiles(session_starts),
+        "by_mode": by_mode,
+        "stages": {
+            name: {**_percentiles(samples), "errors": stage_errors[name]}
+            for name, samples in sorted(stage_samples.items())
+        },
+        "errors": dict(Counter(r["error"] for r in failed).most_common(10)),
+        "services": {
+            "openrouter": fakes["openrouter"].stats.snapshot(),
+            "mem0": fakes["mem0"].snapshot(),
+            "snowflake": fakes["snowflake"].stats.snapshot(),
+            "vanna": fakes["vanna"].stats.snapshot()
+        },
+        "memory_writes": write_behind.get_memory_write_queue().get_metrics(),
+        "scheduler": get_scheduler().get_stats(),
+        "llm_connections": http_pool.get_llm_http_pool().get_stats(),
+        "llm_hedging": hedging.get_hedge_policy().get_stats(),
+        "prompt_cache": llm_api.get_prompt_cache_stats(),
+        "model_routing": model_router.get_model_router().get_stats(),
+        "llm_rate_limit": rate_limiter.get_llm_rate_limiter().get_stats()
+    }
+
+
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Load-test the Companion pipeline against local stand-ins.")
+    parser.add_argument("--users", type=int, default=10, help="Concurrent simulated users")
+    parser.add_argument("--messages", type=int, default=5, help="Messages sent by each user")
+    parser.add_argument("--mode", choices=["process", "stream", "mixed"], default="mixed",
+                        help="Entry point: process_message, process_message_stream, or a random mix")
+    parser.add_argument("--data-ratio", type=float, default=0.6, help="Fraction of messages that are data questions")
+    parser.add_argument("--chat-ratio", type=float, default=0.0,
+                        help="Fraction of messages that are chit-chat (thanks, greetings, clarifications)")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Mean seconds a user waits between messages")
+    parser.add_argument("--ramp-up", type=float, default=2.0, help="Seconds over which users start")
+    parser.add_argument("--answer-cache", action="store_true", help="Keep the answer cache enabled (off by default)")
+    parser.add_argument("--replica", action="store_true", help="Serve eligible data queries from the local replica")
+    parser.add_argument("--llm-ttft-ms", type=float, default=800.0, help="OpenRouter time to first token")
+    parser.add_argument("--llm-light-ttft-ms", type=float,
+                        help="Time to first token of models other than OPENROUTER_MODEL (default: --llm-ttft-ms)")
+    parser.add_argument("--llm-token-ms", type=float, default=15.0, help="OpenRouter time per token")
+    parser.add_argument("--llm-tokens", type=int, default=150, help="Tokens per completion")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Fraction of OpenRouter calls that fail")
+    parser.add_argument("--llm-stall-rate", type=float, default=0.0,
+                        help="Fraction of primary-model streams whose first token takes --llm-stall-ms")
+    parser.add_argument("--llm-rate-limit", type=int,
+                        help="OpenRouter requests accepted per 10 s window; beyond it calls get a 429 (default: unlimited)")
+    parser.add_argument("--no-rate-limit", action="store_true", help="Disable the client-side rate limiter")
+    parser.add_argument("--llm-stall-ms", type=float, default=30000.0, help="Time to first token of a stalled stream")
+    parser.add_argument("--hedge-budget", type=float, help="Seconds without a first token before hedging (default: config)")
+    parser.add_argument("--mem0-search-ms", type=float, default=300.0, help="Mem0 search latency")
+    parser.add_argument("--mem0-add-ms", type=float, default=600.0, help="Mem0 add latency")
+    parser.add_argument("--mem0-error-rate", type=float, default=0.0, help="Fraction of Mem0 calls that fail")
+    parser.add_argument("--sql-generate-ms", type=float, default=1500.0, help="Vanna SQL generation latency")
+    parser.add_argument("--sql-execute-ms", type=float, default=700.0, help="Snowflake latency of data queries")
+    parser.add_argument("--sql-roundtrip-ms", type=float, default=120.0,
+                        help="Snowflake latency of history, table-version and health-check statements")
+    parser.add_argument("--sql-error-rate", type=float, default=0.0, help="Fraction of SQL generations and data queries that fail")
+    parser.add_argument("--history-messages", type=int, default=0,
+                        help="Messages of prior conversation each user starts with")
+    parser.add_argument("--seed-storage", choices=[snowflake_memory.MESSAGES_STORAGE, snowflake_memory.CONVERSATION_STORAGE],
+                        help="Layout the prior conversation is seeded in (default: --history-storage; "
+                             "'conversation' with --history-storage messages exercises the migration)")
+    parser.add_argument("--history-storage", choices=[snowflake_memory.MESSAGES_STORAGE, snowflake_memory.CONVERSATION_STORAGE],
+                        default=snowflake_memory.SHORT_TERM_MEMORY_STORAGE, help="Short-term memory storage layout")
+    parser.add_argument("--jitter", type=float, default=0.3, help="Relative latency spread of every stand-in")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for questions, latencies and failures")
+    parser.add_argument("--output", help="Write the JSON report to this file (default: stdout)")
+    parser.add_argument("--max-error-rate", type=float, help="Exit with status 1 if the error rate exceeds this")
+    parser.add_argument("--verbose", action="store_true", help="Show the application's log output")
+    return parser.parse_args()
+
+
+def check_routing():
+    """
+    Verify that the sample messages take the routes the mixed mode expects.
+
+    Raises:
+        SystemExit: If a chit-chat sample is not routed to chit_chat, or another message is
+    """
+    misrouted = [message for message in CHIT_CHAT_MESSAGES
+                 if model_router.ModelRouter.classify(message) != model_router.CHIT_CHAT]
+    misrouted += [message for message in NOT_CHIT_CHAT_MESSAGES + STRATEGY_QUESTIONS
+                  if model_router.ModelRouter.classify(message) == model_router.CHIT_CHAT]
+    if misrouted:
+        sys.exit(f"❌ Misrouted messages: {misrouted}")
+
+
+def main():
+    """Run the load test and print or save the report."""
+    args = parse_args()
+    check_routing()
+    results, session_starts, results_lock = [], [], threading.Lock()
+    if not args.verbose:
+        logging.disable(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory(prefix="companion-load-") as directory, open(os.devnull, "w") as devnull:
+        fakes = install_fakes(args, directory)
+        print(f"🚀 Load test: {args.users} users x {args.messages} messages ({args.mode})", file=sys.stderr)
+
+        with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull):
+            start = time.time()
+            with ThreadPoolExecutor(max_workers=args.users) as executor:
+                futures = [executor.submit(run_user, i, args, results, session_starts, results_lock) for i in range(args.users)]
+                for future in futures:
+                    future.result()
+            duration = time.time() - start
+
+            # Memory writes finish after the sessions close; count their spans too
+            write_behind.get_memory_write_queue().drain()
+        report = build_report(args, results, session_starts, fakes, duration)
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"✅ Report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.max_error_rate is not None and report["requests"]["error_rate"] > args.max_error_rate:
+        print(f"❌ Error rate {report['requests']['error_rate']} exceeds {args.max_error_rate}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
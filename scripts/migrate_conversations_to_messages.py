@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+Script to migrate conversation histories from USER_CONVERSATIONS to the USER_MESSAGES log.
+
+SnowflakeShortTermMemory migrates a user the first time their history is loaded; this
+script migrates every user up front. Users that already have USER_MESSAGES rows are
+skipped, and the USER_CONVERSATIONS rows are left in place.
+"""
+import os
+import sys
+
+# Add the parent directory to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.config import SHORT_TERM_MEMORY_STORAGE
+from src.memory.snowflake_memory import SnowflakeShortTermMemory, MESSAGES_STORAGE
+from src.vanna_scripts.snowflake_connector import SnowflakeConnector
+
+def migrate_conversations():
+    """Migrate every user without USER_MESSAGES rows from USER_CONVERSATIONS."""
+    if SHORT_TERM_MEMORY_STORAGE != MESSAGES_STORAGE:
+        print(f"SHORT_TERM_MEMORY_STORAGE is '{SHORT_TERM_MEMORY_STORAGE}'; set it to '{MESSAGES_STORAGE}' to migrate.")
+        return
+    
+    print("Starting migration of USER_CONVERSATIONS to USER_MESSAGES...")
+    
+    snowflake = SnowflakeConnector()
+    conn = snowflake.connect()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT USER_ID 
+        FROM USER_CONVERSATIONS 
+        WHERE USER_ID NOT IN (SELECT DISTINCT USER_ID FROM USER_MESSAGES)
+        ORDER BY USER_ID
+    """)
+    user_ids = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    
+    print(f"Found {len(user_ids)} users to migrate.")
+    
+    success_count = 0
+    error_count = 0
+    
+    for user_id in user_ids:
+        memory = None
+        try:
+            # Loading a user with no USER_MESSAGES rows copies their history across
+            memory = SnowflakeShortTermMemory(user_id)
+            if not memory.history_loaded:
+                raise RuntimeError("history could not be loaded")
+            success_count += 1
+        except Exception as e:
+            error_count += 1
+            print(f"Error migrating data for user {user_id}: {e}")
+        finally:
+            if memory is not None:
+                memory.close()
+    
+    print(f"Migration completed. Successfully migrated {success_count} users. Encountered {error_count} errors.")
+
+if __name__ == "__main__":
+    migrate_conversations()
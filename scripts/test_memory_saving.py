@@ -29,11 +29,11 @@ def test_mem0_direct():
         test_user_id = "test_memory_user"
         
         print(f"\n🔄 Testing memory storage for user: {test_user_id}")
-        user_result = long_term_memory.store_memory(test_content, test_user_id, is_agent=False)
+        user_result = long_term_memory.write_memory(test_content, test_user_id, is_agent=False)
         print(f"User memory storage result: {user_result}")
         
         print(f"\n🔄 Testing memory storage for companion: {COMPANION_ID}")
-        companion_result = long_term_memory.store_memory(test_content, COMPANION_ID, is_agent=True)
+        companion_result = long_term_memory.write_memory(test_content, COMPANION_ID, is_agent=True)
         print(f"Companion memory storage result: {companion_result}")
         
         if user_result and companion_result:
@@ -80,6 +80,9 @@ def test_memory_manager():
         if result["overall_success"]:
             print("✅ MemoryManager conversation storage test passed!")
             
+            # Storage is write-behind; wait for the queued writes before searching
+            memory_manager.flush_long_term()
+            
             # Test memory retrieval through memory manager
             print(f"\n🔍 Testing memory retrieval through MemoryManager...")
             query = "customer acquisition"
@@ -100,9 +100,9 @@ def test_memory_system():
         print("✅ Test message added successfully")
         
         # Verify it was saved
-        history = memory.get_full_history()
+        history = memory.get_api_history(1)
         if len(history) > 0:
-            print(f"✅ Message saved and retrieved. History length: {len(history)}")
+            print(f"✅ Message saved and retrieved. History length: {memory.get_message_count()}")
             print(f"   Last message: {history[-1]}")
         else:
             print("❌ No messages found in history")
@@ -113,6 +113,7 @@ def test_memory_system():
         conn = connector.connect()
         cursor = conn.cursor()
         cursor.execute("DELETE FROM USER_CONVERSATIONS WHERE USER_ID = %s", (test_user_id,))
+        cursor.execute("DELETE FROM USER_MESSAGES WHERE USER_ID = %s", (test_user_id,))
         conn.commit()
         cursor.close()
         print("✅ Test data cleaned up")
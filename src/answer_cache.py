@@ -0,0 +1,356 @@
+"""
+Answer cache for data questions, invalidated when the underlying tables change.
+
+Two levels are cached:
+
+- data: normalized question -> query result, plus the versions (LAST_ALTERED and
+  row count) of the tables the SQL reads. A hit skips SQL generation and the
+  warehouse query.
+- answers: (analyst type, normalized question, result fingerprint) -> response.
+  A hit also skips memory retrieval and the LLM call, so an answer is served to
+  any user of the analyst: only answers generated without user memories or
+  conversation history (such as the prewarmed ones) may be stored.
+
+Table versions are re-checked at most once per freshness interval per entry.
+When a referenced table has changed, the data entry and every answer built on it
+are dropped. The cache is persisted to disk so prewarmed answers survive restarts;
+changes are written in the background at most once per ANSWER_CACHE_SAVE_DELAY, so a
+put never waits for the file to be rewritten.
+"""
+import sys
+import os
+import json
+import atexit
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import (
+    ANSWER_CACHE_PATH,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_MAX_AGE,
+    ANSWER_CACHE_FRESHNESS_CHECK_INTERVAL,
+    ANSWER_CACHE_SAVE_DELAY
+)
+
+# Version of the persisted answers; answers saved under another version are discarded on load
+# (version 1 also stored answers written with a user's memories and history)
+ANSWER_FORMAT_VERSION = 2
+
+
+class AnswerCache:
+    """Process-wide, disk-backed cache of data results and generated answers."""
+
+    def __init__(
+        self,
+        path=ANSWER_CACHE_PATH,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        max_age=ANSWER_CACHE_MAX_AGE,
+        freshness_check_interval=ANSWER_CACHE_FRESHNESS_CHECK_INTERVAL,
+        save_delay=ANSWER_CACHE_SAVE_DELAY
+    ):
+        """
+        Initialize the cache and load any persisted entries.
+
+        Args:
+            path: JSON file the cache is persisted to (None keeps it in memory only)
+            max_entries: Maximum number of data entries and of answer entries
+            max_age: Seconds after which an entry is recomputed even if its tables are unchanged
+            freshness_check_interval: Minimum seconds between table-version checks for one entry
+            save_delay: Seconds a change waits before the cache is written, coalescing later changes
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.freshness_check_interval = freshness_check_interval
+        self.save_delay = save_delay
+
+        self._data = OrderedDict()
+        self._answers = OrderedDict()
+        self._lock = threading.RLock()
+        self._save_timer = None
+        self._save_lock = threading.Lock()  # Serializes file writes
+        self.stats = {"data_hits": 0, "data_misses": 0, "answer_hits": 0, "answer_misses": 0, "invalidations": 0}
+
+        self._load()
+
+    @staticmethod
+    def normalize_question(question):
+        """Normalize a question for use as a cache key."""
+        return " ".join(question.lower().split()).rstrip("?!. ")
+
+    @staticmethod
+    def fingerprint(data_result):
+        """
+        Fingerprint a query result by its SQL and rows.
+
+        Args:
+            data_result: Result dictionary from VannaToolWrapper.snowflake_query
+
+        Returns:
+            Hex digest identifying the result set
+        """
+        payload = json.dumps(
+            {"sql": data_result.get("sql"), "results": data_result.get("results")},
+            sort_keys=True,
+            default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    @staticmethod
+    def _answer_key(question, analyst_type, fingerprint):
+        """Key for the answer level."""
+        return f"{analyst_type}|{fingerprint}|{AnswerCache.normalize_question(question)}"
+
+    def has_data(self, question):
+        """Return True if a result is cached for the question (without checking freshness)."""
+        with self._lock:
+            return self.normalize_question(question) in self._data
+
+    def get_data(self, question, get_table_versions):
+        """
+        Look up a cached query result, verifying that its tables have not changed.
+
+        Args:
+            question: The user's question
+            get_table_versions: Callable(tables) returning {table: version} for the current warehouse state
+
+        Returns:
+            The cached result dictionary, or None
+        """
+        key = self.normalize_question(question)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.stats["data_misses"] += 1
+                return None
+
+        now = time.time()
+        if now - entry["cached_at"] > self.max_age:
+            self._drop_data(key, "expired")
+            self.stats["data_misses"] += 1
+            return None
+
+        verified = False
+        if now - entry["checked_at"] >= self.freshness_check_interval:
+            try:
+                current_versions = get_table_versions(entry["tables"])
+            except Exception as e:
+                print(f"⚠️ Answer cache: could not check table versions, bypassing cache: {e}")
+                self.stats["data_misses"] += 1
+                return None
+
+            if current_versions != entry["table_versions"]:
+                self._invalidate_tables(entry["tables"])
+                self.stats["data_misses"] += 1
+                return None
+            verified = True
+
+        with self._lock:
+            if verified:
+                entry["checked_at"] = now
+            self._data.move_to_end(key)
+            self.stats["data_hits"] += 1
+        return {**entry["data_result"], "cached": True}
+
+    def put_data(self, question, data_result, table_versions):
+        """
+        Cache a successful query result.
+
+        Args:
+            question: The user's question
+            data_result: Result dictionary from VannaToolWrapper.snowflake_query
+            table_versions: {table: version} for the tables the SQL reads, taken after the query ran
+        """
+        if table_versions is None:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._data[self.normalize_question(question)] = {
+                "data_result": {k: v for k, v in data_result.items() if k != "cached"},
+                "fingerprint": self.fingerprint(data_result),
+                "tables": (data_result.get("metadata") or {}).get("tables_used", []),
+                "table_versions": table_versions,
+                "cached_at": now,
+                "checked_at": now
+            }
+            self._evict(self._data)
+            self._save()
+
+    def get_or_query_data(self, question, wrapper, max_results=100):
+        """
+        Return a fresh cached result for a question, or run the query and cache it.
+
+        Args:
+            question: The user's question
+            wrapper: VannaToolWrapper used for the query and table versions
+            max_results: Maximum number of rows to return
+
+        Returns:
+            Result dictionary from the cache or from VannaToolWrapper.snowflake_query
+        """
+        cached = self.get_data(question, wrapper.get_table_versions)
+        if cached:
+            print(f"⚡ Answer cache: reusing query result for '{question[:60]}'")
+            return cached
+
+        result = wrapper.snowflake_query(question=question, execute_query=True, max_results=max_results)
+        if isinstance(result, dict) and result.get("success"):
+            tables = (result.get("metadata") or {}).get("tables_used", [])
+            try:
+                self.put_data(question, result, wrapper.get_table_versions(tables))
+            except Exception as e:
+                print(f"⚠️ Answer cache: not caching result, table versions unavailable: {e}")
+        return result
+
+    def get_answer(self, question, analyst_type, fingerprint):
+        """
+        Look up a generated answer.
+
+        Args:
+            question: The user's question
+            analyst_type: The analyst persona that generated the answer
+            fingerprint: Fingerprint of the result set the answer was based on
+
+        Returns:
+            The cached response text, or None
+        """
+        key = self._answer_key(question, analyst_type, fingerprint)
+        with self._lock:
+            entry = self._answers.get(key)
+            if entry is None or time.time() - entry["cached_at"] > self.max_age:
+                self.stats["answer_misses"] += 1
+                return None
+            self._answers.move_to_end(key)
+            self.stats["answer_hits"] += 1
+            return entry["response"]
+
+    def put_answer(self, question, analyst_type, fingerprint, response):
+        """
+        Cache a generated answer.
+
+        Args:
+            question: The user's question
+            analyst_type: The analyst persona that generated the answer
+            fingerprint: Fingerprint of the result set the answer was based on
+            response: The full response text
+        """
+        with self._lock:
+            self._answers[self._answer_key(question, analyst_type, fingerprint)] = {
+                "response": response,
+                "fingerprint": fingerprint,
+                "cached_at": time.time()
+            }
+            self._evict(self._answers)
+            self._save()
+
+    def _drop_data(self, key, reason):
+        """Remove a data entry and the answers built on it."""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return
+            for answer_key in [k for k, a in self._answers.items() if a["fingerprint"] == entry["fingerprint"]]:
+                del self._answers[answer_key]
+            self.stats["invalidations"] += 1
+            self._save()
+        print(f"🗑️ Answer cache: dropped '{key[:60]}' ({reason})")
+
+    def _invalidate_tables(self, tables):
+        """Drop every entry that reads any of the given tables."""
+        changed = set(tables)
+        with self._lock:
+            stale = [key for key, entry in self._data.items() if changed & set(entry["tables"])]
+        for key in stale:
+            self._drop_data(key, "tables changed")
+
+    def invalidate_all(self):
+        """Drop every entry (for example after retraining or reloading data)."""
+        with self._lock:
+            dropped = len(self._data) + len(self._answers)
+            self._data.clear()
+            self._answers.clear()
+            self.stats["invalidations"] += 1
+            self._save()
+        print(f"🗑️ Answer cache: cleared {dropped} entries")
+
+    def _evict(self, entries):
+        """Evict least recently used entries beyond the size limit (lock held)."""
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def _load(self):
+        """Load persisted entries."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                persisted = json.load(f)
+            self._data.update(persisted.get("data", {}))
+            if persisted.get("answer_format") == ANSWER_FORMAT_VERSION:
+                self._answers.update(persisted.get("answers", {}))
+            print(f"✅ Answer cache loaded: {len(self._data)} results, {len(self._answers)} answers")
+        except Exception as e:
+            print(f"⚠️ Could not load answer cache: {e}")
+
+    def _save(self):
+        """Schedule a write of the entries (lock held); changes made before it runs are written with it."""
+        if not self.path or self._save_timer is not None:
+            return
+        self._save_timer = threading.Timer(self.save_delay, self.flush)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def flush(self):
+        """
+        Write the entries to disk now, outside the cache lock. Written to a temporary
+        file first so a crash never truncates the cache.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            persisted = {"data": dict(self._data), "answers": dict(self._answers), "answer_format": ANSWER_FORMAT_VERSION}
+        with self._save_lock:
+            try:
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(persisted, f, default=str)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                print(f"⚠️ Could not save answer cache: {e}")
+
+    def get_stats(self):
+        """
+        Report cache size and hit rates.
+
+        Returns:
+            Dictionary of cache statistics
+        """
+        with self._lock:
+            return {"data_entries": len(self._data), "answer_entries": len(self._answers), **self.stats}
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """
+    Get the process-wide answer cache, loading it on first use.
+
+    Returns:
+        The shared AnswerCache instance
+    """
+    global _answer_cache
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = AnswerCache()
+                atexit.register(_answer_cache.flush)
+    return _answer_cache
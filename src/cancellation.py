@@ -0,0 +1,204 @@
+"""
+Cancellation tokens for in-flight requests.
+
+Each request gets a token when it starts. The stages that do expensive remote
+work register what to do if the request is abandoned (cancel the Snowflake
+statement, close the LLM stream, drop the pending memory search) for as long as
+that work is running. Cancelling the token runs those callbacks from the
+cancelling thread, and the stages then stop with RequestCancelled.
+
+The token is current in the request's context, so executor calls bound with
+tracing.bind() see it too; code running outside that context (the streaming
+generator) is passed the token explicitly.
+"""
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+
+_current_token = contextvars.ContextVar("cancel_token", default=None)
+
+
+class RequestCancelled(Exception):
+    """Raised by a stage that stops because its request was cancelled."""
+
+
+class CancellationToken:
+    """Signals that a request has been abandoned and runs the registered cancel callbacks."""
+
+    def __init__(self):
+        """Initialize an uncancelled token."""
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self._next_id = 0
+        self.cancelled = False
+        self.reason = None
+
+    def cancel(self, reason="cancelled"):
+        """
+        Cancel the request, running every registered callback once.
+
+        Args:
+            reason: Why the request was cancelled
+
+        Returns:
+            True if this call cancelled the token, False if it was already cancelled
+        """
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.cancelled = True
+            self.reason = reason
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️ Cancellation callback failed: {e}")
+        return True
+
+    def raise_if_cancelled(self):
+        """
+        Raise RequestCancelled if the request has been cancelled.
+
+        Raises:
+            RequestCancelled: If cancel() has been called
+        """
+        if self.cancelled:
+            raise RequestCancelled(self.reason)
+
+    @contextmanager
+    def on_cancel(self, callback):
+        """
+        Run a callback if the request is cancelled while the block runs (or already was).
+
+        Args:
+            callback: Callable taking no arguments; it runs on the cancelling thread
+        """
+        with self._lock:
+            cancelled = self.cancelled
+            if not cancelled:
+                callback_id = self._next_id
+                self._next_id += 1
+                self._callbacks[callback_id] = callback
+        if cancelled:
+            callback()
+        try:
+            yield
+        finally:
+            if not cancelled:
+                with self._lock:
+                    self._callbacks.pop(callback_id, None)
+
+
+def start_request():
+    """
+    Create a token for a new request and make it current in this context.
+
+    Returns:
+        The new CancellationToken
+    """
+    token = CancellationToken()
+    _current_token.set(token)
+    return token
+
+
+def current_token():
+    """Get the cancellation token current in this context, or None."""
+    return _current_token.get()
+
+
+@contextmanager
+def on_cancel(token, callback):
+    """
+    Register a cancel callback for the duration of a block (no-op without a token).
+
+    Args:
+        token: CancellationToken or None
+        callback: Callable run if the token is cancelled while the block runs
+    """
+    if token is None:
+        yield
+        return
+    with token.on_cancel(callback):
+        yield
+
+
+def guard(iterable, token):
+    """
+    Iterate until the token is cancelled.
+
+    Errors raised by the iterable after the token was cancelled (such as reading
+    from a stream the cancel callback closed) are reported as RequestCancelled.
+
+    Args:
+        iterable: The iterable to consume
+        token: CancellationToken or None
+
+    Yields:
+        Items of the iterable
+
+    Raises:
+        RequestCancelled: Once the token is cancelled
+    """
+    if token is None:
+        yield from iterable
+        return
+    try:
+        for item in iterable:
+            token.raise_if_cancelled()
+            yield item
+    except RequestCancelled:
+        raise
+    except Exception:
+        token.raise_if_cancelled()
+        raise
+    token.raise_if_cancelled()
+
+
+async def aguard(aiterable, token):
+    """
+    Iterate an async iterable until the token is cancelled.
+
+    Each wait for the next item is raced against the token, so a stream that has
+    stalled stops as soon as the request is cancelled from another thread.
+
+    Args:
+        aiterable: The async iterable to consume
+        token: CancellationToken or None
+
+    Yields:
+        Items of the iterable
+
+    Raises:
+        RequestCancelled: Once the token is cancelled
+    """
+    if token is None:
+        async for item in aiterable:
+            yield item
+        return
+
+    loop = asyncio.get_running_loop()
+    cancelled = loop.create_future()
+
+    def wake():
+        loop.call_soon_threadsafe(lambda: cancelled.done() or cancelled.set_result(None))
+
+    iterator = aiterable.__aiter__()
+    with token.on_cancel(wake):
+        while True:
+            token.raise_if_cancelled()
+            next_item = asyncio.ensure_future(iterator.__anext__())
+            await asyncio.wait({next_item, cancelled}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_item.done():
+                next_item.cancel()
+                token.raise_if_cancelled()
+            try:
+                item = next_item.result()
+            except StopAsyncIteration:
+                return
+            except Exception:
+                token.raise_if_cancelled()
+                raise
+            yield item
@@ -8,6 +8,9 @@ import json
 import re
 import time
 import asyncio
+import weakref
+import contextvars
+from concurrent.futures import wait as wait_for_futures
 from functools import lru_cache
 from datetime import date, datetime
 
@@ -16,13 +19,62 @@ if __name__ == "__main__":
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from src.memory.memory_manager import MemoryManager
-from src.llm_api import LlmApi
-from src.vanna_scripts import VannaToolWrapper
+from src.llm_api import LlmApi, get_prompt_cache_stats
+from src.http_pool import get_llm_http_pool
+from src.hedging import get_hedge_policy
+from src.model_router import get_model_router
+from src.rate_limiter import get_llm_rate_limiter
+from src.event_loop import get_background_loop
+from src import tracing
+from src import scheduler
+from src import cancellation
+from src.prompt_assembler import PromptAssembler
+from src.result_encoder import encode_results
+from src.answer_cache import AnswerCache, get_answer_cache
+from src.question_decomposer import get_question_decomposer
+from src.resource_registry import get_resource_registry, VANNA
+from src.vanna_scripts.data_intent_router import get_data_intent_router
+from src.vanna_scripts.vanna_tool_wrapper import VannaToolWrapper
 from config.config import (
-    COMPANION_MAX_COMPLETION_TOKENS,
-    API_CONVERSATION_HISTORY_LIMIT
+    API_CONVERSATION_HISTORY_LIMIT,
+    PENDING_WRITE_FLUSH_TIMEOUT,
+    LLM_ASYNC_STREAMING,
+    TWO_PHASE_OPENING_MAX_TOKENS,
+    TWO_PHASE_DATA_TIMEOUT,
+    TOOL_CALL_TIMEOUT,
+    TOOL_CALL_MAX_RESULTS,
+    WARM_START_PROMPT,
+    ANALYST_TYPES,
+    ANSWER_CACHE_PREWARM_INTERVAL
 )
 
+# Instructions for the two segments of a two-phase streamed answer
+TWO_PHASE_OPENING_INSTRUCTIONS = """
+
+(The database query for this question is still running. Write a brief opening of two to four sentences that frames the question using what you know about the user and the conversation so far. Do not state specific figures or draw conclusions from data yet; a data-grounded analysis will follow immediately after your opening.)"""
+
+TWO_PHASE_CONTINUATION_INSTRUCTIONS = """
+
+You have already sent the user this opening:
+---
+{opening}
+---
+Continue directly from it with the data-grounded analysis. Do not repeat or restate the opening."""
+
+# Added to the user message in tool-calling mode
+TOOL_MODE_INSTRUCTIONS = """
+
+(You can query the company's Snowflake data warehouse with the snowflake_query tool. Call it only when the answer depends on current figures; answer strategy and advice questions directly. When several metrics are needed, request them as separate snowflake_query calls in the same turn so they run in parallel, then ground your answer in the returned results.)"""
+
+# Responses that report a failure rather than answer the question, and so are never cached
+UNCACHEABLE_RESPONSE_PREFIXES = (
+    "Error:",
+    "I encountered an error",
+    "I apologize, but I encountered an issue"
+)
+
+TWO_PHASE_NO_DATA_MESSAGE = "⚠️ I wasn't able to retrieve the data for this question, so the analysis above isn't grounded in current figures. Try rephrasing the question or check the data connection."
+
 # Custom JSON encoder to handle date objects
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -31,7 +83,12 @@ class CustomJSONEncoder(json.JSONEncoder):
         return super().default(obj)
 
 class DataAnalysisDetector:
-    """Fast cached data analysis detection with optimized patterns."""
+    """
+    Fast cached data analysis detection with optimized patterns.
+
+    Fallback for when the embedding-based DataIntentRouter has no index (Chroma
+    unavailable or Vanna not yet trained); it over-triggers on common words.
+    """
     
     def __init__(self):
         self.cache = {}
@@ -103,15 +160,35 @@ class Companion:
         """
         self.user_id = user_id
         self.analyst_type = analyst_type
-        self.memory_manager = MemoryManager(user_id, strict_memory=strict_memory)
-        self.llm_api = LlmApi(analyst_type=analyst_type)
-        self.vanna_wrapper = None  # Initialize lazily when needed
+        self.llm_api = LlmApi(analyst_type=analyst_type, user_id=user_id)
+        self.memory_manager = MemoryManager(
+            user_id,
+            strict_memory=strict_memory,
+            summarizer=self.llm_api.summarize_conversation,
+            history_limit=API_CONVERSATION_HISTORY_LIMIT
+        )
+        self.prompt_assembler = PromptAssembler(self.llm_api.get_static_system_prompt, self._build_data_context)
+        self.vanna_wrapper = None  # Borrowed from the resource registry when first needed
+        self._vanna_lock = threading.Lock()
         self.data_analysis_enabled = True  # Enable data analysis by default
         
-        # Performance optimizations
-        self.data_detector = DataAnalysisDetector()
+        # Performance optimizations: route on similarity to the Vanna training
+        # questions, falling back to keyword matching when no index is available
+        router = get_data_intent_router()
+        self.data_detector = router if router.is_available() else DataAnalysisDetector()
         self._session_active = True
         
+        # Cancellation tokens of this session's in-flight turns (see cancel())
+        self._active_requests = weakref.WeakSet()
+        self._requests_lock = threading.Lock()
+        
+        # Shared background loop that runs the request pipeline
+        self._loop = get_background_loop()
+
+        # Shared cache of query results and data-grounded answers
+        self.answer_cache = get_answer_cache()
+        self.question_decomposer = get_question_decomposer()
+        
         # Check memory status on initialization
         memory_status = self.memory_manager.get_memory_status()
         if self.memory_manager.is_memory_degraded():
@@ -121,91 +198,64 @@ class Companion:
             print("✅ Companion initialized with full memory capabilities")
     
     def _get_vanna_wrapper(self):
-        """Get or create VannaToolWrapper instance (lazy initialization)."""
+        """Borrow the process-wide VannaToolWrapper on first use (it is built once per process)."""
         if self.vanna_wrapper is None:
-            try:
-                print("🔄 Companion: Initializing VannaToolWrapper...")
-                self.vanna_wrapper = VannaToolWrapper()
-                print("✅ Companion: VannaToolWrapper initialized successfully")
-            except Exception as e:
-                print(f"❌ Companion: Failed to initialize VannaToolWrapper: {e}")
-                import traceback
-                print(f"Full error: {traceback.format_exc()}")
-                return None
+            with self._vanna_lock:
+                if self.vanna_wrapper is None:
+                    try:
+                        self.vanna_wrapper = get_resource_registry().acquire(VANNA)
+                    except Exception as e:
+                        print(f"❌ Companion: Failed to initialize VannaToolWrapper: {e}")
+                        import traceback
+                        print(f"Full error: {traceback.format_exc()}")
+                        return None
         return self.vanna_wrapper
     
-    def _store_conversation_async(self, user_message, assistant_response):
-        """
-        Store a conversation in long-term memory asynchronously.
-        
-        Args:
-            user_message: The user's message
-            assistant_response: The assistant's response
-        """
-        try:
-            print(f"\n[DEBUG] Companion: Starting async memory storage...")
-            result = self.memory_manager.store_conversation(user_message, assistant_response)
-            
-            if result["overall_success"]:
-                print(f"✅ Companion: Long-term memory storage completed successfully")
-            else:
-                print(f"⚠️ Companion: Memory storage partially failed:")
-                print(f"   User memory: {'✅' if result['user_memory_saved'] else '❌'}")
-                print(f"   Companion memory: {'✅' if result['companion_memory_saved'] else '❌'}")
-                
-        except Exception as e:
-            print(f"❌ Companion: Error in async memory storage: {e}")
-            import traceback
-            print(f"   Full error: {traceback.format_exc()}")
-    
     def _should_use_data_analysis(self, user_message):
         """
         Determine if the user message requires data analysis (optimized with caching).
-        
+
         Args:
             user_message: The user's message
-            
+
         Returns:
             Boolean indicating if data analysis should be used
         """
         if not self.data_analysis_enabled:
             return False
-        
-        start_time = time.time()
-        result = self.data_detector.should_analyze(user_message)
-        detection_time = (time.time() - start_time) * 1000
-        
-        print(f"🚀 Data analysis detection: {result} (took {detection_time:.1f}ms)")
+
+        with tracing.span("detect", detector=type(self.data_detector).__name__) as span:
+            result = self.data_detector.should_analyze(user_message)
+            span.set(needs_data=result)
         return result
-    
+
     def _analyze_data(self, user_message):
         """
         Analyze data using VannaToolWrapper.
-        
+
         Args:
             user_message: The user's data question
-            
+
         Returns:
             Dictionary with analysis results or None if failed
         """
         print(f"🔍 Companion: Starting data analysis for: {user_message[:100]}...")
-        
+
         wrapper = self._get_vanna_wrapper()
         if not wrapper:
             print("❌ Companion: VannaToolWrapper not available")
             return None
-        
+
         try:
             print(f"🚀 Companion: Calling wrapper.snowflake_query()...")
-            result = wrapper.snowflake_query(
-                question=user_message,
-                execute_query=True,
-                max_results=100
-            )
-            
+            with tracing.span("analyze") as span:
+                result = self.question_decomposer.query(user_message, self.answer_cache, wrapper, max_results=100)
+                if isinstance(result, dict):
+                    span.set(success=bool(result.get("success")), rows=result.get("row_count", 0),
+                             cached=bool(result.get("cached")), parts=len(result.get("sub_results") or [result]))
+
             print(f"✅ Companion: wrapper.snowflake_query() completed")
-            print(f"📊 Companion: Result type: {type(result)}")
-            
+
             if isinstance(result, dict):
                 if result.get("success"):
                     print(f"✅ Companion: Data analysis successful: {result.get('row_count', 0)} rows returned")
@@ -213,573 +263,919 @@ class Companion:
                     return result
                 else:
                     print(f"❌ Companion: Data analysis failed: {result.get('error', 'Unknown error')}")
-                    print(f"Full result: {result}")
                     return None
             else:
                 print(f"❌ Companion: Unexpected result type: {type(result)}")
-                print(f"Result: {result}")
                 return None
-                
+
         except Exception as e:
             print(f"❌ Companion: Error in data analysis: {e}")
             import traceback
             print(f"Full error: {traceback.format_exc()}")
             return None
-    
-    async def _analyze_data_async(self, user_message):
+
+    def _lookup_cached_answer(self, user_message):
         """
-        Asynchronously analyze data using VannaToolWrapper.
-        
+        Cache stage: find a fresh cached query result for a data question, and this
+        analyst's answer built on it.
+
         Args:
             user_message: The user's data question
-            
+
         Returns:
-            Dictionary with analysis results or None if failed
+            Tuple of (data_result, response); either may be None
         """
-        print(f"🔍 Companion: Starting async data analysis for: {user_message[:100]}...")
-        
         wrapper = self._get_vanna_wrapper()
         if not wrapper:
-            print("❌ Companion: VannaToolWrapper not available")
-            return None
-        
+            return None, None
+
         try:
-            print(f"🚀 Companion: Calling async wrapper.snowflake_query()...")
-            
-            # Run the data analysis in a thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None,
-                lambda: wrapper.snowflake_query(
-                    question=user_message,
-                    execute_query=True,
-                    max_results=100
-                )
-            )
-            
-            print(f"✅ Companion: async wrapper.snowflake_query() completed")
-            print(f"📊 Companion: Result type: {type(result)}")
-            
-            if isinstance(result, dict):
-                if result.get("success"):
-                    print(f"✅ Companion: Async data analysis successful: {result.get('row_count', 0)} rows returned")
-                    print(f"📊 Companion: SQL length: {len(result.get('sql', '')) if result.get('sql') else 0}")
-                    return result
-                else:
-                    print(f"❌ Companion: Async data analysis failed: {result.get('error', 'Unknown error')}")
-                    print(f"Full result: {result}")
-                    return None
-            else:
-                print(f"❌ Companion: Unexpected async result type: {type(result)}")
-                print(f"Result: {result}")
-                return None
-                
+            data_result = self.answer_cache.get_data(user_message, wrapper.get_table_versions)
         except Exception as e:
-            print(f"❌ Companion: Error in async data analysis: {e}")
-            import traceback
-            print(f"Full error: {traceback.format_exc()}")
-            # Fallback to sync method
-            print("🔄 Falling back to synchronous data analysis...")
-            return self._analyze_data(user_message)
-    
-    async def _store_conversation_async_new(self, user_message, assistant_response):
+            print(f"⚠️ Companion: Answer cache lookup failed: {e}")
+            return None, None
+        if not data_result:
+            return None, None
+
+        response = self.answer_cache.get_answer(user_message, self.analyst_type, AnswerCache.fingerprint(data_result))
+        return data_result, response
+
+    def _cache_answer(self, turn, response):
         """
-        Store a conversation in long-term memory asynchronously using the new async methods.
-        
+        Cache a complete data-grounded answer for this analyst.
+
+        Cached answers are served to every user of the analyst, so only answers
+        written without this user's memories, summary or earlier messages are
+        stored - the same context-free prompt the prewarm job uses.
+
+        Args:
+            turn: Turn dictionary produced by _prepare_turn
+            response: The full response text
+        """
+        if turn["cached_answer"] or not turn["data_analysis"]:
+            return
+        if not response or response.startswith(UNCACHEABLE_RESPONSE_PREFIXES):
+            return
+        memories = turn["memories"] or {}
+        # api_history is this user's conversation before the current message
+        if (memories.get("user_memories") or memories.get("companion_memories")
+                or turn["conversation_summary"] or turn["api_history"]):
+            return
+        self.answer_cache.put_answer(
+            turn["user_message"], self.analyst_type, AnswerCache.fingerprint(turn["data_analysis"]), response
+        )
+
+    def _start_data_analysis(self, user_message):
+        """
+        Start the analyze stage on the shared executor.
+
+        The blocking Vanna/Snowflake round trip runs off the event loop so memory
+        retrieval (and, in two-phase streaming, the opening narrative) can proceed
+        while the query is in flight.
+
+        Args:
+            user_message: The user's data question
+
+        Returns:
+            concurrent.futures.Future resolving to the analysis result or None
+        """
+        return self._loop.executor.submit(tracing.bind(self._analyze_data), user_message)
+
+    def _schedule_persist(self, user_message, assistant_response, trace=None):
+        """
+        Persist stage: record the exchange in short-term memory and queue it for
+        long-term storage.
+
+        The user message is recorded here, with its reply, so a cancelled or failed
+        turn leaves no unanswered message in the history. The long-term write is
+        handled by the process-wide write-behind queue, so it never blocks the request
+        and close() can wait for it. Recording the exchange may flush the short-term
+        buffer to Snowflake, so async callers run this on the executor.
+
         Args:
             user_message: The user's message
             assistant_response: The assistant's response
+            trace: The request's Trace, which this stage completes (default: the current trace)
         """
-        try:
-            print(f"\n[DEBUG] Companion: Starting new async memory storage...")
-            result = await self.memory_manager.store_conversation_async(user_message, assistant_response)
-            
-            if result["overall_success"]:
-                print(f"✅ Companion: New async long-term memory storage completed successfully")
-            else:
-                print(f"⚠️ Companion: New async memory storage partially failed:")
-                print(f"   User memory: {'✅' if result['user_memory_saved'] else '❌'}")
-                print(f"   Companion memory: {'✅' if result['companion_memory_saved'] else '❌'}")
-                
-        except Exception as e:
-            print(f"❌ Companion: Error in new async memory storage: {e}")
-            import traceback
-            print(f"   Full error: {traceback.format_exc()}")
-    
-    async def process_message_async(self, user_message):
+        trace = trace or tracing.current_trace()
+        with tracing.span("persist", trace=trace, response_chars=len(assistant_response)):
+            self.memory_manager.add_user_message(user_message)
+            self.memory_manager.add_assistant_message(assistant_response)
+            result = self.memory_manager.store_conversation(user_message, assistant_response)
+        if trace:
+            trace.finish()
+
+        if not result["overall_success"]:
+            print(f"⚠️ Companion: Long-term memory write not queued:")
+            print(f"   User memory: {'✅' if result['user_memory_saved'] else '❌'}")
+            print(f"   Companion memory: {'✅' if result['companion_memory_saved'] else '❌'}")
+
+    def _end_if_cancelled(self, turn):
         """
-        Process a user message asynchronously with parallel memory retrieval and data analysis.
-        
+        Finish a cancelled turn's trace; its partial answer is neither cached nor persisted.
+
         Args:
-            user_message: The message from the user
-            
+            turn: Turn dictionary produced by _prepare_turn
+
         Returns:
-            The companion's response, optionally with data analysis results
+            True if the turn was cancelled
         """
-        # Add the user message to short-term memory
-        self.memory_manager.add_user_message(user_message)
-        
-        # Start parallel operations
-        start_time = time.time()
-        
-        # Check if this message requires data analysis
-        needs_data_analysis = self._should_use_data_analysis(user_message)
-        
-        # Create tasks for parallel execution
-        memory_task = asyncio.create_task(
-            self.memory_manager.get_relevant_memories_async(user_message)
-        )
-        
-        data_task = None
-        if needs_data_analysis:
-            print("🤖 Data analysis detected - querying database in parallel...")
-            data_task = asyncio.create_task(self._analyze_data_async(user_message))
-        
-        # Get conversation context (this is fast, so we can do it synchronously)
-        api_history = self.memory_manager.get_api_conversation_history(API_CONVERSATION_HISTORY_LIMIT)
-        conversation_context = "\n".join([f"{msg['role']}: {msg['content']}" for msg in api_history])
-        
-        # Wait for parallel operations to complete
-        if data_task:
-            memories, data_result = await asyncio.gather(
-                memory_task, data_task, return_exceptions=True
+        token = turn["cancel_token"]
+        if not token.cancelled:
+            return False
+        print(f"🛑 Companion: Turn cancelled ({token.reason}) - turn not saved")
+        turn["trace"].finish(cancelled=True)
+        return True
+
+    def cancel(self, reason="cancelled"):
+        """
+        Cancel this session's in-flight turns.
+
+        Running Snowflake statements are cancelled by query id, LLM streams are
+        closed, pending memory searches are dropped and calls still queued in the
+        scheduler leave the queue. Interrupted turns are not persisted.
+
+        Args:
+            reason: Why the turns were cancelled (recorded on their traces)
+
+        Returns:
+            Number of turns cancelled
+        """
+        with self._requests_lock:
+            tokens = list(self._active_requests)
+            self._active_requests.clear()
+        cancelled = sum(1 for token in tokens if token.cancel(reason))
+        if cancelled:
+            print(f"🛑 Companion: Cancelled {cancelled} in-flight turn(s) for user {self.user_id} ({reason})")
+        return cancelled
+
+    def flush_pending_writes(self, timeout=PENDING_WRITE_FLUSH_TIMEOUT):
+        """
+        Wait for this session's queued long-term memory writes to finish.
+
+        Args:
+            timeout: Maximum number of seconds to wait
+
+        Returns:
+            Number of writes still pending when the timeout expired
+        """
+        remaining = self.memory_manager.flush_long_term(timeout)
+        if remaining:
+            print(f"⚠️ Companion: {remaining} memory writes still pending after {timeout}s")
+        return remaining
+
+    @staticmethod
+    def _build_data_context(data_result, max_rows=None):
+        """
+        Format successful data analysis results for inclusion in the LLM prompt.
+
+        A decomposed question is described one sub-question at a time, each with its
+        own SQL and results.
+
+        Args:
+            data_result: Result dictionary from VannaToolWrapper.snowflake_query or
+                QuestionDecomposer.query
+            max_rows: Maximum number of result rows to include per sub-question (default: all)
+
+        Returns:
+            Prompt section describing the query and its results
+        """
+        if data_result.get("sub_results"):
+            parts = "\n".join(
+                f"""
+Sub-question {index}: {part.get('question', '')}
+SQL Query: {part.get('sql', '')}
+Results:
+{encode_results(part.get('results', []), max_rows)}
+Row Count: {part.get('row_count', 0)}{Companion._describe_data_source(part)}"""
+                for index, part in enumerate(data_result["sub_results"], 1)
             )
-        else:
-            memories = await memory_task
-            data_result = None
-        
-        # Handle exceptions from parallel operations
-        if isinstance(memories, Exception):
-            print(f"⚠️ Memory retrieval failed: {memories}")
-            memories = {"user_memories": "", "companion_memories": ""}
-        
-        if isinstance(data_result, Exception):
-            print(f"⚠️ Data analysis failed: {data_result}")
-            data_result = None
-        
-        parallel_time = (time.time() - start_time) * 1000
-        print(f"🚀 Parallel operations completed in {parallel_time:.1f}ms")
-        
-        # Debug print statements
-        print("\n=== Async Conversation Context Debug Info ===")
-        print(f"API conversation history limit: {API_CONVERSATION_HISTORY_LIMIT} messages")
-        print(f"API conversation history actual length: {len(api_history)} messages")
-        print(f"API conversation context tokens (estimated): {len(conversation_context) // 4} tokens")
-        print(f"Full memory history length: {len(self.memory_manager.get_full_conversation_history())} messages")
-        if data_result:
-            print(f"Data analysis results: {data_result.get('row_count', 0)} rows")
-        print("============================================\n")
-        
-        # Print long-term memories for debugging
-        print("\n=== Retrieved Long-term Memories (Async) ===")
-        print("User memories:", memories["user_memories"] if memories["user_memories"] else "None")
-        print("Companion memories:", memories["companion_memories"] if memories["companion_memories"] else "None")
-        print("==========================================\n")
-        
-        # Prepare the message for the LLM
-        enhanced_message = user_message
-        
-        # If we have data results, include them in the context
-        if data_result and data_result.get("success"):
-            data_context = f"""
+            failed = (data_result.get("metadata") or {}).get("failed_sub_questions") or []
+            missing = "".join(f"\nNo data for: {part['question']} ({part['error']})" for part in failed)
+            return f"""
 
 DATA ANALYSIS RESULTS:
 Question: {data_result.get('question', '')}
-SQL Query: {data_result.get('sql', '')}
-Results: {json.dumps(data_result.get('results', []), indent=2, cls=CustomJSONEncoder)}
-Row Count: {data_result.get('row_count', 0)}
+The question was answered with {len(data_result["sub_results"])} separate queries run in parallel.
+{parts}{missing}
 Execution Time: {data_result.get('execution_time_ms', 0)}ms
 
 Please analyze these results and provide insights in your response. Reference the specific data points and explain what they mean for the business."""
-            
-            enhanced_message = user_message + data_context
-        
-        # Generate the response with a limit on completion tokens
-        assistant_response = self.llm_api.generate_response(
-            enhanced_message, 
-            memories["user_memories"], 
-            memories["companion_memories"], 
-            conversation_context,
-            max_tokens=COMPANION_MAX_COMPLETION_TOKENS
-        )
-        
-        # Add the assistant response to short-term memory
-        self.memory_manager.add_assistant_message(assistant_response)
-        
-        # Store the conversation in long-term memory asynchronously using the new async method
-        print(f"\n[DEBUG] Companion: Initiating new async memory storage...")
-        asyncio.create_task(self._store_conversation_async_new(user_message, assistant_response))
-        print(f"[DEBUG] Companion: New async memory storage task started")
-        
-        # Return response with optional data results
-        response_data = {
-            "response": assistant_response,
-            "data_analysis": data_result if data_result and data_result.get("success") else None
-        }
-        
-        return response_data
 
-    def process_message(self, user_message):
-        """
-        Process a user message and generate a response using async optimization when possible.
-        
-        Args:
-            user_message: The message from the user
-            
-        Returns:
-            The companion's response, optionally with data analysis results
-        """
-        # Try to use async version if we can get or create an event loop
-        try:
-            # Try to get the current event loop
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                # If we're in an async context, create a task for async processing
-                print("🚀 Using async parallel processing...")
-                return asyncio.run_coroutine_threadsafe(
-                    self.process_message_async(user_message), loop
-                ).result()
-            else:
-                # Run async version with asyncio.run
-                print("🚀 Using async parallel processing...")
-                return asyncio.run(self.process_message_async(user_message))
-        except (RuntimeError, AttributeError):
-            # If we can't use async (no event loop), fall back to sync version
-            print("ℹ️ Falling back to synchronous processing...")
-            
-            # Add the user message to short-term memory
-            self.memory_manager.add_user_message(user_message)
-            
-            # Check if this message requires data analysis
-            data_result = None
-            if self._should_use_data_analysis(user_message):
-                print("🤖 Data analysis detected - querying database...")
-                data_result = self._analyze_data(user_message)
-            
-            # Get relevant memories and conversation context
-            memories = self.memory_manager.get_relevant_memories(user_message)
-            
-            # Use the limited API conversation history
-            api_history = self.memory_manager.get_api_conversation_history(API_CONVERSATION_HISTORY_LIMIT)
-            conversation_context = "\n".join([f"{msg['role']}: {msg['content']}" for msg in api_history])
-            
-            # Debug print statements
-            print("\n=== Conversation Context Debug Info ===")
-            print(f"API conversation history limit: {API_CONVERSATION_HISTORY_LIMIT} messages")
-            print(f"API conversation history actual length: {len(api_history)} messages")
-            print(f"API conversation context tokens (estimated): {len(conversation_context) // 4} tokens")
-            print(f"Full memory history length: {len(self.memory_manager.get_full_conversation_history())} messages")
-            if data_result:
-                print(f"Data analysis results: {data_result.get('row_count', 0)} rows")
-            print("========================================\n")
-            
-            # Print long-term memories for debugging
-            print("\n=== Retrieved Long-term Memories ===")
-            print("User memories:", memories["user_memories"] if memories["user_memories"] else "None")
-            print("Companion memories:", memories["companion_memories"] if memories["companion_memories"] else "None")
-            print("===================================\n")
-            
-            # Prepare the message for the LLM
-            enhanced_message = user_message
-            
-            # If we have data results, include them in the context
-            if data_result and data_result.get("success"):
-                data_context = f"""
+        return f"""
 
 DATA ANALYSIS RESULTS:
 Question: {data_result.get('question', '')}
 SQL Query: {data_result.get('sql', '')}
-Results: {json.dumps(data_result.get('results', []), indent=2, cls=CustomJSONEncoder)}
-Row Count: {data_result.get('row_count', 0)}
+Results:
+{encode_results(data_result.get('results', []), max_rows)}
+Row Count: {data_result.get('row_count', 0)}{Companion._describe_data_source(data_result)}
 Execution Time: {data_result.get('execution_time_ms', 0)}ms
 
 Please analyze these results and provide insights in your response. Reference the specific data points and explain what they mean for the business."""
-                
-                enhanced_message = user_message + data_context
-            
-            # Generate the response with a limit on completion tokens
-            assistant_response = self.llm_api.generate_response(
-                enhanced_message, 
-                memories["user_memories"], 
-                memories["companion_memories"], 
-                conversation_context,
-                max_tokens=COMPANION_MAX_COMPLETION_TOKENS
-            )
-            
-            # Add the assistant response to short-term memory
-            self.memory_manager.add_assistant_message(assistant_response)
-            
-            # Store the conversation in long-term memory asynchronously
-            print(f"\n[DEBUG] Companion: Initiating async memory storage thread...")
-            memory_thread = threading.Thread(
-                target=self._store_conversation_async,
-                args=(user_message, assistant_response)
+
+    @staticmethod
+    def _describe_data_source(result):
+        """
+        Describe where a query result came from when it was not read live from Snowflake.
+
+        Args:
+            result: Result dictionary from VannaToolWrapper.snowflake_query
+
+        Returns:
+            Prompt line naming the replica snapshot time, or "" for live results
+        """
+        data_source = (result.get("metadata") or {}).get("data_source") or {}
+        if data_source.get("source") != "replica":
+            return ""
+        return (f"\nData Source: local replica snapshot of {data_source.get('snapshot_at')} "
+                f"(verified current {data_source.get('staleness_seconds')}s ago)")
+
+    def _assemble_prompt(self, turn):
+        """
+        Assemble stage: fit data, memories and history into the model's prompt budget.
+
+        Args:
+            turn: Turn dictionary produced by _prepare_turn; its prompt fields are
+                rebuilt from the raw memories, history and data analysis result
+        """
+        with tracing.span("assemble"):
+            prompt = self.prompt_assembler.assemble(
+                turn["user_message"],
+                turn["data_analysis"],
+                turn["memories"]["user_memories"],
+                turn["memories"]["companion_memories"],
+                turn["api_history"],
+                model=turn["route"]["model"],
+                summary=turn["conversation_summary"]
             )
-            memory_thread.daemon = True
-            memory_thread.start()
-            print(f"[DEBUG] Companion: Memory storage thread started")
-            
-            # Return response with optional data results
-            response_data = {
-                "response": assistant_response,
-                "data_analysis": data_result if data_result and data_result.get("success") else None
-            }
-            
-            return response_data
-    
-    async def process_message_stream_async(self, user_message):
+            tracing.set_attributes(**{f"tokens_{k}": v for k, v in prompt["prompt_tokens"].items()})
+        turn.update(prompt)
+        print(f"   Prompt tokens: {self.prompt_assembler.describe(prompt['prompt_tokens'])}")
+
+    async def _prepare_turn(self, user_message, defer_data=False, use_tools=False):
         """
-        Process a user message asynchronously and generate a streaming response with parallel operations.
-        
+        Run the detect → retrieve → analyze → assemble stages of the request pipeline.
+
+        Memory retrieval and data analysis run concurrently; the generate and persist
+        stages are driven by the blocking or streaming entry points.
+
         Args:
             user_message: The message from the user
-            
+            defer_data: If True, return as soon as memories are ready and leave the
+                data analysis running in turn["data_future"]
+            use_tools: If True, skip detection and analysis; the model queries data itself
+
         Returns:
-            A tuple containing:
-            - Generator that yields chunks of the response
-            - Dictionary with metadata (data_analysis, etc.)
+            Turn dictionary with the assembled prompt inputs and data analysis result
         """
-        # Add the user message to short-term memory
-        self.memory_manager.add_user_message(user_message)
-        
-        # Start parallel operations
-        start_time = time.time()
-        
-        # Check if this message requires data analysis
-        needs_data_analysis = self._should_use_data_analysis(user_message)
-        
-        # Create tasks for parallel execution
-        memory_task = asyncio.create_task(
-            self.memory_manager.get_relevant_memories_async(user_message)
+        # Every span recorded for this request, in this task or bound executor calls, joins its trace
+        trace = tracing.start_trace(user_id=self.user_id, analyst=self.analyst_type)
+        # ...and every backend call is admitted as this user's interactive work
+        scheduler.start_work(self.user_id)
+        # ...and can be abandoned with cancel()
+        cancel_token = cancellation.start_request()
+        with self._requests_lock:
+            self._active_requests.add(cancel_token)
+
+        # Get the recent history and the summary of everything before it on the executor: reading
+        # older messages reaches Snowflake, which must not stall the loop. The message itself is
+        # sent after the turn's context and saved with the reply by the persist stage
+        conversation_summary, api_history = await asyncio.get_running_loop().run_in_executor(
+            None, tracing.bind(self.memory_manager.get_summarized_conversation_history),
+            API_CONVERSATION_HISTORY_LIMIT
         )
-        
-        data_task = None
-        if needs_data_analysis:
-            print("🤖 Data analysis detected - querying database in parallel...")
-            data_task = asyncio.create_task(self._analyze_data_async(user_message))
-        
-        # Get conversation context (this is fast, so we can do it synchronously)
-        api_history = self.memory_manager.get_api_conversation_history(API_CONVERSATION_HISTORY_LIMIT)
-        conversation_context = "\n".join([f"{msg['role']}: {msg['content']}" for msg in api_history])
-        
-        # Wait for parallel operations to complete
-        if data_task:
-            memories, data_result = await asyncio.gather(
-                memory_task, data_task, return_exceptions=True
-            )
-        else:
-            memories = await memory_task
-            data_result = None
-        
+
+        start_time = time.time()
+
+        # Detect: does this message require data analysis? (in tool-calling mode the model decides)
+        # The detector embeds the message and queries Chroma, so it runs on the executor
+        # to keep the loop free for other sessions
+        needs_data_analysis = False
+        if not use_tools:
+            needs_data_analysis = await asyncio.get_running_loop().run_in_executor(
+                None, tracing.bind(self._should_use_data_analysis), user_message
+            )
+
+        # Route: pick the model and completion budget from the turn's intent
+        with tracing.span("route") as span:
+            route = self.llm_api.route_turn(user_message, needs_data=needs_data_analysis, tools=use_tools)
+            span.set(route=route["name"], model=route["model"], max_tokens=route["max_tokens"])
+        print(f"🧭 Route: {route['name']} → {route['model']} (max {route['max_tokens']} tokens)")
+
+        # Cache: a fresh result skips the query; a cached answer skips everything else too
+        cached_data = cached_answer = None
+        if needs_data_analysis and self.answer_cache.has_data(user_message):
+            loop = asyncio.get_running_loop()
+            with tracing.span("cache.lookup") as span:
+                cached_data, cached_answer = await loop.run_in_executor(
+                    None, tracing.bind(self._lookup_cached_answer), user_message
+                )
+                span.set(data_hit=bool(cached_data), answer_hit=bool(cached_answer))
+
+        if cached_answer:
+            print(f"⚡ Answer cache hit - skipping memory retrieval and generation "
+                  f"({(time.time() - start_time) * 1000:.1f}ms)")
+            turn = {
+                "user_message": user_message,
+                "memories": {"user_memories": "", "companion_memories": ""},
+                "api_history": [],
+                "conversation_summary": "",
+                "data_analysis": None,
+                "data_future": None,
+                "cached_answer": cached_answer,
+                "route": route,
+                "trace": trace,
+                "cancel_token": cancel_token
+            }
+            self._attach_data_result(turn, cached_data)
+            return turn
+
+        # Retrieve and analyze in parallel
+        memory_task = asyncio.create_task(
+            self.memory_manager.get_relevant_memories_async(user_message)
+        )
+
+        data_future = None
+        if needs_data_analysis and not cached_data:
+            print("🤖 Data analysis detected - querying database in parallel...")
+            data_future = self._start_data_analysis(user_message)
+
+        # Cancelling the turn drops the pending memory search and a query that has not started
+        # (a running query is cancelled in Snowflake by the analyze stage itself)
+        loop = asyncio.get_running_loop()
+        
+        def drop_pending_work():
+            loop.call_soon_threadsafe(memory_task.cancel)
+            if data_future:
+                data_future.cancel()
+        
+        with cancellation.on_cancel(cancel_token, drop_pending_work):
+            if data_future and not defer_data:
+                memories, data_result = await asyncio.gather(
+                    memory_task, asyncio.wrap_future(data_future), return_exceptions=True
+                )
+            else:
+                memories = (await asyncio.gather(memory_task, return_exceptions=True))[0]
+                data_result = None
+        if cancel_token.cancelled:
+            print(f"🛑 Companion: Turn cancelled ({cancel_token.reason}) before generation")
+            trace.finish(cancelled=True)
+            cancel_token.raise_if_cancelled()
+
         # Handle exceptions from parallel operations
         if isinstance(memories, Exception):
             print(f"⚠️ Memory retrieval failed: {memories}")
             memories = {"user_memories": "", "companion_memories": ""}
-        
+
+        parallel_time = (time.time() - start_time) * 1000
+        print(f"🚀 Parallel operations completed in {parallel_time:.1f}ms")
+        print(f"   API conversation history: {len(api_history)}/{API_CONVERSATION_HISTORY_LIMIT} messages"
+              f"{' + summary' if conversation_summary else ''}")
+
+        turn = {
+            "user_message": user_message,
+            "memories": memories,
+            "api_history": api_history,
+            "conversation_summary": conversation_summary,
+            "data_analysis": None,
+            "data_future": data_future if defer_data else None,
+            "cached_answer": None,
+            "route": route,
+            "trace": trace,
+            "cancel_token": cancel_token,
+            # This request's trace, work and cancellation context, for tool calls made during generation
+            "context": contextvars.copy_context()
+        }
+        if data_future and not defer_data:
+            self._attach_data_result(turn, data_result)
+        elif cached_data:
+            self._attach_data_result(turn, cached_data)
+        else:
+            self._assemble_prompt(turn)
+        return turn
+
+    def _attach_data_result(self, turn, data_result):
+        """
+        Assemble stage for data: add a finished analysis result to the turn's prompt,
+        re-fitting the other sections around it.
+
+        Args:
+            turn: Turn dictionary produced by _prepare_turn
+            data_result: Result (or exception) from the analyze stage
+        """
         if isinstance(data_result, Exception):
             print(f"⚠️ Data analysis failed: {data_result}")
             data_result = None
-        
-        parallel_time = (time.time() - start_time) * 1000
-        print(f"🚀 Async streaming parallel operations completed in {parallel_time:.1f}ms")
-        
-        # Debug print statements
-        print("\n=== Async Streaming Conversation Context Debug Info ===")
-        print(f"API conversation history limit: {API_CONVERSATION_HISTORY_LIMIT} messages")
-        print(f"API conversation history actual length: {len(api_history)} messages")
-        print(f"API conversation context tokens (estimated): {len(conversation_context) // 4} tokens")
-        print(f"Full memory history length: {len(self.memory_manager.get_full_conversation_history())} messages")
-        if data_result:
-            print(f"Data analysis results: {data_result.get('row_count', 0)} rows")
-        print("======================================================\n")
-        
-        # Print long-term memories for debugging
-        print("\n=== Retrieved Long-term Memories (Async Stream) ===")
-        print("User memories:", memories["user_memories"] if memories["user_memories"] else "None")
-        print("Companion memories:", memories["companion_memories"] if memories["companion_memories"] else "None")
-        print("=================================================\n")
-        
-        # Prepare the message for the LLM
-        enhanced_message = user_message
-        
-        # If we have data results, include them in the context
+
         if data_result and data_result.get("success"):
-            data_context = f"""
+            print(f"   Data analysis results: {data_result.get('row_count', 0)} rows")
+            turn["data_analysis"] = data_result
+        elif "prompt_tokens" in turn:
+            return  # Prompt already assembled without data
 
-DATA ANALYSIS RESULTS:
-Question: {data_result.get('question', '')}
-SQL Query: {data_result.get('sql', '')}
-Results: {json.dumps(data_result.get('results', []), indent=2, cls=CustomJSONEncoder)}
-Row Count: {data_result.get('row_count', 0)}
-Execution Time: {data_result.get('execution_time_ms', 0)}ms
+        self._assemble_prompt(turn)
+
+    async def process_message_async(self, user_message):
+        """
+        Process a user message through the request pipeline.
+
+        Args:
+            user_message: The message from the user
+
+        Returns:
+            The companion's response, optionally with data analysis results
+        """
+        turn = await self._prepare_turn(user_message)
+
+        if turn["cached_answer"]:
+            assistant_response = turn["cached_answer"]
+        else:
+            # Generate the response on the executor so the loop stays free for other sessions
+            loop = asyncio.get_running_loop()
+            with tracing.span("llm.total", phase="answer", streaming=False):
+                assistant_response = await loop.run_in_executor(
+                    None,
+                    tracing.bind(lambda: self.llm_api.generate_response(
+                        turn["enhanced_message"],
+                        turn["user_memories"],
+                        turn["companion_memories"],
+                        turn["conversation_messages"],
+                        max_tokens=turn["route"]["max_tokens"],
+                        route=turn["route"]
+                    ))
+                )
+            if self._end_if_cancelled(turn):
+                turn["cancel_token"].raise_if_cancelled()
+            self._cache_answer(turn, assistant_response)
+
+        await asyncio.get_running_loop().run_in_executor(
+            None, tracing.bind(self._schedule_persist), user_message, assistant_response, turn["trace"]
+        )
+
+        return {
+            "response": assistant_response,
+            "data_analysis": turn["data_analysis"],
+            "prompt_tokens": turn["prompt_tokens"],
+            "answer_cached": bool(turn["cached_answer"])
+        }
+
+    def process_message(self, user_message):
+        """
+        Process a user message and generate a response.
+
+        The pipeline runs on the shared background event loop; this call blocks
+        until the response is ready.
+
+        Args:
+            user_message: The message from the user
+
+        Returns:
+            The companion's response, optionally with data analysis results
+        """
+        return self._loop.run(self.process_message_async(user_message))
+
+    def _stream_response(self, turn, metadata):
+        """
+        Generate stage for streaming: yield LLM chunks, then persist the full reply.
+
+        Args:
+            turn: Turn dictionary produced by _prepare_turn
+            metadata: Metadata dictionary returned to the caller; receives full_response
+
+        Yields:
+            Chunks of the response as they arrive from the API
+        """
+        response_chunks = []
+        yield from self._stream_answer(turn, response_chunks)
+        if self._end_if_cancelled(turn):
+            return
+
+        full_response = "".join(response_chunks)
+        metadata["full_response"] = full_response
+        self._cache_answer(turn, full_response)
+        self._schedule_persist(turn["user_message"], full_response, turn["trace"])
+
+    async def process_message_stream_async(self, user_message):
+        """
+        Process a user message through the request pipeline and return a streaming response.
+
+        Args:
+            user_message: The message from the user
+
+        Returns:
+            A tuple containing:
+            - Generator that yields chunks of the response
+            - Dictionary with metadata (data_analysis, etc.)
+        """
+        turn = await self._prepare_turn(user_message)
 
-Please analyze these results and provide insights in your response. Reference the specific data points and explain what they mean for the business."""
-            
-            enhanced_message = user_message + data_context
-        
-        # Create the metadata dict
         metadata = {
-            "data_analysis": data_result if data_result and data_result.get("success") else None
+            "data_analysis": turn["data_analysis"],
+            "prompt_tokens": turn["prompt_tokens"],
+            "answer_cached": bool(turn["cached_answer"])
         }
-        
-        # Create the streaming generator
-        def stream_generator():
-            full_response = ""
-            try:
-                for chunk in self.llm_api.generate_response_stream(
-                    enhanced_message, 
-                    memories["user_memories"], 
-                    memories["companion_memories"], 
-                    conversation_context,
-                    max_tokens=COMPANION_MAX_COMPLETION_TOKENS
-                ):
-                    full_response += chunk
-                    yield chunk
-                    
-            except Exception as e:
-                print(f"❌ Error during async streaming: {e}")
-                error_message = f"I encountered an error while generating my response: {str(e)}"
-                full_response = error_message
-                yield error_message
-            
-            # Store the complete response for memory after streaming
-            metadata["full_response"] = full_response
-            
-            # Add the complete assistant response to short-term memory
-            self.memory_manager.add_assistant_message(full_response)
-            
-            # Store the conversation in long-term memory asynchronously using the new async method
-            print(f"\n[DEBUG] Companion: Initiating new async memory storage from stream...")
-            asyncio.create_task(self._store_conversation_async_new(user_message, full_response))
-            print(f"[DEBUG] Companion: New async memory storage task started from stream")
-        
-        return stream_generator(), metadata
+
+        return self._stream_response(turn, metadata), metadata
 
     def process_message_stream(self, user_message):
         """
-        Process a user message and generate a streaming response using async optimization when possible.
-        
+        Process a user message and generate a streaming response.
+
+        The retrieval and analysis stages run on the shared background event loop;
+        the returned generator streams the LLM response in the caller's thread.
+
         Args:
             user_message: The message from the user
-            
+
         Returns:
             A tuple containing:
             - Generator that yields chunks of the response
             - Dictionary with metadata (data_analysis, etc.)
         """
-        # Try to use async version if we can get or create an event loop
+        return self._loop.run(self.process_message_stream_async(user_message))
+
+    def _stream_llm(self, message, turn, max_tokens, chunks, phase="answer", tool_runner=None):
+        """
+        Stream one LLM completion for a turn, collecting the chunks as they are yielded.
+
+        Time to first token and total time are recorded on the turn's trace; the
+        spans are measured by hand because the stream is consumed across yields.
+        Plain answers are read on the background event loop (LLM_ASYNC_STREAMING)
+        and handed to the caller's thread as they arrive; tool-calling answers run
+        their tool rounds in the caller's thread and stream synchronously.
+
+        Args:
+            message: The user-role message to send
+            turn: Turn dictionary produced by _prepare_turn
+            max_tokens: Completion token limit for this segment
+            chunks: List that receives every yielded chunk
+            phase: Segment name recorded on the spans
+            tool_runner: If given, the model may call the Vanna tools and this callable runs each round of calls
+
+        Yields:
+            Chunks of the response as they arrive from the API
+        """
+        trace = turn["trace"]
+        start = time.time()
+        first_chunk_at = None
+        error = None
+        streamed = 0
+        if tool_runner:
+            stream = self.llm_api.generate_response_with_tools_stream(
+                message,
+                turn["user_memories"],
+                turn["companion_memories"],
+                turn["conversation_messages"],
+                VannaToolWrapper.get_function_schemas()["openai"],
+                tool_runner,
+                max_tokens=max_tokens,
+                cancel_token=turn["cancel_token"],
+                route=turn["route"]
+            )
+        elif LLM_ASYNC_STREAMING:
+            stream = self._loop.iterate(self.llm_api.generate_response_stream_async(
+                message,
+                turn["user_memories"],
+                turn["companion_memories"],
+                turn["conversation_messages"],
+                max_tokens=max_tokens,
+                cancel_token=turn["cancel_token"],
+                trace=trace,
+                route=turn["route"]
+            ))
+        else:
+            stream = self.llm_api.generate_response_stream(
+                message,
+                turn["user_memories"],
+                turn["companion_memories"],
+                turn["conversation_messages"],
+                max_tokens=max_tokens,
+                cancel_token=turn["cancel_token"],
+                route=turn["route"]
+            )
         try:
-            # Try to get the current event loop
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                # If we're in an async context, we need to handle this carefully for streaming
-                print("🚀 Using async parallel processing for streaming...")
-                # Create a future that will be resolved with the async result
-                future = asyncio.run_coroutine_threadsafe(
-                    self.process_message_stream_async(user_message), loop
+            for chunk in stream:
+                if first_chunk_at is None:
+                    first_chunk_at = time.time()
+                    trace.record("llm.ttft", start, first_chunk_at, phase=phase)
+                streamed += 1
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            print(f"❌ Error during streaming: {e}")
+            error = e
+            error_message = f"I encountered an error while generating my response: {str(e)}"
+            chunks.append(error_message)
+            yield error_message
+        finally:
+            stream.close()
+            trace.record("llm.total", start, time.time(), error=error, phase=phase, streaming=True,
+                         cancelled=turn["cancel_token"].cancelled, tools=bool(tool_runner),
+                         chunks=streamed, ttft_ms=round((first_chunk_at - start) * 1000, 2) if first_chunk_at else None)
+
+    def _stream_answer(self, turn, chunks):
+        """
+        Stream the complete answer for a turn, replaying a cached answer if there is one.
+
+        Args:
+            turn: Turn dictionary produced by _prepare_turn
+            chunks: List that receives every yielded chunk
+
+        Yields:
+            Chunks of the response
+        """
+        if turn["cached_answer"]:
+            chunks.append(turn["cached_answer"])
+            yield turn["cached_answer"]
+            return
+        yield from self._stream_llm(turn["enhanced_message"], turn, turn["route"]["max_tokens"], chunks)
+
+    def _stream_phases(self, turn, metadata):
+        """
+        Generate stage for two-phase streaming.
+
+        Streams an opening grounded in memories and history while the SQL query is
+        still running, then a data-grounded continuation once it returns.
+
+        Args:
+            turn: Turn dictionary produced by _prepare_turn with defer_data=True
+            metadata: Metadata dictionary returned to the caller; receives data_analysis and full_response
+
+        Yields:
+            (phase, chunk_generator) tuples where phase is "opening", "analysis" or "answer"
+        """
+        data_future = turn["data_future"]
+
+        # No query in flight, or it already finished: a single normal answer is just as fast
+        if data_future is None or data_future.done():
+            if data_future is not None:
+                self._attach_data_result(turn, data_future.exception() or data_future.result())
+                metadata["data_analysis"] = turn["data_analysis"]
+                metadata["prompt_tokens"] = turn["prompt_tokens"]
+            chunks = []
+            yield "answer", self._stream_answer(turn, chunks)
+            full_response = "".join(chunks)
+        else:
+            opening_chunks = []
+            opening_message = turn["user_message"] + TWO_PHASE_OPENING_INSTRUCTIONS
+            yield "opening", self._stream_llm(
+                opening_message, turn, min(TWO_PHASE_OPENING_MAX_TOKENS, turn["route"]["max_tokens"]), opening_chunks,
+                phase="opening"
+            )
+            opening = "".join(opening_chunks)
+            if self._end_if_cancelled(turn):
+                return
+
+            # Block until the analyze stage finishes (the caller shows its own status meanwhile)
+            try:
+                with cancellation.on_cancel(turn["cancel_token"], data_future.cancel):
+                    data_result = data_future.result(timeout=TWO_PHASE_DATA_TIMEOUT)
+            except Exception as e:
+                data_result = e
+            if self._end_if_cancelled(turn):
+                return
+            self._attach_data_result(turn, data_result)
+            metadata["data_analysis"] = turn["data_analysis"]
+            metadata["prompt_tokens"] = turn["prompt_tokens"]
+
+            analysis_chunks = []
+            if turn["data_analysis"]:
+                continuation_message = (
+                    turn["enhanced_message"]
+                    + TWO_PHASE_CONTINUATION_INSTRUCTIONS.format(opening=opening)
+                )
+                yield "analysis", self._stream_llm(
+                    continuation_message, turn, turn["route"]["max_tokens"], analysis_chunks, phase="analysis"
                 )
-                return future.result()
             else:
-                # Run async version with asyncio.run
-                print("🚀 Using async parallel processing for streaming...")
-                return asyncio.run(self.process_message_stream_async(user_message))
-        except (RuntimeError, AttributeError):
-            # If we can't use async (no event loop), fall back to sync version
-            print("ℹ️ Falling back to synchronous streaming processing...")
-            
-            # Add the user message to short-term memory
-            self.memory_manager.add_user_message(user_message)
-            
-            # Check if this message requires data analysis
-            data_result = None
-            if self._should_use_data_analysis(user_message):
-                print("🤖 Data analysis detected - querying database...")
-                data_result = self._analyze_data(user_message)
-            
-            # Get relevant memories and conversation context
-            memories = self.memory_manager.get_relevant_memories(user_message)
-            
-            # Use the limited API conversation history
-            api_history = self.memory_manager.get_api_conversation_history(API_CONVERSATION_HISTORY_LIMIT)
-            conversation_context = "\n".join([f"{msg['role']}: {msg['content']}" for msg in api_history])
-            
-            # Debug print statements
-            print("\n=== Streaming Conversation Context Debug Info ===")
-            print(f"API conversation history limit: {API_CONVERSATION_HISTORY_LIMIT} messages")
-            print(f"API conversation history actual length: {len(api_history)} messages")
-            print(f"API conversation context tokens (estimated): {len(conversation_context) // 4} tokens")
-            print(f"Full memory history length: {len(self.memory_manager.get_full_conversation_history())} messages")
-            if data_result:
-                print(f"Data analysis results: {data_result.get('row_count', 0)} rows")
-            print("===============================================\n")
-            
-            # Print long-term memories for debugging
-            print("\n=== Retrieved Long-term Memories ===")
-            print("User memories:", memories["user_memories"] if memories["user_memories"] else "None")
-            print("Companion memories:", memories["companion_memories"] if memories["companion_memories"] else "None")
-            print("===================================\n")
-            
-            # Prepare the message for the LLM
-            enhanced_message = user_message
-            
-            # If we have data results, include them in the context
-            if data_result and data_result.get("success"):
-                data_context = f"""
+                analysis_chunks.append(TWO_PHASE_NO_DATA_MESSAGE)
+                yield "analysis", iter(analysis_chunks[:])
 
-DATA ANALYSIS RESULTS:
-Question: {data_result.get('question', '')}
+            full_response = opening + "\n\n" + "".join(analysis_chunks)
+
+        if self._end_if_cancelled(turn):
+            return
+        metadata["full_response"] = full_response
+        self._cache_answer(turn, full_response)
+        self._schedule_persist(turn["user_message"], full_response, turn["trace"])
+
+    async def process_message_stream_phased_async(self, user_message):
+        """
+        Process a user message and return a two-phase streaming response.
+
+        Only memory retrieval is awaited before returning; a data query, if any,
+        keeps running while the opening segment streams.
+
+        Args:
+            user_message: The message from the user
+
+        Returns:
+            A tuple containing:
+            - Generator of (phase, chunk_generator) tuples, one per streamed segment
+            - Dictionary with metadata (data_analysis is filled in once the query returns)
+        """
+        turn = await self._prepare_turn(user_message, defer_data=True)
+
+        metadata = {
+            "data_analysis": turn["data_analysis"],
+            "prompt_tokens": turn["prompt_tokens"],
+            "answer_cached": bool(turn["cached_answer"]),
+            "two_phase": turn["data_future"] is not None
+        }
+
+        return self._stream_phases(turn, metadata), metadata
+
+    def process_message_stream_phased(self, user_message):
+        """
+        Process a user message and generate a two-phase streaming response.
+
+        For data questions the first segment starts streaming as soon as memories
+        are retrieved, so SQL generation and warehouse execution no longer set the
+        time-to-first-token. Consume each segment fully before requesting the next.
+
+        Args:
+            user_message: The message from the user
+
+        Returns:
+            A tuple containing:
+            - Generator of (phase, chunk_generator) tuples, one per streamed segment
+            - Dictionary with metadata (data_analysis is filled in once the query returns)
+        """
+        return self._loop.run(self.process_message_stream_phased_async(user_message))
+
+    @staticmethod
+    def _format_tool_result(data_result):
+        """
+        Format a snowflake_query result as a tool message for the model.
+
+        Args:
+            data_result: Result dictionary from VannaToolWrapper.snowflake_query
+
+        Returns:
+            Tool result text with the question, SQL and encoded results
+        """
+        return f"""Question: {data_result.get('question', '')}
 SQL Query: {data_result.get('sql', '')}
-Results: {json.dumps(data_result.get('results', []), indent=2, cls=CustomJSONEncoder)}
-Row Count: {data_result.get('row_count', 0)}
-Execution Time: {data_result.get('execution_time_ms', 0)}ms
+Results:
+{encode_results(data_result.get('results', []))}
+Row Count: {data_result.get('row_count', 0)}"""
+
+    def _run_tool_call(self, call):
+        """
+        Execute one tool call requested by the model.
+
+        Args:
+            call: {"id", "name", "arguments"} with the arguments as a JSON string
+
+        Returns:
+            Tuple of (result text for the model, data result dictionary or None)
+        """
+        try:
+            arguments = json.loads(call["arguments"] or "{}")
+        except json.JSONDecodeError as e:
+            return json.dumps({"success": False, "error": f"Invalid arguments: {e}"}), None
+
+        wrapper = self._get_vanna_wrapper()
+        if not wrapper:
+            return json.dumps({"success": False, "error": "Data analysis is not available"}), None
+
+        if call["name"] == "snowflake_query":
+            question = arguments.get("question", "")
+            with tracing.span("analyze", tool=True, question=question) as span:
+                if arguments.get("execute_query", True):
+                    result = self.answer_cache.get_or_query_data(
+                        question, wrapper, max_results=arguments.get("max_results", TOOL_CALL_MAX_RESULTS)
+                    )
+                else:
+                    result = wrapper.snowflake_query(question=question, execute_query=False)
+                span.set(success=bool(result.get("success")), rows=result.get("row_count", 0),
+                         cached=bool(result.get("cached")))
+            if result.get("success") and result.get("results") is not None:
+                return self._format_tool_result(result), result
+            return json.dumps(
+                {key: result.get(key) for key in ("success", "question", "sql", "error")}, cls=CustomJSONEncoder
+            ), None
+
+        if call["name"] == "test_connection":
+            result = wrapper.test_connection(detailed=bool(arguments.get("detailed", False)))
+            return json.dumps(result, default=str), None
+
+        return json.dumps({"success": False, "error": f"Unknown tool '{call['name']}'"}), None
+
+    def _run_tool_calls(self, turn, calls, metadata):
+        """
+        Run one round of tool calls concurrently on the shared executor.
+
+        Each call runs in a copy of the request's context, so its spans join the
+        turn's trace, its queries are admitted as this user's interactive work and
+        cancelling the turn cancels them.
+
+        Args:
+            turn: Turn dictionary produced by _prepare_turn
+            calls: List of {"id", "name", "arguments"} tool calls
+            metadata: Metadata dictionary returned to the caller; receives tool_calls and data_analysis
+
+        Returns:
+            List of result texts, in the order of calls
+        """
+        futures = [
+            self._loop.executor.submit(turn["context"].copy().run, self._run_tool_call, call)
+            for call in calls
+        ]
+        cancel_token = turn["cancel_token"]
+        with cancellation.on_cancel(cancel_token, lambda: [future.cancel() for future in futures]):
+            wait_for_futures(futures, timeout=TOOL_CALL_TIMEOUT)
+        cancel_token.raise_if_cancelled()
+
+        results = []
+        for call, future in zip(calls, futures):
+            if not future.done():
+                text, data_result = json.dumps({"success": False, "error": "Tool call timed out"}), None
+            elif future.exception():
+                text, data_result = json.dumps({"success": False, "error": str(future.exception())}), None
+            else:
+                text, data_result = future.result()
+            results.append(text)
+            metadata["tool_calls"].append({
+                "name": call["name"],
+                "arguments": call["arguments"],
+                "success": data_result is not None
+            })
+            if data_result and metadata["data_analysis"] is None:
+                metadata["data_analysis"] = data_result  # Shown under the answer
+        return results
+
+    def _stream_tool_answer(self, turn, metadata):
+        """
+        Generate stage for tool-calling mode: stream the answer while the model
+        queries data as it needs it, then persist the full reply.
+
+        Args:
+            turn: Turn dictionary produced by _prepare_turn with use_tools=True
+            metadata: Metadata dictionary returned to the caller; receives tool_calls,
+                data_analysis and full_response
+
+        Yields:
+            Chunks of the response as they arrive from the API
+        """
+        chunks = []
+        if self.data_analysis_enabled:
+            yield from self._stream_llm(
+                turn["enhanced_message"] + TOOL_MODE_INSTRUCTIONS, turn, turn["route"]["max_tokens"], chunks,
+                tool_runner=lambda calls: self._run_tool_calls(turn, calls, metadata)
+            )
+        else:
+            yield from self._stream_llm(turn["enhanced_message"], turn, turn["route"]["max_tokens"], chunks)
+        if self._end_if_cancelled(turn):
+            return
+
+        full_response = "".join(chunks)
+        metadata["full_response"] = full_response
+        self._schedule_persist(turn["user_message"], full_response, turn["trace"])
+
+    async def process_message_stream_tools_async(self, user_message):
+        """
+        Process a user message in tool-calling mode and return a streaming response.
+
+        Args:
+            user_message: The message from the user
+
+        Returns:
+            A tuple containing:
+            - Generator that yields chunks of the response
+            - Dictionary with metadata (tool_calls and data_analysis are filled in as the model queries data)
+        """
+        turn = await self._prepare_turn(user_message, use_tools=True)
+
+        metadata = {
+            "data_analysis": None,
+            "prompt_tokens": turn["prompt_tokens"],
+            "answer_cached": False,
+            "tool_calls": []
+        }
+
+        return self._stream_tool_answer(turn, metadata), metadata
+
+    def process_message_stream_tools(self, user_message):
+        """
+        Process a user message in tool-calling mode and generate a streaming response.
+
+        Instead of deciding up front whether to run SQL, the model is given the
+        snowflake_query tool and calls it only when the question needs data; the
+        calls it makes together run concurrently and the answer continues in the
+        same stream once their results are in.
+
+        Args:
+            user_message: The message from the user
+
+        Returns:
+            A tuple containing:
+            - Generator that yields chunks of the response
+            - Dictionary with metadata (tool_calls and data_analysis are filled in as the model queries data)
+        """
+        return self._loop.run(self.process_message_stream_tools_async(user_message))
 
-Please analyze these results and provide insights in your response. Reference the specific data points and explain what they mean for the business."""
-                
-                enhanced_message = user_message + data_context
-            
-            # Create the metadata dict
-            metadata = {
-                "data_analysis": data_result if data_result and data_result.get("success") else None
-            }
-            
-            # Create the streaming generator
-            def stream_generator():
-                full_response = ""
-                try:
-                    for chunk in self.llm_api.generate_response_stream(
-                        enhanced_message, 
-                        memories["user_memories"], 
-                        memories["companion_memories"], 
-                        conversation_context,
-                        max_tokens=COMPANION_MAX_COMPLETION_TOKENS
-                    ):
-                        full_response += chunk
-                        yield chunk
-                        
-                except Exception as e:
-                    print(f"❌ Error during streaming: {e}")
-                    error_message = f"I encountered an error while generating my response: {str(e)}"
-                    full_response = error_message
-                    yield error_message
-                
-                # Store the complete response for memory after streaming
-                metadata["full_response"] = full_response
-                
-                # Add the complete assistant response to short-term memory
-                self.memory_manager.add_assistant_message(full_response)
-                
-                # Store the conversation in long-term memory asynchronously
-                print(f"\n[DEBUG] Companion: Initiating async memory storage thread...")
-                memory_thread = threading.Thread(
-                    target=self._store_conversation_async,
-                    args=(user_message, full_response)
-                )
-                memory_thread.daemon = True
-                memory_thread.start()
-                print(f"[DEBUG] Companion: Memory storage thread started")
-            
-            return stream_generator(), metadata
-    
     def set_data_analysis_enabled(self, enabled):
         """Enable or disable data analysis capabilities."""
         self.data_analysis_enabled = enabled
@@ -802,23 +1198,24 @@ Please analyze these results and provide insights in your response. Reference th
         
         self._session_active = False
         
-        # Force write any pending memory operations
+        # Stop in-flight queries and streams; nobody is waiting for their results any more
+        self.cancel("session closed")
+        
+        # Let in-flight long-term memory writes and summary refreshes finish before tearing down
+        self.flush_pending_writes()
+        self.memory_manager.flush_summary()
+        
+        # Force write any pending memory operations and return the shared clients
         try:
-            if hasattr(self.memory_manager.short_term, 'force_write'):
-                self.memory_manager.short_term.force_write()
-            if hasattr(self.memory_manager.short_term, 'close'):
-                self.memory_manager.short_term.close()
+            self.memory_manager.close()
             print("✅ Companion: Memory writes flushed")
         except Exception as e:
             print(f"⚠️ Companion: Error flushing memory: {e}")
         
-        # Close VannaToolWrapper connections
+        # Return the shared VannaToolWrapper; its connections stay open for other sessions
         if self.vanna_wrapper:
-            try:
-                self.vanna_wrapper.close()
-                print("✅ Companion: VannaToolWrapper connections closed")
-            except Exception as e:
-                print(f"⚠️ Companion: Error closing VannaToolWrapper: {e}")
+            get_resource_registry().release(VANNA, self.vanna_wrapper)
+            self.vanna_wrapper = None
         
         print("🔚 Companion: Session closed successfully")
 
@@ -839,9 +1236,105 @@ Please analyze these results and provide insights in your response. Reference th
                     "can_analyze": data_status.get("success", False)
                 }
             },
+            "tracing": tracing.get_trace_stats(),
+            "shared_resources": get_resource_registry().get_stats(),
+            "scheduler": scheduler.get_scheduler().get_stats(),
+            "llm_connections": get_llm_http_pool().get_stats(),
+            "llm_hedging": get_hedge_policy().get_stats(),
+            "prompt_cache": get_prompt_cache_stats(),
+            "model_routing": get_model_router().get_stats(),
+            "llm_rate_limit": get_llm_rate_limiter().get_stats(),
+            "question_decomposition": self.question_decomposer.get_stats(),
+            "answer_cache": self.answer_cache.get_stats(),
             "overall_health": "operational" if not self.memory_manager.is_memory_degraded() and data_status.get("success") else "degraded"
         }
 
+def prewarm_answers(question=WARM_START_PROMPT, analyst_types=ANALYST_TYPES):
+    """
+    Fill the answer cache with each analyst's answer to a question.
+
+    The query runs once (or is reused from the cache while its tables are
+    unchanged) and each analyst's answer is generated without user memories or
+    history, so it can be served to any user of that analyst.
+
+    Args:
+        question: The question to answer (default: the Warm Start briefing)
+        analyst_types: Analyst personas to generate answers for
+
+    Returns:
+        Number of answers generated
+    """
+    cache = get_answer_cache()
+    registry = get_resource_registry()
+    wrapper = registry.acquire(VANNA)
+    try:
+        data_result = get_question_decomposer().query(question, cache, wrapper)
+    finally:
+        registry.release(VANNA, wrapper)
+
+    if not (isinstance(data_result, dict) and data_result.get("success")):
+        print(f"⚠️ Prewarm: query failed for '{question[:60]}', nothing cached")
+        return 0
+
+    fingerprint = AnswerCache.fingerprint(data_result)
+    generated = 0
+    for analyst_type in analyst_types:
+        if cache.get_answer(question, analyst_type, fingerprint):
+            continue
+
+        llm_api = LlmApi(analyst_type=analyst_type)
+        route = llm_api.route_turn(question, needs_data=True)
+        prompt = PromptAssembler(llm_api.get_static_system_prompt, Companion._build_data_context).assemble(
+            question, data_result, "", "", [], model=route["model"]
+        )
+        response = llm_api.generate_response(
+            prompt["enhanced_message"], "", "", "", max_tokens=route["max_tokens"], route=route
+        )
+        if response and not response.startswith(UNCACHEABLE_RESPONSE_PREFIXES):
+            cache.put_answer(question, analyst_type, fingerprint, response)
+            generated += 1
+
+    print(f"✅ Prewarm: {generated} answers generated for '{question[:60]}'")
+    return generated
+
+
+async def _prewarm_loop(interval):
+    """Background job: re-run prewarm_answers every interval seconds."""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, scheduler.as_background(prewarm_answers))
+        except Exception as e:
+            print(f"❌ Prewarm failed: {e}")
+        await asyncio.sleep(interval)
+
+
+_prewarm_started = False
+_prewarm_lock = threading.Lock()
+
+
+def start_answer_prewarm(interval=ANSWER_CACHE_PREWARM_INTERVAL):
+    """
+    Start the background job that keeps the Warm Start briefing cached for every
+    analyst. Safe to call on every Streamlit rerun; the job starts once per process.
+
+    Args:
+        interval: Seconds between prewarm runs (each run only regenerates what changed)
+
+    Returns:
+        True if the job was started by this call
+    """
+    global _prewarm_started
+    with _prewarm_lock:
+        if _prewarm_started:
+            return False
+        _prewarm_started = True
+
+    get_background_loop().submit(_prewarm_loop(interval))
+    print(f"🔥 Answer prewarm job started (every {interval:.0f}s)")
+    return True
+
+
 def main():
     """
     Main function to run the AI companion directly
@@ -0,0 +1,167 @@
+"""
+Process-wide background event loop shared by all Companion sessions.
+
+Streamlit runs each session's script on its own thread, so calling asyncio.run()
+per turn builds and tears down an event loop (and its default executor) on every
+message and cancels any task still pending when it returns. Instead, a single
+long-lived loop runs on a dedicated daemon thread and callers submit coroutines
+to it from any thread.
+
+Async generators (such as LLM streams read with httpx.AsyncClient) are consumed
+on the loop and handed to a synchronous caller through a thread-safe queue by
+iterate(), so the loop thread serves every active stream while the caller's
+thread only waits for chunks.
+"""
+import asyncio
+import queue
+import sys
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import PIPELINE_EXECUTOR_WORKERS, STREAM_BRIDGE_MAX_BUFFERED_CHUNKS
+
+# Markers passed through the queue of iterate()
+_ITEM = "item"
+_END = "end"
+_ERROR = "error"
+
+
+class BackgroundEventLoop:
+    """Runs one asyncio event loop on a dedicated thread."""
+
+    def __init__(self, max_workers=PIPELINE_EXECUTOR_WORKERS):
+        """
+        Start the loop thread and wait until the loop is running.
+
+        Args:
+            max_workers: Size of the thread pool used for blocking calls made with run_in_executor
+        """
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="companion-io")
+        self.loop.set_default_executor(self.executor)
+        self._started = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="companion-event-loop", daemon=True)
+        self.thread.start()
+        self._started.wait()
+        print(f"✅ Background event loop started ({max_workers} executor workers)")
+
+    def _run(self):
+        """Thread target: run the loop until stop() is called."""
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._started.set)
+        self.loop.run_forever()
+
+    def in_loop_thread(self):
+        """Return True if the caller is running on the loop thread."""
+        return threading.current_thread() is self.thread
+
+    def submit(self, coro):
+        """
+        Schedule a coroutine on the background loop without waiting for it.
+
+        Args:
+            coro: The coroutine to run
+
+        Returns:
+            concurrent.futures.Future resolving to the coroutine's result
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """
+        Run a coroutine on the background loop and block until it completes.
+
+        Args:
+            coro: The coroutine to run
+            timeout: Optional timeout in seconds
+
+        Returns:
+            The coroutine's result
+        """
+        if self.in_loop_thread():
+            coro.close()
+            raise RuntimeError("BackgroundEventLoop.run() called from the loop thread - await the coroutine instead")
+        return self.submit(coro).result(timeout)
+
+    def iterate(self, agen, max_buffered=STREAM_BRIDGE_MAX_BUFFERED_CHUNKS):
+        """
+        Consume an async generator on the background loop and yield its items in the caller's thread.
+
+        At most max_buffered items are read ahead of the caller: the loop stops
+        pulling from the generator until the caller takes one, so a slow reader
+        slows the stream down. Closing the returned generator (or abandoning it)
+        cancels the task, which closes the async generator.
+
+        The generator runs in the loop thread's context, not the caller's:
+        context variables set by the caller (the current trace, cancel token or
+        user) are not visible to it and must be passed to it explicitly.
+
+        Args:
+            agen: Async generator to consume
+            max_buffered: Maximum number of items waiting for the caller
+
+        Yields:
+            The generator's items
+
+        Raises:
+            Whatever the async generator raises
+        """
+        if self.in_loop_thread():
+            raise RuntimeError("BackgroundEventLoop.iterate() called from the loop thread - iterate the generator instead")
+
+        items = queue.Queue()
+        credits = {}
+
+        async def pump():
+            credits["semaphore"] = semaphore = asyncio.Semaphore(max_buffered)
+            try:
+                async for item in agen:
+                    await semaphore.acquire()
+                    items.put((_ITEM, item))
+                items.put((_END, None))
+            except BaseException as e:
+                items.put((_ERROR, e))
+                raise
+            finally:
+                await agen.aclose()
+
+        future = self.submit(pump())
+        try:
+            while True:
+                kind, value = items.get()
+                if kind == _END:
+                    return
+                if kind == _ERROR:
+                    raise value
+                self.loop.call_soon_threadsafe(credits["semaphore"].release)
+                yield value
+        finally:
+            future.cancel()
+
+    def stop(self):
+        """Stop the loop and shut down its executor."""
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=5)
+        self.executor.shutdown(wait=False)
+
+
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+
+def get_background_loop():
+    """
+    Get the process-wide background event loop, starting it on first use.
+
+    Returns:
+        The shared BackgroundEventLoop instance
+    """
+    global _background_loop
+    if _background_loop is None:
+        with _background_loop_lock:
+            if _background_loop is None:
+                _background_loop = BackgroundEventLoop()
+    return _background_loop
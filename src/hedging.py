@@ -0,0 +1,217 @@
+"""
+Time-to-first-token hedging for streamed LLM answers.
+
+The primary model (OPENROUTER_MODEL) occasionally stalls before its first token,
+and the user used to wait the whole API_TIMEOUT for an error. The hedge policy
+starts the primary stream and, if no first token has arrived within
+LLM_HEDGE_TTFT_BUDGET seconds, also asks the secondary model (LLM_HEDGE_MODEL).
+Whichever stream produces its first token first is streamed to the user and
+the other request is cancelled. A primary that fails before its first token
+fails over to the secondary at once.
+
+Each stream's outcome is counted so the hedge rate and who wins can be watched:
+
+- primary: first token within the budget, no hedge sent
+- primary_after_hedge: hedge sent, but the primary still answered first
+- hedge: the secondary answered first after the budget expired
+- failover: the primary failed before its first token and the secondary answered
+- failed: every model failed
+
+Only streams read through LlmApi.generate_response_stream_async are hedged, which
+covers plain answers when LLM_ASYNC_STREAMING is on (the default). The other call
+paths go to one model only:
+
+- generate_response (non-streaming turns and answer-cache prewarming): the first
+  token arrives with the whole answer, so a time-to-first-token budget would hedge
+  nearly every long answer and double its cost
+- generate_response_with_tools_stream (tool-calling mode): its tool rounds run in
+  the caller's thread between streamed rounds
+- generate_response_stream: the synchronous fallback used when LLM_ASYNC_STREAMING is off
+"""
+import sys
+import os
+import time
+import asyncio
+import threading
+from collections import Counter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import LLM_HEDGE_ENABLED, LLM_HEDGE_MODEL, LLM_HEDGE_TTFT_BUDGET
+from src.cancellation import RequestCancelled
+
+OUTCOMES = ("primary", "primary_after_hedge", "hedge", "failover", "failed")
+
+
+class HedgePolicy:
+    """Races a secondary model against a primary that is slow to produce its first token."""
+
+    def __init__(self, hedge_model=LLM_HEDGE_MODEL, ttft_budget=LLM_HEDGE_TTFT_BUDGET, enabled=LLM_HEDGE_ENABLED):
+        """
+        Initialize the policy.
+
+        Args:
+            hedge_model: Secondary model asked when the primary is slow or fails
+            ttft_budget: Seconds to wait for the primary's first token before hedging
+            enabled: If False, streams go to the primary model only
+        """
+        self.hedge_model = hedge_model
+        self.ttft_budget = ttft_budget
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.outcomes = Counter()
+        self.stats = Counter()
+
+    def should_hedge(self, model):
+        """Return True if streams of this model are hedged."""
+        return self.enabled and bool(self.hedge_model) and model != self.hedge_model
+
+    def _record(self, report, outcome, model, start, first_token_at=None):
+        """Count an outcome and describe it in the caller's report."""
+        with self._lock:
+            self.outcomes[outcome] += 1
+        report.update({
+            "outcome": outcome,
+            "model": model,
+            "ttft_ms": round((first_token_at - start) * 1000, 2) if first_token_at else None
+        })
+
+    async def stream(self, open_stream, model, report=None):
+        """
+        Stream a completion from the primary model, hedging with the secondary one if needed.
+
+        Args:
+            open_stream: Callable taking a model name and returning an async generator of
+                chunks that raises on failure
+            model: Primary model
+            report: Dictionary that receives outcome, model (the winner), ttft_ms and
+                hedge_started_ms once the winner is known
+
+        Yields:
+            Chunks of the winning stream
+
+        Raises:
+            RequestCancelled: If the request is cancelled
+            Exception: The primary model's error if every model failed
+        """
+        report = report if report is not None else {}
+        with self._lock:
+            self.stats["streams"] += 1
+        if not self.should_hedge(model):
+            async for chunk in open_stream(model):
+                yield chunk
+            return
+
+        start = time.time()
+        pending = {}  # first-chunk task -> (model, generator)
+        errors = {}
+        hedge_started_at = None
+        winner = None
+
+        def launch(candidate):
+            generator = open_stream(candidate)
+            pending[asyncio.ensure_future(generator.__anext__())] = (candidate, generator)
+
+        async def discard(task, generator):
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await generator.aclose()
+
+        launch(model)
+        try:
+            while pending and winner is None:
+                timeout = None if hedge_started_at is not None else max(0.0, start + self.ttft_budget - time.time())
+                done, _ = await asyncio.wait(set(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge_started_at = time.time()
+                    print(f"⏱️ No first token from {model} after {self.ttft_budget}s, hedging with {self.hedge_model}")
+                    launch(self.hedge_model)
+                    continue
+
+                for task in done:
+                    candidate, generator = pending.pop(task)
+                    if winner is not None:
+                        await generator.aclose()
+                        continue
+                    error = task.exception()
+                    if isinstance(error, RequestCancelled):
+                        await generator.aclose()
+                        raise error
+                    if error is None or isinstance(error, StopAsyncIteration):
+                        winner = (candidate, generator, None if error else task.result())
+                        continue
+                    errors[candidate] = error
+                    await generator.aclose()
+                    if hedge_started_at is None and candidate == model:
+                        hedge_started_at = time.time()
+                        print(f"⚠️ {model} failed before its first token ({error}), failing over to {self.hedge_model}")
+                        launch(self.hedge_model)
+        except BaseException:
+            for task, (_, generator) in list(pending.items()):
+                await discard(task, generator)
+            raise
+
+        # The other request is no longer needed
+        for task, (_, generator) in list(pending.items()):
+            await discard(task, generator)
+
+        if hedge_started_at is not None:
+            with self._lock:
+                self.stats["hedged"] += 1
+            report["hedge_started_ms"] = round((hedge_started_at - start) * 1000, 2)
+
+        if winner is None:
+            self._record(report, "failed", None, start)
+            raise errors.get(model) or next(iter(errors.values()))
+
+        winner_model, generator, first_chunk = winner
+        if winner_model != model:
+            outcome = "failover" if model in errors else "hedge"
+        else:
+            outcome = "primary" if hedge_started_at is None else "primary_after_hedge"
+        self._record(report, outcome, winner_model, start, time.time())
+
+        try:
+            if first_chunk is not None:
+                yield first_chunk
+            async for chunk in generator:
+                yield chunk
+        finally:
+            await generator.aclose()
+
+    def get_stats(self):
+        """
+        Report how often streams were hedged and which model won.
+
+        Returns:
+            Dictionary with the policy settings, hedge rate and outcome counts
+        """
+        with self._lock:
+            streams = self.stats["streams"]
+            return {
+                "enabled": self.enabled,
+                "hedge_model": self.hedge_model,
+                "ttft_budget_s": self.ttft_budget,
+                "streams": streams,
+                "hedged": self.stats["hedged"],
+                "hedge_rate": round(self.stats["hedged"] / streams, 3) if streams else 0.0,
+                "outcomes": {outcome: self.outcomes[outcome] for outcome in OUTCOMES}
+            }
+
+
+_hedge_policy = None
+_hedge_policy_lock = threading.Lock()
+
+
+def get_hedge_policy():
+    """
+    Get the process-wide hedge policy.
+
+    Returns:
+        The shared HedgePolicy instance
+    """
+    global _hedge_policy
+    if _hedge_policy is None:
+        with _hedge_policy_lock:
+            if _hedge_policy is None:
+                _hedge_policy = HedgePolicy()
+    return _hedge_policy
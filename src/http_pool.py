@@ -0,0 +1,204 @@
+"""
+Shared, keep-alive HTTP clients for OpenRouter.
+
+Every LLM call used to go through module-level httpx.post / httpx.stream, which
+open a new connection per call and pay DNS, TCP and TLS setup to openrouter.ai
+on every turn. The pool owns one httpx.Client (used by LlmApi from worker
+threads) and one httpx.AsyncClient (for code running on the background event
+loop), both with connection pooling, keep-alive and, when the h2 package is
+installed, HTTP/2 so concurrent calls share one connection.
+
+New connections and TLS handshakes are counted through httpcore's trace
+extension, so get_stats() reports how often a request reused a pooled
+connection.
+"""
+import sys
+import os
+import atexit
+import asyncio
+import threading
+from collections import Counter
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import (
+    API_TIMEOUT,
+    LLM_HTTP2_ENABLED,
+    LLM_HTTP_MAX_CONNECTIONS,
+    LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    LLM_HTTP_KEEPALIVE_EXPIRY,
+    LLM_HTTP_CONNECT_TIMEOUT
+)
+
+try:
+    import h2  # noqa: F401 - required by httpx for HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class LlmHttpPool:
+    """Long-lived sync and async httpx clients with connection-reuse statistics."""
+
+    def __init__(
+        self,
+        max_connections=LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY,
+        http2=LLM_HTTP2_ENABLED,
+        transport=None,
+        async_transport=None
+    ):
+        """
+        Initialize the pool. Clients are created on first use.
+
+        Args:
+            max_connections: Maximum open connections per client
+            max_keepalive_connections: Idle connections kept open per client
+            keepalive_expiry: Seconds an idle connection is kept open
+            http2: Negotiate HTTP/2 if the h2 package is installed
+            transport: httpx transport for the sync client (default: network)
+            async_transport: httpx transport for the async client (default: network)
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(API_TIMEOUT, connect=LLM_HTTP_CONNECT_TIMEOUT)
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.transport = transport
+        self.async_transport = async_transport
+
+        self._client = None
+        self._async_client = None
+        self._async_loop = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = Counter()
+        self.http_versions = Counter()
+
+    @property
+    def client(self):
+        """The shared httpx.Client."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(
+                        http2=self.http2,
+                        limits=self.limits,
+                        timeout=self.timeout,
+                        transport=self.transport,
+                        event_hooks={"request": [self._on_request], "response": [self._on_response]}
+                    )
+        return self._client
+
+    @property
+    def async_client(self):
+        """The shared httpx.AsyncClient, bound to the event loop it is first used on (call from a coroutine)."""
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    self._async_loop = asyncio.get_running_loop()
+                    self._async_client = httpx.AsyncClient(
+                        http2=self.http2,
+                        limits=self.limits,
+                        timeout=self.timeout,
+                        transport=self.async_transport,
+                        event_hooks={"request": [self._on_request_async], "response": [self._on_response_async]}
+                    )
+        return self._async_client
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _on_request(self, request):
+        """Count the request and ask httpcore to report connection setup for it."""
+        self._count("requests")
+        request.extensions["trace"] = self._trace
+
+    def _on_response(self, response):
+        with self._stats_lock:
+            self.http_versions[response.http_version] += 1
+
+    async def _on_request_async(self, request):
+        self._count("requests")
+        request.extensions["trace"] = self._trace_async
+
+    async def _on_response_async(self, response):
+        self._on_response(response)
+
+    def _trace(self, event, info):
+        """httpcore trace callback: a completed TCP connect or TLS handshake means the pool had no reusable connection."""
+        if event == "connection.connect_tcp.complete":
+            self._count("new_connections")
+        elif event == "connection.start_tls.complete":
+            self._count("tls_handshakes")
+
+    async def _trace_async(self, event, info):
+        self._trace(event, info)
+
+    def get_stats(self):
+        """
+        Report pool configuration and connection reuse.
+
+        Returns:
+            Dictionary with request and connection counts and the reuse rate
+        """
+        with self._stats_lock:
+            requests = self.stats["requests"]
+            new_connections = self.stats["new_connections"]
+            return {
+                "http2": self.http2,
+                "max_connections": self.limits.max_connections,
+                "max_keepalive_connections": self.limits.max_keepalive_connections,
+                "keepalive_expiry": self.limits.keepalive_expiry,
+                "requests": requests,
+                "new_connections": new_connections,
+                "tls_handshakes": self.stats["tls_handshakes"],
+                "reuse_rate": round(1 - new_connections / requests, 3) if requests else None,
+                "http_versions": dict(self.http_versions)
+            }
+
+    def close(self, timeout=5.0):
+        """
+        Close both clients and their pooled connections.
+
+        Args:
+            timeout: Seconds to wait for the async client to close on its event loop
+        """
+        with self._lock:
+            client, self._client = self._client, None
+            async_client, self._async_client = self._async_client, None
+            loop, self._async_loop = self._async_loop, None
+        if client is not None:
+            client.close()
+        if async_client is not None and loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(async_client.aclose(), loop).result(timeout)
+            except Exception as e:
+                print(f"⚠️ HTTP pool: async client did not close cleanly: {e}")
+
+
+_http_pool = None
+_http_pool_lock = threading.Lock()
+
+
+def get_llm_http_pool():
+    """
+    Get the process-wide OpenRouter HTTP pool, closed at interpreter exit.
+
+    Returns:
+        The shared LlmHttpPool instance
+    """
+    global _http_pool
+    if _http_pool is None:
+        with _http_pool_lock:
+            if _http_pool is None:
+                _http_pool = LlmHttpPool()
+                if LLM_HTTP2_ENABLED and not HTTP2_AVAILABLE:
+                    print("⚠️ HTTP pool: h2 not installed, OpenRouter connections use HTTP/1.1 keep-alive")
+                atexit.register(_http_pool.close)
+    return _http_pool
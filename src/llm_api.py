@@ -5,94 +5,372 @@ import httpx
 import sys
 import os
 import json
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager, asynccontextmanager
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config.config as app_config  # OPENROUTER_MODEL is read per call so update_model() takes effect
 from config.config import (
     OPENROUTER_API_KEY, 
     OPENROUTER_API_URL, 
-    OPENROUTER_MODEL, 
     API_TIMEOUT,
-    DEFAULT_MAX_COMPLETION_TOKENS  # Import the new config variable
+    DEFAULT_MAX_COMPLETION_TOKENS,  # Import the new config variable
+    CONVERSATION_SUMMARY_MODEL,
+    CONVERSATION_SUMMARY_MAX_TOKENS,
+    TOOL_CALL_MAX_ROUNDS,
+    QUESTION_DECOMPOSITION_MODEL,
+    QUESTION_DECOMPOSITION_MAX_TOKENS,
+    LLM_RATE_LIMIT_MAX_RETRIES
 )
-from config.persona import get_system_prompt as get_arabella_prompt
-from config.motions_analyst import get_system_prompt as get_motions_analyst_prompt
-from config.GTM_leadership_strategist import get_system_prompt as get_gtm_leadership_prompt
+from config.persona import get_persona_prompt as get_arabella_persona
+from config.motions_analyst import get_persona_prompt as get_motions_analyst_persona
+from config.GTM_leadership_strategist import get_persona_prompt as get_gtm_leadership_persona
+from src import tracing
+from src import cancellation
+from src.scheduler import get_scheduler, LLM, BACKGROUND
+from src.http_pool import get_llm_http_pool
+from src.hedging import get_hedge_policy
+from src.model_router import get_model_router
+from src.rate_limiter import get_llm_rate_limiter
+
+# Appended to the persona so the model knows where per-turn context comes from
+TURN_CONTEXT_INSTRUCTIONS = """
+
+The latest user message may begin with a <turn_context> block holding your relevant memories about the user and about yourself. The block is supplied by the system, not written by the user: use it as background, and do not mention the tags."""
+
+_prompt_cache_stats = Counter()
+_prompt_cache_lock = threading.Lock()
+
+
+def _record_usage(model, usage):
+    """
+    Count the prompt tokens of one completion and how many were served from the provider's prompt cache.
+    
+    Args:
+        model: Model that served the completion
+        usage: The "usage" dictionary of the response
+        
+    Returns:
+        Number of cached prompt tokens
+    """
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    with _prompt_cache_lock:
+        _prompt_cache_stats["calls"] += 1
+        _prompt_cache_stats["prompt_tokens"] += prompt_tokens
+        _prompt_cache_stats["cached_tokens"] += cached_tokens
+        if cached_tokens:
+            _prompt_cache_stats["cache_hits"] += 1
+    print(f"💾 Prompt cache ({model}): {cached_tokens}/{prompt_tokens} prompt tokens cached")
+    return cached_tokens
+
+
+def get_prompt_cache_stats():
+    """
+    Report how much of the prompt input was served from the provider's prompt cache.
+    
+    Returns:
+        Dictionary with call and token counts, the share of calls with a cache hit
+        and the share of prompt tokens that were cached
+    """
+    with _prompt_cache_lock:
+        calls = _prompt_cache_stats["calls"]
+        prompt_tokens = _prompt_cache_stats["prompt_tokens"]
+        return {
+            "calls": calls,
+            "cache_hits": _prompt_cache_stats["cache_hits"],
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": _prompt_cache_stats["cached_tokens"],
+            "hit_rate": round(_prompt_cache_stats["cache_hits"] / calls, 3) if calls else 0.0,
+            "cached_token_share": round(_prompt_cache_stats["cached_tokens"] / prompt_tokens, 3) if prompt_tokens else 0.0
+        }
+
 
 class LlmApi:
     """Handles interactions with the LLM API."""
     
-    def __init__(self, analyst_type="GTM Leadership Strategist"):
+    def __init__(self, analyst_type="GTM Leadership Strategist", user_id=None):
         """
         Initialize the API connection.
         
         Args:
             analyst_type: The type of analyst to use for generating responses
+            user_id: The user calls are admitted for (default: the current work context)
         """
         self.headers = {
             "Authorization": f"Bearer {OPENROUTER_API_KEY}",
             "Content-Type": "application/json"
         }
         self.analyst_type = analyst_type
+        self.user_id = user_id
+        self.scheduler = get_scheduler()
+        self.http = get_llm_http_pool()
+        self.hedge_policy = get_hedge_policy()
+        self.router = get_model_router()
+        self.rate_limiter = get_llm_rate_limiter()
         
-        # Set the appropriate system prompt function based on analyst type
+        # Set the appropriate persona prompt function based on analyst type
         if analyst_type == "Sales Motion Strategy Agent":
-            self.get_system_prompt = get_motions_analyst_prompt
+            self.get_persona_prompt = get_motions_analyst_persona
         elif analyst_type == "GTM Leadership Strategist":
-            self.get_system_prompt = get_gtm_leadership_prompt
+            self.get_persona_prompt = get_gtm_leadership_persona
         else:  # Default to Arabella
-            self.get_system_prompt = get_arabella_prompt
+            self.get_persona_prompt = get_arabella_persona
+    
+    def route_turn(self, user_message, needs_data=False, tools=False):
+        """
+        Pick the model and completion budget for a turn from its intent.
+        
+        Args:
+            user_message: The user's message
+            needs_data: True if the data detector chose to query for this message
+            tools: True if the model may query data itself (tool-calling mode)
+            
+        Returns:
+            Route dictionary (name, model, max_tokens) to pass to the generate methods
+        """
+        return self.router.route(user_message, self.analyst_type, needs_data, tools)
+    
+    @staticmethod
+    def _model_for(route):
+        """The route's model, or the currently selected model when there is no route."""
+        return route["model"] if route else app_config.OPENROUTER_MODEL
+    
+    def _record_route(self, route, start, first_token_at=None, usage=None):
+        """Record a finished call's latency and tokens against its route, if it has one."""
+        if route:
+            self.router.record(route, time.time() - start,
+                               first_token_at - start if first_token_at else None, usage)
+    
+    def _post(self, payload, priority=None):
+        """
+        Send a non-streaming completion request, pacing it with the rate limiter.
+        
+        Args:
+            payload: Chat completion request payload
+            priority: Scheduler class of the call (default: interactive)
+            
+        Returns:
+            The response JSON
+            
+        Raises:
+            httpx.HTTPError: If the request fails (a 429 only once its retries are used up)
+            RateLimitExceeded: If the call cannot be sent within the rate limiter's deadline
+        """
+        for attempt in range(LLM_RATE_LIMIT_MAX_RETRIES + 1):
+            reservation = self.rate_limiter.acquire(payload)
+            try:
+                with self.scheduler.slot(LLM, priority=priority, user_id=self.user_id):
+                    response = self.http.client.post(
+                        OPENROUTER_API_URL,
+                        headers=self.headers,
+                        json=payload,
+                        timeout=API_TIMEOUT
+                    )
+            except BaseException:
+                # No response (transport error, timeout or cancelled wait for a slot)
+                self.rate_limiter.release(reservation)
+                raise
+            if self.rate_limiter.observe(response.status_code, response.headers) and attempt < LLM_RATE_LIMIT_MAX_RETRIES:
+                self.rate_limiter.settle(reservation, None)
+                self.rate_limiter.record_retry()
+                continue
+            if response.is_error:
+                self.rate_limiter.settle(reservation, None)
+            response.raise_for_status()
+            result = response.json()
+            self.rate_limiter.settle(reservation, result.get("usage"))
+            return result
+    
+    @contextmanager
+    def _open_stream(self, payload, cancel_token=None):
+        """
+        Open a streaming completion, pacing it with the rate limiter and retrying 429 responses.
+        
+        The scheduler slot is held until the block ends, and cancelling the token closes the response.
+        
+        Args:
+            payload: Chat completion request payload with "stream": True
+            cancel_token: CancellationToken that ends the wait or closes the response
+            
+        Yields:
+            Tuple of (httpx response, rate limiter reservation to settle with the usage; a block that
+                ends without settling it, e.g. a cancelled stream, settles it as unused)
+        """
+        for attempt in range(LLM_RATE_LIMIT_MAX_RETRIES + 1):
+            reservation = self.rate_limiter.acquire(payload, cancel_token)
+            answered = False
+            try:
+                with self.scheduler.slot(LLM, user_id=self.user_id, cancel_token=cancel_token), self.http.client.stream(
+                    "POST",
+                    OPENROUTER_API_URL,
+                    headers=self.headers,
+                    json=payload,
+                    timeout=API_TIMEOUT
+                ) as response, cancellation.on_cancel(cancel_token, response.close):
+                    answered = True
+                    if self.rate_limiter.observe(response.status_code, response.headers) and attempt < LLM_RATE_LIMIT_MAX_RETRIES:
+                        self.rate_limiter.settle(reservation, None)
+                        self.rate_limiter.record_retry()
+                        continue
+                    if response.is_error:
+                        self.rate_limiter.settle(reservation, None)
+                    response.raise_for_status()
+                    try:
+                        yield response, reservation
+                    finally:
+                        # A stream closed before its usage chunk (cancelled, or a losing hedge) is settled as unused
+                        if reservation is not None and not reservation.get("settled"):
+                            self.rate_limiter.settle(reservation, None)
+                    return
+            except BaseException:
+                # No response (transport error, timeout or cancelled wait for a slot)
+                if not answered:
+                    self.rate_limiter.release(reservation)
+                raise
     
-    def generate_response(self, user_message, user_memories, companion_memories, recent_conversation, max_tokens=DEFAULT_MAX_COMPLETION_TOKENS):
+    @asynccontextmanager
+    async def _open_stream_async(self, payload, cancel_token=None):
+        """
+        Coroutine version of _open_stream() using the pool's httpx.AsyncClient.
+        
+        Args:
+            payload: Chat completion request payload with "stream": True
+            cancel_token: CancellationToken that ends the wait
+            
+        Yields:
+            Tuple of (async httpx response, rate limiter reservation to settle with the usage; a block that
+                ends without settling it, e.g. a cancelled stream, settles it as unused)
+        """
+        for attempt in range(LLM_RATE_LIMIT_MAX_RETRIES + 1):
+            reservation = await self.rate_limiter.acquire_async(payload, cancel_token)
+            answered = False
+            try:
+                async with self.scheduler.async_slot(LLM, user_id=self.user_id, cancel_token=cancel_token), self.http.async_client.stream(
+                    "POST",
+                    OPENROUTER_API_URL,
+                    headers=self.headers,
+                    json=payload,
+                    timeout=API_TIMEOUT
+                ) as response:
+                    answered = True
+                    if self.rate_limiter.observe(response.status_code, response.headers) and attempt < LLM_RATE_LIMIT_MAX_RETRIES:
+                        self.rate_limiter.settle(reservation, None)
+                        self.rate_limiter.record_retry()
+                        continue
+                    if response.is_error:
+                        self.rate_limiter.settle(reservation, None)
+                        await response.aread()  # So the error handler can report the body
+                    response.raise_for_status()
+                    try:
+                        yield response, reservation
+                    finally:
+                        # A stream closed before its usage chunk (cancelled, or a losing hedge) is settled as unused
+                        if reservation is not None and not reservation.get("settled"):
+                            self.rate_limiter.settle(reservation, None)
+                    return
+            except BaseException:
+                # No response (transport error, timeout or cancelled wait for a slot)
+                if not answered:
+                    self.rate_limiter.release(reservation)
+                raise
+    
+    def get_static_system_prompt(self):
+        """
+        Get the system message sent first on every call.
+        
+        It holds only the persona and fixed instructions, never memories or
+        conversation, so every call of this analyst starts with the same bytes and
+        the provider can serve that prefix from its prompt cache.
+        
+        Returns:
+            The static system prompt
+        """
+        return self.get_persona_prompt() + TURN_CONTEXT_INSTRUCTIONS
+    
+    def _build_messages(self, user_message, user_memories, companion_memories, recent_conversation):
+        """
+        Lay out a call's messages from the most to the least stable part.
+        
+        The static system prompt comes first, then the conversation as real
+        user/assistant messages (which only grow between turns), then the new user
+        message with this turn's memories in a delimited <turn_context> block.
+        
+        Args:
+            user_message: The user's message, including any data analysis results
+            user_memories: Memories related to the user
+            companion_memories: Memories from the companion
+            recent_conversation: List of {"role", "content"} messages, oldest first, or
+                a pre-formatted transcript string (sent in the context block)
+            
+        Returns:
+            List of chat messages
+        """
+        context = []
+        if user_memories:
+            context.append(f"User's relevant memories:\n{user_memories}")
+        if companion_memories:
+            context.append(f"Your own relevant memories:\n{companion_memories}")
+        
+        messages = [{"role": "system", "content": self.get_static_system_prompt()}]
+        if isinstance(recent_conversation, str):
+            if recent_conversation:
+                context.append(f"Recent conversation:\n{recent_conversation}")
+        else:
+            messages.extend({"role": msg["role"], "content": msg["content"]} for msg in recent_conversation or [])
+        
+        if context:
+            user_message = "<turn_context>\n" + "\n\n".join(context) + "\n</turn_context>\n\n" + user_message
+        messages.append({"role": "user", "content": user_message})
+        return messages
+    
+    def generate_response(self, user_message, user_memories, companion_memories, recent_conversation, max_tokens=DEFAULT_MAX_COMPLETION_TOKENS, route=None):
         """
         Generate a response from the LLM.
         
+        The call is not hedged (see src/hedging.py): a slow or failing model is waited for.
+        
         Args:
             user_message: The user's message
             user_memories: Memories related to the user
             companion_memories: Memories from the companion
-            recent_conversation: Recent conversation history
+            recent_conversation: Recent conversation messages (see _build_messages)
             max_tokens: Maximum number of tokens to generate in the response (default from config)
+            route: Route from route_turn() whose model answers and whose stats record the call
+                (default: the selected model)
             
         Returns:
             The generated response from the LLM
         """
-        # Create the system prompt with all context
-        system_prompt = self.get_system_prompt(user_memories, companion_memories, recent_conversation)
+        model = self._model_for(route)
+        start = time.time()
         
         # Prepare the payload
         payload = {
-            "model": OPENROUTER_MODEL,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
+            "model": model,
+            "messages": self._build_messages(user_message, user_memories, companion_memories, recent_conversation),
             "max_tokens": max_tokens  # Add max_tokens parameter to limit completion length
         }
         
         # Make the API call
-        response = httpx.post(
-            OPENROUTER_API_URL,
-            headers=self.headers,
-            json=payload,
-            timeout=API_TIMEOUT
-        )
-        
-        response.raise_for_status()
-        result = response.json()
-        
-        # Debug: Print the full response structure
-        print("\n=== OpenRouter API Response Structure ===")
-        print(f"Model used: {OPENROUTER_MODEL}")
-        print(f"Max tokens setting: {max_tokens}")
-        print(json.dumps(result, indent=2))
+        result = self._post(payload)
         
         # Check for token usage and potential truncation
         if "usage" in result:
             completion_tokens = result["usage"].get("completion_tokens", 0)
-            print(f"Completion tokens used: {completion_tokens}/{max_tokens}")
+            tracing.set_attributes(
+                model=model,
+                route=route["name"] if route else None,
+                prompt_tokens=result["usage"].get("prompt_tokens", 0),
+                cached_tokens=_record_usage(model, result["usage"]),
+                completion_tokens=completion_tokens,
+                max_tokens=max_tokens
+            )
             if completion_tokens >= max_tokens * 0.95:  # 95% of limit
-                print("⚠️ WARNING: Response may be truncated - approaching token limit!")
+                print(f"⚠️ WARNING: Response may be truncated - {completion_tokens}/{max_tokens} completion tokens used")
         
-        print("=======================================\n")
+        self._record_route(route, start, usage=result.get("usage"))
         
         # Check if the response has the expected structure
         if "choices" in result and len(result["choices"]) > 0:
@@ -102,90 +380,360 @@ class LlmApi:
             # Return a fallback message
             return "I apologize, but I encountered an issue with my response. Please try again or contact support."
     
-    def generate_response_stream(self, user_message, user_memories, companion_memories, recent_conversation, max_tokens=DEFAULT_MAX_COMPLETION_TOKENS):
+    def generate_response_stream(self, user_message, user_memories, companion_memories, recent_conversation, max_tokens=DEFAULT_MAX_COMPLETION_TOKENS, cancel_token=None, route=None):
         """
         Generate a streaming response from the LLM.
         
+        This is the synchronous fallback for LLM_ASYNC_STREAMING; unlike
+        generate_response_stream_async it is not hedged.
+        
         Args:
             user_message: The user's message
             user_memories: Memories related to the user
             companion_memories: Memories from the companion
-            recent_conversation: Recent conversation history
+            recent_conversation: Recent conversation messages (see _build_messages)
             max_tokens: Maximum number of tokens to generate in the response (default from config)
+            cancel_token: CancellationToken that closes the stream when cancelled; the generator then stops
+            route: Route from route_turn() whose model answers and whose stats record the call
+                (default: the selected model)
             
         Yields:
             Chunks of the response as they arrive from the API
         """
-        # Create the system prompt with all context
-        system_prompt = self.get_system_prompt(user_memories, companion_memories, recent_conversation)
+        model = self._model_for(route)
+        start = time.time()
+        first_token_at = None
         
         # Prepare the payload with streaming enabled
         payload = {
-            "model": OPENROUTER_MODEL,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
+            "model": model,
+            "messages": self._build_messages(user_message, user_memories, companion_memories, recent_conversation),
             "max_tokens": max_tokens,
-            "stream": True  # Enable streaming
+            "stream": True,  # Enable streaming
+            "usage": {"include": True}  # Token counts arrive in the last chunk
         }
         
-        print(f"\n🚀 Starting streaming response for model: {OPENROUTER_MODEL}")
+        print(f"\n🚀 Starting streaming response for model: {model}")
         
         try:
-            # Make the streaming API call
-            with httpx.stream(
-                method="POST",
-                url=OPENROUTER_API_URL,
-                headers=self.headers,
-                json=payload,
-                timeout=API_TIMEOUT
-            ) as response:
-                response.raise_for_status()
-                
-                full_content = ""  # Keep track of full response for debugging
+            # Make the streaming API call (the slot is held until the stream ends)
+            with self._open_stream(payload, cancel_token) as (response, reservation):
+                content_length = 0  # Keep track of the response length for debugging
+                usage = None
                 
-                # Process each chunk from the stream
-                for line in response.iter_lines():
-                    if line.strip():
-                        # Remove the "data: " prefix if present
-                        if line.startswith("data: "):
-                            data = line[6:]
-                        else:
-                            data = line
-                        
-                        # Skip empty lines and special markers
-                        if not data.strip() or data.strip() == "[DONE]":
-                            continue
-                        
-                        try:
-                            # Parse the JSON chunk
-                            chunk = json.loads(data)
+                # Process each chunk from the stream (cancelling closes the response, ending the loop)
+                for chunk in self._iter_stream_chunks(response, cancel_token):
+                    usage = chunk.get("usage") or usage
+                    try:
+                        # Extract content from the chunk
+                        if "choices" in chunk and len(chunk["choices"]) > 0:
+                            delta = chunk["choices"][0].get("delta", {})
+                            content = delta.get("content", "")
                             
-                            # Extract content from the chunk
-                            if "choices" in chunk and len(chunk["choices"]) > 0:
-                                delta = chunk["choices"][0].get("delta", {})
-                                content = delta.get("content", "")
+                            if content:
+                                first_token_at = first_token_at or time.time()
+                                content_length += len(content)
+                                yield content
                                 
-                                if content:
-                                    full_content += content
-                                    yield content
-                                    
-                        except json.JSONDecodeError as e:
-                            # Check if this is an expected OpenRouter status message
-                            if any(status in data.upper() for status in ["OPENROUTER PROCESSING", "PROCESSING", "CONNECTING", "INITIALIZING"]):
-                                # These are expected status messages, log at debug level only
-                                print(f"🔄 OpenRouter status: {data.strip()}")
-                            else:
-                                # Unexpected JSON parsing error, log as warning
-                                print(f"⚠️ Warning: Failed to parse JSON chunk: {data[:100]}... Error: {e}")
-                            continue
-                        except Exception as e:
-                            print(f"⚠️ Warning: Error processing chunk: {e}")
+                    except Exception as e:
+                        print(f"⚠️ Warning: Error processing chunk: {e}")
+                        continue
+                
+                print(f"✅ Streaming completed. Total content length: {content_length} characters")
+                if usage:
+                    _record_usage(model, usage)
+                    self.rate_limiter.settle(reservation, usage)
+                self._record_route(route, start, first_token_at, usage)
+                
+        except cancellation.RequestCancelled as e:
+            print(f"🛑 Streaming cancelled: {e}")
+        except httpx.HTTPStatusError as e:
+            print(f"❌ HTTP error during streaming: {e}")
+            yield f"Error: HTTP {e.response.status_code} - {e.response.text}"
+        except httpx.TimeoutException:
+            print("❌ Timeout during streaming")
+            yield "Error: Request timed out. Please try again."
+        except Exception as e:
+            print(f"❌ Unexpected error during streaming: {e}")
+            yield f"Error: {str(e)}"
+    
+    async def generate_response_stream_async(self, user_message, user_memories, companion_memories, recent_conversation, max_tokens=DEFAULT_MAX_COMPLETION_TOKENS, cancel_token=None, trace=None, route=None):
+        """
+        Generate a streaming response from the LLM without blocking a thread.
+        
+        The completion is read with the pool's httpx.AsyncClient on the running event
+        loop, one chunk per iteration: while the consumer does not ask for the next
+        chunk nothing more is read from the connection, so a slow reader holds back
+        the stream instead of buffering it. Cancelling the token, or cancelling the
+        consuming task, closes the stream. If the model is slow to produce its first
+        token, or fails before it, the hedge policy also asks the secondary model and
+        streams whichever answers first.
+        
+        Args:
+            user_message: The user's message
+            user_memories: Memories related to the user
+            companion_memories: Memories from the companion
+            recent_conversation: Recent conversation messages (see _build_messages)
+            max_tokens: Maximum number of tokens to generate in the response (default from config)
+            cancel_token: CancellationToken that closes the stream when cancelled; the generator then stops
+            trace: Trace that receives an "llm.usage" span with the prompt and cached token
+                counts, and an "llm.hedge" span when a hedge request was sent
+            route: Route from route_turn() whose model answers and whose stats record the call
+                (default: the selected model)
+            
+        Yields:
+            Chunks of the response as they arrive from the API
+        """
+        model = self._model_for(route)
+        messages = self._build_messages(user_message, user_memories, companion_memories, recent_conversation)
+        
+        print(f"\n🚀 Starting async streaming response for model: {model}")
+        
+        start = time.time()
+        report = {}
+        usage = {}
+        try:
+            content_length = 0
+            async for content in self.hedge_policy.stream(
+                lambda candidate: self._stream_completion_async(candidate, messages, max_tokens, cancel_token, usage),
+                model,
+                report
+            ):
+                content_length += len(content)
+                yield content
+            
+            print(f"✅ Streaming completed ({report.get('model', model)}). Total content length: {content_length} characters")
+            ttft_ms = report.get("ttft_ms")
+            self._record_route(route, start, start + ttft_ms / 1000 if ttft_ms else None, usage)
+            
+        except cancellation.RequestCancelled as e:
+            print(f"🛑 Streaming cancelled: {e}")
+        except httpx.HTTPStatusError as e:
+            print(f"❌ HTTP error during streaming: {e}")
+            yield f"Error: HTTP {e.response.status_code} - {e.response.text}"
+        except httpx.TimeoutException:
+            print("❌ Timeout during streaming")
+            yield "Error: Request timed out. Please try again."
+        except Exception as e:
+            print(f"❌ Unexpected error during streaming: {e}")
+            yield f"Error: {str(e)}"
+        finally:
+            if trace is not None and usage:
+                trace.record("llm.usage", start, time.time(), **usage)
+            if trace is not None and "hedge_started_ms" in report:
+                trace.record("llm.hedge", start, time.time(), primary_model=model,
+                             hedge_model=self.hedge_policy.hedge_model, **report)
+    
+    async def _stream_completion_async(self, model, messages, max_tokens, cancel_token=None, usage=None):
+        """
+        Stream one completion from one model.
+        
+        Args:
+            model: OpenRouter model to ask
+            messages: Chat messages to send
+            max_tokens: Maximum number of tokens to generate
+            cancel_token: CancellationToken that ends the stream when cancelled
+            usage: Dictionary that receives model, prompt_tokens, cached_tokens and
+                completion_tokens when the stream reports its usage
+            
+        Yields:
+            Content chunks as they arrive from the API
+            
+        Raises:
+            httpx.HTTPError: If the request fails
+            RequestCancelled: If the token is cancelled
+        """
+        payload = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "stream": True,
+            "usage": {"include": True}
+        }
+        async with self._open_stream_async(payload, cancel_token) as (response, reservation):
+            async for chunk in self._aiter_stream_chunks(response, cancel_token):
+                if chunk.get("usage"):
+                    self.rate_limiter.settle(reservation, chunk["usage"])
+                if chunk.get("usage") and usage is not None:
+                    usage.update(
+                        model=model,
+                        prompt_tokens=chunk["usage"].get("prompt_tokens", 0),
+                        cached_tokens=_record_usage(model, chunk["usage"]),
+                        completion_tokens=chunk["usage"].get("completion_tokens", 0)
+                    )
+                choices = chunk.get("choices") or []
+                content = (choices[0].get("delta") or {}).get("content") if choices else None
+                if content:
+                    yield content
+    
+    @staticmethod
+    def _iter_stream_chunks(response, cancel_token=None):
+        """
+        Parse the server-sent events of a streaming completion.
+        
+        Args:
+            response: Streaming httpx response
+            cancel_token: CancellationToken that ends the iteration when cancelled
+            
+        Yields:
+            Parsed JSON chunk dictionaries
+        """
+        for line in cancellation.guard(response.iter_lines(), cancel_token):
+            chunk = LlmApi._parse_stream_line(line)
+            if chunk is not None:
+                yield chunk
+    
+    @staticmethod
+    async def _aiter_stream_chunks(response, cancel_token=None):
+        """
+        Parse the server-sent events of a streaming completion read with httpx.AsyncClient.
+        
+        Args:
+            response: Async streaming httpx response
+            cancel_token: CancellationToken that ends the iteration when cancelled
+            
+        Yields:
+            Parsed JSON chunk dictionaries
+        """
+        async for line in cancellation.aguard(response.aiter_lines(), cancel_token):
+            chunk = LlmApi._parse_stream_line(line)
+            if chunk is not None:
+                yield chunk
+    
+    @staticmethod
+    def _parse_stream_line(line):
+        """
+        Parse one server-sent event line.
+        
+        Args:
+            line: A line of the streaming response
+            
+        Returns:
+            The JSON chunk dictionary, or None for blank lines, markers and status messages
+        """
+        if not line.strip():
+            return None
+        
+        # Remove the "data: " prefix if present
+        data = line[6:] if line.startswith("data: ") else line
+        
+        # Skip empty lines and special markers
+        if not data.strip() or data.strip() == "[DONE]":
+            return None
+        
+        try:
+            return json.loads(data)
+        except json.JSONDecodeError as e:
+            # Check if this is an expected OpenRouter status message
+            if any(status in data.upper() for status in ["OPENROUTER PROCESSING", "PROCESSING", "CONNECTING", "INITIALIZING"]):
+                # These are expected status messages, log at debug level only
+                print(f"🔄 OpenRouter status: {data.strip()}")
+            else:
+                # Unexpected JSON parsing error, log as warning
+                print(f"⚠️ Warning: Failed to parse JSON chunk: {data[:100]}... Error: {e}")
+            return None
+    
+    def generate_response_with_tools_stream(self, user_message, user_memories, companion_memories, recent_conversation,
+                                            tools, run_tool_calls, max_tokens=DEFAULT_MAX_COMPLETION_TOKENS,
+                                            max_rounds=TOOL_CALL_MAX_ROUNDS, cancel_token=None, route=None):
+        """
+        Generate a streaming response in which the model may call tools.
+        
+        When the model requests tools, all calls of that round are handed to
+        run_tool_calls together (so they can run concurrently), their results are
+        added to the conversation and the completion continues. Text from every
+        round streams through this one generator. Rounds are not hedged (see src/hedging.py).
+        
+        Args:
+            user_message: The user's message
+            user_memories: Memories related to the user
+            companion_memories: Memories from the companion
+            recent_conversation: Recent conversation messages (see _build_messages)
+            tools: Tool schemas in OpenAI format (see VannaToolWrapper.get_function_schemas)
+            run_tool_calls: Callable taking a list of {"id", "name", "arguments"} calls and
+                returning their result strings in the same order
+            max_tokens: Maximum number of tokens to generate per round
+            max_rounds: Maximum number of tool-calling rounds before the model must answer
+            cancel_token: CancellationToken that closes the stream when cancelled; the generator then stops
+            route: Route from route_turn() whose model answers and whose stats record the call
+                (default: the selected model)
+            
+        Yields:
+            Chunks of the response as they arrive from the API
+        """
+        model = self._model_for(route)
+        messages = self._build_messages(user_message, user_memories, companion_memories, recent_conversation)
+        start = time.time()
+        first_token_at = None
+        usage = Counter()  # Summed over the tool-calling rounds
+        
+        print(f"\n🚀 Starting tool-calling response for model: {model}")
+        
+        try:
+            for round_number in range(max_rounds + 1):
+                payload = {
+                    "model": model,
+                    "messages": messages,
+                    "max_tokens": max_tokens,
+                    "stream": True,
+                    "usage": {"include": True},
+                    "tools": tools,
+                    # The last round must answer with what it has
+                    "tool_choice": "auto" if round_number < max_rounds else "none"
+                }
+                
+                content_parts = []
+                tool_calls = {}  # index -> call assembled from streamed fragments
+                with self._open_stream(payload, cancel_token) as (response, reservation):
+                    for chunk in self._iter_stream_chunks(response, cancel_token):
+                        if chunk.get("usage"):
+                            _record_usage(model, chunk["usage"])
+                            self.rate_limiter.settle(reservation, chunk["usage"])
+                            usage["prompt_tokens"] += chunk["usage"].get("prompt_tokens") or 0
+                            usage["completion_tokens"] += chunk["usage"].get("completion_tokens") or 0
+                        choices = chunk.get("choices") or []
+                        if not choices:
                             continue
+                        delta = choices[0].get("delta") or {}
+                        if delta.get("content"):
+                            first_token_at = first_token_at or time.time()
+                            content_parts.append(delta["content"])
+                            yield delta["content"]
+                        for fragment in delta.get("tool_calls") or []:
+                            call = tool_calls.setdefault(fragment.get("index", 0), {"id": None, "name": "", "arguments": ""})
+                            call["id"] = fragment.get("id") or call["id"]
+                            function = fragment.get("function") or {}
+                            call["name"] += function.get("name") or ""
+                            call["arguments"] += function.get("arguments") or ""
+                
+                if not tool_calls:
+                    self._record_route(route, start, first_token_at, usage)
+                    return
                 
-                print(f"✅ Streaming completed. Total content length: {len(full_content)} characters")
+                calls = [tool_calls[index] for index in sorted(tool_calls)]
+                for number, call in enumerate(calls):
+                    call["id"] = call["id"] or f"call_{round_number}_{number}"
+                print(f"🛠️ Round {round_number + 1}: model requested {len(calls)} tool call(s): "
+                      f"{', '.join(call['name'] for call in calls)}")
                 
+                messages.append({
+                    "role": "assistant",
+                    "content": "".join(content_parts) or None,
+                    "tool_calls": [
+                        {"id": call["id"], "type": "function",
+                         "function": {"name": call["name"], "arguments": call["arguments"] or "{}"}}
+                        for call in calls
+                    ]
+                })
+                results = run_tool_calls(calls)
+                for call, result in zip(calls, results):
+                    messages.append({"role": "tool", "tool_call_id": call["id"], "content": result})
+                
+                if content_parts:
+                    yield "\n\n"  # Separate any narration before the tool calls from what follows
+                    
+        except cancellation.RequestCancelled as e:
+            print(f"🛑 Streaming cancelled: {e}")
         except httpx.HTTPStatusError as e:
             print(f"❌ HTTP error during streaming: {e}")
             yield f"Error: HTTP {e.response.status_code} - {e.response.text}"
@@ -194,4 +742,89 @@ class LlmApi:
             yield "Error: Request timed out. Please try again."
         except Exception as e:
             print(f"❌ Unexpected error during streaming: {e}")
-            yield f"Error: {str(e)}" 
\ No newline at end of file
+            yield f"Error: {str(e)}"
+    
+    def summarize_conversation(self, previous_summary, messages, max_tokens=CONVERSATION_SUMMARY_MAX_TOKENS):
+        """
+        Fold older conversation messages into a rolling summary.
+        
+        Args:
+            previous_summary: The current summary of the conversation before these messages ("" if none)
+            messages: List of {"role", "content"} messages to fold in, oldest first
+            max_tokens: Maximum length of the updated summary in tokens
+            
+        Returns:
+            The updated summary text
+            
+        Raises:
+            httpx.HTTPError: If the request fails
+            ValueError: If the response has no summary
+        """
+        transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+        instructions = (
+            "You maintain a running summary of a conversation between a user and a GTM analytics assistant. "
+            "Update the summary with the new messages. Keep the user's goals, stated facts and preferences, "
+            "questions asked, key figures and conclusions, and open follow-ups. Drop pleasantries and formatting. "
+            f"Write plain prose of at most {max_tokens * 3 // 4} words. Reply with the updated summary only."
+        )
+        payload = {
+            "model": CONVERSATION_SUMMARY_MODEL,
+            "messages": [
+                {"role": "system", "content": instructions},
+                {"role": "user", "content": f"Current summary:\n{previous_summary or '(none yet)'}\n\nNew messages:\n{transcript}"}
+            ],
+            "max_tokens": max_tokens
+        }
+        
+        result = self._post(payload, priority=BACKGROUND)
+        
+        choices = result.get("choices") or []
+        summary = (choices[0].get("message", {}).get("content") or "").strip() if choices else ""
+        if not summary:
+            raise ValueError(f"Unexpected summary response: {str(result)[:200]}")
+        return summary
+    
+    def decompose_question(self, question, max_parts, max_tokens=QUESTION_DECOMPOSITION_MAX_TOKENS):
+        """
+        Split a compound data question into independent sub-questions.
+        
+        Args:
+            question: The user's data question
+            max_parts: Maximum number of sub-questions
+            max_tokens: Completion limit for the reply
+            
+        Returns:
+            List of sub-questions (the question itself if it does not split; empty if
+            no part of it can be answered from the data)
+            
+        Raises:
+            httpx.HTTPError: If the request fails
+            ValueError: If the response is not the expected JSON
+        """
+        instructions = (
+            "You split business questions into sub-questions for a text-to-SQL system over a company's "
+            "data warehouse. Each sub-question must be answerable by one SQL query on its own and must not "
+            "depend on another's result. Keep shared qualifiers such as time periods on every sub-question "
+            "they apply to. Leave out parts that ask for advice or opinions rather than data. If the question "
+            "asks for a single result, return it unchanged as the only sub-question. Return at most "
+            f'{max_parts} sub-questions as JSON: {{"sub_questions": ["...", "..."]}}'
+        )
+        payload = {
+            "model": QUESTION_DECOMPOSITION_MODEL,
+            "messages": [
+                {"role": "system", "content": instructions},
+                {"role": "user", "content": question}
+            ],
+            "max_tokens": max_tokens,
+            "response_format": {"type": "json_object"}
+        }
+        
+        result = self._post(payload)
+        
+        choices = result.get("choices") or []
+        content = (choices[0].get("message", {}).get("content") or "").strip() if choices else ""
+        try:
+            sub_questions = json.loads(content)["sub_questions"]
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            raise ValueError(f"Unexpected decomposition response: {content[:200]}") from e
+        return [q.strip() for q in sub_questions if isinstance(q, str) and q.strip()][:max_parts]
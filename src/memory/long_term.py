@@ -7,6 +7,9 @@ import asyncio
 from mem0 import Memory
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 from config.config import MEM0_API_KEY, MEM0_ORG_ID, MEM0_PROJECT_ID, OUTPUT_FORMAT
+from .write_behind import get_memory_write_queue
+from src import tracing
+from src.scheduler import get_scheduler, MEMORY
 
 class LongTermMemory:
     """Manages the long-term memory using Mem0."""
@@ -57,6 +60,11 @@ class LongTermMemory:
                     print("🔄 Operating without long-term memory - no fake data will be generated")
                     self.mem0_client = None
                     self.is_operational = False
+        
+        # Writes go through the process-wide write-behind queue
+        self.write_queue = get_memory_write_queue()
+        if self.is_operational:
+            self.write_queue.register_writer(self)
     
     def _create_mock_client(self):
         """This method is removed - we don't use mock clients anymore."""
@@ -91,7 +99,28 @@ class LongTermMemory:
     
     def store_memory(self, content, entity_id, is_agent=False):
         """
-        Store a memory for either the user or the companion.
+        Queue a memory for either the user or the companion.
+        
+        The write is performed in the background by the shared write-behind queue,
+        which coalesces turns per entity and retries failed writes.
+        
+        Args:
+            content: The conversation content to store
+            entity_id: The ID of the entity (user or agent)
+            is_agent: Boolean to determine if the entity is the agent or user
+            
+        Returns:
+            The queued turn's ID, or None if the memory was not accepted for storage
+        """
+        if not self.is_operational:
+            print("⚠️ WARNING: Mem0 client unavailable - memory not stored")
+            return None
+        
+        return self.write_queue.enqueue(self, content, entity_id, is_agent=is_agent)
+    
+    def write_memory(self, content, entity_id, is_agent=False):
+        """
+        Write a memory to Mem0 immediately, bypassing the write-behind queue.
         
         Args:
             content: The conversation content to store
@@ -105,37 +134,28 @@ class LongTermMemory:
             print("⚠️ WARNING: Mem0 client unavailable - memory not stored")
             return False
         
-        try:
-            print(f"\n[DEBUG] Storing memory to Mem0:")
-            print(f"  Entity ID: {entity_id}")
-            print(f"  Is Agent: {is_agent}")
-            print(f"  Agent ID: {entity_id if is_agent else None}")
-            print(f"  User ID: {entity_id if not is_agent else None}")
-            print(f"  Content type: {type(content)}")
-            print(f"  Content length: {len(str(content)) if content else 0}")
-            
-            result = self.mem0_client.add(
-                content,
-                agent_id=entity_id if is_agent else None,
-                user_id=entity_id if not is_agent else None,
-                output_format=OUTPUT_FORMAT
-            )
-            
-            print(f"\n[DEBUG] Mem0 add response:")
-            print(f"  {result}")
-            
-            if result:
-                print(f"✅ Memory stored successfully to Mem0")
-                return True
-            else:
-                print(f"⚠️ Mem0 returned empty response")
-                return False
+        with tracing.span("memory.write", entity_id=entity_id, is_agent=is_agent,
+                          content_chars=len(str(content)) if content else 0) as span:
+            try:
+                with get_scheduler().slot(MEMORY):
+                    result = self.mem0_client.add(
+                        content,
+                        agent_id=entity_id if is_agent else None,
+                        user_id=entity_id if not is_agent else None,
+                        output_format=OUTPUT_FORMAT
+                    )
                 
-        except Exception as e:
-            print(f"❌ Error storing memory to Mem0: {e}")
-            import traceback
-            print(f"   Full error: {traceback.format_exc()}")
-            return False
+                if result:
+                    return True
+                else:
+                    print(f"⚠️ Mem0 returned empty response")
+                    span.fail("empty response")
+                    return False
+                    
+            except Exception as e:
+                print(f"❌ Error storing memory to Mem0: {e}")
+                span.fail(e)
+                return False
     
     def search_memories(self, query, entity_id, is_agent=False):
         """
@@ -153,39 +173,40 @@ class LongTermMemory:
             print("⚠️ WARNING: Mem0 client unavailable - no long-term memories available")
             return ""  # Return empty string instead of fake data
         
-        print(f"\n[DEBUG] Searching Mem0 with parameters:")
-        print(f"  Query: {query}")
-        print(f"  Entity ID: {entity_id}")
-        print(f"  Is Agent: {is_agent}")
-        print(f"  Agent ID: {entity_id if is_agent else None}")
-        print(f"  User ID: {entity_id if not is_agent else None}")
-        
-        try:
-            memories = self.mem0_client.search(
-                query,
-                agent_id=entity_id if is_agent else None,
-                user_id=entity_id if not is_agent else None,
-                output_format=OUTPUT_FORMAT
-            )
-            
-            print(f"\n[DEBUG] Raw Mem0 response:")
-            print(f"  {memories}")
-            
-            # Extract memories from the response
-            if memories and "results" in memories:
-                # Sort memories by score in descending order
-                sorted_memories = sorted(memories["results"], key=lambda x: x.get("score", 0), reverse=True)
-                # Extract and join the memory strings
-                extracted = "\n".join([m["memory"] for m in sorted_memories])
-                print(f"\n[DEBUG] Extracted memories:")
-                print(f"  {extracted}")
+        with tracing.span("memory.search", entity="companion" if is_agent else "user", entity_id=entity_id) as span:
+            try:
+                with get_scheduler().slot(MEMORY):
+                    memories = self.mem0_client.search(
+                        query,
+                        agent_id=entity_id if is_agent else None,
+                        user_id=entity_id if not is_agent else None,
+                        output_format=OUTPUT_FORMAT
+                    )
+                extracted = self._extract_memories(memories)
+                span.set(results=len(memories.get("results", [])) if memories else 0, chars=len(extracted))
                 return extracted
+            except Exception as e:
+                print(f"❌ Error searching memories: {e}")
+                span.fail(e)
+                return ""  # Return empty instead of fake data
+    
+    @staticmethod
+    def _extract_memories(memories):
+        """
+        Join the memories in a Mem0 search response, highest score first.
+        
+        Args:
+            memories: Mem0 search response
             
-            print("\n[DEBUG] No memories extracted from response")
-            return ""
-        except Exception as e:
-            print(f"❌ Error searching memories: {e}")
-            return ""  # Return empty instead of fake data
+        Returns:
+            Newline-separated memory strings ("" if there are none)
+        """
+        if memories and "results" in memories:
+            # Sort memories by score in descending order
+            sorted_memories = sorted(memories["results"], key=lambda x: x.get("score", 0), reverse=True)
+            # Extract and join the memory strings
+            return "\n".join([m["memory"] for m in sorted_memories])
+        return ""
     
     async def search_memories_async(self, query, entity_id, is_agent=False):
         """
@@ -203,49 +224,35 @@ class LongTermMemory:
             print("⚠️ WARNING: Mem0 client unavailable - no long-term memories available")
             return ""  # Return empty string instead of fake data
         
-        print(f"\n[DEBUG] Async searching Mem0 with parameters:")
-        print(f"  Query: {query}")
-        print(f"  Entity ID: {entity_id}")
-        print(f"  Is Agent: {is_agent}")
-        print(f"  Agent ID: {entity_id if is_agent else None}")
-        print(f"  User ID: {entity_id if not is_agent else None}")
-        
-        try:
-            # Run the Mem0 search in a thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
-            memories = await loop.run_in_executor(
-                None,
-                lambda: self.mem0_client.search(
-                    query,
-                    agent_id=entity_id if is_agent else None,
-                    user_id=entity_id if not is_agent else None,
-                    output_format=OUTPUT_FORMAT
-                )
-            )
-            
-            print(f"\n[DEBUG] Async Mem0 response:")
-            print(f"  {memories}")
-            
-            # Extract memories from the response
-            if memories and "results" in memories:
-                # Sort memories by score in descending order
-                sorted_memories = sorted(memories["results"], key=lambda x: x.get("score", 0), reverse=True)
-                # Extract and join the memory strings
-                extracted = "\n".join([m["memory"] for m in sorted_memories])
-                print(f"\n[DEBUG] Extracted async memories:")
-                print(f"  {extracted}")
+        with tracing.span("memory.search", entity="companion" if is_agent else "user", entity_id=entity_id) as span:
+            try:
+                # Run the Mem0 search in a thread pool to avoid blocking; the bound
+                # context carries the caller's trace and work context into the thread
+                def search():
+                    with get_scheduler().slot(MEMORY):
+                        return self.mem0_client.search(
+                            query,
+                            agent_id=entity_id if is_agent else None,
+                            user_id=entity_id if not is_agent else None,
+                            output_format=OUTPUT_FORMAT
+                        )
+                
+                loop = asyncio.get_event_loop()
+                memories = await loop.run_in_executor(None, tracing.bind(search))
+                extracted = self._extract_memories(memories)
+                span.set(results=len(memories.get("results", [])) if memories else 0, chars=len(extracted))
                 return extracted
-            
-            print("\n[DEBUG] No memories extracted from async response")
-            return ""
-            
-        except Exception as e:
-            print(f"❌ Error in async memory search: {e}")
-            return ""  # Return empty instead of fake data
+                
+            except Exception as e:
+                print(f"❌ Error in async memory search: {e}")
+                span.fail(e)
+                return ""  # Return empty instead of fake data
     
     async def store_memory_async(self, content, entity_id, is_agent=False):
         """
-        Asynchronously store a memory for either the user or the companion.
+        Queue a memory for either the user or the companion from async code.
+        
+        Enqueueing never blocks, so this simply delegates to store_memory.
         
         Args:
             content: The conversation content to store
@@ -253,46 +260,9 @@ class LongTermMemory:
             is_agent: Boolean to determine if the entity is the agent or user
             
         Returns:
-            Boolean indicating success/failure
+            The queued turn's ID, or None if the memory was not accepted for storage
         """
-        if not self.is_operational:
-            print("⚠️ WARNING: Mem0 client unavailable - memory not stored")
-            return False
-        
-        try:
-            print(f"\n[DEBUG] Async storing memory to Mem0:")
-            print(f"  Entity ID: {entity_id}")
-            print(f"  Is Agent: {is_agent}")
-            print(f"  Agent ID: {entity_id if is_agent else None}")
-            print(f"  User ID: {entity_id if not is_agent else None}")
-            print(f"  Content type: {type(content)}")
-            print(f"  Content length: {len(str(content)) if content else 0}")
-            
-            # Run the Mem0 add operation in a thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None,
-                lambda: self.mem0_client.add(
-                    content,
-                    agent_id=entity_id if is_agent else None,
-                    user_id=entity_id if not is_agent else None,
-                    output_format=OUTPUT_FORMAT
-                )
-            )
-            
-            print(f"\n[DEBUG] Async Mem0 add response:")
-            print(f"  {result}")
-            
-            if result:
-                print(f"✅ Memory stored asynchronously to Mem0")
-                return True
-            else:
-                print(f"⚠️ Async Mem0 returned empty response")
-                return False
-                
-        except Exception as e:
-            print(f"❌ Error in async memory storage: {e}")
-            return False  # Return False instead of falling back to anything
+        return self.store_memory(content, entity_id, is_agent=is_agent)
     
     def get_client(self):
         """Get the Mem0 client (may be None if unavailable)."""
@@ -301,4 +271,6 @@ class LongTermMemory:
     def set_client(self, client):
         """Set the Mem0 client (useful for testing)."""
         self.mem0_client = client
-        self.is_operational = client is not None 
\ No newline at end of file
+        self.is_operational = client is not None
+        if self.is_operational:
+            self.write_queue.register_writer(self) 
\ No newline at end of file
@@ -2,12 +2,24 @@
 Memory manager to coordinate between short-term and long-term memory systems.
 """
 import asyncio
+import threading
 from .snowflake_memory import SnowflakeShortTermMemory
-from .long_term import LongTermMemory
+from .write_behind import get_memory_write_queue
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-from config.config import COMPANION_ID
+from config.config import (
+    COMPANION_ID,
+    PENDING_WRITE_FLUSH_TIMEOUT,
+    API_CONVERSATION_HISTORY_LIMIT,
+    CONVERSATION_SUMMARY_MIN_NEW_MESSAGES,
+    CONVERSATION_SUMMARY_MAX_MESSAGES_PER_REFRESH,
+    CONVERSATION_SUMMARY_MESSAGE_CHARS,
+    SHORT_TERM_MEMORY_HISTORY_PAGE_SIZE
+)
+from src.event_loop import get_background_loop
+from src import tracing
+from src.resource_registry import get_resource_registry, MEM0
 
 class MemoryManager:
     """
@@ -17,17 +29,36 @@ class MemoryManager:
     and the Mem0-based long-term memory.
     """
     
-    def __init__(self, user_id, strict_memory=False):
+    def __init__(self, user_id, strict_memory=False, summarizer=None, history_limit=API_CONVERSATION_HISTORY_LIMIT):
         """
         Initialize the memory manager.
         
         Args:
             user_id: The ID of the user
             strict_memory: If True, fail if Mem0 is unavailable. If False, operate without long-term memory.
+            summarizer: Callable(previous_summary, messages) returning an updated summary, or None
+                to keep sending raw history only
+            history_limit: Number of recent raw messages sent with each prompt; older ones are summarized
         """
         self.user_id = user_id
         self.short_term = SnowflakeShortTermMemory(user_id)
-        self.long_term = LongTermMemory(fail_on_error=strict_memory)
+        
+        # The Mem0 client is shared by every session in the process
+        self.long_term = get_resource_registry().acquire(MEM0)
+        if strict_memory and self.long_term.is_degraded():
+            get_resource_registry().release(MEM0, self.long_term)
+            self.short_term.close()
+            raise RuntimeError("Mem0 client unavailable and strict_memory is set")
+        
+        # Rolling conversation summary, refreshed in the background after each exchange
+        self.summarizer = summarizer
+        self.history_limit = history_limit
+        self._summary_lock = threading.Lock()
+        self._summary_future = None
+        self._summary_requested = False
+        
+        # IDs of this session's long-term memory writes that may still be queued
+        self._queued_turn_ids = set()
     
     def add_user_message(self, content):
         """
@@ -48,34 +79,35 @@ class MemoryManager:
         """
         # Add to short-term memory
         self.short_term.add_message("assistant", content)
+        
+        # The exchange is complete: fold messages leaving the history window into the summary
+        self.schedule_summary_refresh()
     
     def store_conversation(self, user_message, assistant_message):
         """
-        Store a complete conversation exchange in long-term memory.
+        Queue a complete conversation exchange for long-term memory.
+        
+        The exchange is handed to the write-behind queue, so this returns as soon
+        as both writes are accepted rather than when Mem0 has stored them.
         
         Args:
             user_message: The user's message
             assistant_message: The assistant's response
             
         Returns:
-            Dictionary with success status for user and companion memory storage
+            Dictionary with acceptance status for user and companion memory storage
         """
         conversation_content = [
             {"role": "user", "content": user_message},
             {"role": "assistant", "content": assistant_message}
         ]
         
-        print(f"\n[DEBUG] MemoryManager storing conversation:")
-        print(f"  User: {user_message[:100]}...")
-        print(f"  Assistant: {assistant_message[:100]}...")
-        
-        # Store in long-term memory for both user and companion
-        user_success = self.long_term.store_memory(conversation_content, self.user_id)
-        companion_success = self.long_term.store_memory(conversation_content, COMPANION_ID, is_agent=True)
-        
-        print(f"\n[DEBUG] Memory storage results:")
-        print(f"  User memory stored: {'✅ Success' if user_success else '❌ Failed'}")
-        print(f"  Companion memory stored: {'✅ Success' if companion_success else '❌ Failed'}")
+        # Queue for long-term memory for both user and companion
+        user_turn_id = self.long_term.store_memory(conversation_content, self.user_id)
+        companion_turn_id = self.long_term.store_memory(conversation_content, COMPANION_ID, is_agent=True)
+        self._queued_turn_ids.update(turn_id for turn_id in (user_turn_id, companion_turn_id) if turn_id)
+        user_success = user_turn_id is not None
+        companion_success = companion_turn_id is not None
         
         return {
             "user_memory_saved": user_success,
@@ -93,7 +125,6 @@ class MemoryManager:
         Returns:
             Dict containing user memories and companion memories
         """
-        print(f"\n[DEBUG] MemoryManager searching with query: {query}")
         user_memories = self.long_term.search_memories(query, self.user_id)
         companion_memories = self.long_term.search_memories(query, COMPANION_ID, is_agent=True)
         
@@ -124,10 +155,33 @@ class MemoryManager:
         """
         Get the complete conversation history.
         
+        Reads every message before the loaded window; prefer iter_conversation_history_pages.
+        
         Returns:
             List of all conversation message dictionaries
         """
         return self.short_term.get_full_history()
+    
+    def iter_conversation_history_pages(self, page_size=SHORT_TERM_MEMORY_HISTORY_PAGE_SIZE):
+        """
+        Page backwards through the conversation history, reading older pages on demand.
+        
+        Args:
+            page_size: Messages per page
+            
+        Returns:
+            Iterator of message dictionary lists, newest page first
+        """
+        return self.short_term.iter_history_pages(page_size)
+    
+    def get_message_count(self):
+        """
+        Get the number of messages in the conversation without loading them.
+        
+        Returns:
+            Total number of conversation messages
+        """
+        return self.short_term.get_message_count()
 
     def get_api_conversation_history(self, limit=30):
         """
@@ -141,6 +195,122 @@ class MemoryManager:
         """
         return self.short_term.get_api_history(limit)
     
+    def get_summarized_conversation_history(self, limit=None):
+        """
+        Get the rolling summary of older messages and the recent messages it does not cover.
+        
+        Args:
+            limit: Maximum number of recent raw messages (default: the manager's history limit)
+            
+        Returns:
+            Tuple of (summary text, list of recent message dictionaries)
+        """
+        return self.short_term.get_summarized_history(limit or self.history_limit)
+    
+    def get_conversation_summary(self):
+        """
+        Get the rolling summary of older conversation messages.
+        
+        Returns:
+            Dict with the summary text and the number of messages it covers
+        """
+        return {
+            "summary": self.short_term.summary,
+            "summarized_count": self.short_term.summarized_count
+        }
+    
+    def _summary_target(self):
+        """
+        Number of messages, from the start of the history, that should be summarized.
+        
+        Covers every message that will have left the raw history window once the
+        next user message is added, so there is no gap between summary and window.
+        """
+        return max(self.short_term.get_message_count() - self.history_limit + 1, 0)
+    
+    def schedule_summary_refresh(self):
+        """
+        Refresh the rolling summary on the background executor, off the request path.
+        
+        At most one refresh runs per user; a request made while one is running is
+        picked up by that refresh before it finishes.
+        
+        Returns:
+            Future for the running refresh, or None if no refresh is needed
+        """
+        if self.summarizer is None:
+            return None
+        if self._summary_target() - self.short_term.summarized_count < CONVERSATION_SUMMARY_MIN_NEW_MESSAGES:
+            return None
+        
+        with self._summary_lock:
+            self._summary_requested = True
+            if self._summary_future is not None and not self._summary_future.done():
+                return self._summary_future
+            self._summary_future = get_background_loop().executor.submit(self._run_summary_refresh)
+            return self._summary_future
+    
+    def _run_summary_refresh(self):
+        """Refresh the summary until no further request is pending."""
+        while True:
+            with self._summary_lock:
+                if not self._summary_requested:
+                    return
+                self._summary_requested = False
+            self.refresh_summary()
+    
+    def refresh_summary(self):
+        """
+        Fold messages that have left the raw history window into the rolling summary.
+        
+        Large backlogs are folded in chunks, and the summary is persisted after each
+        chunk so progress survives a failure part way through.
+        
+        Returns:
+            Number of messages folded into the summary
+        """
+        folded = 0
+        while True:
+            summary = self.short_term.summary
+            start = self.short_term.summarized_count
+            end = min(self._summary_target(), start + CONVERSATION_SUMMARY_MAX_MESSAGES_PER_REFRESH)
+            if end - start < CONVERSATION_SUMMARY_MIN_NEW_MESSAGES:
+                return folded
+            
+            try:
+                # Messages before the loaded window are read from Snowflake
+                messages = [
+                    {"role": msg["role"], "content": msg["content"][:CONVERSATION_SUMMARY_MESSAGE_CHARS]}
+                    for msg in self.short_term.get_messages(start, end)
+                ]
+                summary = self.summarizer(summary, messages)
+            except Exception as e:
+                print(f"⚠️ Conversation summary refresh failed for user '{self.user_id}': {e}")
+                return folded
+            
+            self.short_term.save_summary(summary, end)
+            folded += end - start
+            print(f"🧾 Conversation summary updated for user '{self.user_id}': {end} messages summarized ({len(summary)} chars)")
+    
+    def flush_summary(self, timeout=PENDING_WRITE_FLUSH_TIMEOUT):
+        """
+        Wait for a running summary refresh to complete.
+        
+        Args:
+            timeout: Maximum number of seconds to wait
+            
+        Returns:
+            True if no refresh is still running
+        """
+        future = self._summary_future
+        if future is None:
+            return True
+        try:
+            future.result(timeout=timeout)
+        except Exception as e:
+            print(f"⚠️ Conversation summary refresh did not finish: {e}")
+        return future.done()
+    
     async def get_relevant_memories_async(self, query):
         """
         Asynchronously retrieve relevant memories for the given query using parallel searches.
@@ -151,21 +321,20 @@ class MemoryManager:
         Returns:
             Dict containing user memories and companion memories
         """
-        print(f"\n[DEBUG] MemoryManager async searching with query: {query}")
-        
         try:
-            # Run user and companion memory searches in parallel
-            user_task = asyncio.create_task(
-                self.long_term.search_memories_async(query, self.user_id, is_agent=False)
-            )
-            companion_task = asyncio.create_task(
-                self.long_term.search_memories_async(query, COMPANION_ID, is_agent=True)
-            )
-            
-            # Wait for both searches to complete
-            user_memories, companion_memories = await asyncio.gather(
-                user_task, companion_task, return_exceptions=True
-            )
+            with tracing.span("memory.retrieve"):
+                # Run user and companion memory searches in parallel
+                user_task = asyncio.create_task(
+                    self.long_term.search_memories_async(query, self.user_id, is_agent=False)
+                )
+                companion_task = asyncio.create_task(
+                    self.long_term.search_memories_async(query, COMPANION_ID, is_agent=True)
+                )
+                
+                # Wait for both searches to complete
+                user_memories, companion_memories = await asyncio.gather(
+                    user_task, companion_task, return_exceptions=True
+                )
             
             # Handle any exceptions
             if isinstance(user_memories, Exception):
@@ -190,78 +359,87 @@ class MemoryManager:
     
     async def store_conversation_async(self, user_message, assistant_message):
         """
-        Asynchronously store a complete conversation exchange in long-term memory.
+        Queue a complete conversation exchange for long-term memory from async code.
         
         Args:
             user_message: The user's message
             assistant_message: The assistant's response
             
         Returns:
-            Dictionary with success status for user and companion memory storage
+            Dictionary with acceptance status for user and companion memory storage
         """
-        conversation_content = [
-            {"role": "user", "content": user_message},
-            {"role": "assistant", "content": assistant_message}
-        ]
+        return self.store_conversation(user_message, assistant_message)
+    
+    def flush_long_term(self, timeout=PENDING_WRITE_FLUSH_TIMEOUT):
+        """
+        Wait for the long-term memory writes this session queued to complete.
         
-        print(f"\n[DEBUG] MemoryManager async storing conversation:")
-        print(f"  User: {user_message[:100]}...")
-        print(f"  Assistant: {assistant_message[:100]}...")
+        Only this session's turns are waited for: the companion's memories are shared,
+        so other users' writes for it must not hold up this session's close.
         
-        try:
-            # Store in long-term memory for both user and companion in parallel
-            user_task = asyncio.create_task(
-                self.long_term.store_memory_async(conversation_content, self.user_id, is_agent=False)
-            )
-            companion_task = asyncio.create_task(
-                self.long_term.store_memory_async(conversation_content, COMPANION_ID, is_agent=True)
-            )
-            
-            # Wait for both storage operations to complete
-            user_success, companion_success = await asyncio.gather(
-                user_task, companion_task, return_exceptions=True
-            )
-            
-            # Handle any exceptions
-            if isinstance(user_success, Exception):
-                print(f"⚠️ User memory storage failed: {user_success}")
-                user_success = False
-            
-            if isinstance(companion_success, Exception):
-                print(f"⚠️ Companion memory storage failed: {companion_success}")
-                companion_success = False
-            
-            print(f"\n[DEBUG] Async memory storage results:")
-            print(f"  User memory stored: {'✅ Success' if user_success else '❌ Failed'}")
-            print(f"  Companion memory stored: {'✅ Success' if companion_success else '❌ Failed'}")
-            
-            return {
-                "user_memory_saved": user_success,
-                "companion_memory_saved": companion_success,
-                "overall_success": user_success and companion_success
-            }
+        Args:
+            timeout: Maximum number of seconds to wait
             
-        except Exception as e:
-            print(f"❌ Error in async conversation storage: {e}")
-            # Fallback to synchronous method
-            print("🔄 Falling back to synchronous conversation storage...")
-            return self.store_conversation(user_message, assistant_message)
+        Returns:
+            Number of writes still pending when the timeout expired
+        """
+        turn_ids = set(self._queued_turn_ids)
+        remaining = get_memory_write_queue().drain(timeout, turn_ids=turn_ids)
+        if remaining == 0:
+            self._queued_turn_ids -= turn_ids
+        return remaining
+    
+    def close(self):
+        """Flush short-term memory and return the shared clients to the registry."""
+        self.short_term.force_write()
+        self.short_term.close()
+        if self.long_term is not None:
+            get_resource_registry().release(MEM0, self.long_term)
+            self.long_term = None
     
     def get_memory_status(self):
-        """Get the status of both short-term and long-term memory systems."""
+        """
+        Get the status of both short-term and long-term memory systems.
+        
+        After close() the long-term client has been returned to the registry and is
+        reported as released.
+        """
+        if self.long_term is None:
+            long_term_status = {
+                "status": "released",
+                "message": "Mem0 client released - memory manager closed",
+                "capabilities": {
+                    "can_store": False,
+                    "can_retrieve": False,
+                    "data_persistent": False
+                }
+            }
+        else:
+            long_term_status = self.long_term.get_status()
         return {
             "short_term": {
                 "status": "operational",
                 "message": "Snowflake short-term memory active",
+                "storage": self.short_term.storage,
+                "messages": self.short_term.get_message_count(),
+                "loaded_messages": len(self.short_term.loaded_history),
                 "capabilities": {
                     "can_store": True,
                     "can_retrieve": True,
                     "data_persistent": True
                 }
             },
-            "long_term": self.long_term.get_status()
+            "long_term": long_term_status,
+            "write_queue": get_memory_write_queue().get_metrics(),
+            "summary": {
+                "enabled": self.summarizer is not None,
+                "summarized_messages": self.short_term.summarized_count,
+                "summary_chars": len(self.short_term.summary)
+            }
         }
     
     def is_memory_degraded(self):
-        """Check if any memory system is in degraded mode."""
-        return self.long_term.is_degraded() 
\ No newline at end of file
+        """Check if any memory system is in degraded mode, which includes after close()."""
+        if self.long_term is None:
+            return True
+        return self.long_term.is_degraded()
\ No newline at end of file
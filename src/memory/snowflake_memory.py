@@ -1,5 +1,17 @@
 """
 Short-term memory implementation using Snowflake with batch writing optimization.
+
+Messages are stored one row each in USER_MESSAGES (USER_ID, SEQ, ROLE, CONTENT, TS),
+so a flush inserts only the buffered messages. SEQ is an AUTOINCREMENT ORDER column
+allocated by Snowflake on insert, so concurrent sessions of the same user never write
+the same SEQ; a message's position in the history is its rank in (SEQ, TS) order. The legacy layout, the whole history
+in one USER_CONVERSATIONS VARIANT cell, is kept behind SHORT_TERM_MEMORY_STORAGE.
+
+Only the most recent messages (enough for the context deque and the prompt's
+history window) are read when a session starts, so starting a session does not
+depend on how long the user has been chatting. Older messages are read from
+USER_MESSAGES when asked for, a page at a time (iter_history_pages). The legacy
+layout still loads the whole history, since its flush rewrites all of it.
 """
 import json
 from collections import deque
@@ -10,8 +22,17 @@ import threading
 import time
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-from config.config import SHORT_TERM_MEMORY_SIZE
-from src.vanna_scripts.snowflake_connector import SnowflakeConnector
+from config.config import (
+    SHORT_TERM_MEMORY_SIZE,
+    SHORT_TERM_MEMORY_STORAGE,
+    SHORT_TERM_MEMORY_INSERT_BATCH_ROWS,
+    SHORT_TERM_MEMORY_HISTORY_PAGE_SIZE,
+    API_CONVERSATION_HISTORY_LIMIT
+)
+from src.resource_registry import get_resource_registry, SNOWFLAKE_MEMORY
+
+MESSAGES_STORAGE = "messages"  # One USER_MESSAGES row per message, appended on flush
+CONVERSATION_STORAGE = "conversation"  # The whole history in one USER_CONVERSATIONS VARIANT cell
 
 class SnowflakeShortTermMemory:
     """Manages the short-term conversation memory using Snowflake with batch optimization."""
@@ -24,70 +45,292 @@ class SnowflakeShortTermMemory:
             user_id: The ID of the user
         """
         self.user_id = user_id
-        self.full_history = []  # Store all messages
+        # The loaded tail of the history: loaded_history[0] is message number history_start
+        self.loaded_history = []
+        self.history_start = 0
+        self.load_window = max(SHORT_TERM_MEMORY_SIZE, API_CONVERSATION_HISTORY_LIMIT)  # Messages read at session start
         self.recent_history = deque(maxlen=SHORT_TERM_MEMORY_SIZE)  # Only recent messages for context
-        self.snowflake = SnowflakeConnector()
+        # The connector (and its connection) is shared by every session in the process
+        self.snowflake = get_resource_registry().acquire(SNOWFLAKE_MEMORY)
+        self.storage = SHORT_TERM_MEMORY_STORAGE
+        self.history_loaded = False  # False if the history could not be read at session start
         
         # Batch writing optimization
         self.write_buffer = []  # Buffer for pending writes
         self.batch_timer = None  # Timer for periodic writes
-        self.write_lock = threading.Lock()  # Thread safety for buffer operations
+        self.write_lock = threading.RLock()  # Thread safety for buffer operations (re-entered by _schedule_batch_write)
         self.batch_size = 5  # Write after 5 messages
         self.batch_timeout = 10.0  # Write after 10 seconds max
         self.last_write_time = time.time()
         self.pending_write = False
         
+        # Rolling summary of the first summarized_count messages of the history
+        self.summary = ""
+        self.summarized_count = 0
+        
         self._load_conversation()
+        self._load_summary()
     
     def _load_conversation(self):
         """Load the conversation history from Snowflake."""
         try:
             # Connect to Snowflake
-            conn = self.snowflake.connect()
+            conn = self.snowflake.get_connection()
+            cursor = conn.cursor()
+            
+            if self.storage == MESSAGES_STORAGE:
+                self._load_recent_messages(cursor)
+                if self.get_message_count() == 0:
+                    history = self._migrate_conversation(cursor)
+                    conn.commit()
+                    self.history_start = max(len(history) - self.load_window, 0)
+                    self.loaded_history = history[self.history_start:]
+            else:
+                self.loaded_history = self._load_conversation_variant(cursor)
+                self.history_start = 0
+            
+            # Load the most recent messages into the deque for context
+            self.recent_history = deque(self.loaded_history[-SHORT_TERM_MEMORY_SIZE:], maxlen=SHORT_TERM_MEMORY_SIZE)
+            
+            cursor.close()
+            self.history_loaded = True
+            print(f"✅ Loaded {len(self.loaded_history)} of {self.get_message_count()} messages for user '{self.user_id}' from Snowflake")
+        except Exception as e:
+            print(f"Error loading conversation from Snowflake: {e}")
+            # Initialize with empty history if there's an error
+            self.loaded_history = []
+            self.history_start = 0
+            self.recent_history = deque(maxlen=SHORT_TERM_MEMORY_SIZE)
+    
+    def _load_recent_messages(self, cursor):
+        """
+        Read the last load_window rows of the user's USER_MESSAGES log.
+        
+        SEQ values are unique but not contiguous, so the user's row count, read in
+        the same statement, gives the position of the loaded window.
+        
+        Args:
+            cursor: Open Snowflake cursor
+        """
+        query = """
+            SELECT ROLE, CONTENT, 
+                   (SELECT COUNT(*) FROM USER_MESSAGES WHERE USER_ID = %(user_id)s) AS TOTAL 
+            FROM USER_MESSAGES 
+            WHERE USER_ID = %(user_id)s 
+            ORDER BY SEQ DESC, TS DESC 
+            LIMIT %(limit)s
+        """
+        
+        cursor.execute(query, {"user_id": self.user_id, "limit": self.load_window})
+        rows = cursor.fetchall()[::-1]
+        self.loaded_history = [{"role": role, "content": content} for role, content, _ in rows]
+        self.history_start = int(rows[0][2]) - len(rows) if rows else 0
+    
+    def _fetch_messages(self, start, end):
+        """
+        Read messages start to end (exclusive) from the USER_MESSAGES log.
+        
+        Args:
+            start: Position of the first message
+            end: Position after the last message
+            
+        Returns:
+            List of message dictionaries in (SEQ, TS) order
+            
+        Raises:
+            Exception: If the query fails, so callers never mistake a failed read for no messages
+        """
+        conn = self.snowflake.get_connection()
+        cursor = conn.cursor()
+        try:
+            query = """
+                SELECT ROLE, CONTENT 
+                FROM USER_MESSAGES 
+                WHERE USER_ID = %(user_id)s 
+                ORDER BY SEQ, TS 
+                LIMIT %(limit)s OFFSET %(start)s
+            """
+            
+            cursor.execute(query, {"user_id": self.user_id, "limit": end - start, "start": start})
+            return [{"role": role, "content": content} for role, content in cursor.fetchall()]
+        finally:
+            cursor.close()
+    
+    def _load_conversation_variant(self, cursor):
+        """
+        Read the user's history from the legacy USER_CONVERSATIONS VARIANT column.
+        
+        Args:
+            cursor: Open Snowflake cursor
+            
+        Returns:
+            List of message dictionaries (empty if the user has no valid history)
+        """
+        # Query to get the user's conversation history
+        query = """
+            SELECT CONVERSATION_HISTORY 
+            FROM USER_CONVERSATIONS 
+            WHERE USER_ID = %(user_id)s
+        """
+        
+        cursor.execute(query, {"user_id": self.user_id})
+        result = cursor.fetchone()
+        
+        if not result or not result[0]:
+            return []
+        
+        # Parse the conversation history from the VARIANT column
+        data = result[0]
+        
+        # Ensure data is a list - Snowflake might return it as a string or other format
+        if isinstance(data, str):
+            try:
+                # Try to parse it as JSON
+                return json.loads(data)
+            except json.JSONDecodeError:
+                # If it's not valid JSON, initialize as empty list
+                print(f"Error: Invalid JSON data from Snowflake: {data}")
+                return []
+        if isinstance(data, list):
+            # It's already a list, use as is
+            return data
+        # Some other format, initialize as empty list
+        print(f"Error: Unexpected data type from Snowflake: {type(data)}")
+        return []
+    
+    def _migrate_conversation(self, cursor):
+        """
+        Copy a user's legacy USER_CONVERSATIONS history into USER_MESSAGES.
+        
+        Called when the user has no USER_MESSAGES rows. The legacy row is left in place,
+        so switching SHORT_TERM_MEMORY_STORAGE back still finds the history it had.
+        
+        Args:
+            cursor: Open Snowflake cursor
+            
+        Returns:
+            The migrated list of message dictionaries (empty if there was nothing to migrate)
+        """
+        history = self._load_conversation_variant(cursor)
+        if not history:
+            return []
+        
+        timestamp = datetime.now().isoformat()
+        rows = [
+            {"role": msg.get("role"), "content": msg.get("content"), "ts": timestamp}
+            for msg in history
+        ]
+        try:
+            for start in range(0, len(rows), SHORT_TERM_MEMORY_INSERT_BATCH_ROWS):
+                self._insert_messages(cursor, rows[start:start + SHORT_TERM_MEMORY_INSERT_BATCH_ROWS])
+        except Exception:
+            # Remove a partial copy so the next load migrates the user again
+            cursor.execute("DELETE FROM USER_MESSAGES WHERE USER_ID = %(user_id)s", {"user_id": self.user_id})
+            raise
+        print(f"🔀 Migrated {len(rows)} messages for user '{self.user_id}' from USER_CONVERSATIONS to USER_MESSAGES")
+        return history
+    
+    def _insert_messages(self, cursor, rows):
+        """
+        Append rows to USER_MESSAGES with one multi-row INSERT.
+        
+        SEQ is left to the column's AUTOINCREMENT ORDER default, which numbers the
+        rows in VALUES order after every row already in the table.
+        
+        Args:
+            cursor: Open Snowflake cursor
+            rows: List of dictionaries with role, content and ts
+        """
+        values = []
+        params = {"user_id": self.user_id}
+        for i, row in enumerate(rows):
+            values.append(f"(%(user_id)s, %(role_{i})s, %(content_{i})s, %(ts_{i})s)")
+            params.update({
+                f"role_{i}": row["role"],
+                f"content_{i}": row["content"],
+                f"ts_{i}": row["ts"]
+            })
+        
+        query = "INSERT INTO USER_MESSAGES (USER_ID, ROLE, CONTENT, TS) VALUES " + ", ".join(values)
+        cursor.execute(query, params)
+    
+    def _load_summary(self):
+        """Load the rolling conversation summary from Snowflake."""
+        try:
+            conn = self.snowflake.get_connection()
             cursor = conn.cursor()
             
-            # Query to get the user's conversation history
             query = """
-                SELECT CONVERSATION_HISTORY 
-                FROM USER_CONVERSATIONS 
+                SELECT SUMMARY, SUMMARIZED_COUNT 
+                FROM USER_CONVERSATION_SUMMARIES 
                 WHERE USER_ID = %(user_id)s
             """
             
             cursor.execute(query, {"user_id": self.user_id})
             result = cursor.fetchone()
+            cursor.close()
             
             if result and result[0]:
-                # Parse the conversation history from the VARIANT column
-                data = result[0]
-                
-                # Ensure data is a list - Snowflake might return it as a string or other format
-                if isinstance(data, str):
-                    try:
-                        # Try to parse it as JSON
-                        self.full_history = json.loads(data)
-                    except json.JSONDecodeError:
-                        # If it's not valid JSON, initialize as empty list
-                        print(f"Error: Invalid JSON data from Snowflake: {data}")
-                        self.full_history = []
-                elif isinstance(data, list):
-                    # It's already a list, use as is
-                    self.full_history = data
-                else:
-                    # Some other format, initialize as empty list
-                    print(f"Error: Unexpected data type from Snowflake: {type(data)}")
-                    self.full_history = []
-                
-                # Load the most recent messages into the deque for context
-                recent_messages = self.full_history[-SHORT_TERM_MEMORY_SIZE:] if len(self.full_history) > SHORT_TERM_MEMORY_SIZE else self.full_history
-                self.recent_history = deque(recent_messages, maxlen=SHORT_TERM_MEMORY_SIZE)
+                summarized_count = int(result[1] or 0)
+                # A summary covering more messages than the history holds no longer matches it
+                if summarized_count > self.get_message_count():
+                    print(f"⚠️ Ignoring conversation summary for user '{self.user_id}': covers {summarized_count} messages, history has {self.get_message_count()}")
+                    return
+                self.summary = result[0]
+                self.summarized_count = summarized_count
+                print(f"✅ Loaded conversation summary for user '{self.user_id}' ({summarized_count} messages summarized)")
+        except Exception as e:
+            print(f"⚠️ Could not load conversation summary from Snowflake: {e}")
+    
+    def save_summary(self, summary, summarized_count):
+        """
+        Store the rolling conversation summary next to the conversation history.
+        
+        Args:
+            summary: The summary text
+            summarized_count: Number of messages, from the start of the history, the summary covers
             
+        Returns:
+            True if the summary was written
+        """
+        self.summary = summary
+        self.summarized_count = summarized_count
+        try:
+            conn = self.snowflake.get_connection()
+            cursor = conn.cursor()
+            
+            query = """
+                MERGE INTO USER_CONVERSATION_SUMMARIES AS target
+                USING (SELECT %(user_id)s AS USER_ID, 
+                              %(summary)s AS SUMMARY, 
+                              %(summarized_count)s AS SUMMARIZED_COUNT, 
+                              %(last_updated)s AS LAST_UPDATED) AS source
+                ON target.USER_ID = source.USER_ID
+                WHEN MATCHED THEN
+                    UPDATE SET 
+                        SUMMARY = source.SUMMARY,
+                        SUMMARIZED_COUNT = source.SUMMARIZED_COUNT,
+                        LAST_UPDATED = source.LAST_UPDATED
+                WHEN NOT MATCHED THEN
+                    INSERT (USER_ID, SUMMARY, SUMMARIZED_COUNT, LAST_UPDATED)
+                    VALUES (source.USER_ID, source.SUMMARY, source.SUMMARIZED_COUNT, source.LAST_UPDATED)
+            """
+            
+            cursor.execute(
+                query,
+                {
+                    "user_id": self.user_id,
+                    "summary": summary,
+                    "summarized_count": summarized_count,
+                    "last_updated": datetime.now().isoformat()
+                }
+            )
+            conn.commit()
             cursor.close()
-            print(f"✅ Loaded {len(self.full_history)} messages for user '{self.user_id}' from Snowflake")
+            return True
         except Exception as e:
-            print(f"Error loading conversation from Snowflake: {e}")
-            # Initialize with empty history if there's an error
-            self.full_history = []
-            self.recent_history = deque(maxlen=SHORT_TERM_MEMORY_SIZE)
+            print(f"❌ Error saving conversation summary to Snowflake: {e}")
+            return False
     
     def _flush_write_buffer(self):
         """Flush the write buffer to Snowflake (thread-safe)."""
@@ -97,45 +340,19 @@ class SnowflakeShortTermMemory:
             
             try:
                 # Connect to Snowflake
-                conn = self.snowflake.connect()
+                conn = self.snowflake.get_connection()
                 cursor = conn.cursor()
                 
-                # MERGE statement (UPSERT) to insert or update the conversation
-                query = """
-                    MERGE INTO USER_CONVERSATIONS AS target
-                    USING (SELECT %(user_id)s AS USER_ID, 
-                                  %(last_updated)s AS LAST_UPDATED, 
-                                  PARSE_JSON(%(history_json)s) AS CONVERSATION_HISTORY) AS source
-                    ON target.USER_ID = source.USER_ID
-                    WHEN MATCHED THEN
-                        UPDATE SET 
-                            LAST_UPDATED = source.LAST_UPDATED,
-                            CONVERSATION_HISTORY = source.CONVERSATION_HISTORY
-                    WHEN NOT MATCHED THEN
-                        INSERT (USER_ID, LAST_UPDATED, CONVERSATION_HISTORY)
-                        VALUES (source.USER_ID, source.LAST_UPDATED, source.CONVERSATION_HISTORY)
-                """
-                
-                # Convert the full_history to a JSON string
-                history_json = json.dumps(self.full_history)
-                
-                print(f"🔄 Batch writing {len(self.write_buffer)} messages for user '{self.user_id}' to Snowflake")
+                count = len(self.write_buffer)
+                print(f"🔄 Batch writing {count} messages for user '{self.user_id}' to Snowflake")
                 
-                # Execute the query with parameters
-                cursor.execute(
-                    query, 
-                    {
-                        "user_id": self.user_id, 
-                        "last_updated": datetime.now().isoformat(), 
-                        "history_json": history_json
-                    }
-                )
-                
-                # Commit the transaction
-                conn.commit()
+                if self.storage == MESSAGES_STORAGE:
+                    self._append_buffered_messages(conn, cursor)
+                else:
+                    self._write_conversation_variant(conn, cursor)
                 cursor.close()
                 
-                print(f"✅ Successfully batch saved {len(self.write_buffer)} messages for user '{self.user_id}' to Snowflake")
+                print(f"✅ Successfully batch saved {count} messages for user '{self.user_id}' to Snowflake")
                 
                 # Clear the buffer and reset timer
                 self.write_buffer.clear()
@@ -150,6 +367,63 @@ class SnowflakeShortTermMemory:
                 # Keep the buffer for retry
                 self.pending_write = False
     
+    def _append_buffered_messages(self, conn, cursor):
+        """
+        Insert the buffered messages into USER_MESSAGES, in batches of SHORT_TERM_MEMORY_INSERT_BATCH_ROWS.
+        
+        Each committed batch is removed from the buffer, so a failed flush retries only
+        the messages that were not written.
+        
+        Args:
+            conn: Open Snowflake connection
+            cursor: Cursor of conn
+        """
+        while self.write_buffer:
+            batch = self.write_buffer[:SHORT_TERM_MEMORY_INSERT_BATCH_ROWS]
+            self._insert_messages(cursor, batch)
+            conn.commit()
+            del self.write_buffer[:len(batch)]
+    
+    def _write_conversation_variant(self, conn, cursor):
+        """
+        Rewrite the whole history into the legacy USER_CONVERSATIONS VARIANT column.
+        
+        Args:
+            conn: Open Snowflake connection
+            cursor: Cursor of conn
+        """
+        # MERGE statement (UPSERT) to insert or update the conversation
+        query = """
+            MERGE INTO USER_CONVERSATIONS AS target
+            USING (SELECT %(user_id)s AS USER_ID, 
+                          %(last_updated)s AS LAST_UPDATED, 
+                          PARSE_JSON(%(history_json)s) AS CONVERSATION_HISTORY) AS source
+            ON target.USER_ID = source.USER_ID
+            WHEN MATCHED THEN
+                UPDATE SET 
+                    LAST_UPDATED = source.LAST_UPDATED,
+                    CONVERSATION_HISTORY = source.CONVERSATION_HISTORY
+            WHEN NOT MATCHED THEN
+                INSERT (USER_ID, LAST_UPDATED, CONVERSATION_HISTORY)
+                VALUES (source.USER_ID, source.LAST_UPDATED, source.CONVERSATION_HISTORY)
+        """
+        
+        # Convert the history (loaded in full in this layout) to a JSON string
+        history_json = json.dumps(self.loaded_history)
+        
+        # Execute the query with parameters
+        cursor.execute(
+            query, 
+            {
+                "user_id": self.user_id, 
+                "last_updated": datetime.now().isoformat(), 
+                "history_json": history_json
+            }
+        )
+        
+        # Commit the transaction
+        conn.commit()
+    
     def _schedule_batch_write(self):
         """Schedule a batch write based on buffer size or timeout."""
         with self.write_lock:
@@ -186,13 +460,13 @@ class SnowflakeShortTermMemory:
         """
         message = {"role": role, "content": content}
         
-        # Add to both full history and recent history immediately
-        self.full_history.append(message)
+        # Add to both the loaded history and recent history immediately
+        self.loaded_history.append(message)
         self.recent_history.append(message)
         
-        # Add to write buffer for batch processing
+        # Add to write buffer for batch processing (Snowflake assigns SEQ on insert)
         with self.write_lock:
-            self.write_buffer.append(message)
+            self.write_buffer.append({**message, "ts": datetime.now().isoformat()})
         
         # Schedule batch write
         self._schedule_batch_write()
@@ -212,6 +486,10 @@ class SnowflakeShortTermMemory:
         
         if self.batch_timer:
             self.batch_timer.cancel()
+        
+        if self.snowflake is not None:
+            get_resource_registry().release(SNOWFLAKE_MEMORY, self.snowflake)
+            self.snowflake = None
     
     def get_formatted_history(self):
         """
@@ -231,14 +509,68 @@ class SnowflakeShortTermMemory:
         """
         return list(self.recent_history)
     
+    def get_message_count(self):
+        """
+        Get the number of messages in the conversation, without reading older messages.
+        
+        Returns:
+            Total number of messages, including those not loaded
+        """
+        return self.history_start + len(self.loaded_history)
+    
+    def get_messages(self, start, end=None):
+        """
+        Get messages by position, reading any before the loaded window from Snowflake.
+        
+        Args:
+            start: Position of the first message
+            end: Position after the last message (default: the end of the history)
+            
+        Returns:
+            List of message dictionaries
+        """
+        count = self.get_message_count()
+        start = max(start, 0)
+        end = count if end is None else min(end, count)
+        if start >= end:
+            return []
+        
+        older = self._fetch_messages(start, min(end, self.history_start)) if start < self.history_start else []
+        if end <= self.history_start:
+            return older
+        return older + self.loaded_history[max(start - self.history_start, 0):end - self.history_start]
+    
+    def iter_history_pages(self, page_size=SHORT_TERM_MEMORY_HISTORY_PAGE_SIZE):
+        """
+        Page backwards through the conversation history.
+        
+        Pages before the loaded window are read from Snowflake as the iteration
+        reaches them, so stopping early reads no further.
+        
+        Args:
+            page_size: Messages per page
+            
+        Yields:
+            Lists of message dictionaries in chronological order, newest page first
+        """
+        end = self.get_message_count()
+        while end > 0:
+            start = max(end - page_size, 0)
+            yield self.get_messages(start, end)
+            end = start
+    
     def get_full_history(self):
         """
         Get the complete conversation history.
         
+        Reads every message before the loaded window; use iter_history_pages or
+        get_messages to read only what is needed.
+        
         Returns:
             List of all message dictionaries
         """
-        return self.full_history
+        pages = list(self.iter_history_pages())
+        return [msg for page in reversed(pages) for msg in page]
     
     def get_api_history(self, limit=30):
         """
@@ -250,4 +582,17 @@ class SnowflakeShortTermMemory:
         Returns:
             List of the most recent message dictionaries, limited to the specified count
         """
-        return self.full_history[-limit:] if len(self.full_history) > limit else self.full_history 
\ No newline at end of file
+        return self.get_messages(self.get_message_count() - limit)
+    
+    def get_summarized_history(self, limit=30):
+        """
+        Get the rolling summary and the recent messages it does not cover.
+        
+        Args:
+            limit: Maximum number of recent messages to return
+            
+        Returns:
+            Tuple of (summary text, list of recent message dictionaries)
+        """
+        start = max(self.summarized_count, self.get_message_count() - limit, 0)
+        return self.summary, self.get_messages(start)
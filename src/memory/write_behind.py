@@ -0,0 +1,396 @@
+"""
+Process-wide write-behind queue for long-term (Mem0) memory stores.
+
+Conversation turns are accepted immediately and written in the background by a
+fixed pool of workers. Turns queued for the same entity while an earlier write
+is pending are coalesced into a single Mem0 add, failed writes are retried with
+exponential backoff, and every accepted turn is journaled to disk so that writes
+still pending at shutdown (or after a crash) are replayed on the next start. The
+journal is compacted to the outstanding turns whenever the queue empties or the
+file grows past MEM0_WRITE_JOURNAL_COMPACT_BYTES.
+"""
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from config.config import (
+    MEM0_WRITE_WORKERS,
+    MEM0_WRITE_MAX_BATCH_TURNS,
+    MEM0_WRITE_MAX_RETRIES,
+    MEM0_WRITE_RETRY_BASE_DELAY,
+    MEM0_WRITE_JOURNAL_PATH,
+    MEM0_WRITE_JOURNAL_COMPACT_BYTES,
+    PENDING_WRITE_FLUSH_TIMEOUT
+)
+from src.scheduler import work_context, BACKGROUND
+
+
+class MemoryWriteQueue:
+    """
+    Bounded-parallelism, per-entity coalescing write-behind queue for Mem0.
+
+    Writes for one entity are never in flight concurrently, which keeps each
+    entity's memories in conversation order; different entities are written in
+    parallel up to the worker count.
+    """
+
+    def __init__(
+        self,
+        max_workers=MEM0_WRITE_WORKERS,
+        max_batch_turns=MEM0_WRITE_MAX_BATCH_TURNS,
+        max_retries=MEM0_WRITE_MAX_RETRIES,
+        retry_base_delay=MEM0_WRITE_RETRY_BASE_DELAY,
+        journal_path=MEM0_WRITE_JOURNAL_PATH,
+        journal_compact_bytes=MEM0_WRITE_JOURNAL_COMPACT_BYTES
+    ):
+        """
+        Initialize the queue and start its workers.
+
+        Args:
+            max_workers: Number of concurrent Mem0 writes
+            max_batch_turns: Maximum number of queued turns coalesced into one write
+            max_retries: Retry attempts per batch before it is counted as failed
+            retry_base_delay: Base delay in seconds for exponential backoff
+            journal_path: JSONL file recording accepted and completed writes (None disables it)
+            journal_compact_bytes: Journal size above which it is compacted while turns are outstanding
+        """
+        self.max_workers = max_workers
+        self.max_batch_turns = max_batch_turns
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.journal_path = journal_path
+        self.journal_compact_bytes = journal_compact_bytes
+
+        # (entity_id, is_agent) -> list of pending turn dicts, in arrival order
+        self._pending = OrderedDict()
+        # (entity_id, is_agent) -> batch of turns being written
+        self._in_flight = {}
+        self._writer = None
+        self._condition = threading.Condition()
+        self._journal_lock = threading.Lock()
+        self._shutting_down = False
+
+        self.stats = {
+            "turns_enqueued": 0,
+            "turns_written": 0,
+            "turns_failed": 0,
+            "batches_written": 0,
+            "retries": 0,
+            "last_write_lag_seconds": 0.0
+        }
+
+        self._replay_journal()
+
+        self._workers = []
+        for i in range(max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"mem0-writer-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def register_writer(self, long_term_memory):
+        """
+        Register the LongTermMemory used for turns that carry no writer of their own
+        (turns replayed from the journal).
+
+        Args:
+            long_term_memory: An operational LongTermMemory instance
+        """
+        with self._condition:
+            if self._writer is None:
+                self._writer = long_term_memory
+                self._condition.notify_all()
+
+    def enqueue(self, long_term_memory, content, entity_id, is_agent=False):
+        """
+        Accept a conversation turn for background storage.
+
+        Args:
+            long_term_memory: LongTermMemory instance that will perform the write
+            content: List of message dictionaries for the turn
+            entity_id: The ID of the entity (user or agent)
+            is_agent: Boolean to determine if the entity is the agent or user
+
+        Returns:
+            The turn's ID (for drain), or None if the queue is shutting down and the turn was not accepted
+        """
+        with self._condition:
+            if self._shutting_down:
+                return None
+
+            turn = {
+                "id": uuid.uuid4().hex,
+                "entity_id": entity_id,
+                "is_agent": is_agent,
+                "content": content,
+                "enqueued_at": time.time(),
+                "writer": long_term_memory
+            }
+            self._journal("enqueue", turn)
+            self._pending.setdefault((entity_id, is_agent), []).append(turn)
+            self.stats["turns_enqueued"] += 1
+            self._condition.notify()
+        return turn["id"]
+
+    def _next_batch(self):
+        """Pop the oldest coalesced batch whose entity is not already being written (lock held)."""
+        for key, turns in self._pending.items():
+            if key in self._in_flight:
+                continue
+            writer = next((t["writer"] for t in turns if t["writer"] is not None), None) or self._writer
+            if writer is None:
+                continue
+            batch = turns[:self.max_batch_turns]
+            remaining = turns[self.max_batch_turns:]
+            if remaining:
+                self._pending[key] = remaining
+            else:
+                del self._pending[key]
+            self._in_flight[key] = batch
+            return key, writer, batch
+        return None
+
+    def _worker_loop(self):
+        """Worker thread: take batches and write them until shutdown drains the queue."""
+        while True:
+            with self._condition:
+                job = self._next_batch()
+                while job is None:
+                    if self._shutting_down and not self._pending:
+                        return
+                    self._condition.wait(timeout=1.0)
+                    job = self._next_batch()
+
+            key, writer, batch = job
+            try:
+                self._write_batch(writer, key, batch)
+            finally:
+                with self._condition:
+                    # Journaled with the batch leaving _in_flight, so a compaction never keeps a finished turn
+                    del self._in_flight[key]
+                    self._journal("done", *batch)
+                    self._compact_journal_if_due()
+                    self._condition.notify_all()
+
+    def _write_batch(self, writer, key, batch):
+        """Write a coalesced batch to Mem0, retrying with exponential backoff."""
+        entity_id, is_agent = key
+        content = [message for turn in batch for message in turn["content"]]
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                # Memory writes are admitted as background work so they never hold up a turn
+                with work_context(priority=BACKGROUND, user_id=entity_id):
+                    if writer.write_memory(content, entity_id, is_agent=is_agent):
+                        break
+            except Exception as e:
+                print(f"⚠️ Mem0 write for '{entity_id}' raised: {e}")
+
+            if attempt < self.max_retries:
+                delay = self.retry_base_delay * (2 ** attempt)
+                with self._condition:
+                    self.stats["retries"] += 1
+                print(f"🔄 Retrying Mem0 write for '{entity_id}' in {delay:.1f}s (attempt {attempt + 2}/{self.max_retries + 1})")
+                time.sleep(delay)
+        else:
+            with self._condition:
+                self.stats["turns_failed"] += len(batch)
+            print(f"❌ Dropping {len(batch)} turns for '{entity_id}' after {self.max_retries + 1} attempts")
+            return
+
+        with self._condition:
+            self.stats["turns_written"] += len(batch)
+            self.stats["batches_written"] += 1
+            self.stats["last_write_lag_seconds"] = time.time() - batch[0]["enqueued_at"]
+        if len(batch) > 1:
+            print(f"✅ Coalesced {len(batch)} turns into one Mem0 write for '{entity_id}'")
+
+    def drain(self, timeout=PENDING_WRITE_FLUSH_TIMEOUT, entity_ids=None, turn_ids=None):
+        """
+        Wait until queued writes have completed.
+
+        Args:
+            timeout: Maximum number of seconds to wait
+            entity_ids: Optional collection of entity IDs to wait for (default: all)
+            turn_ids: Optional collection of turn IDs returned by enqueue to wait for (default: all)
+
+        Returns:
+            Number of turns still pending when the timeout expired
+        """
+        deadline = time.time() + timeout
+        with self._condition:
+            while True:
+                remaining = self._count_outstanding(entity_ids, turn_ids)
+                wait_time = deadline - time.time()
+                if remaining == 0 or wait_time <= 0:
+                    return remaining
+                self._condition.wait(timeout=min(wait_time, 1.0))
+
+    def _count_outstanding(self, entity_ids=None, turn_ids=None):
+        """Count pending and in-flight turns, optionally limited to some entities or turns (lock held)."""
+        def wanted(key, turn):
+            return ((entity_ids is None or key[0] in entity_ids)
+                    and (turn_ids is None or turn["id"] in turn_ids))
+
+        return sum(
+            1
+            for queue in (self._pending, self._in_flight)
+            for key, turns in queue.items()
+            for turn in turns
+            if wanted(key, turn)
+        )
+
+    def get_metrics(self):
+        """
+        Report queue depth, lag and write counters.
+
+        Returns:
+            Dictionary of queue metrics
+        """
+        with self._condition:
+            oldest = min(
+                (turns[0]["enqueued_at"] for turns in self._pending.values() if turns),
+                default=None
+            )
+            return {
+                "queue_depth": sum(len(turns) for turns in self._pending.values()),
+                "entities_pending": len(self._pending),
+                "in_flight": len(self._in_flight),
+                "oldest_pending_lag_seconds": time.time() - oldest if oldest else 0.0,
+                **self.stats
+            }
+
+    def shutdown(self, timeout=PENDING_WRITE_FLUSH_TIMEOUT):
+        """
+        Stop accepting writes and drain the queue. Turns that do not complete in
+        time stay in the journal and are replayed on the next start.
+
+        Args:
+            timeout: Maximum number of seconds to wait for the drain
+        """
+        with self._condition:
+            if self._shutting_down:
+                return
+            self._shutting_down = True
+            self._condition.notify_all()
+
+        remaining = self.drain(timeout)
+        if remaining:
+            print(f"⚠️ Mem0 write queue shut down with {remaining} turns pending (kept in journal for replay)")
+
+    @staticmethod
+    def _journal_record(op, turn):
+        """Build the journal record for a turn."""
+        record = {"op": op, "id": turn["id"]}
+        if op == "enqueue":
+            record.update({
+                "entity_id": turn["entity_id"],
+                "is_agent": turn["is_agent"],
+                "content": turn["content"],
+                "enqueued_at": turn["enqueued_at"]
+            })
+        return record
+
+    def _journal(self, op, *turns):
+        """Append enqueue/done records to the journal file."""
+        if not self.journal_path:
+            return
+        try:
+            with self._journal_lock:
+                with open(self.journal_path, "a", encoding="utf-8") as f:
+                    for turn in turns:
+                        f.write(json.dumps(self._journal_record(op, turn)) + "\n")
+        except Exception as e:
+            print(f"⚠️ Could not write Mem0 journal: {e}")
+
+    def _rewrite_journal(self, records):
+        """Atomically replace the journal with the given enqueue records."""
+        temp_path = self.journal_path + ".tmp"
+        with self._journal_lock:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+            os.replace(temp_path, self.journal_path)
+
+    def _compact_journal_if_due(self):
+        """
+        Drop completed turns from the journal once the queue is empty, or once the
+        journal exceeds journal_compact_bytes (lock held, so no turn is enqueued meanwhile).
+        """
+        if not self.journal_path:
+            return
+        outstanding = [turn for queue in (self._pending, self._in_flight) for turns in queue.values() for turn in turns]
+        try:
+            if outstanding and os.path.getsize(self.journal_path) <= self.journal_compact_bytes:
+                return
+            self._rewrite_journal([self._journal_record("enqueue", turn) for turn in outstanding])
+        except FileNotFoundError:
+            pass  # Nothing journaled yet
+        except Exception as e:
+            print(f"⚠️ Could not compact Mem0 journal: {e}")
+
+    def _replay_journal(self):
+        """Re-queue turns that were accepted but never completed, then compact the journal."""
+        if not self.journal_path or not os.path.exists(self.journal_path):
+            return
+
+        accepted = OrderedDict()
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Torn final line from a crash
+                    if record.get("op") == "enqueue":
+                        accepted[record["id"]] = record
+                    elif record.get("op") == "done":
+                        accepted.pop(record["id"], None)
+        except Exception as e:
+            print(f"⚠️ Could not read Mem0 journal: {e}")
+            return
+
+        for record in accepted.values():
+            turn = {
+                "id": record["id"],
+                "entity_id": record["entity_id"],
+                "is_agent": record["is_agent"],
+                "content": record["content"],
+                "enqueued_at": record["enqueued_at"],
+                "writer": None
+            }
+            self._pending.setdefault((turn["entity_id"], turn["is_agent"]), []).append(turn)
+
+        # Rewrite the journal with only the outstanding turns
+        try:
+            self._rewrite_journal(accepted.values())
+        except Exception as e:
+            print(f"⚠️ Could not compact Mem0 journal: {e}")
+
+        if accepted:
+            print(f"🔄 Replaying {len(accepted)} unwritten Mem0 turns from journal")
+
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+
+def get_memory_write_queue():
+    """
+    Get the process-wide Mem0 write queue, starting it on first use.
+
+    Returns:
+        The shared MemoryWriteQueue instance
+    """
+    global _write_queue
+    if _write_queue is None:
+        with _write_queue_lock:
+            if _write_queue is None:
+                _write_queue = MemoryWriteQueue()
+                atexit.register(_write_queue.shutdown)
+    return _write_queue
@@ -0,0 +1,220 @@
+"""
+Intent-based model routing for Companion turns.
+
+Every turn used to go to the selected reasoning model with the full completion
+budget, so a "thanks" waited as long as a pipeline analysis. The router
+classifies each turn with a cheap signal (the data detector's verdict and a
+pattern match on short messages) and picks the model and max_tokens of its
+route:
+
+- chit_chat: short greetings, thanks and acknowledgements, and requests to clarify the last answer
+- strategy: narrative advice without data
+- data: interpreting query results (or tool-calling turns that may query)
+
+Routes are configured in MODEL_ROUTES, with per-analyst overrides in
+MODEL_ROUTES_BY_ANALYST. A route without a model uses the model selected in the
+UI, read from config at call time so update_model() takes effect. Latency,
+time to first token and token counts are recorded per route.
+"""
+import sys
+import os
+import re
+import threading
+from collections import Counter, deque
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config.config as app_config
+from config.config import (
+    COMPANION_MAX_COMPLETION_TOKENS,
+    MODEL_ROUTING_ENABLED,
+    MODEL_ROUTES,
+    MODEL_ROUTES_BY_ANALYST,
+    MODEL_ROUTING_CHIT_CHAT_MAX_WORDS,
+    MODEL_ROUTING_METRICS_WINDOW
+)
+
+CHIT_CHAT = "chit_chat"
+STRATEGY = "strategy"
+DATA = "data"
+DEFAULT = "default"  # Routing disabled: the selected model and COMPANION_MAX_COMPLETION_TOKENS
+
+# Messages made up only of pleasantries or acknowledgements, followed by nothing but punctuation
+# or emoji ("Thanks, that helps! 🙏"); "Thanks. Now draft a plan" asks for more and is not chit-chat...
+_ACKNOWLEDGEMENT = (
+    r"(?:hi|hello|hey)(?: there| all| team)?|thanks(?: a lot| so much| again)?|"
+    r"thank you(?: so much| very much| again)?|many thanks|thx|ty|cheers|ok|okay|cool|great|nice|"
+    r"awesome|perfect|got it|sounds good|(?:that )?makes sense|understood|"
+    r"(?:that['’]?s |that is |very )?helpful|that helps|bye|goodbye|good (?:morning|afternoon|evening)"
+)
+ACKNOWLEDGEMENT_PATTERN = re.compile(
+    rf"\W*(?:{_ACKNOWLEDGEMENT})(?:[\W_]+(?:{_ACKNOWLEDGEMENT}))*[\W_]*",
+    re.IGNORECASE
+)
+# ...or ask to clarify the last answer
+CLARIFICATION_PATTERN = re.compile(
+    r"^\W*(what do you mean|what does that mean|can you clarify|could you clarify|"
+    r"can you rephrase|could you rephrase|say that again|sorry\W*$)",
+    re.IGNORECASE
+)
+
+
+class ModelRouter:
+    """Picks each turn's model and completion budget and records per-route metrics."""
+
+    def __init__(self, routes=MODEL_ROUTES, routes_by_analyst=MODEL_ROUTES_BY_ANALYST,
+                 enabled=MODEL_ROUTING_ENABLED, metrics_window=MODEL_ROUTING_METRICS_WINDOW):
+        """
+        Initialize the router.
+
+        Args:
+            routes: Route name -> {"model", "max_tokens"}; a model of None means the selected model
+            routes_by_analyst: Analyst type -> route overrides merged over routes
+            enabled: If False, every turn takes the "default" route
+            metrics_window: Recent latency samples kept per route
+        """
+        self.routes = routes
+        self.routes_by_analyst = routes_by_analyst
+        self.enabled = enabled
+        self.metrics_window = metrics_window
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    @staticmethod
+    def classify(user_message, needs_data=False, tools=False):
+        """
+        Classify a turn by intent.
+
+        Args:
+            user_message: The user's message
+            needs_data: True if the data detector chose to query for this message
+            tools: True if the model may query data itself (tool-calling mode)
+
+        Returns:
+            "chit_chat", "strategy" or "data"
+        """
+        if needs_data:
+            return DATA
+        if len(user_message.split()) <= MODEL_ROUTING_CHIT_CHAT_MAX_WORDS:
+            if CLARIFICATION_PATTERN.match(user_message):
+                return CHIT_CHAT
+            if ACKNOWLEDGEMENT_PATTERN.fullmatch(user_message) and "?" not in user_message:
+                return CHIT_CHAT
+        return DATA if tools else STRATEGY
+
+    def policy(self, analyst_type):
+        """
+        Get the routes of an analyst.
+
+        Args:
+            analyst_type: The analyst answering the turn
+
+        Returns:
+            Route name -> {"model", "max_tokens"} with the analyst's overrides applied
+        """
+        overrides = self.routes_by_analyst.get(analyst_type) or {}
+        return {name: {**settings, **overrides.get(name, {})} for name, settings in self.routes.items()}
+
+    def route(self, user_message, analyst_type, needs_data=False, tools=False):
+        """
+        Pick the model and completion budget for a turn.
+
+        Args:
+            user_message: The user's message
+            analyst_type: The analyst answering the turn
+            needs_data: True if the data detector chose to query for this message
+            tools: True if the model may query data itself (tool-calling mode)
+
+        Returns:
+            Dictionary with the route name, model and max_tokens
+        """
+        selected_model = app_config.OPENROUTER_MODEL
+        if not self.enabled:
+            return {"name": DEFAULT, "model": selected_model, "max_tokens": COMPANION_MAX_COMPLETION_TOKENS}
+
+        name = self.classify(user_message, needs_data, tools)
+        settings = self.policy(analyst_type).get(name) or {}
+        return {
+            "name": name,
+            "model": settings.get("model") or selected_model,
+            "max_tokens": settings.get("max_tokens") or COMPANION_MAX_COMPLETION_TOKENS
+        }
+
+    def record(self, route, latency, ttft=None, usage=None):
+        """
+        Record one LLM call made for a route.
+
+        Args:
+            route: The route dictionary returned by route()
+            latency: Seconds from request to the end of the response
+            ttft: Seconds to the first streamed token, if streamed
+            usage: The response's "usage" dictionary, if reported
+        """
+        usage = usage or {}
+        with self._lock:
+            stats = self._stats.get(route["name"])
+            if stats is None:
+                stats = self._stats[route["name"]] = {
+                    "counts": Counter(),
+                    "models": Counter(),
+                    "latency": deque(maxlen=self.metrics_window),
+                    "ttft": deque(maxlen=self.metrics_window)
+                }
+            stats["counts"]["calls"] += 1
+            stats["counts"]["prompt_tokens"] += usage.get("prompt_tokens") or 0
+            stats["counts"]["completion_tokens"] += usage.get("completion_tokens") or 0
+            stats["models"][route["model"]] += 1
+            stats["latency"].append(latency)
+            if ttft is not None:
+                stats["ttft"].append(ttft)
+
+    @staticmethod
+    def _percentile(samples, fraction):
+        """Nearest-rank percentile of a sorted list, in milliseconds."""
+        if not samples:
+            return 0.0
+        index = min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))
+        return round(samples[index] * 1000, 2)
+
+    def get_stats(self):
+        """
+        Report calls, tokens and latency per route.
+
+        Returns:
+            Dictionary with the routing settings and, per route, call and token counts,
+            the models used and p50/p95 latency and time to first token in milliseconds
+        """
+        routes = {}
+        with self._lock:
+            for name, stats in self._stats.items():
+                latency = sorted(stats["latency"])
+                ttft = sorted(stats["ttft"])
+                calls = stats["counts"]["calls"]
+                routes[name] = {
+                    **stats["counts"],
+                    "avg_completion_tokens": round(stats["counts"]["completion_tokens"] / calls, 1) if calls else 0.0,
+                    "models": dict(stats["models"]),
+                    "latency_ms_p50": self._percentile(latency, 0.50),
+                    "latency_ms_p95": self._percentile(latency, 0.95),
+                    "ttft_ms_p50": self._percentile(ttft, 0.50),
+                    "ttft_ms_p95": self._percentile(ttft, 0.95)
+                }
+        return {"enabled": self.enabled, "routes": routes}
+
+
+_model_router = None
+_model_router_lock = threading.Lock()
+
+
+def get_model_router():
+    """
+    Get the process-wide model router.
+
+    Returns:
+        The shared ModelRouter instance
+    """
+    global _model_router
+    if _model_router is None:
+        with _model_router_lock:
+            if _model_router is None:
+                _model_router = ModelRouter()
+    return _model_router
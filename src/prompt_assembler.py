@@ -0,0 +1,244 @@
+"""
+Token-budgeted prompt assembly for the Companion pipeline.
+
+Prompt sections are counted with a local tokenizer and admitted in priority
+order until the model's input budget is spent:
+
+1. persona (the analyst's static system prompt) and the user's message - always sent
+2. data analysis results - trimmed by rows
+3. long-term memories - trimmed by whole memories, most relevant first
+4. conversation history - trimmed by whole messages, most recent first
+5. rolling summary of older conversation - sent whole or not at all
+
+History is returned as chat messages rather than a transcript, so LlmApi can
+send it after the static system prompt and keep the prompt prefix cacheable.
+"""
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config.config as app_config
+from config.config import (
+    PROMPT_TOKEN_BUDGETS,
+    DEFAULT_PROMPT_TOKEN_BUDGET,
+    PROMPT_TOKENIZER_ENCODING
+)
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+
+class TokenCounter:
+    """Counts tokens with tiktoken, or estimates them when it is unavailable."""
+
+    def __init__(self, encoding_name=PROMPT_TOKENIZER_ENCODING):
+        """
+        Load the tokenizer.
+
+        Args:
+            encoding_name: tiktoken encoding to use (o200k_base matches the o-series and GPT-4o models)
+        """
+        self.encoding = None
+        if TIKTOKEN_AVAILABLE:
+            try:
+                self.encoding = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                print(f"⚠️ Could not load tokenizer '{encoding_name}': {e}")
+        if self.encoding is None:
+            print("⚠️ tiktoken unavailable - estimating prompt tokens as characters / 4")
+
+    def count(self, text):
+        """
+        Count the tokens in a string.
+
+        Args:
+            text: The text to count
+
+        Returns:
+            Number of tokens
+        """
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return (len(text) + 3) // 4
+
+
+class PromptAssembler:
+    """Fits the persona, data, memories and history of a turn into a token budget."""
+
+    def __init__(self, get_system_prompt, format_data_context, token_counter=None):
+        """
+        Initialize the assembler.
+
+        Args:
+            get_system_prompt: Callable returning the analyst's static system prompt
+                (LlmApi.get_static_system_prompt)
+            format_data_context: Callable(data_result, max_rows) returning the data prompt section
+            token_counter: TokenCounter instance (created if not provided)
+        """
+        self.get_system_prompt = get_system_prompt
+        self.format_data_context = format_data_context
+        self.token_counter = token_counter or TokenCounter()
+        self._persona_tokens = None
+
+    @staticmethod
+    def get_budget(model=None):
+        """
+        Get the prompt token budget for a model.
+
+        Args:
+            model: OpenRouter model name (default: the currently selected model)
+
+        Returns:
+            Maximum number of input tokens for the assembled prompt
+        """
+        model = model or app_config.OPENROUTER_MODEL
+        return PROMPT_TOKEN_BUDGETS.get(model, DEFAULT_PROMPT_TOKEN_BUDGET)
+
+    def persona_tokens(self):
+        """Tokens in the static system prompt (computed once)."""
+        if self._persona_tokens is None:
+            self._persona_tokens = self.token_counter.count(self.get_system_prompt())
+        return self._persona_tokens
+
+    def _fit_data(self, data_result, budget):
+        """Largest data section, by number of result rows, that fits the budget."""
+        if not data_result:
+            return "", 0
+
+        section = self.format_data_context(data_result, None)
+        tokens = self.token_counter.count(section)
+        if tokens <= budget:
+            return section, tokens
+
+        # Binary search on the number of rows kept
+        low, high = 0, len(data_result.get("results") or [])
+        best = None
+        while low <= high:
+            rows = (low + high) // 2
+            candidate = self.format_data_context(data_result, rows)
+            candidate_tokens = self.token_counter.count(candidate)
+            if candidate_tokens <= budget:
+                best = (candidate, candidate_tokens)
+                low = rows + 1
+            else:
+                high = rows - 1
+
+        # Even zero rows does not fit: send the query summary anyway rather than dropping it
+        if best is None:
+            section = self.format_data_context(data_result, 0)
+            best = (section, self.token_counter.count(section))
+        return best
+
+    def _fit_lines(self, lines, budget):
+        """Keep whole lines, in order, while they fit the budget."""
+        kept, used = [], 0
+        for line in lines:
+            tokens = self.token_counter.count(line + "\n")
+            if used + tokens > budget:
+                break
+            kept.append(line)
+            used += tokens
+        return kept, used
+
+    def assemble(self, user_message, data_result, user_memories, companion_memories, history, model=None, summary=""):
+        """
+        Assemble the prompt inputs for one LLM call within the model's budget.
+
+        Args:
+            user_message: The user's message
+            data_result: Successful data analysis result, or None
+            user_memories: Newline-separated user memories, most relevant first
+            companion_memories: Newline-separated companion memories, most relevant first
+            history: List of {"role", "content"} messages, oldest first
+            model: OpenRouter model name (default: the currently selected model)
+            summary: Rolling summary of the conversation before history ("" if none)
+
+        Returns:
+            Dictionary with enhanced_message, user_memories, companion_memories,
+            conversation_messages (the summary as a system message, then the kept
+            history, oldest first) and prompt_tokens (per-section counts and budget)
+        """
+        budget = self.get_budget(model)
+        persona = self.persona_tokens()
+        message = self.token_counter.count(user_message)
+        remaining = max(budget - persona - message, 0)
+
+        data_context, data_tokens = self._fit_data(data_result, remaining)
+        remaining = max(remaining - data_tokens, 0)
+
+        user_lines = [line for line in (user_memories or "").split("\n") if line.strip()]
+        companion_lines = [line for line in (companion_memories or "").split("\n") if line.strip()]
+        kept_user, user_tokens = self._fit_lines(user_lines, remaining)
+        remaining -= user_tokens
+        kept_companion, companion_tokens = self._fit_lines(companion_lines, remaining)
+        remaining -= companion_tokens
+
+        # Walk history newest first, then restore chronological order
+        history_lines = [f"{msg['role']}: {msg['content']}" for msg in reversed(history or [])]
+        kept_history, history_tokens = self._fit_lines(history_lines, remaining)
+        kept_history.reverse()
+        remaining -= history_tokens
+
+        # The summary stands in for messages older than the history window
+        summary_text = f"Summary of earlier conversation:\n{summary}" if summary else ""
+        summary_tokens = self.token_counter.count(summary_text)
+        if summary_tokens > remaining:
+            summary_text, summary_tokens = "", 0
+
+        # The kept lines are the newest messages; send them as chat messages
+        conversation_messages = [{"role": "system", "content": summary_text}] if summary_text else []
+        conversation_messages += [{"role": msg["role"], "content": msg["content"]}
+                                  for msg in (history or [])[len(history_lines) - len(kept_history):]]
+
+        prompt_tokens = {
+            "persona": persona,
+            "message": message,
+            "data": data_tokens,
+            "memories": user_tokens + companion_tokens,
+            "history": history_tokens,
+            "summary": summary_tokens,
+            "budget": budget,
+            "memories_dropped": len(user_lines) + len(companion_lines) - len(kept_user) - len(kept_companion),
+            "history_dropped": len(history_lines) - len(kept_history),
+            "summary_dropped": bool(summary) and not summary_text
+        }
+        prompt_tokens["total"] = (persona + message + data_tokens + user_tokens + companion_tokens
+                                  + history_tokens + summary_tokens)
+
+        return {
+            "enhanced_message": user_message + data_context,
+            "user_memories": "\n".join(kept_user),
+            "companion_memories": "\n".join(kept_companion),
+            "conversation_messages": conversation_messages,
+            "prompt_tokens": prompt_tokens
+        }
+
+    @staticmethod
+    def describe(prompt_tokens):
+        """
+        Format per-section token counts for the trace.
+
+        Args:
+            prompt_tokens: The prompt_tokens dictionary returned by assemble()
+
+        Returns:
+            One-line summary string
+        """
+        summary = (f"persona={prompt_tokens['persona']} message={prompt_tokens['message']} "
+                   f"data={prompt_tokens['data']} memories={prompt_tokens['memories']} "
+                   f"history={prompt_tokens['history']} summary={prompt_tokens.get('summary', 0)} total={prompt_tokens['total']}/{prompt_tokens['budget']}")
+        dropped = []
+        if prompt_tokens["memories_dropped"]:
+            dropped.append(f"{prompt_tokens['memories_dropped']} memories")
+        if prompt_tokens["history_dropped"]:
+            dropped.append(f"{prompt_tokens['history_dropped']} history messages")
+        if prompt_tokens.get("summary_dropped"):
+            dropped.append("the conversation summary")
+        if dropped:
+            summary += f" (dropped {', '.join(dropped)})"
+        return summary
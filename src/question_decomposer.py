@@ -0,0 +1,279 @@
+"""
+Decomposition of compound data questions into concurrent sub-queries.
+
+A question such as the Warm Start briefing asks for several unrelated results
+("milestones and business risks ... and revenue for the last quarter"). Sent to
+Vanna as one question it becomes one large statement that is generated and run
+serially and is often wrong. This stage sits in front of
+VannaToolWrapper.snowflake_query:
+
+1. Questions that look compound (a conjunction or list separator and enough
+   words) are split by a small, fast model into independent sub-questions.
+   Splits are remembered per process.
+2. Each sub-question goes through the answer cache and, on a miss, its own
+   snowflake_query call. The calls run concurrently on a dedicated pool, so the
+   wall time is bounded by the slowest sub-query (and the SQL admission limit).
+3. The sub-results are merged into one result dictionary in the
+   snowflake_query format. Rows are labelled with the sub-question they answer,
+   the SQL is concatenated with a comment per sub-question, and the individual
+   results are kept under "sub_results". When every part succeeds the merged
+   result is cached under the compound question as well.
+"""
+import sys
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait as wait_for_futures
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import (
+    QUESTION_DECOMPOSITION_ENABLED,
+    QUESTION_DECOMPOSITION_MAX_PARTS,
+    QUESTION_DECOMPOSITION_MIN_WORDS,
+    QUESTION_DECOMPOSITION_WORKERS,
+    QUESTION_DECOMPOSITION_CACHE_SIZE
+)
+from src.llm_api import LlmApi
+from src.answer_cache import AnswerCache
+from src import tracing
+from src import cancellation
+
+# Conjunctions and separators that can join independent requests in one question
+COMPOUND_MARKERS = re.compile(r"\b(?:and|as well as|also|plus|along with|together with)\b|[;,]", re.IGNORECASE)
+
+# Column added to merged rows naming the sub-question they answer
+SUB_QUESTION_COLUMN = "SUB_QUESTION"
+
+
+class QuestionDecomposer:
+    """Splits compound questions and runs their sub-queries concurrently."""
+
+    def __init__(
+        self,
+        llm_api=None,
+        max_parts=QUESTION_DECOMPOSITION_MAX_PARTS,
+        min_words=QUESTION_DECOMPOSITION_MIN_WORDS,
+        workers=QUESTION_DECOMPOSITION_WORKERS,
+        cache_size=QUESTION_DECOMPOSITION_CACHE_SIZE,
+        enabled=QUESTION_DECOMPOSITION_ENABLED
+    ):
+        """
+        Initialize the decomposer.
+
+        Args:
+            llm_api: LlmApi used to split questions (default: a new instance)
+            max_parts: Maximum number of sub-questions per question
+            min_words: Questions with fewer words are never decomposed
+            workers: Threads running sub-queries
+            cache_size: Number of decompositions remembered
+            enabled: If False, every question is queried as a whole
+        """
+        self.llm_api = llm_api or LlmApi()
+        self.max_parts = max_parts
+        self.min_words = min_words
+        self.cache_size = cache_size
+        self.enabled = enabled
+
+        # Sub-queries get their own pool: callers already run on the pipeline executor,
+        # and waiting there for work queued behind them could deadlock it
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="subquery")
+        self._decompositions = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"questions": 0, "decomposed": 0, "sub_queries": 0, "split_cache_hits": 0, "split_errors": 0}
+
+    def looks_compound(self, question):
+        """
+        Cheap pre-check for questions that may ask for several independent results.
+
+        Args:
+            question: The user's question
+
+        Returns:
+            True if the question is worth sending to the decomposition model
+        """
+        return len(question.split()) >= self.min_words and bool(COMPOUND_MARKERS.search(question))
+
+    def decompose(self, question):
+        """
+        Split a question into independent sub-questions.
+
+        Args:
+            question: The user's question
+
+        Returns:
+            List of sub-questions; [question] if it does not split or cannot be split
+        """
+        if not self.enabled or not self.looks_compound(question):
+            return [question]
+
+        key = AnswerCache.normalize_question(question)
+        with self._lock:
+            if key in self._decompositions:
+                self._decompositions.move_to_end(key)
+                self.stats["split_cache_hits"] += 1
+                return list(self._decompositions[key])
+
+        with tracing.span("decompose") as span:
+            try:
+                sub_questions = self.llm_api.decompose_question(question, self.max_parts)
+            except Exception as e:
+                print(f"⚠️ Decomposer: could not split question, querying it whole: {e}")
+                with self._lock:
+                    self.stats["split_errors"] += 1
+                return [question]
+            span.set(parts=len(sub_questions))
+
+        # No data part at all: let the whole question fail or succeed as before
+        if not sub_questions:
+            sub_questions = [question]
+
+        with self._lock:
+            self._decompositions[key] = sub_questions
+            while len(self._decompositions) > self.cache_size:
+                self._decompositions.popitem(last=False)
+        return list(sub_questions)
+
+    def query(self, question, cache, wrapper, max_results=100):
+        """
+        Answer a data question, running the sub-queries of a compound question concurrently.
+
+        Args:
+            question: The user's question
+            cache: AnswerCache consulted for the question and each sub-question
+            wrapper: VannaToolWrapper used for queries and table versions
+            max_results: Maximum number of rows per sub-query
+
+        Returns:
+            Result dictionary in the VannaToolWrapper.snowflake_query format; merged
+            results also carry "sub_results" and metadata["sub_questions"]
+        """
+        with self._lock:
+            self.stats["questions"] += 1
+        cached = cache.get_data(question, wrapper.get_table_versions)
+        if cached:
+            print(f"⚡ Answer cache: reusing query result for '{question[:60]}'")
+            return cached
+
+        sub_questions = self.decompose(question)
+        if len(sub_questions) == 1:
+            return cache.get_or_query_data(question, wrapper, max_results=max_results)
+
+        with self._lock:
+            self.stats["decomposed"] += 1
+            self.stats["sub_queries"] += len(sub_questions)
+        print(f"🧩 Decomposer: running {len(sub_questions)} sub-queries for '{question[:60]}'")
+
+        start_time = time.time()
+        futures = [
+            self._executor.submit(tracing.bind(cache.get_or_query_data), sub_question, wrapper, max_results)
+            for sub_question in sub_questions
+        ]
+        # Sub-queries already running stop through their own statement cancellation
+        cancel_token = cancellation.current_token()
+        with cancellation.on_cancel(cancel_token, lambda: [future.cancel() for future in futures]):
+            wait_for_futures(futures)
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+
+        sub_results = []
+        for sub_question, future in zip(sub_questions, futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"success": False, "question": sub_question, "error": str(e)}
+            if not isinstance(result, dict):
+                result = {"success": False, "question": sub_question, "error": f"Unexpected result type: {type(result)}"}
+            sub_results.append({**result, "question": sub_question})
+
+        merged = self._merge(question, sub_results, int((time.time() - start_time) * 1000))
+        if merged["success"] and not merged["metadata"]["failed_sub_questions"]:
+            tables = merged["metadata"]["tables_used"]
+            try:
+                cache.put_data(question, merged, wrapper.get_table_versions(tables))
+            except Exception as e:
+                print(f"⚠️ Answer cache: not caching merged result, table versions unavailable: {e}")
+        return merged
+
+    @staticmethod
+    def _merge(question, sub_results, execution_time_ms):
+        """
+        Merge sub-query results into one labelled result.
+
+        Args:
+            question: The compound question
+            sub_results: Result dictionaries, one per sub-question, in order
+            execution_time_ms: Wall time of the concurrent sub-queries
+
+        Returns:
+            Result dictionary in the VannaToolWrapper.snowflake_query format
+        """
+        succeeded = [r for r in sub_results if r.get("success")]
+        failed = [r for r in sub_results if not r.get("success")]
+        if not succeeded:
+            return {
+                "success": False,
+                "question": question,
+                "error": "; ".join(f"{r['question']}: {r.get('error', 'Unknown error')}" for r in failed),
+                "execution_time_ms": execution_time_ms,
+                "sub_results": sub_results
+            }
+
+        tables = []
+        rows = []
+        sql_sections = []
+        for result in succeeded:
+            for table in (result.get("metadata") or {}).get("tables_used", []):
+                if table not in tables:
+                    tables.append(table)
+            rows.extend({SUB_QUESTION_COLUMN: result["question"], **row} for row in result.get("results") or [])
+            sql_sections.append(f"-- {result['question']}\n{result.get('sql', '')}")
+
+        return {
+            "success": True,
+            "question": question,
+            "sql": "\n\n".join(sql_sections),
+            "results": rows,
+            "row_count": len(rows),
+            "execution_time_ms": execution_time_ms,
+            "sub_results": succeeded,
+            "metadata": {
+                "tables_used": tables,
+                "decomposed": True,
+                "sub_questions": [r["question"] for r in sub_results],
+                "failed_sub_questions": [
+                    {"question": r["question"], "error": r.get("error", "Unknown error")} for r in failed
+                ],
+                "has_more_results": any((r.get("metadata") or {}).get("has_more_results") for r in succeeded)
+            }
+        }
+
+    def get_stats(self):
+        """
+        Report how many questions were decomposed.
+
+        Returns:
+            Dictionary of decomposition statistics
+        """
+        with self._lock:
+            return {"enabled": self.enabled, "remembered_splits": len(self._decompositions), **self.stats}
+
+
+_decomposer = None
+_decomposer_lock = threading.Lock()
+
+
+def get_question_decomposer():
+    """
+    Get the process-wide question decomposer.
+
+    Returns:
+        The shared QuestionDecomposer instance
+    """
+    global _decomposer
+    if _decomposer is None:
+        with _decomposer_lock:
+            if _decomposer is None:
+                _decomposer = QuestionDecomposer()
+    return _decomposer
@@ -0,0 +1,377 @@
+"""
+Process-wide client-side rate limiting of OpenRouter calls.
+
+LlmApi used to send every call at once and surface OpenRouter's 429 responses
+as errors, so a burst of concurrent users turned into failed answers. Every
+call now reserves one request and its estimated tokens from two shared token
+buckets (LLM_RATE_LIMIT_RPM requests and LLM_RATE_LIMIT_TPM tokens per minute)
+and waits until the reservation is covered. Reservations are granted in
+arrival order, so waiting calls form a queue; a call whose wait would exceed
+its deadline fails at once with RateLimitExceeded instead of waiting in vain.
+
+The server's view wins over the local estimate: a 429 pauses new calls for its
+Retry-After (and the call is retried), and X-RateLimit-* headers reporting no
+remaining requests or tokens pause calls until the reported reset. Token
+reservations are settled against the usage the response reports.
+"""
+import sys
+import os
+import re
+import json
+import time
+import asyncio
+import threading
+import email.utils
+from collections import Counter, deque
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import (
+    LLM_RATE_LIMIT_ENABLED,
+    LLM_RATE_LIMIT_RPM,
+    LLM_RATE_LIMIT_TPM,
+    LLM_RATE_LIMIT_MAX_WAIT,
+    LLM_RATE_LIMIT_DEFAULT_RETRY_AFTER,
+    SCHEDULER_METRICS_WINDOW
+)
+from src.cancellation import RequestCancelled, on_cancel
+
+# Durations such as "1m30s" or "250ms" in x-ratelimit-reset-* headers
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a call cannot be sent within its deadline."""
+
+
+class _TokenBucket:
+    """A bucket refilled continuously at per_minute / 60 per second; reservations may take it below zero."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount):
+        """Seconds until amount is covered, given the level at the last refill."""
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def give(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class LlmRateLimiter:
+    """Shared request and token buckets that pace OpenRouter calls and follow the server's rate-limit signals."""
+
+    def __init__(self, requests_per_minute=LLM_RATE_LIMIT_RPM, tokens_per_minute=LLM_RATE_LIMIT_TPM,
+                 max_wait=LLM_RATE_LIMIT_MAX_WAIT, default_retry_after=LLM_RATE_LIMIT_DEFAULT_RETRY_AFTER,
+                 enabled=LLM_RATE_LIMIT_ENABLED, metrics_window=SCHEDULER_METRICS_WINDOW):
+        """
+        Initialize the limiter with full buckets.
+
+        Args:
+            requests_per_minute: Calls allowed per minute
+            tokens_per_minute: Prompt plus completion tokens allowed per minute
+            max_wait: Default seconds a call may wait for headroom
+            default_retry_after: Seconds to pause after a 429 without a Retry-After header
+            enabled: If False, calls are never delayed and 429s are not retried
+            metrics_window: Recent wait-time samples kept
+        """
+        self.requests = _TokenBucket(requests_per_minute)
+        self.tokens = _TokenBucket(tokens_per_minute)
+        self.max_wait = max_wait
+        self.default_retry_after = default_retry_after
+        self.enabled = enabled
+        self._paused_until = 0.0  # monotonic time before which no call is sent
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.stats = Counter()
+        self.wait_times = deque(maxlen=metrics_window)
+
+    @staticmethod
+    def estimate_tokens(payload):
+        """
+        Estimate the tokens a call will use: its prompt (characters / 4) plus its completion limit.
+
+        Args:
+            payload: Chat completion request payload
+
+        Returns:
+            Estimated token count
+        """
+        return len(json.dumps(payload.get("messages", []))) // 4 + (payload.get("max_tokens") or 0)
+
+    def _reserve(self, payload, max_wait):
+        """Debit one request and the payload's estimated tokens, returning when the call may be sent."""
+        tokens = self.estimate_tokens(payload)
+        max_wait = self.max_wait if max_wait is None else max_wait
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            delay = max(self.requests.delay(1), self.tokens.delay(tokens), self._paused_until - now)
+            if delay > max_wait:
+                self.stats["rejected"] += 1
+                raise RateLimitExceeded(
+                    f"The AI service is at its rate limit; a response would take more than {max_wait:.0f}s to start. "
+                    "Please try again shortly."
+                )
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.stats["requests"] += 1
+            if delay > 0:
+                self.stats["delayed"] += 1
+            self.wait_times.append(delay)
+        return {"tokens": tokens, "delay": delay}
+
+    def acquire(self, payload, cancel_token=None, max_wait=None):
+        """
+        Wait until a call may be sent.
+
+        Args:
+            payload: Chat completion request payload (sized with estimate_tokens)
+            cancel_token: CancellationToken that ends the wait
+            max_wait: Seconds the call may wait (default: the limiter's max_wait)
+
+        Returns:
+            Reservation to pass to settle() once the call's usage is known
+
+        Raises:
+            RateLimitExceeded: If the wait would exceed max_wait
+            RequestCancelled: If the token is cancelled while waiting
+        """
+        if not self.enabled:
+            return None
+        reservation = self._reserve(payload, max_wait)
+        if reservation["delay"] > 0:
+            woken = threading.Event()
+            self._count_waiting(1)
+            try:
+                with on_cancel(cancel_token, woken.set):
+                    woken.wait(reservation["delay"])
+            except BaseException:
+                self.release(reservation)
+                raise
+            finally:
+                self._count_waiting(-1)
+            if cancel_token is not None and cancel_token.cancelled:
+                self.release(reservation)
+                raise RequestCancelled(cancel_token.reason)
+        return reservation
+
+    async def acquire_async(self, payload, cancel_token=None, max_wait=None):
+        """
+        Wait, without blocking the event loop, until a call may be sent.
+
+        Args:
+            payload: Chat completion request payload (sized with estimate_tokens)
+            cancel_token: CancellationToken that ends the wait
+            max_wait: Seconds the call may wait (default: the limiter's max_wait)
+
+        Returns:
+            Reservation to pass to settle() once the call's usage is known
+
+        Raises:
+            RateLimitExceeded: If the wait would exceed max_wait
+            RequestCancelled: If the token is cancelled while waiting
+        """
+        if not self.enabled:
+            return None
+        reservation = self._reserve(payload, max_wait)
+        if reservation["delay"] > 0:
+            loop = asyncio.get_running_loop()
+            woken = loop.create_future()
+
+            def wake():
+                loop.call_soon_threadsafe(lambda: woken.done() or woken.set_result(None))
+
+            self._count_waiting(1)
+            try:
+                with on_cancel(cancel_token, wake):
+                    await asyncio.wait({woken}, timeout=reservation["delay"])
+            except BaseException:
+                self.release(reservation)
+                raise
+            finally:
+                self._count_waiting(-1)
+            if cancel_token is not None and cancel_token.cancelled:
+                self.release(reservation)
+                raise RequestCancelled(cancel_token.reason)
+        return reservation
+
+    def _count_waiting(self, amount):
+        with self._lock:
+            self.waiting += amount
+
+    def release(self, reservation):
+        """
+        Return a reservation whose call was never sent or never answered.
+
+        Args:
+            reservation: Reservation returned by acquire()
+        """
+        if reservation is None:
+            return
+        with self._lock:
+            self.requests.give(1)
+            self.tokens.give(reservation["tokens"])
+
+    def settle(self, reservation, usage):
+        """
+        Correct a reservation's token estimate with the usage the response reported.
+
+        Args:
+            reservation: Reservation returned by acquire()
+            usage: The response's "usage" dictionary, or None for a call that used no tokens
+        """
+        if reservation is None:
+            return
+        usage = usage or {}
+        used = (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+        with self._lock:
+            if used > reservation["tokens"]:
+                self.tokens.take(used - reservation["tokens"])
+            else:
+                self.tokens.give(reservation["tokens"] - used)
+        reservation["tokens"] = used
+        reservation["settled"] = True
+
+    @staticmethod
+    def _parse_seconds(value):
+        """
+        Parse a Retry-After or rate-limit reset header into seconds from now.
+
+        Accepts seconds, an HTTP date, a Unix timestamp in seconds or milliseconds,
+        or a duration such as "1m30s".
+        """
+        if value is None:
+            return None
+        value = value.strip()
+        try:
+            number = float(value)
+        except ValueError:
+            parts = _DURATION_PART.findall(value)
+            if parts and "".join(f"{n}{u}" for n, u in parts) == value:
+                return sum(float(n) * _DURATION_SECONDS[u] for n, u in parts)
+            try:
+                return email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        if number > 1e12:  # Unix time in milliseconds (OpenRouter's X-RateLimit-Reset)
+            return number / 1000 - time.time()
+        if number > 1e9:  # Unix time in seconds
+            return number - time.time()
+        return number
+
+    def _pause(self, seconds):
+        """Hold every new call back for at least the given number of seconds (call with the lock held)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + max(0.0, seconds))
+
+    def observe(self, status_code, headers):
+        """
+        Apply a response's rate-limit signals.
+
+        Args:
+            status_code: HTTP status of the response
+            headers: Response headers
+
+        Returns:
+            True if the call was rate limited (429) and should be retried
+        """
+        if not self.enabled:
+            return False
+        with self._lock:
+            for kind, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if kind == "requests":
+                    remaining = remaining if remaining is not None else headers.get("x-ratelimit-remaining")
+                if remaining is None:
+                    continue
+                try:
+                    remaining = float(remaining)
+                except ValueError:
+                    continue
+                bucket.level = min(bucket.level, remaining)
+                if remaining <= 0:
+                    reset = self._parse_seconds(headers.get(f"x-ratelimit-reset-{kind}")
+                                                or headers.get("x-ratelimit-reset"))
+                    self._pause(reset if reset is not None else self.default_retry_after)
+
+            if status_code != 429:
+                return False
+            self.stats["rate_limited"] += 1
+            retry_after = self._parse_seconds(headers.get("retry-after"))
+            self._pause(retry_after if retry_after is not None else self.default_retry_after)
+        print(f"⏳ OpenRouter rate limited the call (429), pausing new calls for "
+              f"{retry_after if retry_after is not None else self.default_retry_after:.1f}s")
+        return True
+
+    def record_retry(self):
+        """Count a call retried after a 429."""
+        with self._lock:
+            self.stats["retries"] += 1
+
+    @staticmethod
+    def _percentile(samples, fraction):
+        """Nearest-rank percentile of a sorted list, in milliseconds."""
+        if not samples:
+            return 0.0
+        index = min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))
+        return round(samples[index] * 1000, 2)
+
+    def get_stats(self):
+        """
+        Report the limits, current headroom and how often calls waited or were rate limited.
+
+        Returns:
+            Dictionary with the configured limits, the fraction of each bucket currently
+            available (headroom is the smaller one), calls waiting now, p50/p95 wait time
+            in milliseconds and counts of delayed, rejected, rate-limited and retried calls
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            request_headroom = max(0.0, self.requests.level) / self.requests.capacity
+            token_headroom = max(0.0, self.tokens.level) / self.tokens.capacity
+            waits = sorted(self.wait_times)
+            return {
+                "enabled": self.enabled,
+                "requests_per_minute": self.requests.capacity,
+                "tokens_per_minute": self.tokens.capacity,
+                "request_headroom": round(request_headroom, 3),
+                "token_headroom": round(token_headroom, 3),
+                "headroom": round(min(request_headroom, token_headroom), 3),
+                "paused_for_s": round(max(0.0, self._paused_until - now), 2),
+                "waiting": self.waiting,
+                "wait_ms_p50": self._percentile(waits, 0.50),
+                "wait_ms_p95": self._percentile(waits, 0.95),
+                **{key: self.stats[key] for key in ("requests", "delayed", "rejected", "rate_limited", "retries")}
+            }
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_llm_rate_limiter():
+    """
+    Get the process-wide OpenRouter rate limiter.
+
+    Returns:
+        The shared LlmRateLimiter instance
+    """
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = LlmRateLimiter()
+    return _rate_limiter
@@ -0,0 +1,310 @@
+"""
+Process-wide registry of heavy clients shared by every session.
+
+Each Streamlit session builds its own Companion, but the Vanna/Snowflake query
+stack, the Chroma client over data/chroma_db, the local replica of the schema
+(one refresh thread over data/replica), the Snowflake connection used for
+conversation history and the Mem0 client are built once per process here and
+borrowed by sessions with acquire()/release().
+
+Borrows are reference counted. A resource is health-checked when it is borrowed
+(at most once per check interval); an unhealthy resource is replaced for new
+borrowers and the old instance is closed when its last borrower releases it.
+"""
+import sys
+import os
+import time
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import RESOURCE_HEALTH_CHECK_INTERVAL
+
+# Resource names
+VANNA = "vanna"
+CHROMA = "chroma"
+REPLICA = "replica"
+SNOWFLAKE_MEMORY = "snowflake_memory"
+MEM0 = "mem0"
+
+
+class ResourceRegistry:
+    """Owns shared clients, counting borrows and replacing unhealthy instances."""
+
+    def __init__(self, health_check_interval=RESOURCE_HEALTH_CHECK_INTERVAL):
+        """
+        Initialize an empty registry.
+
+        Args:
+            health_check_interval: Minimum seconds between health checks of one resource
+        """
+        self.health_check_interval = health_check_interval
+        self._resources = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory, health_check=None, close=None):
+        """
+        Register how to build, check and close a resource. Nothing is built until first use.
+
+        Args:
+            name: Resource name
+            factory: Callable returning a new instance
+            health_check: Callable(instance) returning True if the instance is usable
+            close: Callable(instance) that releases the instance's connections
+        """
+        with self._lock:
+            self._resources[name] = {
+                "factory": factory,
+                "health_check": health_check,
+                "close": close,
+                "lock": threading.Lock(),
+                "current": None,
+                "retired": [],
+                "stats": {"created": 0, "replaced": 0, "failed_checks": 0, "acquires": 0}
+            }
+
+    def _get(self, name):
+        """Look up a registered resource."""
+        with self._lock:
+            resource = self._resources.get(name)
+        if resource is None:
+            raise KeyError(f"Unknown resource '{name}'")
+        return resource
+
+    def _is_healthy(self, name, resource, entry):
+        """Run the health check if it is due (resource lock held)."""
+        if resource["health_check"] is None:
+            return True
+        now = time.time()
+        if now - entry["checked_at"] < self.health_check_interval:
+            return entry["healthy"]
+        try:
+            entry["healthy"] = bool(resource["health_check"](entry["instance"]))
+        except Exception as e:
+            print(f"⚠️ Registry: health check for '{name}' raised: {e}")
+            entry["healthy"] = False
+        entry["checked_at"] = now
+        if not entry["healthy"]:
+            resource["stats"]["failed_checks"] += 1
+        return entry["healthy"]
+
+    def acquire(self, name):
+        """
+        Borrow a shared resource, building it on first use.
+
+        Args:
+            name: Resource name
+
+        Returns:
+            The shared instance; pass it back to release() when done
+
+        Raises:
+            Exception: Whatever the factory raises if the resource cannot be built
+        """
+        resource = self._get(name)
+        with resource["lock"]:
+            entry = resource["current"]
+            if entry is not None and not self._is_healthy(name, resource, entry):
+                print(f"🔄 Registry: '{name}' failed its health check, replacing it")
+                resource["current"] = None
+                resource["stats"]["replaced"] += 1
+                if entry["refs"] > 0:
+                    resource["retired"].append(entry)
+                else:
+                    self._close(name, resource, entry)
+                entry = None
+
+            if entry is None:
+                instance = resource["factory"]()
+                entry = {"instance": instance, "refs": 0, "created_at": time.time(),
+                         "checked_at": time.time(), "healthy": True}
+                resource["current"] = entry
+                resource["stats"]["created"] += 1
+                print(f"✅ Registry: created shared '{name}'")
+
+            entry["refs"] += 1
+            resource["stats"]["acquires"] += 1
+            return entry["instance"]
+
+    def release(self, name, instance):
+        """
+        Return a borrowed resource. Shared instances stay open for the next borrower;
+        a replaced instance is closed once its last borrower releases it.
+
+        Args:
+            name: Resource name
+            instance: The instance returned by acquire()
+        """
+        resource = self._get(name)
+        with resource["lock"]:
+            entries = [resource["current"]] + resource["retired"]
+            for entry in entries:
+                if entry is not None and entry["instance"] is instance:
+                    entry["refs"] = max(entry["refs"] - 1, 0)
+                    if entry is not resource["current"] and entry["refs"] == 0:
+                        resource["retired"].remove(entry)
+                        self._close(name, resource, entry)
+                    return
+
+    def _close(self, name, resource, entry):
+        """Close one instance (resource lock held)."""
+        if resource["close"] is None:
+            return
+        try:
+            resource["close"](entry["instance"])
+            print(f"🔚 Registry: closed '{name}'")
+        except Exception as e:
+            print(f"⚠️ Registry: error closing '{name}': {e}")
+
+    def close_idle(self):
+        """
+        Close every resource that no session is borrowing.
+
+        Returns:
+            Number of instances closed
+        """
+        closed = 0
+        with self._lock:
+            resources = list(self._resources.items())
+        for name, resource in resources:
+            with resource["lock"]:
+                entry = resource["current"]
+                if entry is not None and entry["refs"] == 0:
+                    resource["current"] = None
+                    self._close(name, resource, entry)
+                    closed += 1
+        return closed
+
+    def get_stats(self):
+        """
+        Report each resource's borrow count, age and health.
+
+        Returns:
+            Dictionary keyed by resource name
+        """
+        with self._lock:
+            resources = list(self._resources.items())
+        stats = {}
+        for name, resource in resources:
+            with resource["lock"]:
+                entry = resource["current"]
+                stats[name] = {
+                    "active": entry is not None,
+                    "refs": entry["refs"] if entry else 0,
+                    "age_seconds": round(time.time() - entry["created_at"], 1) if entry else None,
+                    "healthy": entry["healthy"] if entry else None,
+                    "retired_in_use": len(resource["retired"]),
+                    **resource["stats"]
+                }
+        return stats
+
+
+def _create_vanna():
+    """Build the Vanna/Snowflake query stack over the shared Chroma client and local replica."""
+    from src.vanna_scripts.vanna_tool_wrapper import VannaToolWrapper
+    import config
+    registry = get_resource_registry()
+    chroma_client = registry.acquire(CHROMA)
+    replica = None
+    if config.REPLICA_ENABLED:
+        try:
+            replica = registry.acquire(REPLICA)
+        except Exception as e:
+            print(f"⚠️ Registry: local replica unavailable, all queries go to Snowflake: {e}")
+    try:
+        return VannaToolWrapper(chroma_client=chroma_client, replica=replica)
+    except Exception:
+        registry.release(CHROMA, chroma_client)
+        if replica is not None:
+            registry.release(REPLICA, replica)
+        raise
+
+
+def _check_vanna(wrapper):
+    """The query stack is usable if Vanna is initialized and Snowflake answers (reconnecting if needed)."""
+    connection = wrapper.vanna.snowflake_connection
+    if wrapper.vanna.vanna_ai is None or connection is None:
+        return False
+    if not connection.is_connection_active():
+        connection.reconnect()
+    return connection.is_connection_active()
+
+
+def _close_vanna(wrapper):
+    """Close the query stack's Snowflake connection and return its Chroma client and replica."""
+    chroma_client = wrapper.chroma_client
+    wrapper.close()
+    if chroma_client is not None:
+        get_resource_registry().release(CHROMA, chroma_client)
+    if wrapper.replica is not None:
+        get_resource_registry().release(REPLICA, wrapper.replica)
+
+
+def _create_chroma():
+    """Open the Chroma store shared by Vanna and the data-intent router."""
+    import chromadb
+    from config import CHROMA_PERSISTENCE_DIRECTORY
+    return chromadb.PersistentClient(path=CHROMA_PERSISTENCE_DIRECTORY)
+
+
+def _create_replica():
+    """Open the local replica of the Vanna schema over its own Snowflake connection and start refreshing it."""
+    from config import SNOWFLAKE_DATABASE, SNOWFLAKE_SCHEMA
+    from src.vanna_scripts import local_replica
+    from src.vanna_scripts.vanna_snowflake import create_snowflake_connection
+    connection = create_snowflake_connection()
+    try:
+        replica = local_replica.LocalReplica(connection, SNOWFLAKE_DATABASE, SNOWFLAKE_SCHEMA)
+    except Exception:
+        connection.close()
+        raise
+    replica.start()
+    return replica
+
+
+def _close_replica(replica):
+    """Stop the replica's refresh thread and close its Snowflake connection (snapshots stay on disk)."""
+    replica.close()
+    replica.snowflake_connection.close()
+
+
+def _create_snowflake_memory():
+    """Build the connector used for conversation history and summaries."""
+    from src.vanna_scripts.snowflake_connector import SnowflakeConnector
+    return SnowflakeConnector()
+
+
+def _create_mem0():
+    """Build the Mem0 client (operating without long-term memory if Mem0 is unavailable)."""
+    from src.memory.long_term import LongTermMemory
+    return LongTermMemory(fail_on_error=False)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_resource_registry():
+    """
+    Get the process-wide resource registry, with the shared clients registered.
+
+    Returns:
+        The shared ResourceRegistry instance
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                registry = ResourceRegistry()
+                registry.register(VANNA, _create_vanna, health_check=_check_vanna, close=_close_vanna)
+                registry.register(CHROMA, _create_chroma, health_check=lambda client: client.heartbeat() > 0)
+                registry.register(REPLICA, _create_replica, close=_close_replica)
+                registry.register(
+                    SNOWFLAKE_MEMORY,
+                    _create_snowflake_memory,
+                    health_check=lambda connector: connector.get_connection() is not None,
+                    close=lambda connector: connector.close()
+                )
+                # An unavailable Mem0 client is rebuilt on a later borrow, so long-term memory recovers
+                registry.register(MEM0, _create_mem0, health_check=lambda memory: memory.is_operational)
+                _registry = registry
+    return _registry
@@ -0,0 +1,191 @@
+"""
+Compact, statistics-first encoding of SQL results for the LLM prompt.
+
+Rows are rendered as a CSV table (column names appear once instead of on every
+row) and preceded by summaries computed with pandas/NumPy: per-column
+min/max/mean, period-over-period deltas and trend direction when the result is
+a time series, and the top-k rows by the leading metric. Large results are sent
+as the summary alone.
+"""
+import sys
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import (
+    RESULT_SUMMARY_ONLY_ROWS,
+    RESULT_TOP_K_ROWS,
+    RESULT_TREND_FLAT_TOLERANCE
+)
+
+# Column-name words that mark a time period column (e.g. YEAR, ORDER_MONTH, FISCAL_QTR)
+PERIOD_NAME_WORDS = {"YEAR", "QUARTER", "QTR", "MONTH", "WEEK", "DAY", "DATE", "PERIOD", "FY"}
+
+
+def results_to_frame(results):
+    """
+    Convert query result rows to a DataFrame with numeric columns recognised.
+
+    Snowflake NUMBER columns arrive as Decimal objects, so object columns whose
+    values all parse as numbers are converted, to integers where every value is whole.
+
+    Args:
+        results: List of row dictionaries
+
+    Returns:
+        pandas DataFrame
+    """
+    frame = pd.DataFrame(results)
+    for column in frame.columns:
+        if frame[column].dtype == object:
+            converted = pd.to_numeric(frame[column], errors="coerce")
+            if converted.notna().sum() == frame[column].notna().sum() and converted.notna().any():
+                frame[column] = converted
+        if pd.api.types.is_float_dtype(frame[column]):
+            values = frame[column].dropna()
+            if len(values) and (values == values.round()).all():
+                frame[column] = frame[column].astype("Int64")
+    return frame
+
+
+def _format_number(value):
+    """Format a number compactly for the prompt."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return "n/a"
+    if float(value).is_integer():
+        return f"{int(value):,}"
+    return f"{value:,.2f}"
+
+
+def _format_period(values):
+    """Label a period from its column values, e.g. 2024-Q3."""
+    parts = []
+    for value in values:
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        parts.append(str(value))
+    return "-".join(parts)
+
+
+def _to_csv(frame):
+    """Render a DataFrame as CSV with floats rounded to two decimals."""
+    return frame.round(2).to_csv(index=False).strip()
+
+
+def _period_columns(frame):
+    """Columns that identify a time period: datetimes, or columns named like one."""
+    periods = []
+    for column in frame.columns:
+        words = set(re.split(r"[^A-Z0-9]+", str(column).upper()))
+        if pd.api.types.is_datetime64_any_dtype(frame[column]) or words & PERIOD_NAME_WORDS:
+            periods.append(column)
+    return periods
+
+
+def _trend_direction(values):
+    """Classify a series as up, down or flat from the slope of a least-squares fit."""
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) < 3:
+        return None
+    slope = np.polyfit(np.arange(len(values)), values, 1)[0]
+    scale = np.mean(np.abs(values)) or 1.0
+    if abs(slope) / scale < RESULT_TREND_FLAT_TOLERANCE:
+        return "flat"
+    return "up" if slope > 0 else "down"
+
+
+def summarize_results(frame, top_k=RESULT_TOP_K_ROWS):
+    """
+    Compute prompt-ready summaries of a result set.
+
+    Args:
+        frame: DataFrame from results_to_frame
+        top_k: Number of top rows to include (0 to leave them out)
+
+    Returns:
+        List of summary lines
+    """
+    numeric = [c for c in frame.columns if pd.api.types.is_numeric_dtype(frame[c])]
+    periods = _period_columns(frame)
+    metrics = [c for c in numeric if c not in periods]
+    lines = []
+
+    for column in metrics:
+        series = frame[column]
+        lines.append(
+            f"- {column}: min {_format_number(series.min())}, max {_format_number(series.max())}, "
+            f"mean {_format_number(series.mean())}, total {_format_number(series.sum())}"
+        )
+
+    # Period-over-period deltas and trend, when there is one row per period
+    if periods and metrics and len(frame) > 1 and not frame.duplicated(subset=periods).any():
+        ordered = frame.sort_values(periods).reset_index(drop=True)
+        last, previous = len(ordered) - 1, len(ordered) - 2
+        lines.append(f"- Period over period ({_format_period(ordered.loc[last, periods])} vs "
+                     f"{_format_period(ordered.loc[previous, periods])}, ordered by {', '.join(map(str, periods))}):")
+        for column in metrics:
+            current, prior = ordered.at[last, column], ordered.at[previous, column]
+            delta = current - prior
+            change = f" ({delta / abs(prior):+.1%})" if prior else ""
+            trend = _trend_direction(ordered[column])
+            trend_text = f"; trend {trend} over {len(ordered)} periods" if trend else ""
+            lines.append(f"  - {column}: {_format_number(current)} vs {_format_number(prior)}, "
+                         f"change {'+' if delta >= 0 else ''}{_format_number(delta)}{change}{trend_text}")
+
+    # Top rows by the leading metric
+    if top_k and metrics and len(frame) > top_k:
+        leader = metrics[0]
+        top_rows = frame.nlargest(top_k, leader)
+        lines.append(f"- Top {top_k} rows by {leader}:")
+        lines.append(_to_csv(top_rows))
+
+    return lines
+
+
+def encode_results(results, max_rows=None, summary_only_rows=RESULT_SUMMARY_ONLY_ROWS):
+    """
+    Encode query results as summaries plus a compact CSV table.
+
+    Args:
+        results: List of row dictionaries
+        max_rows: Maximum number of rows to include in the table (default: all)
+        summary_only_rows: Results with more rows than this are sent as summaries only
+
+    Returns:
+        Prompt text for the results
+    """
+    if not results:
+        return "(no rows returned)"
+
+    table_rows = len(results) if max_rows is None else min(max_rows, len(results))
+    if len(results) > summary_only_rows:
+        table_rows = 0
+
+    try:
+        frame = results_to_frame(results)
+        # Top rows only add information when the full table is not sent
+        summary = summarize_results(frame, top_k=RESULT_TOP_K_ROWS if table_rows < len(frame) else 0)
+    except Exception as e:
+        print(f"⚠️ Could not summarize results, sending rows only: {e}")
+        frame = pd.DataFrame(results)
+        summary = []
+
+    lines = [f"{len(frame)} rows; columns: {', '.join(map(str, frame.columns))}"]
+    if summary:
+        lines.append("Summary:")
+        lines.extend(summary)
+
+    if table_rows == 0:
+        lines.append(f"(Row-level table omitted; {len(frame)} rows summarized above)")
+    elif table_rows < len(frame):
+        lines.append(f"Table (CSV, first {table_rows} of {len(frame)} rows):")
+        lines.append(_to_csv(frame.head(table_rows)))
+    else:
+        lines.append("Table (CSV):")
+        lines.append(_to_csv(frame))
+
+    return "\n".join(lines)
@@ -0,0 +1,329 @@
+"""
+Process-wide admission control for calls to the LLM, SQL and memory backends.
+
+Every OpenRouter call, Vanna/Snowflake query and Mem0 operation takes a slot
+from its backend before it runs. Each backend admits a fixed number of
+concurrent calls; calls beyond that wait in a queue and are admitted:
+
+- interactive work (a user waiting on a turn) before background work (memory
+  writes, summaries, prewarming),
+- background work only up to its share of the backend's slots, so a burst of
+  background work always leaves slots free for interactive turns,
+- within a class, the user holding the fewest slots first (oldest call on ties),
+  so one busy session cannot starve the others.
+
+The work class and user of a call are taken from the caller's context (see
+work_context() and start_work()) unless they are passed explicitly. A call whose
+request is cancelled while it waits leaves the queue without running.
+"""
+import sys
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import (
+    SCHEDULER_BACKEND_LIMITS,
+    SCHEDULER_BACKGROUND_SHARE,
+    SCHEDULER_METRICS_WINDOW
+)
+from src import tracing
+from src import cancellation
+
+# Backends
+LLM = "llm"
+SQL = "sql"
+MEMORY = "memory"
+
+# Work classes
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+_work_class = contextvars.ContextVar("work_class", default=INTERACTIVE)
+_work_user = contextvars.ContextVar("work_user", default=None)
+
+
+def start_work(user_id, priority=INTERACTIVE):
+    """
+    Tag all backend calls made from this context (and bound executor calls) with a user and class.
+
+    Args:
+        user_id: The user the work is done for
+        priority: INTERACTIVE or BACKGROUND
+    """
+    _work_class.set(priority)
+    _work_user.set(user_id)
+
+
+@contextmanager
+def work_context(priority=None, user_id=None):
+    """
+    Tag the backend calls made inside a block with a work class and/or user.
+
+    Args:
+        priority: INTERACTIVE or BACKGROUND (default: unchanged)
+        user_id: The user the work is done for (default: unchanged)
+    """
+    class_token = _work_class.set(priority) if priority is not None else None
+    user_token = _work_user.set(user_id) if user_id is not None else None
+    try:
+        yield
+    finally:
+        if user_token is not None:
+            _work_user.reset(user_token)
+        if class_token is not None:
+            _work_class.reset(class_token)
+
+
+def as_background(func):
+    """
+    Wrap a callable so the backend calls it makes are admitted as background work.
+
+    Args:
+        func: Callable to run later, possibly in another thread
+
+    Returns:
+        Callable that runs func in a background work context
+    """
+    def run(*args, **kwargs):
+        with work_context(priority=BACKGROUND):
+            return func(*args, **kwargs)
+    return run
+
+
+class _LoopEvent:
+    """Admission signal for a coroutine: set() may be called from any thread."""
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+
+    def set(self):
+        self._loop.call_soon_threadsafe(self._event.set)
+
+    async def wait(self):
+        await self._event.wait()
+
+
+class AdmissionScheduler:
+    """Per-backend concurrency limits with priority classes and per-user fair share."""
+
+    def __init__(self, limits=SCHEDULER_BACKEND_LIMITS, background_share=SCHEDULER_BACKGROUND_SHARE,
+                 metrics_window=SCHEDULER_METRICS_WINDOW):
+        """
+        Initialize the scheduler.
+
+        Args:
+            limits: {backend: maximum concurrent calls}
+            background_share: Fraction of each backend's slots background work may hold
+            metrics_window: Number of recent queue-time samples kept per backend and class
+        """
+        self._backends = {}
+        for backend, limit in limits.items():
+            self._backends[backend] = {
+                "limit": limit,
+                "background_limit": max(1, int(limit * background_share)),
+                "lock": threading.Lock(),
+                "active": {INTERACTIVE: 0, BACKGROUND: 0},
+                "active_by_user": {},
+                "waiters": [],
+                "queue_times": {INTERACTIVE: deque(maxlen=metrics_window), BACKGROUND: deque(maxlen=metrics_window)},
+                "stats": {"admitted": 0, "queued": 0, "cancelled": 0}
+            }
+
+    def _next_waiter(self, state):
+        """Pick the waiter to admit next, or None if no waiter can be admitted (backend lock held)."""
+        if sum(state["active"].values()) >= state["limit"]:
+            return None
+        for priority in (INTERACTIVE, BACKGROUND):
+            if priority == BACKGROUND and state["active"][BACKGROUND] >= state["background_limit"]:
+                continue
+            candidates = [w for w in state["waiters"] if w["priority"] == priority]
+            if candidates:
+                return min(candidates, key=lambda w: (state["active_by_user"].get(w["user_id"], 0), w["enqueued_at"]))
+        return None
+
+    def _dispatch(self, state):
+        """Admit waiters while slots are free (backend lock held)."""
+        while True:
+            waiter = self._next_waiter(state)
+            if waiter is None:
+                return
+            state["waiters"].remove(waiter)
+            waiter["admitted"] = True
+            state["active"][waiter["priority"]] += 1
+            state["active_by_user"][waiter["user_id"]] = state["active_by_user"].get(waiter["user_id"], 0) + 1
+            state["stats"]["admitted"] += 1
+            waiter["event"].set()
+
+    def _release(self, state, waiter):
+        """Return an admitted call's slot and admit the next waiter (backend lock held)."""
+        state["active"][waiter["priority"]] -= 1
+        remaining = state["active_by_user"].get(waiter["user_id"], 1) - 1
+        if remaining > 0:
+            state["active_by_user"][waiter["user_id"]] = remaining
+        else:
+            state["active_by_user"].pop(waiter["user_id"], None)
+        self._dispatch(state)
+
+    def _enqueue(self, state, priority, user_id, event):
+        """Queue a call and admit it at once if a slot is free."""
+        waiter = {
+            "priority": priority or _work_class.get(),
+            "user_id": user_id or _work_user.get() or "anonymous",
+            "enqueued_at": time.time(),
+            "event": event,
+            "admitted": False
+        }
+        with state["lock"]:
+            state["waiters"].append(waiter)
+            self._dispatch(state)
+            if not waiter["admitted"]:
+                state["stats"]["queued"] += 1
+        return waiter
+
+    def _abandon(self, state, waiter):
+        """Give up a call that was cancelled while it waited, returning its slot if it was admitted meanwhile."""
+        with state["lock"]:
+            if waiter["admitted"]:
+                self._release(state, waiter)
+            else:
+                state["waiters"].remove(waiter)
+            state["stats"]["cancelled"] += 1
+
+    def _admitted(self, backend, state, waiter, cancel_token):
+        """Record the wait of a call whose event fired, or abandon it if its request was cancelled."""
+        admitted_at = time.time()
+
+        if cancel_token is not None and cancel_token.cancelled:
+            self._abandon(state, waiter)
+            cancel_token.raise_if_cancelled()
+
+        queue_time = admitted_at - waiter["enqueued_at"]
+        with state["lock"]:
+            state["queue_times"][waiter["priority"]].append(queue_time)
+        if queue_time >= 0.001:
+            trace = tracing.current_trace()
+            if trace is not None:
+                trace.record(f"queue.{backend}", waiter["enqueued_at"], admitted_at, priority=waiter["priority"])
+
+    @contextmanager
+    def slot(self, backend, priority=None, user_id=None, cancel_token=None):
+        """
+        Hold one of a backend's slots for the duration of a block, waiting for it if needed.
+
+        Args:
+            backend: LLM, SQL or MEMORY
+            priority: INTERACTIVE or BACKGROUND (default: the current work context)
+            user_id: User the call is made for (default: the current work context)
+            cancel_token: CancellationToken that abandons the wait (default: the current request's)
+
+        Raises:
+            RequestCancelled: If the request is cancelled before the call is admitted
+        """
+        state = self._backends[backend]
+        cancel_token = cancel_token or cancellation.current_token()
+        waiter = self._enqueue(state, priority, user_id, threading.Event())
+
+        with cancellation.on_cancel(cancel_token, waiter["event"].set):
+            waiter["event"].wait()
+        self._admitted(backend, state, waiter, cancel_token)
+
+        try:
+            yield
+        finally:
+            with state["lock"]:
+                self._release(state, waiter)
+
+    @asynccontextmanager
+    async def async_slot(self, backend, priority=None, user_id=None, cancel_token=None):
+        """
+        Coroutine version of slot(): waits for admission without blocking the event loop.
+
+        Args:
+            backend: LLM, SQL or MEMORY
+            priority: INTERACTIVE or BACKGROUND (default: the current work context)
+            user_id: User the call is made for (default: the current work context)
+            cancel_token: CancellationToken that abandons the wait (default: the current request's)
+
+        Raises:
+            RequestCancelled: If the request is cancelled before the call is admitted
+        """
+        state = self._backends[backend]
+        cancel_token = cancel_token or cancellation.current_token()
+        waiter = self._enqueue(state, priority, user_id, _LoopEvent())
+
+        try:
+            with cancellation.on_cancel(cancel_token, waiter["event"].set):
+                await waiter["event"].wait()
+        except asyncio.CancelledError:
+            self._abandon(state, waiter)
+            raise
+        self._admitted(backend, state, waiter, cancel_token)
+
+        try:
+            yield
+        finally:
+            with state["lock"]:
+                self._release(state, waiter)
+
+    @staticmethod
+    def _percentile(samples, fraction):
+        """Nearest-rank percentile of a sorted list, in milliseconds."""
+        if not samples:
+            return 0.0
+        index = min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))
+        return round(samples[index] * 1000, 2)
+
+    def get_stats(self):
+        """
+        Report each backend's load and queue times.
+
+        Returns:
+            Dictionary keyed by backend with active and waiting calls per class and
+            p50/p95/max queue time in milliseconds over the recent window
+        """
+        stats = {}
+        for backend, state in self._backends.items():
+            with state["lock"]:
+                classes = {}
+                for priority in (INTERACTIVE, BACKGROUND):
+                    samples = sorted(state["queue_times"][priority])
+                    classes[priority] = {
+                        "active": state["active"][priority],
+                        "waiting": sum(1 for w in state["waiters"] if w["priority"] == priority),
+                        "queue_ms_p50": self._percentile(samples, 0.50),
+                        "queue_ms_p95": self._percentile(samples, 0.95),
+                        "queue_ms_max": round(samples[-1] * 1000, 2) if samples else 0.0
+                    }
+                stats[backend] = {
+                    "limit": state["limit"],
+                    "background_limit": state["background_limit"],
+                    "users_active": len(state["active_by_user"]),
+                    **state["stats"],
+                    **classes
+                }
+        return stats
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """
+    Get the process-wide admission scheduler.
+
+    Returns:
+        The shared AdmissionScheduler instance
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = AdmissionScheduler()
+    return _scheduler
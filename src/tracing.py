@@ -0,0 +1,310 @@
+"""
+Lightweight per-request tracing.
+
+Each request starts a trace tagged with the user and analyst. Stages record spans
+(detect, memory search, SQL generation and execution, LLM time-to-first-token and
+total, persistence) that are appended to a local JSONL file, one span per line,
+using the OpenTelemetry span field names so the file can be loaded by OTel tooling.
+
+Traces are sampled when they start; spans that fail are written even for traces
+that were not sampled. Outside a trace, span() is a no-op.
+"""
+import sys
+import os
+import json
+import time
+import random
+import secrets
+import threading
+import contextvars
+from contextlib import contextmanager
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import (
+    TRACE_FILE_PATH,
+    TRACE_SAMPLE_RATE,
+    TRACE_FILE_MAX_BYTES,
+    TRACE_MAX_ATTRIBUTE_CHARS
+)
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+_CURRENT = object()  # record(): take the parent from the current span
+
+
+class SpanExporter:
+    """Appends finished spans to a JSONL file, rotating it when it grows too large."""
+
+    def __init__(self, path=TRACE_FILE_PATH, max_bytes=TRACE_FILE_MAX_BYTES):
+        """
+        Initialize the exporter.
+
+        Args:
+            path: JSONL file spans are appended to (None disables export)
+            max_bytes: Size at which the file is rotated to <path>.1
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._file = None
+        self.exported = 0
+
+    def export(self, span):
+        """
+        Write one finished span.
+
+        Args:
+            span: Span dictionary
+        """
+        if not self.path:
+            return
+        line = json.dumps(span, default=str) + "\n"
+        with self._lock:
+            try:
+                if self._file is None:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    self._file = open(self.path, "a", encoding="utf-8")
+                self._file.write(line)
+                self._file.flush()
+                self.exported += 1
+                if self.max_bytes and self._file.tell() > self.max_bytes:
+                    self._file.close()
+                    self._file = None
+                    os.replace(self.path, self.path + ".1")
+            except Exception as e:
+                print(f"⚠️ Tracing: could not write span: {e}")
+
+    def close(self):
+        """Close the trace file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_exporter = SpanExporter()
+
+
+def _truncate(value):
+    """Limit attribute values to a size that is cheap to serialize."""
+    if isinstance(value, (bool, int, float)) or value is None:
+        return value
+    value = str(value)
+    if len(value) > TRACE_MAX_ATTRIBUTE_CHARS:
+        return value[:TRACE_MAX_ATTRIBUTE_CHARS] + "..."
+    return value
+
+
+class Span:
+    """One timed operation within a trace."""
+
+    def __init__(self, trace, name, parent_id, attributes):
+        """
+        Start a span.
+
+        Args:
+            trace: The Trace this span belongs to
+            name: Span name, e.g. "memory.search"
+            parent_id: span_id of the enclosing span, or None
+            attributes: Initial span attributes
+        """
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = {k: _truncate(v) for k, v in attributes.items()}
+        self.start = time.time()
+        self.error = None
+
+    def set(self, **attributes):
+        """Add attributes to the span."""
+        for key, value in attributes.items():
+            self.attributes[key] = _truncate(value)
+
+    def fail(self, error):
+        """Mark the span as failed when the block handles the error itself."""
+        self.error = error
+
+    def end(self, error=None, end_time=None):
+        """
+        Finish the span and export it if its trace is sampled (or it failed).
+
+        Args:
+            error: Exception or message if the operation failed
+            end_time: Epoch seconds the operation ended (default: now)
+        """
+        self.trace.record(self.name, self.start, end_time or time.time(), error=error or self.error,
+                          span_id=self.span_id, parent_id=self.parent_id, **self.attributes)
+
+
+class _NoopSpan:
+    """Stands in for a span when there is no trace."""
+
+    def set(self, **attributes):
+        pass
+
+    def fail(self, error):
+        pass
+
+    def end(self, error=None, end_time=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """A sampled or unsampled request trace; holds the tags every span carries."""
+
+    def __init__(self, sampled, **attributes):
+        """
+        Start a trace.
+
+        Args:
+            sampled: Whether successful spans are exported
+            **attributes: Tags added to every span, e.g. user_id and analyst
+        """
+        self.trace_id = secrets.token_hex(16)
+        self.sampled = sampled
+        self.attributes = {k: _truncate(v) for k, v in attributes.items()}
+        self.start = time.time()
+
+    def record(self, name, start, end, error=None, span_id=None, parent_id=_CURRENT, **attributes):
+        """
+        Record a span whose start and end were measured by the caller.
+
+        Used for spans that cross generator yields, such as time to first token.
+
+        Args:
+            name: Span name
+            start: Epoch seconds the operation started
+            end: Epoch seconds the operation ended
+            error: Exception or message if the operation failed
+            span_id: Span id (generated if not provided)
+            parent_id: Parent span id (default: the current span in this context)
+            **attributes: Span attributes
+        """
+        if not self.sampled and error is None:
+            return
+        if parent_id is _CURRENT:
+            current = _current_span.get()
+            parent_id = current.span_id if current is not None and current.trace is self else None
+        _exporter.export({
+            "trace_id": self.trace_id,
+            "span_id": span_id or secrets.token_hex(8),
+            "parent_span_id": parent_id,
+            "name": name,
+            "start_time_unix_nano": int(start * 1e9),
+            "end_time_unix_nano": int(end * 1e9),
+            "duration_ms": round((end - start) * 1000, 2),
+            "status": {"code": "ERROR", "message": _truncate(error)} if error is not None else {"code": "OK"},
+            "attributes": {**self.attributes, **{k: _truncate(v) for k, v in attributes.items()}}
+        })
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Time a block as a span of this trace, making it the current span in this context.
+
+        Args:
+            name: Span name
+            **attributes: Span attributes
+
+        Yields:
+            The Span, so the block can add attributes
+        """
+        current = _current_span.get()
+        parent_id = current.span_id if current is not None and current.trace is self else None
+        span = Span(self, name, parent_id, attributes)
+        trace_token = _current_trace.set(self)
+        span_token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(error=e)
+            raise
+        else:
+            span.end()
+        finally:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+
+    def finish(self, **attributes):
+        """Record the whole request as a "request" span from the trace's start until now."""
+        self.record("request", self.start, time.time(), **attributes)
+
+
+def start_trace(sample_rate=TRACE_SAMPLE_RATE, **attributes):
+    """
+    Start a trace and make it current in this context.
+
+    Args:
+        sample_rate: Fraction of traces whose successful spans are exported
+        **attributes: Tags added to every span, e.g. user_id and analyst
+
+    Returns:
+        The new Trace
+    """
+    trace = Trace(random.random() < sample_rate, **attributes)
+    _current_trace.set(trace)
+    _current_span.set(None)
+    return trace
+
+
+def current_trace():
+    """Get the trace current in this context, or None."""
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name, trace=None, **attributes):
+    """
+    Time a block as a span of a trace (no-op outside a trace).
+
+    Args:
+        name: Span name
+        trace: Trace to record on (default: the current trace)
+        **attributes: Span attributes
+
+    Yields:
+        The Span (or a no-op stand-in), so the block can add attributes
+    """
+    trace = trace or _current_trace.get()
+    if trace is None:
+        yield NOOP_SPAN
+        return
+    with trace.span(name, **attributes) as active:
+        yield active
+
+
+def set_attributes(**attributes):
+    """Add attributes to the current span, if there is one."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def bind(func):
+    """
+    Bind a callable to the current context so spans it records in an executor
+    thread join the caller's trace.
+
+    Args:
+        func: Callable to run later, possibly in another thread
+
+    Returns:
+        Callable that runs func in a copy of the current context
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
+
+
+def get_trace_stats():
+    """
+    Report tracing configuration and volume.
+
+    Returns:
+        Dictionary with the trace file, sample rate and number of spans exported
+    """
+    return {"path": _exporter.path, "sample_rate": TRACE_SAMPLE_RATE, "spans_exported": _exporter.exported}
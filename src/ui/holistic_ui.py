@@ -8,23 +8,24 @@ import re
 import traceback
 import json
 import httpx
+import threading
+import weakref
 
 # Add the project root to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
 # Import the Mem0 Companion agent
-from src.companion import Companion
+from src.companion import Companion, start_answer_prewarm
+from src.answer_cache import get_answer_cache
 
 # Import configuration utilities
-from config.config import update_model, OPENROUTER_MODEL, OPENROUTER_API_URL, API_TIMEOUT
+from config.config import update_model, OPENROUTER_MODEL, OPENROUTER_API_URL, API_TIMEOUT, WARM_START_PROMPT, ANALYST_TYPES
 
 # Import LLM API for generating follow-up questions
 from src.llm_api import LlmApi
 
-# Import persona modules for analyst selection
-from config.persona import get_system_prompt as get_arabella_prompt
-from config.motions_analyst import get_system_prompt as get_motions_analyst_prompt
-from config.GTM_leadership_strategist import get_system_prompt as get_gtm_leadership_prompt
+# Frame-coalesced stream rendering and response text formatting
+from src.ui.stream_render import StreamRenderer, format_response_text
 
 # Import Vanna functionality for data analysis (now integrated into Companion)
 from src.ui.vanna_calls import (
@@ -32,6 +33,9 @@ from src.ui.vanna_calls import (
     test_snowflake_connection
 )
 
+# Keep the Warm Start briefing cached for every analyst (starts once per process)
+start_answer_prewarm()
+
 # Initialize session state variables
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -78,6 +82,14 @@ if "selected_analyst" not in st.session_state:
 if "streaming_enabled" not in st.session_state:
     st.session_state.streaming_enabled = True
 
+# Stream an opening while the data query runs, then the data-grounded analysis
+if "two_phase_streaming" not in st.session_state:
+    st.session_state.two_phase_streaming = True
+
+# Let the model decide when to query data through tool calls
+if "tool_calling" not in st.session_state:
+    st.session_state.tool_calling = False
+
 # Add a new state variable for tracking streaming status
 if "is_streaming" not in st.session_state:
     st.session_state.is_streaming = False
@@ -89,60 +101,48 @@ st.set_page_config(
     layout="wide"
 )
 
-# Function to format revenue text to ensure proper spacing
-def fix_revenue_text_spacing(text):
-    """Fix spacing issues in revenue text formatting"""
-    if not text:
-        return text
-    
-    # Fix "KinMonth" pattern (e.g., "747KinJanuary" -> "747K in January")
-    text = re.sub(r'(\d+[KMB])in([A-Za-z]+)', r'\1 in \2', text)
-    
-    # Fix "K(Month)" pattern (e.g., "747K(Jan)" -> "747K (Jan)")
-    text = re.sub(r'(\d+[KMB])\(([A-Za-z]+)\)', r'\1 (\2)', text)
-    
-    # Fix "Kto" pattern (e.g., "747Kto886K" -> "747K to 886K")
-    text = re.sub(r'(\d+[KMB])to(\d+[KMB])', r'\1 to \2', text)
-    
-    # Fix "Kby" pattern (e.g., "886Kby December" -> "886K by December")
-    text = re.sub(r'(\d+[KMB])by([A-Za-z]+)', r'\1 by \2', text)
-    
-    # Fix no space after "→" symbol
-    text = re.sub(r'→([A-Za-z])', r'→ \1', text)
-    
-    # Fix any missing spaces between parentheses and words
-    text = re.sub(r'\)([A-Za-z])', r') \1', text)
-    
-    return text
+# Function to format numeric values in DataFrames
+class _SessionTeardown:
+    """
+    Closes a session's Companion when Streamlit drops the session.
+
+    Streamlit has no session-end callback, but it releases a session's state once the
+    browser session is gone (tab closed or session expired). This object is held only by
+    st.session_state, so its finalizer runs then; close() cancels the turns still running.
+    """
+
+    def __init__(self, companion):
+        # The close runs in its own thread: finalizers run in whichever thread collects them
+        self.close = weakref.finalize(
+            self, lambda: threading.Thread(target=companion.close, name="companion-teardown").start()
+        )
+
+
+def start_companion(user_id, analyst_type):
+    """
+    Create the session's Companion, closed by close_companion() or when the session ends.
+
+    Args:
+        user_id: The ID of the user
+        analyst_type: The analyst answering the session
+
+    Returns:
+        The new Companion
+    """
+    companion = Companion(user_id, analyst_type=analyst_type)
+    st.session_state.companion_teardown = _SessionTeardown(companion)
+    return companion
+
+
+def close_companion():
+    """Close the session's Companion now (at most once), cancelling its in-flight turns."""
+    teardown = st.session_state.get("companion_teardown")
+    if teardown is not None:
+        teardown.close.detach()
+        st.session_state.companion_teardown = None
+    st.session_state.companion.close()
 
-# Function to clean markdown formatting from LLM responses
-def clean_markdown_formatting(text):
-    """Remove markdown formatting that doesn't render well in Streamlit"""
-    if not text:
-        return text
-    
-    # Remove bold formatting (**text** -> text)
-    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
-    
-    # Remove italic formatting (*text* -> text) - but be careful not to remove bullet points
-    text = re.sub(r'(?<!\*)\*([^*\n]+?)\*(?!\*)', r'\1', text)
-    
-    # Clean up any remaining single asterisks that might be left over
-    # but preserve bullet points (lines starting with *)
-    lines = text.split('\n')
-    cleaned_lines = []
-    for line in lines:
-        # Don't clean asterisks at the beginning of lines (bullet points)
-        if line.strip().startswith('*'):
-            cleaned_lines.append(line)
-        else:
-            # Remove stray asterisks in the middle of sentences
-            cleaned_line = re.sub(r'(?<!\s)\*(?!\s)', '', line)
-            cleaned_lines.append(cleaned_line)
-    
-    return '\n'.join(cleaned_lines)
 
-# Function to format numeric values in DataFrames
 def format_numeric_values(df):
     """Format DataFrame numeric values with thousands separators and two decimal places"""
     if df is None or df.empty:
@@ -333,15 +333,23 @@ def process_input_stream(user_input):
         thinking_placeholder = st.empty()
         thinking_placeholder.markdown("🧠 *Analyzing your question and preparing response...*")
         
-        # Show data analysis detection feedback if applicable
-        if st.session_state.companion._should_use_data_analysis(user_input):
+        # Show data analysis detection feedback if applicable (in tool-calling mode the model decides later)
+        if not st.session_state.tool_calling and st.session_state.companion._should_use_data_analysis(user_input):
             thinking_placeholder.markdown("🧠 *Analyzing your question...*\n\n📊 *Data analysis detected - querying database...*")
         
         try:
             # Show preparation phase
             with st.spinner("AI Assistant is preparing your response..."):
-                # Get both the streaming generator and metadata from companion
-                stream_generator, metadata = st.session_state.companion.process_message_stream(user_input)
+                # Get the phased stream (opening first, data-grounded analysis once SQL returns)
+                # or the single-segment stream, plus metadata, from companion
+                if st.session_state.tool_calling:
+                    stream_generator, metadata = st.session_state.companion.process_message_stream_tools(user_input)
+                    segments = iter([("answer", stream_generator)])
+                elif st.session_state.two_phase_streaming:
+                    segments, metadata = st.session_state.companion.process_message_stream_phased(user_input)
+                else:
+                    stream_generator, metadata = st.session_state.companion.process_message_stream(user_input)
+                    segments = iter([("answer", stream_generator)])
             
             # Clear thinking indicator and start streaming
             thinking_placeholder.empty()
@@ -350,21 +358,31 @@ def process_input_stream(user_input):
             streaming_placeholder = st.empty()
             streaming_placeholder.markdown("🌊 *Waiting for first response chunk...*")
             
-            # Use Streamlit's streaming capability with improved handling
+            # Stream each segment in place; between segments show the query status
+            streamed_segments = []
+            stream_completed = False
             try:
-                streamed_text = st.write_stream(stream_generator)
-                # Clear the streaming placeholder once content starts appearing
+                for phase, chunks in segments:
+                    streaming_placeholder.empty()
+                    # Repaint once per frame, formatting lines as they complete
+                    streamed_segments.append(StreamRenderer(st.empty()).render(chunks))
+                    if phase == "opening":
+                        streaming_placeholder = st.empty()
+                        streaming_placeholder.markdown("📊 *Querying database for the data behind this answer...*")
                 streaming_placeholder.empty()
+                stream_completed = True
             except Exception as stream_error:
                 streaming_placeholder.empty()
                 st.error(f"Streaming error: {str(stream_error)}")
                 raise stream_error
+            finally:
+                # Navigating away, Clear Cache or switching analysts stops this script run mid-stream;
+                # cancel the turn so its query and LLM stream stop too
+                if not stream_completed:
+                    st.session_state.companion.cancel("session interrupted")
             
-            # Fix spacing issues in revenue text formatting
-            full_response = fix_revenue_text_spacing(streamed_text)
-            
-            # Clean markdown formatting that doesn't render well
-            full_response = clean_markdown_formatting(full_response)
+            # The segments were formatted (revenue spacing, markdown cleanup) while streaming
+            full_response = "\n\n".join(streamed_segments)
             
         except Exception as e:
             thinking_placeholder.empty()
@@ -485,7 +503,14 @@ def process_input(user_input):
             # Process the user input through the enhanced Companion (now includes data analysis)
             with st.spinner("🤖 AI Assistant is thinking..."):
                 # The Companion now handles data analysis automatically
-                result = st.session_state.companion.process_message(user_input)
+                turn_completed = False
+                try:
+                    result = st.session_state.companion.process_message(user_input)
+                    turn_completed = True
+                finally:
+                    # As in process_input_stream: a stopped script run cancels the turn
+                    if not turn_completed:
+                        st.session_state.companion.cancel("session interrupted")
                 
                 # Handle the new response format
                 if isinstance(result, dict) and "response" in result:
@@ -496,11 +521,8 @@ def process_input(user_input):
                     response = str(result)
                     data_analysis = None
                 
-                # Fix spacing issues in revenue text formatting
-                response = fix_revenue_text_spacing(response)
-                
-                # Clean markdown formatting that doesn't render well
-                response = clean_markdown_formatting(response)
+                # Fix spacing issues in revenue text and clean markdown that doesn't render well
+                response = format_response_text(response)
             
             # Clear thinking indicator and show response
             thinking_placeholder.empty()
@@ -586,14 +608,14 @@ with st.sidebar:
         # Regular start button
         if col1.button("Start Session") and user_id:
             st.session_state.user_id = user_id
-            st.session_state.companion = Companion(user_id, analyst_type=st.session_state.selected_analyst)
+            st.session_state.companion = start_companion(user_id, st.session_state.selected_analyst)
             # st.session_state.llm_api = LlmApi()  # Initialize LLM API for follow-up questions
             st.rerun()
         
         # Warm start button
         if col2.button("Warm Start") and user_id:
             st.session_state.user_id = user_id
-            st.session_state.companion = Companion(user_id, analyst_type=st.session_state.selected_analyst)
+            st.session_state.companion = start_companion(user_id, st.session_state.selected_analyst)
             # st.session_state.llm_api = LlmApi()  # Initialize LLM API for follow-up questions
             # Set a flag to trigger the warm start prompt after rerun
             st.session_state.trigger_warm_start = True
@@ -603,7 +625,7 @@ with st.sidebar:
         
         # Analyst selector
         st.subheader("AI Assistant")
-        analyst_options = ["GTM Leadership Strategist", "Arabella (Business Architect)", "Sales Motion Strategy Agent"]
+        analyst_options = ANALYST_TYPES
         selected_analyst = st.selectbox(
             "Select AI Assistant:",
             options=analyst_options,
@@ -616,14 +638,14 @@ with st.sidebar:
             # Close the existing companion properly
             if st.session_state.companion:
                 try:
-                    st.session_state.companion.close()
+                    close_companion()
                     print(f"✅ UI: Closed {st.session_state.selected_analyst} session")
                 except Exception as e:
                     print(f"⚠️ UI: Error closing companion during analyst switch: {e}")
             
             st.session_state.selected_analyst = selected_analyst
             # Reinitialize companion with new analyst
-            st.session_state.companion = Companion(st.session_state.user_id, analyst_type=selected_analyst)
+            st.session_state.companion = start_companion(st.session_state.user_id, selected_analyst)
             st.success(f"🔄 Switched to {selected_analyst} (previous session closed)")
         
         # Model selector
@@ -659,6 +681,26 @@ with st.sidebar:
             else:
                 st.info("ℹ️ Streaming mode disabled - responses will appear all at once")
         
+        # Two-phase streaming toggle (only applies when streaming is enabled)
+        two_phase_streaming = st.toggle(
+            "⚡ Answer While Querying",
+            value=st.session_state.two_phase_streaming,
+            disabled=not st.session_state.streaming_enabled,
+            help="For data questions, start the answer immediately and add the data-grounded analysis once the query returns"
+        )
+        if two_phase_streaming != st.session_state.two_phase_streaming:
+            st.session_state.two_phase_streaming = two_phase_streaming
+        
+        # Tool-calling toggle (only applies when streaming is enabled; takes precedence over two-phase)
+        tool_calling = st.toggle(
+            "🛠️ Model-Driven Queries",
+            value=st.session_state.tool_calling,
+            disabled=not st.session_state.streaming_enabled,
+            help="Let the AI decide when to query the data warehouse; multi-metric questions are fetched in parallel"
+        )
+        if tool_calling != st.session_state.tool_calling:
+            st.session_state.tool_calling = tool_calling
+        
         st.divider()
         
         # Data connection section
@@ -754,6 +796,8 @@ with st.sidebar:
                         training_result = vanna.train()
                         
                         if training_result:
+                            # Cached SQL results and answers came from the previous model
+                            get_answer_cache().invalidate_all()
                             progress_bar.progress(90)
                             status_text.text("📊 Getting training statistics...")
                             
@@ -822,11 +866,15 @@ with st.sidebar:
             # Properly close companion session before clearing
             if st.session_state.companion:
                 try:
-                    st.session_state.companion.close()
+                    close_companion()
                     print("✅ UI: Companion session closed properly")
                 except Exception as e:
                     print(f"⚠️ UI: Error closing companion: {e}")
             
+            # The answer cache is shared by every session and is not cleared here: its entries are
+            # dropped when their tables change or Vanna is retrained, and clearing it would discard
+            # every user's prewarmed answers until the next prewarm
+            
             # Reset all session state
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
@@ -842,7 +890,7 @@ if st.session_state.user_id:
     
     # Check for the trigger_warm_start flag and process the warm start prompt
     if st.session_state.trigger_warm_start:
-        initial_prompt = "Give me a status of the most recent financial milestones and business risks, and show me the revenue for the last quarter, be succinct"
+        initial_prompt = WARM_START_PROMPT
         st.session_state.trigger_warm_start = False
         process_input(initial_prompt)
     
@@ -850,10 +898,10 @@ if st.session_state.user_id:
     if not st.session_state.is_streaming:
         for message in st.session_state.messages:
             with st.chat_message(message["role"]):
-                # Apply both text formatting functions to all displayed messages to ensure proper formatting
-                formatted_content = fix_revenue_text_spacing(message["content"])
-                formatted_content = clean_markdown_formatting(formatted_content)
-                st.write(formatted_content)
+                # Format each message once; reruns reuse the result
+                if "formatted_content" not in message:
+                    message["formatted_content"] = format_response_text(message["content"])
+                st.write(message["formatted_content"])
                 
                 # If this message has data attached, display it
                 if "data" in message and message["data"]:
@@ -0,0 +1,177 @@
+"""
+Frame-coalesced rendering of streamed LLM responses.
+
+st.write_stream repainted the message on every SSE delta, and the spacing and
+markdown fixes then ran over the whole response once it ended (and again for
+every message on every rerun). StreamRenderer instead buffers deltas in a list
+and repaints a placeholder at most once per STREAM_RENDER_FRAME_INTERVAL, so UI
+work scales with frames rather than tokens.
+
+Every pattern in fix_revenue_text_spacing and clean_markdown_formatting matches
+within a single line, so formatting is applied incrementally: each line is
+formatted once when its newline arrives, and only the unfinished last line is
+carried over and re-formatted per frame. The result is identical to formatting
+the whole text at the end.
+"""
+import sys
+import os
+import re
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from config.config import STREAM_RENDER_FRAME_INTERVAL
+
+# Function to format revenue text to ensure proper spacing
+def fix_revenue_text_spacing(text):
+    """Fix spacing issues in revenue text formatting"""
+    if not text:
+        return text
+
+    # Fix "KinMonth" pattern (e.g., "747KinJanuary" -> "747K in January")
+    text = re.sub(r'(\d+[KMB])in([A-Za-z]+)', r'\1 in \2', text)
+
+    # Fix "K(Month)" pattern (e.g., "747K(Jan)" -> "747K (Jan)")
+    text = re.sub(r'(\d+[KMB])\(([A-Za-z]+)\)', r'\1 (\2)', text)
+
+    # Fix "Kto" pattern (e.g., "747Kto886K" -> "747K to 886K")
+    text = re.sub(r'(\d+[KMB])to(\d+[KMB])', r'\1 to \2', text)
+
+    # Fix "Kby" pattern (e.g., "886Kby December" -> "886K by December")
+    text = re.sub(r'(\d+[KMB])by([A-Za-z]+)', r'\1 by \2', text)
+
+    # Fix no space after "→" symbol
+    text = re.sub(r'→([A-Za-z])', r'→ \1', text)
+
+    # Fix any missing spaces between parentheses and words
+    text = re.sub(r'\)([A-Za-z])', r') \1', text)
+
+    return text
+
+# Function to clean markdown formatting from LLM responses
+def clean_markdown_formatting(text):
+    """Remove markdown formatting that doesn't render well in Streamlit"""
+    if not text:
+        return text
+
+    # Remove bold formatting (**text** -> text)
+    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
+
+    # Remove italic formatting (*text* -> text) - but be careful not to remove bullet points
+    text = re.sub(r'(?<!\*)\*([^*\n]+?)\*(?!\*)', r'\1', text)
+
+    # Clean up any remaining single asterisks that might be left over
+    # but preserve bullet points (lines starting with *)
+    lines = text.split('\n')
+    cleaned_lines = []
+    for line in lines:
+        # Don't clean asterisks at the beginning of lines (bullet points)
+        if line.strip().startswith('*'):
+            cleaned_lines.append(line)
+        else:
+            # Remove stray asterisks in the middle of sentences
+            cleaned_line = re.sub(r'(?<!\s)\*(?!\s)', '', line)
+            cleaned_lines.append(cleaned_line)
+
+    return '\n'.join(cleaned_lines)
+
+def format_response_text(text):
+    """Apply the revenue spacing and markdown fixes to a complete response."""
+    return clean_markdown_formatting(fix_revenue_text_spacing(text))
+
+
+class IncrementalFormatter:
+    """Applies format_response_text to streamed text one completed line at a time."""
+
+    def __init__(self):
+        """Initialize an empty buffer."""
+        self._lines = []  # Formatted complete lines
+        self._tail = []  # Raw deltas of the line still being streamed
+        self._text = ""  # Cached "\n".join(self._lines)
+        self._text_stale = False
+
+    def feed(self, delta):
+        """
+        Add a streamed delta.
+
+        Args:
+            delta: Text received from the stream
+        """
+        if "\n" not in delta:
+            self._tail.append(delta)
+            return
+        first, *complete, rest = delta.split("\n")
+        self._tail.append(first)
+        for raw_line in ["".join(self._tail)] + complete:
+            self._lines.append(format_response_text(raw_line))
+        self._tail = [rest] if rest else []
+        self._text_stale = True
+
+    def text(self):
+        """
+        Get the formatted text so far.
+
+        Returns:
+            The complete lines as formatted, plus the carried-over last line
+            formatted as it stands
+        """
+        if self._text_stale:
+            self._text = "\n".join(self._lines)
+            self._text_stale = False
+        tail = format_response_text("".join(self._tail))
+        if not self._lines:
+            return tail
+        return self._text + "\n" + tail
+
+
+class StreamRenderer:
+    """Paints a streamed response into a Streamlit placeholder once per frame."""
+
+    def __init__(self, placeholder, frame_interval=STREAM_RENDER_FRAME_INTERVAL):
+        """
+        Initialize the renderer.
+
+        Args:
+            placeholder: Streamlit element to paint into (e.g. st.empty())
+            frame_interval: Minimum seconds between repaints
+        """
+        self.placeholder = placeholder
+        self.frame_interval = frame_interval
+        self.frames = 0
+        self.deltas = 0
+
+    def render(self, chunks):
+        """
+        Consume a stream and paint it, coalescing deltas into frames.
+
+        A delta that arrives at least one frame interval after the last repaint is
+        painted at once, so the first token and text after a pause are not held back.
+
+        Args:
+            chunks: Iterable of text deltas
+
+        Returns:
+            The complete formatted response
+        """
+        formatter = IncrementalFormatter()
+        last_paint = 0.0
+        painted = True
+        for chunk in chunks:
+            if not isinstance(chunk, str) or not chunk:
+                continue
+            formatter.feed(chunk)
+            self.deltas += 1
+            painted = False
+            now = time.monotonic()
+            if now - last_paint >= self.frame_interval:
+                self._paint(formatter.text())
+                last_paint = now
+                painted = True
+
+        text = formatter.text()
+        if not painted:
+            self._paint(text)
+        return text
+
+    def _paint(self, text):
+        self.placeholder.markdown(text)
+        self.frames += 1
@@ -7,13 +7,13 @@ import time
 import logging
 import traceback
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Logging is configured by vanna_snowflake (see LOG_LEVEL in config)
 logger = logging.getLogger(__name__)
 
 # Add the project root to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 from src.vanna_scripts.vanna_snowflake import VannaSnowflake
+from src.answer_cache import get_answer_cache
 
 from dotenv import load_dotenv
 
@@ -82,6 +82,8 @@ def get_vanna_instance():
         try:
             vanna.train()
             logger.info("Vanna training completed successfully")
+            # Cached SQL results and answers came from the previous model
+            get_answer_cache().invalidate_all()
         except Exception as e:
             logger.error(f"Vanna training failed: {str(e)}")
             logger.debug(f"Training error details: {traceback.format_exc()}")
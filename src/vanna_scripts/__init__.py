@@ -7,5 +7,6 @@ for LLM function calling integration.
 
 from .vanna_snowflake import VannaSnowflake
 from .vanna_tool_wrapper import VannaToolWrapper, create_vanna_tools
+from .data_intent_router import DataIntentRouter, get_data_intent_router
 
-__all__ = ['VannaSnowflake', 'VannaToolWrapper', 'create_vanna_tools'] 
\ No newline at end of file
+__all__ = ['VannaSnowflake', 'VannaToolWrapper', 'create_vanna_tools', 'DataIntentRouter', 'get_data_intent_router'] 
\ No newline at end of file
@@ -0,0 +1,434 @@
+"""
+Embedding-based router that decides whether a message needs a database query.
+
+Each message is embedded and compared against two labelled sets held in a
+dedicated Chroma collection:
+
+- positives: the questions from Vanna's question/SQL training pairs
+- negatives: strategy, advice and small-talk messages that should be answered
+  from the persona alone
+
+The score is the cosine similarity to the nearest positive minus the similarity
+to the nearest negative, and a message is routed to Vanna when the score reaches
+a threshold calibrated against a held-out labelled set.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from config import (
+    CHROMA_PERSISTENCE_DIRECTORY,
+    DATA_INTENT_INDEX_COLLECTION,
+    DATA_INTENT_NEGATIVE_EXAMPLES_PATH,
+    DATA_INTENT_CALIBRATION_SET_PATH,
+    DATA_INTENT_CALIBRATION_PATH,
+    DATA_INTENT_THRESHOLD,
+    DATA_INTENT_CACHE_SIZE
+)
+
+from src.resource_registry import get_resource_registry, CHROMA
+
+logger = logging.getLogger(__name__)
+
+# Vanna's ChromaDB_VectorStore keeps question/SQL pairs in a fixed collection
+# inside the store at CHROMA_PERSISTENCE_DIRECTORY
+VANNA_SQL_COLLECTION = "sql"
+
+POSITIVE_LABEL = "data"
+NEGATIVE_LABEL = "no_data"
+
+
+class DataIntentRouter:
+    """
+    Scores messages for data intent by vector similarity to labelled examples.
+
+    Exposes the same should_analyze() interface as the regex DataAnalysisDetector
+    it replaces, plus score_batch(), evaluate() and calibrate() for offline tuning.
+    """
+
+    def __init__(
+        self,
+        persist_directory: str = CHROMA_PERSISTENCE_DIRECTORY,
+        negative_examples_path: str = DATA_INTENT_NEGATIVE_EXAMPLES_PATH,
+        calibration_path: str = DATA_INTENT_CALIBRATION_PATH,
+        cache_size: int = DATA_INTENT_CACHE_SIZE,
+        chroma_client: Any = None
+    ):
+        """
+        Open the Chroma store and sync the router index with the training data.
+
+        Args:
+            persist_directory: Chroma persistence directory shared with Vanna
+            negative_examples_path: JSON list of messages that should not trigger a query
+            calibration_path: JSON file holding the calibrated threshold
+            cache_size: Maximum number of message scores kept in the LRU cache
+            chroma_client: Existing client over persist_directory to share (opened if not provided)
+        """
+        self.persist_directory = persist_directory
+        self.negative_examples_path = negative_examples_path
+        self.calibration_path = calibration_path
+        self.cache_size = cache_size
+        self.threshold = self._load_threshold()
+
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.stats = {"cache_hits": 0, "cache_misses": 0, "routed_to_data": 0, "routed_to_persona": 0}
+
+        self._client = None
+        self._collection = None
+        self._embedding_function = None
+        self._available = False
+
+        try:
+            import chromadb
+            from chromadb.utils import embedding_functions
+
+            self._client = chroma_client or chromadb.PersistentClient(path=persist_directory)
+            self._embedding_function = embedding_functions.DefaultEmbeddingFunction()
+            self._collection = self._client.get_or_create_collection(
+                name=DATA_INTENT_INDEX_COLLECTION,
+                embedding_function=self._embedding_function,
+                metadata={"hnsw:space": "cosine"}
+            )
+            self.refresh_index()
+        except Exception as e:
+            logger.warning(f"⚠️ Data-intent router unavailable: {e}")
+            logger.debug("Data-intent router initialization exception:", exc_info=True)
+            self._available = False
+
+    def is_available(self) -> bool:
+        """Return True if the index holds both positive and negative examples."""
+        return self._available
+
+    def _load_threshold(self) -> float:
+        """Read the calibrated threshold, falling back to the configured default."""
+        try:
+            if self.calibration_path and os.path.exists(self.calibration_path):
+                with open(self.calibration_path, "r", encoding="utf-8") as f:
+                    calibration = json.load(f)
+                logger.info(f"📏 Using calibrated data-intent threshold {calibration['threshold']:.3f}")
+                return float(calibration["threshold"])
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read data-intent calibration: {e}")
+        return DATA_INTENT_THRESHOLD
+
+    @staticmethod
+    def _normalize(message: str) -> str:
+        """Normalize a message for caching and indexing."""
+        return " ".join(message.lower().split())
+
+    @staticmethod
+    def _example_id(label: str, text: str) -> str:
+        """Stable index ID for a labelled example."""
+        return f"{label}-{hashlib.sha1(text.encode('utf-8')).hexdigest()}"
+
+    def _load_positive_examples(self) -> List[str]:
+        """Collect the questions from Vanna's question/SQL training pairs."""
+        try:
+            sql_collection = self._client.get_collection(name=VANNA_SQL_COLLECTION)
+        except Exception:
+            logger.warning(f"⚠️ No '{VANNA_SQL_COLLECTION}' collection in {self.persist_directory} - train Vanna first")
+            return []
+
+        questions = []
+        for document in sql_collection.get(include=["documents"]).get("documents") or []:
+            try:
+                question = json.loads(document).get("question")
+            except (TypeError, ValueError, AttributeError):
+                continue
+            if question:
+                questions.append(question)
+        return questions
+
+    def _load_negative_examples(self) -> List[str]:
+        """Read the labelled non-data messages."""
+        if not self.negative_examples_path or not os.path.exists(self.negative_examples_path):
+            logger.warning(f"⚠️ Negative example file not found: {self.negative_examples_path}")
+            return []
+        with open(self.negative_examples_path, "r", encoding="utf-8") as f:
+            return [example for example in json.load(f) if isinstance(example, str) and example.strip()]
+
+    def refresh_index(self) -> Dict[str, int]:
+        """
+        Sync the router index with the current training pairs and negative examples.
+
+        Call this after retraining Vanna so new questions are picked up.
+
+        Returns:
+            Dictionary with the number of positives, negatives, added and removed entries
+        """
+        examples = {}
+        positives = self._load_positive_examples()
+        negatives = self._load_negative_examples()
+        for label, texts in ((POSITIVE_LABEL, positives), (NEGATIVE_LABEL, negatives)):
+            for text in texts:
+                normalized = self._normalize(text)
+                examples[self._example_id(label, normalized)] = (label, normalized)
+
+        existing_ids = set(self._collection.get(include=[]).get("ids") or [])
+        to_add = [example_id for example_id in examples if example_id not in existing_ids]
+        to_remove = [example_id for example_id in existing_ids if example_id not in examples]
+
+        if to_remove:
+            self._collection.delete(ids=to_remove)
+        if to_add:
+            self._collection.add(
+                ids=to_add,
+                documents=[examples[example_id][1] for example_id in to_add],
+                metadatas=[{"label": examples[example_id][0]} for example_id in to_add]
+            )
+
+        with self._cache_lock:
+            self._cache.clear()
+
+        self._available = bool(positives) and bool(negatives)
+        logger.info(f"✅ Data-intent index: {len(positives)} positives, {len(negatives)} negatives "
+                    f"(+{len(to_add)}/-{len(to_remove)})")
+        return {"positives": len(positives), "negatives": len(negatives),
+                "added": len(to_add), "removed": len(to_remove)}
+
+    def _nearest(self, embeddings: List[List[float]], label: str) -> List[Dict[str, Any]]:
+        """Nearest example with the given label for each embedding."""
+        result = self._collection.query(
+            query_embeddings=embeddings,
+            n_results=1,
+            where={"label": label},
+            include=["documents", "distances"]
+        )
+        nearest = []
+        for documents, distances in zip(result["documents"], result["distances"]):
+            if distances:
+                nearest.append({"similarity": 1.0 - distances[0], "example": documents[0]})
+            else:
+                nearest.append({"similarity": 0.0, "example": None})
+        return nearest
+
+    def _score_uncached(self, normalized_messages: List[str]) -> List[Dict[str, Any]]:
+        """Embed the messages once and score them against both label sets."""
+        embeddings = [list(embedding) for embedding in self._embedding_function(normalized_messages)]
+        positives = self._nearest(embeddings, POSITIVE_LABEL)
+        negatives = self._nearest(embeddings, NEGATIVE_LABEL)
+        return [
+            {
+                "score": positive["similarity"] - negative["similarity"],
+                "positive_similarity": positive["similarity"],
+                "negative_similarity": negative["similarity"],
+                "nearest_positive": positive["example"],
+                "nearest_negative": negative["example"]
+            }
+            for positive, negative in zip(positives, negatives)
+        ]
+
+    def score_batch(self, messages: List[str]) -> List[Dict[str, Any]]:
+        """
+        Score several messages with a single embedding call.
+
+        Args:
+            messages: Messages to score
+
+        Returns:
+            One dictionary per message with the score, the nearest positive and
+            negative examples and their similarities, and the routing decision
+        """
+        normalized = [self._normalize(message) for message in messages]
+        scores = {}
+
+        with self._cache_lock:
+            for key in normalized:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[key] = self._cache[key]
+                    self.stats["cache_hits"] += 1
+
+        misses = list(dict.fromkeys(key for key in normalized if key not in scores))
+        if misses:
+            for key, score in zip(misses, self._score_uncached(misses)):
+                scores[key] = score
+            with self._cache_lock:
+                self.stats["cache_misses"] += len(misses)
+                for key in misses:
+                    self._cache[key] = scores[key]
+                    self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return [
+            {"message": message, **scores[key], "is_data": scores[key]["score"] >= self.threshold}
+            for message, key in zip(messages, normalized)
+        ]
+
+    def should_analyze(self, message: str) -> bool:
+        """
+        Decide whether a message needs a database query.
+
+        Args:
+            message: The user's message
+
+        Returns:
+            Boolean indicating if data analysis should be used
+        """
+        start_time = time.time()
+        result = self.score_batch([message])[0]
+        logger.debug(f"Data-intent score {result['score']:.3f} (threshold {self.threshold:.3f}, "
+                     f"{(time.time() - start_time) * 1000:.1f}ms) nearest: {result['nearest_positive']!r}")
+
+        with self._cache_lock:
+            self.stats["routed_to_data" if result["is_data"] else "routed_to_persona"] += 1
+        return result["is_data"]
+
+    @staticmethod
+    def load_labelled_examples(path: str = DATA_INTENT_CALIBRATION_SET_PATH) -> List[Dict[str, Any]]:
+        """
+        Read a labelled evaluation set.
+
+        Args:
+            path: JSON list of {"message": str, "is_data": bool} entries
+
+        Returns:
+            List of labelled examples
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def evaluate(self, examples: List[Dict[str, Any]], threshold: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Measure routing quality on labelled examples.
+
+        Args:
+            examples: List of {"message": str, "is_data": bool} entries
+            threshold: Threshold to evaluate (default: the current threshold)
+
+        Returns:
+            Dictionary with precision, recall, F1, accuracy and the confusion counts
+        """
+        threshold = self.threshold if threshold is None else threshold
+        scored = self.score_batch([example["message"] for example in examples])
+        return self._metrics(
+            [result["score"] for result in scored],
+            [bool(example["is_data"]) for example in examples],
+            threshold
+        )
+
+    @staticmethod
+    def _metrics(scores: List[float], labels: List[bool], threshold: float) -> Dict[str, Any]:
+        """Confusion counts and summary metrics for one threshold."""
+        tp = sum(1 for score, label in zip(scores, labels) if score >= threshold and label)
+        fp = sum(1 for score, label in zip(scores, labels) if score >= threshold and not label)
+        fn = sum(1 for score, label in zip(scores, labels) if score < threshold and label)
+        tn = len(labels) - tp - fp - fn
+        precision = tp / (tp + fp) if tp + fp else 0.0
+        recall = tp / (tp + fn) if tp + fn else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        return {
+            "threshold": threshold,
+            "precision": precision,
+            "recall": recall,
+            "f1": f1,
+            "accuracy": (tp + tn) / len(labels) if labels else 0.0,
+            "true_positives": tp,
+            "false_positives": fp,
+            "true_negatives": tn,
+            "false_negatives": fn
+        }
+
+    def calibrate(self, examples: Optional[List[Dict[str, Any]]] = None, save: bool = True) -> Dict[str, Any]:
+        """
+        Pick the threshold with the best F1 on a labelled set, preferring higher
+        precision (fewer wasted warehouse queries) on ties.
+
+        Args:
+            examples: Labelled examples (default: the configured calibration set)
+            save: Whether to persist the threshold to the calibration file
+
+        Returns:
+            Metrics at the chosen threshold
+        """
+        if examples is None:
+            examples = self.load_labelled_examples()
+
+        scores = [result["score"] for result in self.score_batch([example["message"] for example in examples])]
+        labels = [bool(example["is_data"]) for example in examples]
+
+        best = None
+        for threshold in sorted(set(scores)):
+            metrics = self._metrics(scores, labels, threshold)
+            if best is None or (metrics["f1"], metrics["precision"]) > (best["f1"], best["precision"]):
+                best = metrics
+
+        if best is None:
+            raise ValueError("Calibration requires at least one labelled example")
+
+        self.threshold = best["threshold"]
+        with self._cache_lock:
+            self._cache.clear()
+
+        if save:
+            with open(self.calibration_path, "w", encoding="utf-8") as f:
+                json.dump({**best, "examples": len(examples), "calibrated_at": time.time()}, f, indent=2)
+            logger.info(f"💾 Saved data-intent threshold {self.threshold:.3f} to {self.calibration_path}")
+
+        return best
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Report routing decisions and cache effectiveness.
+
+        Returns:
+            Dictionary of router statistics
+        """
+        with self._cache_lock:
+            return {"threshold": self.threshold, "cache_entries": len(self._cache), **self.stats}
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_data_intent_router() -> DataIntentRouter:
+    """
+    Get the process-wide data-intent router, building its index on first use.
+
+    Returns:
+        The shared DataIntentRouter instance
+    """
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                # Borrow the process-wide Chroma client Vanna also uses (held for the router's lifetime)
+                try:
+                    chroma_client = get_resource_registry().acquire(CHROMA)
+                except Exception as e:
+                    logger.warning(f"⚠️ Shared Chroma client unavailable: {e}")
+                    chroma_client = None
+                _router = DataIntentRouter(chroma_client=chroma_client)
+    return _router
+
+
+def main():
+    """Calibrate the threshold on the labelled set and report the resulting metrics."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    router = DataIntentRouter()
+    if not router.is_available():
+        logger.error("❌ Router index is empty - check the Chroma store and negative examples")
+        return False
+
+    metrics = router.calibrate()
+    logger.info(f"📊 threshold={metrics['threshold']:.3f} precision={metrics['precision']:.2f} "
+                f"recall={metrics['recall']:.2f} f1={metrics['f1']:.2f}")
+    logger.info(f"   TP={metrics['true_positives']} FP={metrics['false_positives']} "
+                f"TN={metrics['true_negatives']} FN={metrics['false_negatives']}")
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,352 @@
+"""
+Local analytical replica of the Vanna schema, queried with DuckDB.
+
+The demo schema is small and changes rarely, yet every data question used to be
+a round trip to a Snowflake warehouse. The replica snapshots the base tables of
+SNOWFLAKE_DATABASE.SNOWFLAKE_SCHEMA into Parquet files under REPLICA_DIRECTORY
+and exposes them to an in-process DuckDB database under the same
+database.schema.table names, so generated SQL can run locally unchanged.
+
+- Refresh: a background thread compares each table's LAST_ALTERED and
+  ROW_COUNT with the snapshot every REPLICA_REFRESH_INTERVAL seconds and
+  re-snapshots only the tables that changed (new tables are added, dropped ones
+  removed). A manifest lets a restarted process reuse the files on disk.
+- Routing: a statement runs locally only if the replica has been verified
+  against Snowflake within REPLICA_MAX_STALENESS seconds, it is a single
+  SELECT/WITH statement and DuckDB can bind it (EXPLAIN succeeds) against the
+  snapshot. Snowflake-only functions or tables outside the replica fail that
+  check, and any local error falls back to Snowflake.
+- Freshness: locally served results carry the snapshot and verification times
+  and the table versions they were read from.
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from config import (
+    REPLICA_DIRECTORY,
+    REPLICA_REFRESH_INTERVAL,
+    REPLICA_MAX_STALENESS,
+    REPLICA_MAX_TABLE_ROWS
+)
+from src.vanna_scripts.snowflake_connection_manager import convert_to_json_serializable
+from src.scheduler import get_scheduler, SQL, BACKGROUND
+from src import tracing
+
+try:
+    import duckdb
+    DUCKDB_AVAILABLE = True
+except ImportError:
+    DUCKDB_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+
+# Identifiers after FROM/JOIN, as in VannaToolWrapper._extract_query_metadata
+_TABLE_REFERENCE = re.compile(r'\b(?:FROM|JOIN)\s+([a-zA-Z_][a-zA-Z0-9_]*(?:\.[a-zA-Z_][a-zA-Z0-9_]*)*)', re.IGNORECASE)
+_READ_ONLY_STATEMENT = re.compile(r'^\s*(?:SELECT|WITH)\b', re.IGNORECASE)
+
+
+def _isoformat(timestamp: Optional[float]) -> Optional[str]:
+    """Format an epoch timestamp as ISO 8601 UTC."""
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat()
+
+
+class LocalReplica:
+    """Parquet snapshots of the Vanna schema, served by DuckDB with Snowflake as the source of truth."""
+
+    def __init__(
+        self,
+        snowflake_connection: Any,
+        database: str,
+        schema: str,
+        directory: str = REPLICA_DIRECTORY,
+        refresh_interval: float = REPLICA_REFRESH_INTERVAL,
+        max_staleness: float = REPLICA_MAX_STALENESS,
+        max_table_rows: int = REPLICA_MAX_TABLE_ROWS
+    ):
+        """
+        Open the replica over any snapshots already on disk. Call start() to keep it refreshed.
+
+        Args:
+            snowflake_connection: SnowflakeConnectionManager used to read versions and snapshot tables
+            database: Snowflake database the generated SQL targets
+            schema: Snowflake schema whose base tables are replicated
+            directory: Directory holding the Parquet files and manifest
+            refresh_interval: Seconds between version checks
+            max_staleness: Seconds since the last successful check after which queries go to Snowflake
+            max_table_rows: Tables with more rows are not replicated
+        """
+        if not DUCKDB_AVAILABLE:
+            raise ImportError("duckdb is required for the local replica")
+
+        self.snowflake_connection = snowflake_connection
+        self.database = database.upper()
+        self.schema = schema.upper()
+        self.directory = os.path.join(directory, self.database, self.schema)
+        self.refresh_interval = refresh_interval
+        self.max_staleness = max_staleness
+        self.max_table_rows = max_table_rows
+
+        # table -> {"version", "file", "rows", "snapshot_at"}
+        self.tables: Dict[str, Dict[str, Any]] = {}
+        self.verified_at: Optional[float] = None
+        self.stats = {"local_queries": 0, "fallbacks": 0, "local_errors": 0, "snapshots": 0, "refresh_errors": 0}
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._duckdb = duckdb.connect()
+        self._duckdb.execute(f'ATTACH \':memory:\' AS "{self.database}"')
+        self._duckdb.execute(f'CREATE SCHEMA "{self.database}"."{self.schema}"')
+        self._load_manifest()
+
+    # ----- Snapshots -----
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_FILE)
+
+    def _load_manifest(self):
+        """Expose the snapshots recorded by a previous process (unverified until the first refresh)."""
+        try:
+            with open(self._manifest_path(), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"⚠️ Replica: ignoring unreadable manifest: {e}")
+            return
+
+        for table, entry in manifest.get("tables", {}).items():
+            if os.path.exists(entry["file"]):
+                self._create_view(table, entry["file"])
+                self.tables[table] = entry
+        self.verified_at = manifest.get("verified_at")
+        logger.info(f"📦 Replica: loaded {len(self.tables)} table snapshots from {self.directory}")
+
+    def _save_manifest(self):
+        """Record the current snapshots (lock held)."""
+        manifest = {"verified_at": self.verified_at, "tables": self.tables}
+        temp_path = self._manifest_path() + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, self._manifest_path())
+
+    def _create_view(self, table: str, path: str):
+        """Point the table's name in DuckDB at a Parquet file."""
+        escaped_path = path.replace("'", "''")
+        self._duckdb.execute(
+            f'CREATE OR REPLACE VIEW "{self.database}"."{self.schema}"."{table}" '
+            f"AS SELECT * FROM read_parquet('{escaped_path}')"
+        )
+
+    def _current_versions(self) -> Dict[str, Tuple[str, int]]:
+        """Read the version and row count of every base table in the schema from Snowflake."""
+        rows = self.snowflake_connection.execute_query(
+            "SELECT TABLE_NAME, LAST_ALTERED, ROW_COUNT FROM INFORMATION_SCHEMA.TABLES "
+            "WHERE TABLE_SCHEMA = %s AND TABLE_TYPE = 'BASE TABLE'",
+            (self.schema,)
+        )
+        return {
+            row["TABLE_NAME"]: (f"{row['LAST_ALTERED']}|{row['ROW_COUNT']}", int(row["ROW_COUNT"] or 0))
+            for row in rows
+        }
+
+    def _snapshot_table(self, table: str, version: str):
+        """Copy one table from Snowflake into a new Parquet file and switch its view to it."""
+        with tracing.span("replica.snapshot", table=table) as span:
+            rows = self.snowflake_connection.execute_query(f'SELECT * FROM "{self.database}"."{self.schema}"."{table}"')
+            frame = pd.DataFrame(rows)
+            digest = hashlib.sha256(version.encode("utf-8")).hexdigest()[:12]
+            path = os.path.join(self.directory, f"{table}.{digest}.parquet")
+            with self._lock:
+                cursor = self._duckdb.cursor()
+            try:
+                cursor.register("snapshot_frame", frame)
+                escaped_path = path.replace("'", "''")
+                cursor.execute(f"COPY snapshot_frame TO '{escaped_path}' (FORMAT PARQUET)")
+            finally:
+                cursor.close()
+            span.set(rows=len(frame))
+
+        with self._lock:
+            previous = self.tables.get(table)
+            self._create_view(table, path)
+            self.tables[table] = {"version": version, "file": path, "rows": len(frame), "snapshot_at": time.time()}
+            self.stats["snapshots"] += 1
+        if previous and previous["file"] != path:
+            self._remove_file(previous["file"])
+        logger.info(f"📦 Replica: snapshotted {table} ({len(frame)} rows)")
+
+    def _drop_table(self, table: str):
+        """Remove a table that no longer exists or is no longer eligible."""
+        with self._lock:
+            entry = self.tables.pop(table, None)
+            self._duckdb.execute(f'DROP VIEW IF EXISTS "{self.database}"."{self.schema}"."{table}"')
+        if entry:
+            self._remove_file(entry["file"])
+            logger.info(f"📦 Replica: dropped {table}")
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def refresh(self) -> Dict[str, int]:
+        """
+        Re-snapshot every table whose version changed since its snapshot.
+
+        Returns:
+            Counts of tables checked, snapshotted and dropped
+        """
+        with self._refresh_lock:
+            versions = self._current_versions()
+            checked_at = time.time()
+            snapshotted = dropped = 0
+
+            # Empty tables have no columns to snapshot; queries on them go to Snowflake
+            eligible = {t: v for t, (v, rows) in versions.items() if 0 < rows <= self.max_table_rows}
+            for table in [t for t in self.tables if t not in eligible]:
+                self._drop_table(table)
+                dropped += 1
+
+            for table, version in eligible.items():
+                entry = self.tables.get(table)
+                if entry is None or entry["version"] != version:
+                    self._snapshot_table(table, version)
+                    snapshotted += 1
+
+            with self._lock:
+                self.verified_at = checked_at
+                self._save_manifest()
+            return {"checked": len(versions), "snapshotted": snapshotted, "dropped": dropped}
+
+    def _refresh_loop(self):
+        """Background thread: refresh now, then every refresh_interval seconds until stopped."""
+        while not self._stop.is_set():
+            try:
+                with get_scheduler().slot(SQL, priority=BACKGROUND, user_id="replica"):
+                    result = self.refresh()
+                if result["snapshotted"] or result["dropped"]:
+                    logger.info(f"📦 Replica refreshed: {result}")
+            except Exception as e:
+                self.stats["refresh_errors"] += 1
+                logger.warning(f"⚠️ Replica refresh failed, queries fall back to Snowflake once stale: {e}")
+            self._stop.wait(self.refresh_interval)
+
+    def start(self):
+        """Start the background refresh thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refresh_loop, name="replica-refresh", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Stop refreshing and close the DuckDB database (snapshots stay on disk for the next process)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        with self._lock:
+            self._duckdb.close()
+
+    # ----- Routing -----
+
+    def is_fresh(self) -> bool:
+        """Return True if the snapshot was verified against Snowflake recently enough to serve queries."""
+        return self.verified_at is not None and time.time() - self.verified_at <= self.max_staleness
+
+    def _referenced_tables(self, sql: str) -> List[str]:
+        """Replicated tables a statement reads."""
+        names = {match.split(".")[-1].upper() for match in _TABLE_REFERENCE.findall(sql)}
+        return sorted(name for name in names if name in self.tables)
+
+    @staticmethod
+    def _column_names(sql: str, description: List[Tuple]) -> List[str]:
+        """Result column names as Snowflake reports them: unquoted identifiers are upper case."""
+        return [name if f'"{name}"' in sql else name.upper() for name, *_ in description]
+
+    def execute(self, sql: str) -> Optional[Tuple[List[Dict[str, Any]], Dict[str, Any]]]:
+        """
+        Run a statement on the replica if it is eligible.
+
+        Args:
+            sql: Generated SQL in the Snowflake dialect
+
+        Returns:
+            Tuple of (rows as dictionaries, freshness metadata), or None if the
+            statement should run on Snowflake
+        """
+        statement = sql.strip().rstrip(";").strip()
+        if not self.tables or not self.is_fresh() or ";" in statement or not _READ_ONLY_STATEMENT.match(statement):
+            self.stats["fallbacks"] += 1
+            return None
+
+        with self._lock:
+            cursor = self._duckdb.cursor()
+        try:
+            cursor.execute(f'USE "{self.database}"."{self.schema}"')
+            try:
+                cursor.execute(f"EXPLAIN {statement}")
+            except duckdb.Error as e:
+                logger.debug(f"Replica cannot bind statement, using Snowflake: {e}")
+                self.stats["fallbacks"] += 1
+                return None
+
+            with tracing.span("sql.replica", sql=statement) as span:
+                cursor.execute(statement)
+                columns = self._column_names(statement, cursor.description)
+                rows = [convert_to_json_serializable(dict(zip(columns, row))) for row in cursor.fetchall()]
+                span.set(rows=len(rows))
+        except Exception as e:
+            logger.warning(f"⚠️ Replica query failed, using Snowflake: {e}")
+            self.stats["local_errors"] += 1
+            self.stats["fallbacks"] += 1
+            return None
+        finally:
+            cursor.close()
+
+        self.stats["local_queries"] += 1
+        tables = self._referenced_tables(statement)
+        with self._lock:
+            snapshots = {t: dict(self.tables[t]) for t in tables if t in self.tables}
+            verified_at = self.verified_at
+        freshness = {
+            "source": "replica",
+            "snapshot_at": _isoformat(min((s["snapshot_at"] for s in snapshots.values()), default=None)),
+            "verified_at": _isoformat(verified_at),
+            "staleness_seconds": round(time.time() - verified_at, 1),
+            "table_versions": {f"{self.schema}.{t}": s["version"] for t, s in snapshots.items()}
+        }
+        return rows, freshness
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Report what is replicated and how queries were routed.
+
+        Returns:
+            Dictionary of replica statistics
+        """
+        with self._lock:
+            return {
+                "tables": len(self.tables),
+                "rows": sum(entry["rows"] for entry in self.tables.values()),
+                "verified_at": _isoformat(self.verified_at),
+                "fresh": self.is_fresh(),
+                **self.stats
+            }
@@ -8,9 +8,9 @@ import snowflake.connector
 from decimal import Decimal
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
+from src import cancellation
 
-# Configure logging with more detail
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Logging is configured by the application (see LOG_LEVEL in config)
 logger = logging.getLogger(__name__)
 
 def convert_to_json_serializable(obj):
@@ -372,7 +372,7 @@ class SnowflakeConnectionManager:
             logger.debug(f"Connection check failed: {str(e)}")
             return False
     
-    def execute_query(self, sql, params=None, retry_count=0):
+    def execute_query(self, sql, params=None, retry_count=0, cancel_token=None):
         """
         Execute a SQL query with automatic reconnection if token expires.
         
@@ -380,9 +380,13 @@ class SnowflakeConnectionManager:
             sql: SQL query to execute
             params: Query parameters
             retry_count: Current retry attempt (used internally)
+            cancel_token: CancellationToken that cancels the running statement in Snowflake
             
         Returns:
             Query results
+            
+        Raises:
+            RequestCancelled: If the token was cancelled before the query finished
         """
         if retry_count > self.max_retries:
             logger.error(f"Maximum retry attempts ({self.max_retries}) exceeded")
@@ -402,7 +406,18 @@ class SnowflakeConnectionManager:
             cursor = self.conn.cursor()
             start_time = time.time()
             
-            if params:
+            if cancel_token is not None:
+                # Submit asynchronously so the statement's query id is known while it runs
+                cursor.execute_async(sql, params)
+                query_id = cursor.sfqid
+                with cancellation.on_cancel(cancel_token, lambda: self.cancel_query(query_id)):
+                    try:
+                        cursor.get_results_from_sfqid(query_id)
+                    except snowflake.connector.errors.ProgrammingError:
+                        cancel_token.raise_if_cancelled()
+                        raise
+                cancel_token.raise_if_cancelled()
+            elif params:
                 cursor.execute(sql, params)
             else:
                 cursor.execute(sql)
@@ -451,17 +466,41 @@ class SnowflakeConnectionManager:
                 
                 # Reconnect and retry
                 self.reconnect()
-                return self.execute_query(sql, params, retry_count + 1)
+                return self.execute_query(sql, params, retry_count + 1, cancel_token)
             else:
                 # Propagate other errors
                 logger.error(f"SQL error: {e}")
                 logger.debug(f"SQL error details: {traceback.format_exc()}")
                 raise
+        except cancellation.RequestCancelled:
+            logger.info(f"🛑 Query cancelled: {log_sql[:100]}")
+            raise
         except Exception as e:
             logger.error(f"Error executing query: {e}")
             logger.debug(f"Query execution error details: {traceback.format_exc()}")
             raise
     
+    def cancel_query(self, query_id):
+        """
+        Cancel a running statement. Safe to call from another thread while the
+        statement's cursor is waiting for results.
+        
+        Args:
+            query_id: Snowflake query id of the statement
+            
+        Returns:
+            True if the cancel request was sent
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT SYSTEM$CANCEL_QUERY(%s)", (query_id,))
+            cursor.close()
+            logger.info(f"🛑 Cancel requested for Snowflake query {query_id}")
+            return True
+        except Exception as e:
+            logger.warning(f"Could not cancel Snowflake query {query_id}: {e}")
+            return False
+    
     def get_connection(self):
         """
         Get the current Snowflake connection, reconnecting if necessary.
@@ -5,6 +5,7 @@ from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
 import logging
 import sys
+import threading
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 from config.config import (
@@ -49,6 +50,38 @@ class SnowflakeConnector:
         self.memory_schema = memory_schema or SNOWFLAKE_MEMORY_SCHEMA
         self.conn = None
         self.p_key = None  # Will hold the loaded private key
+        self._connect_lock = threading.Lock()
+        
+    def is_connection_active(self):
+        """Return True if a connection is open."""
+        return self.conn is not None and not self.conn.is_closed()
+    
+    def get_connection(self):
+        """
+        Get the open connection, connecting (or reconnecting) if necessary.
+        
+        The connection is shared by every caller of this connector, so callers
+        should use their own cursors and must not close it.
+        
+        Returns:
+            Active Snowflake connection
+        """
+        if self.is_connection_active():
+            return self.conn
+        with self._connect_lock:
+            if not self.is_connection_active():
+                self.connect()
+            return self.conn
+    
+    def close(self):
+        """Close the connection if one is open."""
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception as e:
+                logger.warning(f"Error closing Snowflake connection: {e}")
+            finally:
+                self.conn = None
         
     def connect(self):
         """Establishes connection to Snowflake."""
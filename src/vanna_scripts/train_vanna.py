@@ -15,6 +15,7 @@ project_root = Path(__file__).parent.parent.parent
 sys.path.insert(0, str(project_root))
 
 from src.vanna_scripts.vanna_snowflake import VannaSnowflake
+from src.answer_cache import get_answer_cache
 
 # Configure logging
 logging.basicConfig(
@@ -50,6 +51,11 @@ def main():
         if training_result:
             logger.info("✅ Training completed successfully!")
             
+            # Cached SQL results and answers came from the previous model. A running app keeps
+            # its in-memory copy; clear it there with "Clear Cache"
+            get_answer_cache().invalidate_all()
+            logger.info("🗑️ Answer cache cleared")
+            
             # Display training data statistics
             logger.info("📊 Getting training data statistics...")
             try:
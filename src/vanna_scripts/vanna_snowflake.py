@@ -6,27 +6,54 @@ from config import *
 import json
 from pathlib import Path
 from src.vanna_scripts.snowflake_connection_manager import SnowflakeConnectionManager, auto_reconnect
+from src import tracing
+from src import cancellation
 import traceback
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def create_snowflake_connection() -> SnowflakeConnectionManager:
+    """
+    Create a connection manager for SNOWFLAKE_DATABASE.SNOWFLAKE_SCHEMA from the configured credentials.
+    
+    Returns:
+        A new SnowflakeConnectionManager
+    """
+    return SnowflakeConnectionManager(
+        snowflake_account=SNOWFLAKE_ACCOUNT,
+        snowflake_user=SNOWFLAKE_USER,
+        snowflake_org=SNOWFLAKE_ORG,
+        snowflake_warehouse=SNOWFLAKE_WAREHOUSE,
+        snowflake_role=SNOWFLAKE_ROLE,
+        database=SNOWFLAKE_DATABASE,
+        schema=SNOWFLAKE_SCHEMA,
+        snowflake_private_key_path=SNOWFLAKE_PRIVATE_KEY_PATH,
+        snowflake_private_key_base64=os.environ.get("SNOWFLAKE_PRIVATE_KEY_BASE64")
+    )
+
 class VannaSnowflake:
     """
     A class to integrate Vanna.AI with Snowflake and ChromaDB for text-to-SQL generation.
     """
     
-    def __init__(self, openai_api_key: Optional[str] = None):
+    def __init__(self, openai_api_key: Optional[str] = None, chroma_client: Any = None, replica: Any = None):
         """
         Initialize the VannaSnowflake class.
         
         Args:
             openai_api_key: The OpenAI API key to use. If None, it will be read from config.
+            chroma_client: Existing Chroma client to share. If None, Vanna opens a
+                PersistentClient over CHROMA_PERSISTENCE_DIRECTORY.
+            replica: Shared LocalReplica to run eligible queries on (owned by the resource
+                registry, which starts and stops it). If None, every query goes to Snowflake.
         """
         self.openai_api_key = openai_api_key or OPENAI_API_KEY
+        self.chroma_client = chroma_client
         self.snowflake_connection = None
         self.vanna_ai = None
+        self.replica = replica
         # Removed redundant ChromaDB initialization - Vanna handles this internally
         
         # Initialize components
@@ -41,17 +68,7 @@ class VannaSnowflake:
                         f"User={SNOWFLAKE_USER}, Database={SNOWFLAKE_DATABASE}, Schema={SNOWFLAKE_SCHEMA}")
             
             # Use the Connection Manager instead of direct connection
-            self.snowflake_connection = SnowflakeConnectionManager(
-                snowflake_account=SNOWFLAKE_ACCOUNT,
-                snowflake_user=SNOWFLAKE_USER,
-                snowflake_org=SNOWFLAKE_ORG,
-                snowflake_warehouse=SNOWFLAKE_WAREHOUSE,
-                snowflake_role=SNOWFLAKE_ROLE,
-                database=SNOWFLAKE_DATABASE,
-                schema=SNOWFLAKE_SCHEMA,
-                snowflake_private_key_path=SNOWFLAKE_PRIVATE_KEY_PATH,
-                snowflake_private_key_base64=os.environ.get("SNOWFLAKE_PRIVATE_KEY_BASE64")
-            )
+            self.snowflake_connection = create_snowflake_connection()
             
             logger.info(f"Connected to Snowflake: {SNOWFLAKE_DATABASE}.{SNOWFLAKE_SCHEMA}")
         except Exception as e:
@@ -85,6 +102,9 @@ class VannaSnowflake:
                 'collection_name': CHROMA_COLLECTION_NAME,
                 'path': CHROMA_PERSISTENCE_DIRECTORY
             }
+            if self.chroma_client is not None:
+                # ChromaDB_VectorStore uses a client passed in its config instead of opening one
+                vanna_config['client'] = self.chroma_client
             
             logger.debug(f"Vanna config: {vanna_config}")
             logger.info("🚀 Creating MyVanna instance...")
@@ -228,7 +248,9 @@ class VannaSnowflake:
                 raise ValueError("Vanna AI instance not initialized")
             
             logger.info("🚀 Calling self.vanna_ai.generate_sql()...")
-            sql = self.vanna_ai.generate_sql(question=question)
+            with tracing.span("sql.generate", question=question) as span:
+                sql = self.vanna_ai.generate_sql(question=question)
+                span.set(sql_chars=len(sql) if sql else 0)
             
             logger.info(f"✅ self.vanna_ai.generate_sql() completed")
             logger.info(f"📊 Generated SQL length: {len(sql) if sql else 0} characters")
@@ -256,7 +278,10 @@ class VannaSnowflake:
         """
         try:
             # Use the execute_query method from our connection manager
-            return self.snowflake_connection.execute_query(sql)
+            with tracing.span("sql.execute", sql=sql) as span:
+                results = self.snowflake_connection.execute_query(sql, cancel_token=cancellation.current_token())
+                span.set(rows=len(results) if isinstance(results, list) else None)
+            return results
         except Exception as e:
             logger.error(f"Error executing SQL: {e}")
             raise
@@ -288,17 +313,28 @@ class VannaSnowflake:
             
             logger.info(f"✅ Step 1 complete: SQL generated ({len(sql)} chars)")
             
-            # Execute the SQL
+            # Don't start a warehouse query for a request that was abandoned during generation
+            token = cancellation.current_token()
+            if token is not None:
+                token.raise_if_cancelled()
+            
+            # Execute the SQL on the local replica if it can answer it, otherwise on Snowflake
             logger.info("🚀 Step 2: Executing SQL...")
-            results = self.execute_sql(sql)
+            local = self.replica.execute(sql) if self.replica is not None else None
+            if local is not None:
+                results, data_source = local
+            else:
+                results = self.execute_sql(sql)
+                data_source = {"source": "snowflake"}
             
-            logger.info(f"✅ Step 2 complete: SQL executed ({len(results) if results else 0} rows)")
+            logger.info(f"✅ Step 2 complete: SQL executed on {data_source['source']} ({len(results) if results else 0} rows)")
             logger.debug(f"First few results: {results[:3] if results else 'No results'}")
             
             response = {
                 "question": question,
                 "sql": sql,
-                "results": results
+                "results": results,
+                "data_source": data_source
             }
             
             logger.info(f"✅ VannaSnowflake.ask() completed successfully")
@@ -313,7 +349,7 @@ class VannaSnowflake:
             }
             
     def close(self):
-        """Close all connections."""
+        """Close all connections (a shared replica is stopped by its owner, not here)."""
         if self.snowflake_connection:
             self.snowflake_connection.close()
 
@@ -406,6 +442,9 @@ class VannaSnowflake:
                 if not schema_accessible:
                     connection_details["schema_error"] = schema_error
                 
+                if self.replica is not None:
+                    connection_details["replica"] = self.replica.get_stats()
+                
                 return connection_details
             
             return True
@@ -2,6 +2,7 @@ import time
 import logging
 from typing import Dict, Any, Optional, List, Union
 from .vanna_snowflake import VannaSnowflake
+from src.scheduler import get_scheduler, SQL
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -14,17 +15,21 @@ class VannaToolWrapper:
     to invoke our existing Vanna.AI + Snowflake + ChromaDB text-to-SQL capabilities.
     """
     
-    def __init__(self, openai_api_key: Optional[str] = None):
+    def __init__(self, openai_api_key: Optional[str] = None, chroma_client: Any = None, replica: Any = None):
         """
         Initialize the VannaToolWrapper.
         
         Args:
             openai_api_key: The OpenAI API key to use. If None, it will be read from config.
+            chroma_client: Existing Chroma client to share. If None, Vanna opens its own.
+            replica: Shared LocalReplica for eligible queries. If None, every query goes to Snowflake.
         """
         logger.info("🔄 Initializing VannaToolWrapper...")
+        self.chroma_client = chroma_client
+        self.replica = replica
         try:
             logger.info("🚀 Creating VannaSnowflake instance...")
-            self.vanna = VannaSnowflake(openai_api_key)
+            self.vanna = VannaSnowflake(openai_api_key, chroma_client=chroma_client, replica=replica)
             logger.info("✅ VannaSnowflake instance created successfully")
             
             # Test that the vanna_ai instance is available
@@ -102,7 +107,8 @@ class VannaToolWrapper:
                 # Use the full ask() method that generates SQL and executes it
                 logger.info("🚀 Calling vanna.ask() method...")
                 try:
-                    result = self.vanna.ask(question)
+                    with get_scheduler().slot(SQL):
+                        result = self.vanna.ask(question)
                     logger.info(f"✅ vanna.ask() completed: {type(result)}")
                     logger.debug(f"vanna.ask() result keys: {list(result.keys()) if isinstance(result, dict) else 'Not a dict'}")
                     
@@ -141,6 +147,7 @@ class VannaToolWrapper:
                             "execution_time_ms": int((time.time() - start_time) * 1000),
                             "metadata": {
                                 **metadata,
+                                "data_source": result.get("data_source", {"source": "snowflake"}),
                                 "has_more_results": has_more_results,
                                 "total_rows_available": len(results) if results else 0
                             }
@@ -167,7 +174,8 @@ class VannaToolWrapper:
                 # Only generate SQL without executing
                 logger.info("🔧 Calling vanna.generate_sql() method...")
                 try:
-                    sql = self.vanna.generate_sql(question)
+                    with get_scheduler().slot(SQL):
+                        sql = self.vanna.generate_sql(question)
                     logger.info(f"✅ vanna.generate_sql() completed: {len(sql) if sql else 0} characters")
                     logger.debug(f"Generated SQL: {sql}")
                     
@@ -290,6 +298,33 @@ class VannaToolWrapper:
             "tables_used": tables_used
         }
     
+    def get_table_versions(self, tables: List[str]) -> Dict[str, str]:
+        """
+        Get a version stamp for each table, used to detect data changes.
+
+        Args:
+            tables: Table names as returned in _extract_query_metadata()["tables_used"]
+
+        Returns:
+            Dictionary mapping SCHEMA.TABLE to "LAST_ALTERED|ROW_COUNT"
+        """
+        names = sorted({table.split(".")[-1] for table in tables or []})
+        if not names:
+            return {}
+
+        placeholders = ", ".join(["%s"] * len(names))
+        sql = (
+            "SELECT TABLE_SCHEMA, TABLE_NAME, LAST_ALTERED, ROW_COUNT "
+            f"FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME IN ({placeholders})"
+        )
+        rows = self.vanna.snowflake_connection.execute_query(sql, names)
+        versions = {
+            f"{row['TABLE_SCHEMA']}.{row['TABLE_NAME']}": f"{row['LAST_ALTERED']}|{row['ROW_COUNT']}"
+            for row in rows
+        }
+        logger.debug(f"Table versions: {versions}")
+        return versions
+
     @staticmethod
     def get_function_schemas() -> Dict[str, Dict[str, Any]]:
         """